@@ -15,6 +15,11 @@ import pandas as pd
 import sklearn.preprocessing
 
 import path_utils
+path_utils.add_path_to_sys_path("../lib", mode="relative_to_current_source_dir", frame=inspect.currentframe())
+import archive_utils
+import hdf5_utils
+import histogram_utils
+import mesh_utils
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--dataset_dir", required=True)
@@ -23,11 +28,22 @@ parser.add_argument("--batch_name", required=True)
 parser.add_argument("--bounding_box_type", required=True)
 parser.add_argument("--scene_names")
 parser.add_argument("--camera_names")
+parser.add_argument("--archive_dir")
 parser.add_argument("--load_snapshot", action="store_true")
+parser.add_argument("--n_jobs", type=int)
+parser.add_argument("--checkpoint_interval", type=int)
+parser.add_argument("--num_shards", type=int)
+parser.add_argument("--shard_index", type=int)
+parser.add_argument("--merge_shards", action="store_true")
+parser.add_argument("--use_single_threaded_reference_implementation", action="store_true")
 args = parser.parse_args()
 
 assert os.path.exists(args.dataset_dir)
 assert args.bounding_box_type == "axis_aligned" or args.bounding_box_type == "object_aligned_2d" or args.bounding_box_type == "object_aligned_3d"
+assert (args.num_shards is None) == (args.shard_index is None)
+assert args.num_shards is None or 0 <= args.shard_index < args.num_shards
+assert not (args.merge_shards and args.num_shards is not None)
+assert args.checkpoint_interval is None or args.checkpoint_interval >= 1
 
 path_utils.add_path_to_sys_path(args.dataset_dir, mode="relative_to_cwd", frame=inspect.currentframe())
 import _dataset_config
@@ -38,8 +54,22 @@ print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] Begin...")
 
 
 
+if not args.use_single_threaded_reference_implementation:
+    if args.n_jobs is not None:
+        n_jobs = args.n_jobs
+    else:
+        n_jobs = -1 # use all available cores by default, since scenes are processed independently
+
 dataset_scenes_dir = os.path.join(args.dataset_dir, "scenes")
 
+# if --archive_dir is specified, we read scenes that haven't been extracted directly from their ZIP files
+# in archive_dir (see archive_utils.py), so we don't need to extract the ZIP files that were downloaded by
+# dataset_download_images.py
+def get_archive_reader(args):
+    if args.archive_dir is None:
+        return None
+    return archive_utils.ArchiveReader(args.archive_dir)
+
 if args.scene_names is not None:
     scenes = [ s for s in _dataset_config.scenes if fnmatch.fnmatch(s["name"], args.scene_names) ]
 else:
@@ -104,25 +134,26 @@ unique_classes_per_image_hist_bin_edges = arange(unique_classes_per_image_hist_n
 per_class_hist_n_bins         = len(semantic_id_to_name_map) + 2 # +2 because we want to make room for the values 0 and -1
 per_class_hist_min_bin_center = -1
 per_class_hist_max_bin_center = len(semantic_id_to_name_map)
+per_class_hist_bins           = histogram_utils.Bins(per_class_hist_n_bins, per_class_hist_min_bin_center - 0.5, per_class_hist_max_bin_center + 0.5)
 
 # DEPTH (LINEAR)
 depth_hist_linear_n_bins    = 1000
 depth_hist_linear_min       = 0.0
 depth_hist_linear_max       = 20.0
-depth_hist_linear_bin_edges = linspace(depth_hist_linear_min, depth_hist_linear_max, depth_hist_linear_n_bins+1)
+depth_hist_linear_bins      = histogram_utils.Bins(depth_hist_linear_n_bins, depth_hist_linear_min, depth_hist_linear_max)
 
 # DEPTH (LOG)
 depth_hist_log_n_bins    = 1000
 depth_hist_log_base      = 10.0
 depth_hist_log_min       = -2.0 # 0.01
 depth_hist_log_max       = 3.0  # 1000.0
-depth_hist_log_bin_edges = logspace(depth_hist_log_min, depth_hist_log_max, depth_hist_log_n_bins+1, base=depth_hist_log_base)
+depth_hist_log_bins      = histogram_utils.Bins(depth_hist_log_n_bins, depth_hist_log_min, depth_hist_log_max, log_base=depth_hist_log_base)
 
 # NORMAL
 normal_hist_n_bins    = 100
 normal_hist_min       = -1.0
 normal_hist_max       = 1.0
-normal_hist_bin_edges = linspace(normal_hist_min, normal_hist_max, normal_hist_n_bins+1)
+normal_hist_bins      = histogram_utils.Bins(normal_hist_n_bins, normal_hist_min, normal_hist_max)
 
 # RGB COLOR
 # DIFFUSE ILLUMINATION
@@ -130,13 +161,13 @@ normal_hist_bin_edges = linspace(normal_hist_min, normal_hist_max, normal_hist_n
 color_hist_denorm_n_bins    = 20
 color_hist_denorm_min       = 0.0
 color_hist_denorm_max       = 2.0
-color_hist_denorm_bin_edges = linspace(color_hist_denorm_min, color_hist_denorm_max, color_hist_denorm_n_bins+1)
+color_hist_denorm_bins      = histogram_utils.Bins(color_hist_denorm_n_bins, color_hist_denorm_min, color_hist_denorm_max)
 
 # DIFFUSE REFLECTANCE
 color_hist_norm_n_bins    = 10
 color_hist_norm_min       = 0.0
 color_hist_norm_max       = 1.0
-color_hist_norm_bin_edges = linspace(color_hist_norm_min, color_hist_norm_max, color_hist_norm_n_bins+1)
+color_hist_norm_bins      = histogram_utils.Bins(color_hist_norm_n_bins, color_hist_norm_min, color_hist_norm_max)
 
 # RGB COLOR
 # DIFFUSE ILLUMINATION
@@ -145,31 +176,35 @@ color_hist_norm_bin_edges = linspace(color_hist_norm_min, color_hist_norm_max, c
 hue_saturation_hist_n_bins    = 100
 hue_saturation_hist_min       = -1
 hue_saturation_hist_max       = 1
-hue_saturation_hist_bin_edges = linspace(hue_saturation_hist_min, hue_saturation_hist_max, hue_saturation_hist_n_bins+1)
+hue_saturation_hist_bins      = histogram_utils.Bins(hue_saturation_hist_n_bins, hue_saturation_hist_min, hue_saturation_hist_max)
+
+color_hist_denorm_bins_3d   = [color_hist_denorm_bins, color_hist_denorm_bins, color_hist_denorm_bins]
+color_hist_norm_bins_3d     = [color_hist_norm_bins, color_hist_norm_bins, color_hist_norm_bins]
+hue_saturation_hist_bins_2d = [hue_saturation_hist_bins, hue_saturation_hist_bins]
 
 brightness_hist_linear_n_bins    = 1000
 brightness_hist_linear_min       = 0.0
 brightness_hist_linear_max       = 10.0
-brightness_hist_linear_bin_edges = linspace(brightness_hist_linear_min, brightness_hist_linear_max, brightness_hist_linear_n_bins+1)
+brightness_hist_linear_bins      = histogram_utils.Bins(brightness_hist_linear_n_bins, brightness_hist_linear_min, brightness_hist_linear_max)
 
 brightness_hist_log_n_bins    = 1000
 brightness_hist_log_base      = 10.0
 brightness_hist_log_min       = -3.0 # 0.001
 brightness_hist_log_max       = 1.0  # 10.0
-brightness_hist_log_bin_edges = logspace(brightness_hist_log_min, brightness_hist_log_max, brightness_hist_log_n_bins+1, base=brightness_hist_log_base)
+brightness_hist_log_bins      = histogram_utils.Bins(brightness_hist_log_n_bins, brightness_hist_log_min, brightness_hist_log_max, log_base=brightness_hist_log_base)
 
 # OBJECT VOLUME (LINEAR)
 object_volume_hist_linear_n_bins    = 1000
 object_volume_hist_linear_min       = 0.0
 object_volume_hist_linear_max       = 1000.0
-object_volume_hist_linear_bin_edges = linspace(object_volume_hist_linear_min, object_volume_hist_linear_max, object_volume_hist_linear_n_bins+1)
+object_volume_hist_linear_bins      = histogram_utils.Bins(object_volume_hist_linear_n_bins, object_volume_hist_linear_min, object_volume_hist_linear_max)
 
 # OBJECT VOLUME (LOG)
 object_volume_hist_log_n_bins    = 1000
 object_volume_hist_log_base      = 10.0
 object_volume_hist_log_min       = -6.0 # 0.000001
 object_volume_hist_log_max       = 3.0  # 1000.0
-object_volume_hist_log_bin_edges = logspace(object_volume_hist_log_min, object_volume_hist_log_max, object_volume_hist_log_n_bins+1, base=object_volume_hist_log_base)
+object_volume_hist_log_bins      = histogram_utils.Bins(object_volume_hist_log_n_bins, object_volume_hist_log_min, object_volume_hist_log_max, log_base=object_volume_hist_log_base)
 
 
 
@@ -180,152 +215,576 @@ metadata_camera_trajectories_csv_file = os.path.join(args.analysis_dir, "metadat
 # set_index() sets the current index
 df_camera_trajectories = pd.read_csv(metadata_camera_trajectories_csv_file).rename_axis("camera_trajectory_id").reset_index().set_index("Animation")
 
-batch_dir = os.path.join(args.analysis_dir, "image_statistics", args.batch_name)
-
-unique_objects_per_image_hist_hdf5_file               = os.path.join(batch_dir, "metadata_unique_objects_per_image_hist.hdf5")
-unique_classes_per_image_hist_hdf5_file               = os.path.join(batch_dir, "metadata_unique_classes_per_image_hist.hdf5")
-unique_objects_per_class_hist_hdf5_file               = os.path.join(batch_dir, "metadata_unique_objects_per_class_hist.hdf5")
-pixels_per_class_hist_hdf5_file                       = os.path.join(batch_dir, "metadata_pixels_per_class_hist.hdf5")
-depth_hist_linear_hdf5_file                           = os.path.join(batch_dir, "metadata_depth_hist_linear.hdf5")
-depth_hist_log_hdf5_file                              = os.path.join(batch_dir, "metadata_depth_hist_log.hdf5")
-normal_hist_hdf5_file                                 = os.path.join(batch_dir, "metadata_normal_hist.hdf5")
-rgb_color_hist_hdf5_file                              = os.path.join(batch_dir, "metadata_rgb_color_hist.hdf5")
-rgb_color_hue_saturation_hist_hdf5_file               = os.path.join(batch_dir, "metadata_rgb_color_hue_saturation_hist.hdf5")
-rgb_color_brightness_hist_linear_hdf5_file            = os.path.join(batch_dir, "metadata_rgb_color_brightness_hist_linear.hdf5")
-rgb_color_brightness_hist_log_hdf5_file               = os.path.join(batch_dir, "metadata_rgb_color_brightness_hist_log.hdf5")
-diffuse_illumination_hist_hdf5_file                   = os.path.join(batch_dir, "metadata_diffuse_illumination_hist.hdf5")
-diffuse_illumination_hue_saturation_hist_hdf5_file    = os.path.join(batch_dir, "metadata_diffuse_illumination_hue_saturation_hist.hdf5")
-diffuse_illumination_brightness_hist_linear_hdf5_file = os.path.join(batch_dir, "metadata_diffuse_illumination_brightness_hist_linear.hdf5")
-diffuse_illumination_brightness_hist_log_hdf5_file    = os.path.join(batch_dir, "metadata_diffuse_illumination_brightness_hist_log.hdf5")
-diffuse_reflectance_hist_hdf5_file                    = os.path.join(batch_dir, "metadata_diffuse_reflectance_hist.hdf5")
-diffuse_reflectance_hue_saturation_hist_hdf5_file     = os.path.join(batch_dir, "metadata_diffuse_reflectance_hue_saturation_hist.hdf5")
-diffuse_reflectance_brightness_hist_linear_hdf5_file  = os.path.join(batch_dir, "metadata_diffuse_reflectance_brightness_hist_linear.hdf5")
-diffuse_reflectance_brightness_hist_log_hdf5_file     = os.path.join(batch_dir, "metadata_diffuse_reflectance_brightness_hist_log.hdf5")
-residual_hist_hdf5_file                               = os.path.join(batch_dir, "metadata_residual_hist.hdf5")
-residual_hue_saturation_hist_hdf5_file                = os.path.join(batch_dir, "metadata_residual_hue_saturation_hist.hdf5")
-residual_brightness_hist_linear_hdf5_file             = os.path.join(batch_dir, "metadata_residual_brightness_hist_linear.hdf5")
-residual_brightness_hist_log_hdf5_file                = os.path.join(batch_dir, "metadata_residual_brightness_hist_log.hdf5")
-object_volume_hist_linear_hdf5_file                   = os.path.join(batch_dir, "metadata_object_volume_hist_linear.hdf5")
-object_volume_hist_log_hdf5_file                      = os.path.join(batch_dir, "metadata_object_volume_hist_log.hdf5")
-
-if args.load_snapshot:
-    print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] Loading histograms from snapshot...")
-    with h5py.File(unique_objects_per_image_hist_hdf5_file,               "r") as f: unique_objects_per_image_hist               = f["dataset"][:].astype(int64)
-    with h5py.File(unique_classes_per_image_hist_hdf5_file,               "r") as f: unique_classes_per_image_hist               = f["dataset"][:].astype(int64)
-    with h5py.File(unique_objects_per_class_hist_hdf5_file,               "r") as f: unique_objects_per_class_hist               = f["dataset"][:].astype(int64)
-    with h5py.File(pixels_per_class_hist_hdf5_file,                       "r") as f: pixels_per_class_hist                       = f["dataset"][:].astype(int64)
-    with h5py.File(depth_hist_linear_hdf5_file,                           "r") as f: depth_hist_linear                           = f["dataset"][:].astype(int64)
-    with h5py.File(depth_hist_log_hdf5_file,                              "r") as f: depth_hist_log                              = f["dataset"][:].astype(int64)
-    with h5py.File(normal_hist_hdf5_file,                                 "r") as f: normal_hist                                 = f["dataset"][:].astype(int64)
-    with h5py.File(rgb_color_hist_hdf5_file,                              "r") as f: rgb_color_hist                              = f["dataset"][:].astype(int64)
-    with h5py.File(rgb_color_hue_saturation_hist_hdf5_file,               "r") as f: rgb_color_hue_saturation_hist               = f["dataset"][:].astype(int64)
-    with h5py.File(rgb_color_brightness_hist_linear_hdf5_file,            "r") as f: rgb_color_brightness_hist_linear            = f["dataset"][:].astype(int64)
-    with h5py.File(rgb_color_brightness_hist_log_hdf5_file,               "r") as f: rgb_color_brightness_hist_log               = f["dataset"][:].astype(int64)
-    with h5py.File(diffuse_illumination_hist_hdf5_file,                   "r") as f: diffuse_illumination_hist                   = f["dataset"][:].astype(int64)
-    with h5py.File(diffuse_illumination_hue_saturation_hist_hdf5_file,    "r") as f: diffuse_illumination_hue_saturation_hist    = f["dataset"][:].astype(int64)
-    with h5py.File(diffuse_illumination_brightness_hist_linear_hdf5_file, "r") as f: diffuse_illumination_brightness_hist_linear = f["dataset"][:].astype(int64)
-    with h5py.File(diffuse_illumination_brightness_hist_log_hdf5_file,    "r") as f: diffuse_illumination_brightness_hist_log    = f["dataset"][:].astype(int64)
-    with h5py.File(diffuse_reflectance_hist_hdf5_file,                    "r") as f: diffuse_reflectance_hist                    = f["dataset"][:].astype(int64)
-    with h5py.File(diffuse_reflectance_hue_saturation_hist_hdf5_file,     "r") as f: diffuse_reflectance_hue_saturation_hist     = f["dataset"][:].astype(int64)
-    with h5py.File(diffuse_reflectance_brightness_hist_linear_hdf5_file,  "r") as f: diffuse_reflectance_brightness_hist_linear  = f["dataset"][:].astype(int64)
-    with h5py.File(diffuse_reflectance_brightness_hist_log_hdf5_file,     "r") as f: diffuse_reflectance_brightness_hist_log     = f["dataset"][:].astype(int64)
-    with h5py.File(residual_hist_hdf5_file,                               "r") as f: residual_hist                               = f["dataset"][:].astype(int64)
-    with h5py.File(residual_hue_saturation_hist_hdf5_file,                "r") as f: residual_hue_saturation_hist                = f["dataset"][:].astype(int64)
-    with h5py.File(residual_brightness_hist_linear_hdf5_file,             "r") as f: residual_brightness_hist_linear             = f["dataset"][:].astype(int64)
-    with h5py.File(residual_brightness_hist_log_hdf5_file,                "r") as f: residual_brightness_hist_log                = f["dataset"][:].astype(int64)
-    with h5py.File(object_volume_hist_linear_hdf5_file,                   "r") as f: object_volume_hist_linear                   = f["dataset"][:].astype(int64)
-    with h5py.File(object_volume_hist_log_hdf5_file,                      "r") as f: object_volume_hist_log                      = f["dataset"][:].astype(int64)
+batch_dir  = os.path.join(args.analysis_dir, "image_statistics", args.batch_name)
+shards_dir = os.path.join(batch_dir, "shards")
 
-else:
-    print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] Initializing histograms...")
-    unique_objects_per_image_hist               = zeros(unique_objects_per_image_hist_n_bins, dtype=int64)
-    unique_classes_per_image_hist               = zeros(unique_classes_per_image_hist_n_bins, dtype=int64)
-    unique_objects_per_class_hist               = zeros(per_class_hist_n_bins,                dtype=int64)
-    pixels_per_class_hist                       = zeros(per_class_hist_n_bins,                dtype=int64)
-    depth_hist_linear                           = zeros(depth_hist_linear_n_bins,             dtype=int64)
-    depth_hist_log                              = zeros(depth_hist_log_n_bins,                dtype=int64)
-    normal_hist                                 = zeros((normal_hist_n_bins, normal_hist_n_bins), dtype=int64)
-    rgb_color_hist                              = zeros((color_hist_denorm_n_bins, color_hist_denorm_n_bins, color_hist_denorm_n_bins), dtype=int64)
-    rgb_color_hue_saturation_hist               = zeros((hue_saturation_hist_n_bins, hue_saturation_hist_n_bins), dtype=int64)
-    rgb_color_brightness_hist_linear            = zeros(brightness_hist_linear_n_bins,        dtype=int64)
-    rgb_color_brightness_hist_log               = zeros(brightness_hist_log_n_bins,           dtype=int64)
-    diffuse_illumination_hist                   = zeros((color_hist_denorm_n_bins, color_hist_denorm_n_bins, color_hist_denorm_n_bins), dtype=int64)
-    diffuse_illumination_hue_saturation_hist    = zeros((hue_saturation_hist_n_bins, hue_saturation_hist_n_bins), dtype=int64)
-    diffuse_illumination_brightness_hist_linear = zeros(brightness_hist_linear_n_bins,        dtype=int64)
-    diffuse_illumination_brightness_hist_log    = zeros(brightness_hist_log_n_bins,           dtype=int64)
-    residual_hist                               = zeros((color_hist_denorm_n_bins, color_hist_denorm_n_bins, color_hist_denorm_n_bins), dtype=int64)
-    residual_hue_saturation_hist                = zeros((hue_saturation_hist_n_bins, hue_saturation_hist_n_bins), dtype=int64)
-    residual_brightness_hist_linear             = zeros(brightness_hist_linear_n_bins,        dtype=int64)
-    residual_brightness_hist_log                = zeros(brightness_hist_log_n_bins,           dtype=int64)
-    diffuse_reflectance_hist                    = zeros((color_hist_norm_n_bins, color_hist_norm_n_bins, color_hist_norm_n_bins), dtype=int64)
-    diffuse_reflectance_hue_saturation_hist     = zeros((hue_saturation_hist_n_bins, hue_saturation_hist_n_bins), dtype=int64)
-    diffuse_reflectance_brightness_hist_linear  = zeros(brightness_hist_linear_n_bins,        dtype=int64)
-    diffuse_reflectance_brightness_hist_log     = zeros(brightness_hist_log_n_bins,           dtype=int64)
-    object_volume_hist_linear                   = zeros(object_volume_hist_linear_n_bins,     dtype=int64)
-    object_volume_hist_log                      = zeros(object_volume_hist_log_n_bins,        dtype=int64)
-
-
-
-def process_scene(s, args):
-
-    global unique_objects_per_image_hist
-    global unique_classes_per_image_hist
-    global unique_objects_per_class_hist
-    global pixels_per_class_hist
-    global depth_hist_linear
-    global depth_hist_log
-    global normal_hist
-    global rgb_color_hist
-    global rgb_color_hue_saturation_hist
-    global rgb_color_brightness_hist_linear
-    global rgb_color_brightness_hist_log
-    global diffuse_illumination_hist
-    global diffuse_illumination_hue_saturation_hist
-    global diffuse_illumination_brightness_hist_linear
-    global diffuse_illumination_brightness_hist_log
-    global residual_hist
-    global residual_hue_saturation_hist
-    global residual_brightness_hist_linear
-    global residual_brightness_hist_log
-    global diffuse_reflectance_hist
-    global diffuse_reflectance_hue_saturation_hist
-    global diffuse_reflectance_brightness_hist_linear
-    global diffuse_reflectance_brightness_hist_log
-    global object_volume_hist_linear
-    global object_volume_hist_log
-
-    scene_name = s["name"]
-
-    scene_dir  = os.path.join(dataset_scenes_dir, scene_name)    
+#
+# We accumulate the following histograms, where each histogram is stored in its own HDF5 file, i.e.,
+# metadata_<hist_name>.hdf5. All histograms contain integer counts, so partial histograms computed for
+# different camera trajectories and scenes can be merged by adding them, in any order, and the merged
+# histograms are bit-identical to histograms accumulated sequentially over all scenes.
+#
+
+hist_shapes = [
+    ("unique_objects_per_image_hist",               (unique_objects_per_image_hist_n_bins,)),
+    ("unique_classes_per_image_hist",               (unique_classes_per_image_hist_n_bins,)),
+    ("unique_objects_per_class_hist",               (per_class_hist_n_bins,)),
+    ("pixels_per_class_hist",                       (per_class_hist_n_bins,)),
+    ("depth_hist_linear",                           (depth_hist_linear_n_bins,)),
+    ("depth_hist_log",                              (depth_hist_log_n_bins,)),
+    ("normal_hist",                                 (normal_hist_n_bins, normal_hist_n_bins)),
+    ("rgb_color_hist",                              (color_hist_denorm_n_bins, color_hist_denorm_n_bins, color_hist_denorm_n_bins)),
+    ("rgb_color_hue_saturation_hist",               (hue_saturation_hist_n_bins, hue_saturation_hist_n_bins)),
+    ("rgb_color_brightness_hist_linear",            (brightness_hist_linear_n_bins,)),
+    ("rgb_color_brightness_hist_log",               (brightness_hist_log_n_bins,)),
+    ("diffuse_illumination_hist",                   (color_hist_denorm_n_bins, color_hist_denorm_n_bins, color_hist_denorm_n_bins)),
+    ("diffuse_illumination_hue_saturation_hist",    (hue_saturation_hist_n_bins, hue_saturation_hist_n_bins)),
+    ("diffuse_illumination_brightness_hist_linear", (brightness_hist_linear_n_bins,)),
+    ("diffuse_illumination_brightness_hist_log",    (brightness_hist_log_n_bins,)),
+    ("diffuse_reflectance_hist",                    (color_hist_norm_n_bins, color_hist_norm_n_bins, color_hist_norm_n_bins)),
+    ("diffuse_reflectance_hue_saturation_hist",     (hue_saturation_hist_n_bins, hue_saturation_hist_n_bins)),
+    ("diffuse_reflectance_brightness_hist_linear",  (brightness_hist_linear_n_bins,)),
+    ("diffuse_reflectance_brightness_hist_log",     (brightness_hist_log_n_bins,)),
+    ("residual_hist",                               (color_hist_denorm_n_bins, color_hist_denorm_n_bins, color_hist_denorm_n_bins)),
+    ("residual_hue_saturation_hist",                (hue_saturation_hist_n_bins, hue_saturation_hist_n_bins)),
+    ("residual_brightness_hist_linear",             (brightness_hist_linear_n_bins,)),
+    ("residual_brightness_hist_log",                (brightness_hist_log_n_bins,)),
+    ("object_volume_hist_linear",                   (object_volume_hist_linear_n_bins,)),
+    ("object_volume_hist_log",                      (object_volume_hist_log_n_bins,)) ]
+
+hist_names = [ h[0] for h in hist_shapes ]
+
+
+
+def get_empty_hists():
+    return dict([ (hist_name, zeros(hist_shape, dtype=int64)) for hist_name, hist_shape in hist_shapes ])
+
+
+
+def merge_hists(hists, hists_other):
+    for hist_name in hist_names:
+        hists[hist_name] += hists_other[hist_name]
+
+
+
+def get_hist_file(hist_dir, hist_name):
+    return os.path.join(hist_dir, "metadata_" + hist_name + ".hdf5")
+
+
+
+def save_hists(hist_dir, hists):
+
+    if not os.path.exists(hist_dir): os.makedirs(hist_dir)
+
+    for hist_name in hist_names:
+        with h5py.File(get_hist_file(hist_dir, hist_name), "w") as f: f.create_dataset("dataset", data=hists[hist_name])
+
+
+
+#
+# We store our progress in a single checkpoint file per batch (or per shard, see below), which contains
+# the merged histograms for all completed work, and the keys that identify the completed work, i.e.,
+# <scene_name>_<camera_name> for each camera trajectory whose images have been added to the histograms,
+# and <scene_name>:<camera_name>,<camera_name>,... for each scene whose objects have been added to the
+# histograms, where the camera names are the completed camera trajectories whose visible objects have
+# been added. The object histograms for a scene depend on the objects that are visible in any of its
+# camera trajectories, so the checkpoint also contains the semantic instance IDs that are visible in the
+# completed camera trajectories of each scene, and the semantic instance IDs whose objects have been
+# added to the histograms. Each object contributes to the object histograms independently, so if a later
+# run completes more camera trajectories for a scene (e.g., with a different --camera_names), we only add
+# the objects that weren't visible before. We write the checkpoint to a temporary file and rename it, so
+# an interrupted run never leaves a partially written checkpoint, and the histograms in a checkpoint
+# always contain exactly the work identified by its keys.
+#
+
+def get_empty_checkpoint():
+    return {"hists": get_empty_hists(), "completed_keys": set(), "unique_semantic_instance_ids": {}, "counted_semantic_instance_ids": {}, "finished": False}
+
+
+
+def get_scene_objects_key(scene_name, camera_names):
+    return scene_name + ":" + ",".join(camera_names)
+
+
+
+def merge_semantic_instance_ids(semantic_instance_ids, semantic_instance_ids_other):
+    for scene_name in semantic_instance_ids_other:
+        if scene_name in semantic_instance_ids:
+            semantic_instance_ids[scene_name] = unique(r_[ semantic_instance_ids[scene_name], semantic_instance_ids_other[scene_name] ])
+        else:
+            semantic_instance_ids[scene_name] = semantic_instance_ids_other[scene_name]
+
+
+
+def get_checkpoint_file(shard_index=None, num_shards=None):
+
+    if shard_index is None:
+        return os.path.join(batch_dir, "_checkpoint.hdf5")
+    else:
+        return os.path.join(shards_dir, "shard_%04d_of_%04d.hdf5" % (shard_index, num_shards))
+
+
+
+def load_checkpoint(checkpoint_file):
+
+    checkpoint = get_empty_checkpoint()
+
+    with h5py.File(checkpoint_file, "r") as f:
+        assert f.attrs["bounding_box_type"] == args.bounding_box_type
+        for hist_name in hist_names:
+            checkpoint["hists"][hist_name] = f["hists"][hist_name][:].astype(int64)
+        checkpoint["completed_keys"] = set(f["completed_keys"].asstr()[:])
+        for scene_name in f["unique_semantic_instance_ids"]:
+            checkpoint["unique_semantic_instance_ids"][scene_name] = f["unique_semantic_instance_ids"][scene_name][:]
+        for scene_name in f["counted_semantic_instance_ids"]:
+            checkpoint["counted_semantic_instance_ids"][scene_name] = f["counted_semantic_instance_ids"][scene_name][:]
+        checkpoint["finished"] = bool(f.attrs["finished"])
+
+    return checkpoint
+
+
+
+#
+# Load the checkpoint for --load_snapshot. Batches generated by previous versions of this tool don't have
+# a checkpoint, only the merged histograms, so we load the histograms instead, like previous versions of
+# this tool did. These histograms don't identify the work they contain, so we can't skip any completed
+# work, i.e., the selected scenes are added to the histograms, even if they have been added before.
+#
+
+def load_snapshot(checkpoint_file):
+
+    if os.path.exists(checkpoint_file):
+        print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] Loading checkpoint...")
+        return load_checkpoint(checkpoint_file)
+
+    assert checkpoint_file == get_checkpoint_file()
+    assert all([ os.path.exists(get_hist_file(batch_dir, hist_name)) for hist_name in hist_names ])
+
+    print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: NO CHECKPOINT FOUND, LOADING HISTOGRAMS FROM " + batch_dir + " INSTEAD, SO NO WORK WILL BE SKIPPED...")
+
+    checkpoint = get_empty_checkpoint()
+    for hist_name in hist_names:
+        with h5py.File(get_hist_file(batch_dir, hist_name), "r") as f: checkpoint["hists"][hist_name] = f["dataset"][:].astype(int64)
+        assert checkpoint["hists"][hist_name].shape == dict(hist_shapes)[hist_name]
+
+    return checkpoint
+
+
+
+def save_checkpoint(checkpoint_file, checkpoint):
+
+    if not os.path.exists(os.path.dirname(checkpoint_file)): os.makedirs(os.path.dirname(checkpoint_file))
+
+    tmp_checkpoint_file = checkpoint_file + ".tmp"
+
+    with h5py.File(tmp_checkpoint_file, "w") as f:
+        f.attrs["bounding_box_type"] = args.bounding_box_type
+        f.attrs["finished"]          = checkpoint["finished"]
+        for hist_name in hist_names:
+            f.create_dataset("hists/" + hist_name, data=checkpoint["hists"][hist_name])
+        f.create_dataset("completed_keys", data=sorted(checkpoint["completed_keys"]), shape=(len(checkpoint["completed_keys"]),), dtype=h5py.string_dtype())
+        f.create_group("unique_semantic_instance_ids")
+        for scene_name, unique_semantic_instance_ids in checkpoint["unique_semantic_instance_ids"].items():
+            f.create_dataset("unique_semantic_instance_ids/" + scene_name, data=unique_semantic_instance_ids)
+        f.create_group("counted_semantic_instance_ids")
+        for scene_name, counted_semantic_instance_ids in checkpoint["counted_semantic_instance_ids"].items():
+            f.create_dataset("counted_semantic_instance_ids/" + scene_name, data=counted_semantic_instance_ids)
+
+    os.replace(tmp_checkpoint_file, checkpoint_file)
+
+
+
+#
+# Map step (images): compute the partial histograms for the images in a single camera trajectory, and the
+# semantic instance IDs (including -1) that are visible in any of them. Camera trajectories are
+# independent of each other, so we can process them in any order, by any number of processes (or
+# machines, see below).
+#
+
+def process_camera_trajectory(scene_name, camera_name, args):
+
+    hists = get_empty_hists()
+
+    scene_dir  = os.path.join(dataset_scenes_dir, scene_name)
     detail_dir = os.path.join(scene_dir, "_detail")
-    mesh_dir   = os.path.join(scene_dir, "_detail", "mesh")
     images_dir = os.path.join(dataset_scenes_dir, scene_name, "images")
 
-    metadata_scene_file = os.path.join(detail_dir, "metadata_scene.csv")
-    df_scene = pd.read_csv(metadata_scene_file, index_col="parameter_name")
-    meters_per_asset_unit = df_scene.loc["meters_per_asset_unit"][0]
+    print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] For scene " + scene_name + ", generating image statistics for camera " + camera_name + "...")
+
+    unique_semantic_instance_ids_current_camera_trajectory = array([], dtype=int32)
+
+    in_scene_fileroot        = "scene"
+    in_final_hdf5_dir        = os.path.join(images_dir, in_scene_fileroot + "_" + camera_name + "_final_hdf5")
+    in_geometry_hdf5_dir     = os.path.join(images_dir, in_scene_fileroot + "_" + camera_name + "_geometry_hdf5")
+    in_camera_trajectory_dir = os.path.join(detail_dir, camera_name)
+
+    camera_keyframe_frame_indices_hdf5_file = os.path.join(in_camera_trajectory_dir, "camera_keyframe_frame_indices.hdf5")
+    camera_keyframe_positions_hdf5_file     = os.path.join(in_camera_trajectory_dir, "camera_keyframe_positions.hdf5")
+
+    archive_reader = get_archive_reader(args)
 
-    metadata_cameras_csv_file = os.path.join(detail_dir, "metadata_cameras.csv")
-    df_cameras = pd.read_csv(metadata_cameras_csv_file)
-    cameras = df_cameras.to_records()
+    with hdf5_utils.open_hdf5_file(camera_keyframe_frame_indices_hdf5_file, archive_reader) as f: camera_keyframe_frame_indices = f["dataset"][:]
+    with hdf5_utils.open_hdf5_file(camera_keyframe_positions_hdf5_file,     archive_reader) as f: camera_keyframe_positions     = f["dataset"][:]
 
+    assert all(camera_keyframe_frame_indices == arange(camera_keyframe_frame_indices.shape[0]))
 
+    num_camera_positions = camera_keyframe_frame_indices.shape[0]
 
-    # check if scene has been flagged for exclusion
-    scene_included_in_dataset = False
-    for c in cameras:
-        camera_trajectory_name = scene_name + "_" + c["camera_name"]
-        scene_type = df_camera_trajectories.loc[camera_trajectory_name]["Scene type"]
-        if scene_type != "OUTSIDE VIEWING AREA (BAD INITIALIZATION)" and scene_type != "OUTSIDE VIEWING AREA (BAD TRAJECTORY)":
-            scene_included_in_dataset = True
-            break
-    if not scene_included_in_dataset:
-        print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] No good camera trajectories for scene " + scene_name + ", skipping...")
-        return
+    # per-frame and per-trajectory files are kept open across calls to image_reader.load_image(...)
+    image_reader = hdf5_utils.ImageReader(archive_reader)
 
+    for i in range(num_camera_positions):
 
+        camera_position = camera_keyframe_positions[i]
 
-    print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] Generating image statistics for scene " + scene_name + "...")
+        in_file_root = "frame.%04d" % i
+
+        in_depth_meters_hdf5_file      = os.path.join(in_geometry_hdf5_dir, in_file_root + ".depth_meters.hdf5")
+        in_normal_cam_hdf5_file        = os.path.join(in_geometry_hdf5_dir, in_file_root + ".normal_cam.hdf5")
+        in_normal_world_hdf5_file      = os.path.join(in_geometry_hdf5_dir, in_file_root + ".normal_world.hdf5")
+        in_position_hdf5_file          = os.path.join(in_geometry_hdf5_dir, in_file_root + ".position.hdf5")
+        in_render_entity_id_hdf5_file  = os.path.join(in_geometry_hdf5_dir, in_file_root + ".render_entity_id.hdf5")
+        in_semantic_hdf5_file          = os.path.join(in_geometry_hdf5_dir, in_file_root + ".semantic.hdf5")
+        in_semantic_instance_hdf5_file = os.path.join(in_geometry_hdf5_dir, in_file_root + ".semantic_instance.hdf5")
+
+        in_rgb_hdf5_file                  = os.path.join(in_final_hdf5_dir, in_file_root + ".color.hdf5")
+        in_diffuse_illumination_hdf5_file = os.path.join(in_final_hdf5_dir, in_file_root + ".diffuse_illumination.hdf5")
+        in_diffuse_reflectance_hdf5_file  = os.path.join(in_final_hdf5_dir, in_file_root + ".diffuse_reflectance.hdf5")
+        in_residual_hdf5_file             = os.path.join(in_final_hdf5_dir, in_file_root + ".residual.hdf5")
+
+        try:
+            depth_meters      = image_reader.load_image(in_depth_meters_hdf5_file).astype(float32)
+            normal_cam        = image_reader.load_image(in_normal_cam_hdf5_file).astype(float32)
+            normal_world      = image_reader.load_image(in_normal_world_hdf5_file).astype(float32)
+            position          = image_reader.load_image(in_position_hdf5_file).astype(float32)
+            render_entity_id  = image_reader.load_image(in_render_entity_id_hdf5_file).astype(int32)
+            semantic          = image_reader.load_image(in_semantic_hdf5_file).astype(int32)
+            semantic_instance = image_reader.load_image(in_semantic_instance_hdf5_file).astype(int32)
+
+            rgb_color            = image_reader.load_image(in_rgb_hdf5_file).astype(float32)
+            diffuse_illumination = image_reader.load_image(in_diffuse_illumination_hdf5_file).astype(float32)
+            diffuse_reflectance  = image_reader.load_image(in_diffuse_reflectance_hdf5_file).astype(float32)
+            residual             = image_reader.load_image(in_residual_hdf5_file).astype(float32)
+        except:
+            print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: COULD NOT LOAD IMAGE DATA: " + in_file_root + "...")
+            continue
+
+        assert all(semantic != 0)
+        assert all(semantic_instance != 0)
+
+        #
+        # Compute a valid mask, where valid means:
+        # 1. There was some valid geometry rendered at that pixel. AND
+        # 2. There are no inf values in any of the floating-point buffers at that pixel.
+        # We need to handle this case explicitly because we save our data as float16, so
+        # some data that might not have been rendered as inf originally will become inf when
+        # we save our HDF5 data. AND
+        # 3. Has a non-zero normal at that pixel.
+        # We need to handle this case explicitly because V-Ray might render geometry with
+        # zero normals.
+        #
+        
+        valid_mask = render_entity_id != -1
+        valid_mask_ = valid_mask.copy()
+
+        infinite_vals_mask = logical_not(isfinite(depth_meters)) 
+        if any(logical_and(valid_mask, infinite_vals_mask)):
+            warning_pixels_mask = logical_and(valid_mask, infinite_vals_mask)
+            warning_pixels_y, warning_pixels_x = where(warning_pixels_mask)
+            print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: NON-FINITE VALUE AT VALID PIXEL IN " + in_depth_meters_hdf5_file + " (num_pixels=" + str(warning_pixels_y.shape[0]) + "; see pixel y=" + str(warning_pixels_y[0]) + ", x=" + str(warning_pixels_x[0]) + ")")
+        valid_mask_[infinite_vals_mask] = False
+
+        infinite_vals_mask = logical_not(all(isfinite(normal_cam), axis=2))
+        if any(logical_and(valid_mask, infinite_vals_mask)):
+            warning_pixels_mask = logical_and(valid_mask, infinite_vals_mask)
+            warning_pixels_y, warning_pixels_x = where(warning_pixels_mask)
+            print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: NON-FINITE VALUE AT VALID PIXEL IN " + in_normal_cam_hdf5_file + " (num_pixels=" + str(warning_pixels_y.shape[0]) + "; see pixel y=" + str(warning_pixels_y[0]) + ", x=" + str(warning_pixels_x[0]) + ")")
+        valid_mask_[infinite_vals_mask] = False
+
+        infinite_vals_mask = logical_not(all(isfinite(normal_world), axis=2))
+        if any(logical_and(valid_mask, infinite_vals_mask)):
+            warning_pixels_mask = logical_and(valid_mask, infinite_vals_mask)
+            warning_pixels_y, warning_pixels_x = where(warning_pixels_mask)
+            print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: NON-FINITE VALUE AT VALID PIXEL IN " + in_normal_world_hdf5_file + " (num_pixels=" + str(warning_pixels_y.shape[0]) + "; see pixel y=" + str(warning_pixels_y[0]) + ", x=" + str(warning_pixels_x[0]) + ")")
+        valid_mask_[infinite_vals_mask] = False
+
+        infinite_vals_mask = logical_not(all(isfinite(position), axis=2))
+        if any(logical_and(valid_mask, infinite_vals_mask)):
+            warning_pixels_mask = logical_and(valid_mask, infinite_vals_mask)
+            warning_pixels_y, warning_pixels_x = where(warning_pixels_mask)
+            print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: NON-FINITE VALUE AT VALID PIXEL IN " + in_position_hdf5_file + " (num_pixels=" + str(warning_pixels_y.shape[0]) + "; see pixel y=" + str(warning_pixels_y[0]) + ", x=" + str(warning_pixels_x[0]) + ")")
+        valid_mask_[infinite_vals_mask] = False
+
+        infinite_vals_mask = logical_not(all(isfinite(rgb_color), axis=2))
+        if any(logical_and(valid_mask, infinite_vals_mask)):
+            warning_pixels_mask = logical_and(valid_mask, infinite_vals_mask)
+            warning_pixels_y, warning_pixels_x = where(warning_pixels_mask)
+            print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: NON-FINITE VALUE AT VALID PIXEL IN " + in_rgb_hdf5_file + " (num_pixels=" + str(warning_pixels_y.shape[0]) + "; see pixel y=" + str(warning_pixels_y[0]) + ", x=" + str(warning_pixels_x[0]) + ")")
+        valid_mask_[infinite_vals_mask] = False
+
+        infinite_vals_mask = logical_not(all(isfinite(diffuse_illumination), axis=2))
+        if any(logical_and(valid_mask, infinite_vals_mask)):
+            warning_pixels_mask = logical_and(valid_mask, infinite_vals_mask)
+            warning_pixels_y, warning_pixels_x = where(warning_pixels_mask)
+            print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: NON-FINITE VALUE AT VALID PIXEL IN " + in_diffuse_illumination_hdf5_file + " (num_pixels=" + str(warning_pixels_y.shape[0]) + "; see pixel y=" + str(warning_pixels_y[0]) + ", x=" + str(warning_pixels_x[0]) + ")")
+        valid_mask_[infinite_vals_mask] = False
+
+        infinite_vals_mask = logical_not(all(isfinite(diffuse_reflectance), axis=2))
+        if any(logical_and(valid_mask, infinite_vals_mask)):
+            warning_pixels_mask = logical_and(valid_mask, infinite_vals_mask)
+            warning_pixels_y, warning_pixels_x = where(warning_pixels_mask)
+            print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: NON-FINITE VALUE AT VALID PIXEL IN " + in_diffuse_reflectance_hdf5_file + " (num_pixels=" + str(warning_pixels_y.shape[0]) + "; see pixel y=" + str(warning_pixels_y[0]) + ", x=" + str(warning_pixels_x[0]) + ")")
+        valid_mask_[infinite_vals_mask] = False
+
+        infinite_vals_mask = logical_not(all(isfinite(residual), axis=2))
+        if any(logical_and(valid_mask, infinite_vals_mask)):
+            warning_pixels_mask = logical_and(valid_mask, infinite_vals_mask)
+            warning_pixels_y, warning_pixels_x = where(warning_pixels_mask)
+            print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: NON-FINITE VALUE AT VALID PIXEL IN " + in_residual_hdf5_file + " (num_pixels=" + str(warning_pixels_y.shape[0]) + "; see pixel y=" + str(warning_pixels_y[0]) + ", x=" + str(warning_pixels_x[0]) + ")")
+        valid_mask_[infinite_vals_mask] = False
+
+        zero_normals_mask = all(isclose(normal_cam, 0.0), axis=2)
+        if any(logical_and(valid_mask, zero_normals_mask)):
+            warning_pixels_mask = logical_and(valid_mask, zero_normals_mask)
+            warning_pixels_y, warning_pixels_x = where(warning_pixels_mask)
+            print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: ZERO NORMALS AT VALID PIXEL IN " + in_normal_cam_hdf5_file + " (num_pixels=" + str(warning_pixels_y.shape[0]) + "; see pixel y=" + str(warning_pixels_y[0]) + ", x=" + str(warning_pixels_x[0]) + ")")
+        valid_mask_[zero_normals_mask] = False
+
+        zero_normals_mask = all(isclose(normal_world, 0.0), axis=2)
+        if any(logical_and(valid_mask, zero_normals_mask)):
+            warning_pixels_mask = logical_and(valid_mask, zero_normals_mask)
+            warning_pixels_y, warning_pixels_x = where(warning_pixels_mask)
+            print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: ZERO NORMALS AT VALID PIXEL IN " + in_normal_world_hdf5_file + " (num_pixels=" + str(warning_pixels_y.shape[0]) + "; see pixel y=" + str(warning_pixels_y[0]) + ", x=" + str(warning_pixels_x[0]) + ")")
+        valid_mask_[zero_normals_mask] = False
+
+        valid_mask   = valid_mask_
+        invalid_mask = logical_not(valid_mask)
+
+        valid_mask_1d   = valid_mask.reshape(-1)
+        invalid_mask_1d = invalid_mask.reshape(-1)
+
+        if not any(valid_mask_1d):
+            print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: NO VALID PIXELS, SKIPPING...")
+            continue
+
+        # make sure normals are correctly normalized - should do this when generating the HDF5 data?
+        normal_cam_1d_ = normal_cam.reshape(-1,3)
+        normal_cam_1d_[invalid_mask_1d] = -987654321.0
+        normal_cam_1d_ = sklearn.preprocessing.normalize(normal_cam_1d_)
+        normal_cam     = normal_cam_1d_.reshape(normal_cam.shape)
+
+        normal_world_1d_ = normal_world.reshape(-1,3)
+        normal_world_1d_[invalid_mask_1d] = -987654321.0
+        normal_world_1d_ = sklearn.preprocessing.normalize(normal_world_1d_)
+        normal_world     = normal_world_1d_.reshape(normal_world.shape)
+
+        # compute flat lists of valid values
+        depth_meters_1d      = depth_meters.reshape(-1)[valid_mask_1d]
+        normal_cam_1d        = normal_cam.reshape(-1,3)[valid_mask_1d]
+        normal_world_1d      = normal_world.reshape(-1,3)[valid_mask_1d]
+        position_1d          = position.reshape(-1,3)[valid_mask_1d]
+        semantic_1d          = semantic.reshape(-1)[valid_mask_1d]
+        semantic_instance_1d = semantic_instance.reshape(-1)[valid_mask_1d]
+
+        rgb_color_1d            = rgb_color.reshape(-1,3)[valid_mask_1d]
+        diffuse_illumination_1d = diffuse_illumination.reshape(-1,3)[valid_mask_1d]
+        diffuse_reflectance_1d  = diffuse_reflectance.reshape(-1,3)[valid_mask_1d]
+        residual_1d             = residual.reshape(-1,3)[valid_mask_1d]
+
+        assert allclose(linalg.norm(normal_cam_1d,   axis=1), 1.0)
+        assert allclose(linalg.norm(normal_world_1d, axis=1), 1.0)
+
+        if (any(diffuse_reflectance_1d < 0.0)):
+            outliers = sort(diffuse_reflectance_1d[diffuse_reflectance_1d < 0.0])
+            print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: OUTLIER DIFFUSE REFLECTANCE DATA: " + str(outliers.shape[0]) + " outliers, min outlier = " + str(outliers[0]) + ", max outlier = " + str(outliers[-1]))
+        if (any(diffuse_reflectance_1d > 1.0)):
+            outliers = sort(diffuse_reflectance_1d[diffuse_reflectance_1d > 1.0])
+            print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: OUTLIER DIFFUSE REFLECTANCE DATA: " + str(outliers.shape[0]) + " outliers, min outlier = " + str(outliers[0]) + ", max outlier = " + str(outliers[-1]))
+
+        # orient normals towards the camera - should do this when generating the HDF5 data?
+        position_1d_     = position.reshape(-1,3)
+        normal_world_1d_ = normal_world.reshape(-1,3)
+
+        position_1d_[invalid_mask_1d]     = -987654321.0
+        normal_world_1d_[invalid_mask_1d] = -987654321.0
+
+        assert all(isfinite(position_1d_))
+
+        surface_to_cam_world_normalized_1d_ = sklearn.preprocessing.normalize(camera_position - position_1d_)
+        n_dot_v_1d_                         = sum(normal_world_1d_*surface_to_cam_world_normalized_1d_, axis=1)
+        normal_back_facing_mask_1d_         = logical_and(valid_mask_1d, n_dot_v_1d_ < 0)
+        normal_back_facing_mask             = normal_back_facing_mask_1d_.reshape(normal_world.shape[0], normal_world.shape[1])
+        normal_back_facing_mask_1d          = normal_back_facing_mask_1d_.reshape(-1)
+
+        normal_cam_ = normal_cam.copy()
+        normal_cam_[normal_back_facing_mask] = -normal_cam_[normal_back_facing_mask]
+        normal_cam_1d                        = normal_cam_.reshape(-1,3)[valid_mask_1d]
+
+        assert allclose(linalg.norm(normal_cam_1d, axis=1), 1.0)
+
+        # UNIQUE OBJECTS PER IMAGE: get number of unique objects in the current image (not including -1), increment histogram bin
+        semantic_instance_1d_non_null_only = semantic_instance_1d[semantic_instance_1d != -1]
+        num_unique_objects_current_image = unique(semantic_instance_1d_non_null_only).shape[0]
+
+        if num_unique_objects_current_image < unique_objects_per_image_hist_n_bins:
+            hists["unique_objects_per_image_hist"][num_unique_objects_current_image] += 1
+        else:
+            print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: IMAGE " + in_file_root + " CONTAINS " + str(num_unique_objects_current_image) + " UNIQUE OBJECTS, BUT HISTOGRAM ONLY HAS " + str(unique_objects_per_image_hist_n_bins) + " BINS...")
+
+        # UNIQUE CLASSES PER IMAGE: get number of unique classes (not including -1) in the current image, increment histogram bin
+        semantic_1d_non_null_only = semantic_1d[semantic_1d != -1]
+        num_unique_classes_current_image = unique(semantic_1d_non_null_only).shape[0]
+        assert num_unique_classes_current_image < unique_classes_per_image_hist_n_bins
+        hists["unique_classes_per_image_hist"][num_unique_classes_current_image] += 1
+
+        # UNIQUE OBJECTS PER CLASS: update list of unique semantic instance ids (including -1) visible in the current camera trajectory
+        unique_semantic_instance_ids_current_camera_trajectory = unique(r_[ unique_semantic_instance_ids_current_camera_trajectory, semantic_instance_1d ])
+
+        # PIXELS PER CLASS: compute histogram (including -1) for current image
+        histogram_utils.accumulate_histogram(hists["pixels_per_class_hist"], semantic_1d, per_class_hist_bins)
+
+        # DEPTH (LINEAR)
+        histogram_utils.accumulate_histogram(hists["depth_hist_linear"], depth_meters_1d, depth_hist_linear_bins)
+
+        # DEPTH (LOG)
+        histogram_utils.accumulate_histogram(hists["depth_hist_log"], depth_meters_1d, depth_hist_log_bins)
+
+        # NORMAL
+        histogram_utils.accumulate_histogram(hists["normal_hist"], normal_cam_1d[:,[1,0]], [normal_hist_bins, normal_hist_bins])
+
+        #
+        # Compute brightness and normalized hue saturation values for each buffer in a single pass, see
+        # histogram_utils.py for details. We compute brightness according to the "CCIR601 YIQ" method, and
+        # use the CGIntrinsics strategy for tonemapping but exclude gamma, see [1,2]
+        # [1] https://github.com/snavely/pbrs_tonemapper/blob/master/tonemap_rgbe.py
+        # [2] https://landofinterruptions.co.uk/manyshades
+        #
+
+        rgb_color_1d_brightness,            rgb_color_1d_norm_hs_x,            rgb_color_1d_norm_hs_y            = histogram_utils.rgb_to_brightness_and_hue_saturation(rgb_color_1d)
+        diffuse_illumination_1d_brightness, diffuse_illumination_1d_norm_hs_x, diffuse_illumination_1d_norm_hs_y = histogram_utils.rgb_to_brightness_and_hue_saturation(diffuse_illumination_1d)
+        diffuse_reflectance_1d_brightness,  diffuse_reflectance_1d_norm_hs_x,  diffuse_reflectance_1d_norm_hs_y  = histogram_utils.rgb_to_brightness_and_hue_saturation(diffuse_reflectance_1d)
+        residual_1d_brightness,             residual_1d_norm_hs_x,             residual_1d_norm_hs_y             = histogram_utils.rgb_to_brightness_and_hue_saturation(residual_1d)
+
+        # compute linearly tonemapped values
+        percentile                        = 90
+        brightness_nth_percentile_desired = 0.8
+
+        if count_nonzero(valid_mask) == 0:
+            scale = 1.0
+        else:
+            eps                               = 0.0001
+            brightness_nth_percentile_current = np.percentile(rgb_color_1d_brightness, percentile)
+
+            if brightness_nth_percentile_current < eps:
+                scale = 0.0
+            else:
+                scale = brightness_nth_percentile_desired / brightness_nth_percentile_current
+
+        rgb_color_1d_tm            = scale*rgb_color_1d
+        diffuse_illumination_1d_tm = scale*diffuse_illumination_1d
+        residual_1d_tm             = scale*residual_1d
+
+        # RGB COLOR
+        histogram_utils.accumulate_histogram(hists["rgb_color_hist"],                   rgb_color_1d_tm[:,[2,1,0]],                         color_hist_denorm_bins_3d)
+        histogram_utils.accumulate_histogram(hists["rgb_color_hue_saturation_hist"],    c_[rgb_color_1d_norm_hs_y, rgb_color_1d_norm_hs_x], hue_saturation_hist_bins_2d)
+        histogram_utils.accumulate_histogram(hists["rgb_color_brightness_hist_linear"], rgb_color_1d_brightness,                            brightness_hist_linear_bins)
+        histogram_utils.accumulate_histogram(hists["rgb_color_brightness_hist_log"],    rgb_color_1d_brightness,                            brightness_hist_log_bins)
+
+        # DIFFUSE ILLUMINATION
+        histogram_utils.accumulate_histogram(hists["diffuse_illumination_hist"],                   diffuse_illumination_1d_tm[:,[2,1,0]],                                    color_hist_denorm_bins_3d)
+        histogram_utils.accumulate_histogram(hists["diffuse_illumination_hue_saturation_hist"],    c_[diffuse_illumination_1d_norm_hs_y, diffuse_illumination_1d_norm_hs_x], hue_saturation_hist_bins_2d)
+        histogram_utils.accumulate_histogram(hists["diffuse_illumination_brightness_hist_linear"], diffuse_illumination_1d_brightness,                                       brightness_hist_linear_bins)
+        histogram_utils.accumulate_histogram(hists["diffuse_illumination_brightness_hist_log"],    diffuse_illumination_1d_brightness,                                       brightness_hist_log_bins)
+
+        # DIFFUSE REFLECTANCE
+        histogram_utils.accumulate_histogram(hists["diffuse_reflectance_hist"],                   diffuse_reflectance_1d[:,[2,1,0]],                                      color_hist_norm_bins_3d)
+        histogram_utils.accumulate_histogram(hists["diffuse_reflectance_hue_saturation_hist"],    c_[diffuse_reflectance_1d_norm_hs_y, diffuse_reflectance_1d_norm_hs_x], hue_saturation_hist_bins_2d)
+        histogram_utils.accumulate_histogram(hists["diffuse_reflectance_brightness_hist_linear"], diffuse_reflectance_1d_brightness,                                      brightness_hist_linear_bins)
+        histogram_utils.accumulate_histogram(hists["diffuse_reflectance_brightness_hist_log"],    diffuse_reflectance_1d_brightness,                                      brightness_hist_log_bins)
+
+        # NON-DIFFUSE RESIDUAL
+        histogram_utils.accumulate_histogram(hists["residual_hist"],                   residual_1d_tm[:,[2,1,0]],                        color_hist_denorm_bins_3d)
+        histogram_utils.accumulate_histogram(hists["residual_hue_saturation_hist"],    c_[residual_1d_norm_hs_y, residual_1d_norm_hs_x], hue_saturation_hist_bins_2d)
+        histogram_utils.accumulate_histogram(hists["residual_brightness_hist_linear"], residual_1d_brightness,                           brightness_hist_linear_bins)
+        histogram_utils.accumulate_histogram(hists["residual_brightness_hist_log"],    residual_1d_brightness,                           brightness_hist_log_bins)
+
+        print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] Processing frame " + str(i) + " (scale=" + str(scale) + ")...")
+
+        # import mayavi.mlab
+        # path_utils.add_path_to_sys_path("../lib", mode="relative_to_cwd", frame=inspect.currentframe())
+        # import mayavi_utils
+
+        # color_hist_bin_centers_x_1d = color_hist_bin_edges[:-1] + diff(color_hist_bin_edges)/2.0
+        # color_hist_bin_centers_y_1d = color_hist_bin_edges[:-1] + diff(color_hist_bin_edges)/2.0
+        # color_hist_bin_centers_z_1d = color_hist_bin_edges[:-1] + diff(color_hist_bin_edges)/2.0
+
+        # color_hist_bin_centers_z, color_hist_bin_centers_y, color_hist_bin_centers_x = meshgrid(color_hist_bin_centers_x_1d, color_hist_bin_centers_y_1d, color_hist_bin_centers_z_1d, indexing="ij")
+        # color_hist_bin_centers_1d = c_[ color_hist_bin_centers_x.ravel(), color_hist_bin_centers_y.ravel(), color_hist_bin_centers_z.ravel() ]
+
+        # in_geometry_preview_dir = os.path.join(images_dir, in_scene_fileroot + "_" + camera_name + "_geometry_preview")
+
+        # # SEMANTIC
+        # semantic_img_file = os.path.join(in_geometry_preview_dir, in_file_root + ".semantic.png")
+        # semantic_img      = imread(semantic_img_file)
+        # semantic_img_1d   = semantic_img.reshape(-1,4)[:,0:3]
+
+        # H, H_edges = histogramdd(semantic_img_1d[:,[2,1,0]], bins=color_hist_n_bins, range=[(0,1), (0,1), (0,1)])
+        # H_norm    = H / H.sum()
+        # H_norm_1d = H_norm.ravel()
+        # mayavi.mlab.figure(bgcolor=(1,1,1), fgcolor=(0,0,0), engine=None, size=(512, 512))
+        # mayavi_utils.points3d_color_by_rgb_value(color_hist_bin_centers_1d, colors=color_hist_bin_centers_1d, sizes=H_norm_1d, scale_factor=0.5)
+        # mayavi.mlab.outline(color=(0,0,0), extent=[0,1,0,1,0,1])
+        # mayavi.mlab.axes()
+        # mayavi.mlab.xlabel("R")
+        # mayavi.mlab.ylabel("G")
+        # mayavi.mlab.zlabel("B")
+        # mayavi.mlab.show()
+
+        # # SEMANTIC INSTANCE
+        # semantic_instance_img_file = os.path.join(in_geometry_preview_dir, in_file_root + ".semantic_instance.png")
+        # semantic_instance_img      = imread(semantic_instance_img_file)
+        # semantic_instance_img_1d   = semantic_instance_img.reshape(-1,4)[:,0:3]
+
+        # H, H_edges = histogramdd(semantic_instance_img_1d[:,[2,1,0]], bins=color_hist_n_bins, range=[(0,1), (0,1), (0,1)])
+        # H_norm    = H / H.sum()
+        # H_norm_1d = H_norm.ravel()
+        # mayavi.mlab.figure(bgcolor=(1,1,1), fgcolor=(0,0,0), engine=None, size=(512, 512))
+        # mayavi_utils.points3d_color_by_rgb_value(color_hist_bin_centers_1d, colors=color_hist_bin_centers_1d, sizes=H_norm_1d, scale_factor=0.5)
+        # mayavi.mlab.outline(color=(0,0,0), extent=[0,1,0,1,0,1])
+        # mayavi.mlab.axes()
+        # mayavi.mlab.xlabel("R")
+        # mayavi.mlab.ylabel("G")
+        # mayavi.mlab.zlabel("B")
+        # mayavi.mlab.show()
+
+    image_reader.close()
+    if archive_reader is not None:
+        archive_reader.close()
+
+    return hists, unique_semantic_instance_ids_current_camera_trajectory
+
+
+
+#
+# Map step (objects): compute the partial histograms for the objects in a single scene that are visible in
+# any of its camera trajectories.
+#
+
+def process_scene_objects(scene_name, unique_semantic_instance_ids_current_scene, args):
+
+    hists = get_empty_hists()
+
+    scene_dir  = os.path.join(dataset_scenes_dir, scene_name)
+    detail_dir = os.path.join(scene_dir, "_detail")
+    mesh_dir   = os.path.join(scene_dir, "_detail", "mesh")
+
+    archive_reader = get_archive_reader(args)
+
+    metadata_scene_file = os.path.join(detail_dir, "metadata_scene.csv")
+    with archive_utils.open_file(metadata_scene_file, archive_reader) as f: df_scene = pd.read_csv(f, index_col="parameter_name")
+    meters_per_asset_unit = df_scene.loc["meters_per_asset_unit"][0]
+
+    print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] Generating object statistics for scene " + scene_name + "...")
 
     # UNIQUE OBJECTS PER CLASS: Compute the semantic label for each object in the scene.
     # If there is any ambiguity about the label, just ignore the object. Could replace
@@ -340,507 +799,234 @@ def process_scene(s, args):
     if args.bounding_box_type == "object_aligned_3d":
         metadata_semantic_instance_bounding_box_extents_hdf5_file = os.path.join(mesh_dir, "metadata_semantic_instance_bounding_box_object_aligned_3d_extents.hdf5")
 
-    with h5py.File(mesh_objects_si_hdf5_file,                                 "r") as f: mesh_objects_si      = f["dataset"][:]
-    with h5py.File(mesh_objects_sii_hdf5_file,                                "r") as f: mesh_objects_sii     = f["dataset"][:]
-    with h5py.File(metadata_semantic_instance_bounding_box_extents_hdf5_file, "r") as f: bounding_box_extents = f["dataset"][:]
+    with hdf5_utils.open_hdf5_file(mesh_objects_si_hdf5_file,                                 archive_reader) as f: mesh_objects_si      = f["dataset"][:]
+    with hdf5_utils.open_hdf5_file(mesh_objects_sii_hdf5_file,                                archive_reader) as f: mesh_objects_sii     = f["dataset"][:]
+    with hdf5_utils.open_hdf5_file(metadata_semantic_instance_bounding_box_extents_hdf5_file, archive_reader) as f: bounding_box_extents = f["dataset"][:]
 
-    mesh_objects_sii_unique               = unique(mesh_objects_sii)
-    mesh_objects_sii_unique_non_null_only = mesh_objects_sii_unique[mesh_objects_sii_unique != -1]
-    num_mesh_objects_sii_unique           = mesh_objects_sii_unique_non_null_only.shape[0]
+    if archive_reader is not None:
+        archive_reader.close()
 
-    mesh_objects_sii_to_si_map = {}
+    # compute the semantic ID for all semantic instances in a single vectorized pass
+    mesh_objects_sii_unique_non_null_only, mesh_objects_sii_unique_si, mesh_objects_sii_unique_num_si = \
+        mesh_utils.compute_semantic_instance_to_semantic_id_map(mesh_objects_sii, mesh_objects_si)
 
-    for i in range(num_mesh_objects_sii_unique):
+    mesh_objects_sii_to_si_map = dict(zip(mesh_objects_sii_unique_non_null_only, mesh_objects_sii_unique_si))
 
-        sii                     = mesh_objects_sii_unique_non_null_only[i]
+    for sii in mesh_objects_sii_unique_non_null_only[mesh_objects_sii_unique_num_si == 0]:
+        print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: SEMANTIC INSTANCE ID " + str(sii) + " HAS NO SEMANTIC ID...")
+
+    for sii in mesh_objects_sii_unique_non_null_only[mesh_objects_sii_unique_num_si > 1]:
         si_unique               = unique(mesh_objects_si[mesh_objects_sii == sii])
         si_unique_non_null_only = si_unique[si_unique != -1]
-        num_si_unique           = si_unique_non_null_only.shape[0]
+        semantic_names          = [ semantic_id_to_name_map[si] for si in si_unique_non_null_only ]
+        print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: SEMANTIC INSTANCE ID " + str(sii) + " HAS MORE THAN ONE SEMANTIC ID (" + str(si_unique) + ", " + str(semantic_names) + ")...")
+
+    # OBJECT VOLUME (LINEAR)
+    # OBJECT VOLUME (LOG)
+    # UNIQUE OBJECTS PER CLASS
+    unique_semantic_instance_ids_current_scene_non_null_only = unique_semantic_instance_ids_current_scene[unique_semantic_instance_ids_current_scene != -1]
 
-        if num_si_unique == 0:
-            print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: SEMANTIC INSTANCE ID " + str(sii) + " HAS NO SEMANTIC ID...")
-            mesh_objects_sii_to_si_map[sii] = -1
-        if num_si_unique == 1:
-            mesh_objects_sii_to_si_map[sii] = si_unique_non_null_only[0]
-        if num_si_unique > 1:
-            semantic_names = [ semantic_id_to_name_map[si] for si in si_unique_non_null_only ]
-            print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: SEMANTIC INSTANCE ID " + str(sii) + " HAS MORE THAN ONE SEMANTIC ID (" + str(si_unique) + ", " + str(semantic_names) + ")...")
-            mesh_objects_sii_to_si_map[sii] = -1
+    if unique_semantic_instance_ids_current_scene_non_null_only.shape[0] > 0:
 
+        # OBJECT VOLUME (LINEAR)
+        # OBJECT VOLUME (LOG)
+        bounding_box_extents_meters       = meters_per_asset_unit*bounding_box_extents
+        bounding_box_volumes_meters_cubed = prod(bounding_box_extents_meters[unique_semantic_instance_ids_current_scene_non_null_only], axis=1)
 
+        # OBJECT VOLUME (LINEAR)
+        histogram_utils.accumulate_histogram(hists["object_volume_hist_linear"], bounding_box_volumes_meters_cubed, object_volume_hist_linear_bins)
 
-    # iterate over the camera trajectories in the scene
-    if args.camera_names is not None:
-        cameras = [ c for c in df_cameras.to_records() if fnmatch.fnmatch(c["camera_name"], args.camera_names) ]
+        # OBJECT VOLUME (LOG)
+        histogram_utils.accumulate_histogram(hists["object_volume_hist_log"], bounding_box_volumes_meters_cubed, object_volume_hist_log_bins)
+
+        # UNIQUE OBJECTS PER CLASS: compute histogram (including -1) for current scene
+        semantic_ids_current_scene = [ mesh_objects_sii_to_si_map[sii] for sii in unique_semantic_instance_ids_current_scene_non_null_only ]
+
+        histogram_utils.accumulate_histogram(hists["unique_objects_per_class_hist"], array(semantic_ids_current_scene), per_class_hist_bins)
+
+
+    return hists
+
+
+
+#
+# Reduce step: merge the partial histograms for all camera trajectories and scenes into a checkpoint. By
+# default, we process camera trajectories on a process pool in batches of --checkpoint_interval camera
+# trajectories, and save the checkpoint after each batch. When all work is done, we save the merged
+# histograms to the batch directory. If --load_snapshot is specified, we resume from the existing
+# checkpoint, i.e., we skip all completed work, rather than starting from empty histograms. This also
+# makes it possible to add new scenes to an existing batch without counting any scene twice. For batches
+# without a checkpoint, see load_snapshot(...).
+#
+# To distribute the work across multiple machines, run this tool on each machine with the same
+# --num_shards and a different --shard_index, which processes every num_shards-th scene and saves its
+# checkpoint to <batch_dir>/shards/shard_<shard_index>_of_<num_shards>.hdf5. Then run this tool once with
+# --merge_shards, which merges the checkpoints for all shards and saves the merged histograms to the
+# batch directory.
+#
+
+if args.merge_shards:
+
+    shard_checkpoint_files = sorted(glob.glob(os.path.join(shards_dir, "shard_*_of_*.hdf5")))
+    assert len(shard_checkpoint_files) > 0
+
+    num_shards = int(os.path.splitext(os.path.basename(shard_checkpoint_files[0]))[0].split("_")[-1])
+    assert shard_checkpoint_files == [ get_checkpoint_file(i, num_shards) for i in range(num_shards) ]
+
+    checkpoint_file = get_checkpoint_file()
+
+    if args.load_snapshot:
+        checkpoint = load_snapshot(checkpoint_file)
     else:
-        cameras = df_cameras.to_records()
+        checkpoint = get_empty_checkpoint()
 
-    unique_semantic_instance_ids_current_scene = array([])
+    print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] Merging checkpoints for " + str(num_shards) + " shards...")
 
-    for c in cameras:
+    for shard_checkpoint_file in shard_checkpoint_files:
+        shard_checkpoint = load_checkpoint(shard_checkpoint_file)
+        assert shard_checkpoint["finished"]
+        assert len(shard_checkpoint["completed_keys"] & checkpoint["completed_keys"]) == 0
+        merge_hists(checkpoint["hists"], shard_checkpoint["hists"])
+        checkpoint["completed_keys"] |= shard_checkpoint["completed_keys"]
+        merge_semantic_instance_ids(checkpoint["unique_semantic_instance_ids"],  shard_checkpoint["unique_semantic_instance_ids"])
+        merge_semantic_instance_ids(checkpoint["counted_semantic_instance_ids"], shard_checkpoint["counted_semantic_instance_ids"])
 
-        camera_name = c["camera_name"]
+else:
 
-        # check if camera trajectory is flagged for exclusion
-        camera_trajectory_name = scene_name + "_" + camera_name
-        scene_type = df_camera_trajectories.loc[camera_trajectory_name]["Scene type"]
-        if scene_type == "OUTSIDE VIEWING AREA (BAD INITIALIZATION)" or scene_type == "OUTSIDE VIEWING AREA (BAD TRAJECTORY)":
-            print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] Camera " + camera_name + " is outside the viewing area, skipping...")
-            continue
+    if args.num_shards is not None:
+        scenes          = scenes[args.shard_index::args.num_shards]
+        checkpoint_file = get_checkpoint_file(args.shard_index, args.num_shards)
+    else:
+        checkpoint_file = get_checkpoint_file()
 
-        print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] For scene " + scene_name + ", generating image statistics for camera " + camera_name + "...")
+    if args.load_snapshot:
+        checkpoint = load_snapshot(checkpoint_file)
+    else:
+        checkpoint = get_empty_checkpoint()
+
+    checkpoint["finished"] = False
+
+    # get the camera trajectories in each scene, excluding scenes and camera trajectories that have been
+    # flagged for exclusion, and the selected camera trajectories in each scene
+    all_camera_names_per_scene = {}
+    camera_names_per_scene     = {}
+
+    archive_reader = get_archive_reader(args)
+
+    for s in scenes:
 
-        in_scene_fileroot        = "scene"
-        in_final_hdf5_dir        = os.path.join(images_dir, in_scene_fileroot + "_" + camera_name + "_final_hdf5")
-        in_geometry_hdf5_dir     = os.path.join(images_dir, in_scene_fileroot + "_" + camera_name + "_geometry_hdf5")
-        in_camera_trajectory_dir = os.path.join(detail_dir, camera_name)
+        scene_name = s["name"]
+        detail_dir = os.path.join(dataset_scenes_dir, scene_name, "_detail")
 
-        camera_keyframe_frame_indices_hdf5_file = os.path.join(in_camera_trajectory_dir, "camera_keyframe_frame_indices.hdf5")
-        camera_keyframe_positions_hdf5_file     = os.path.join(in_camera_trajectory_dir, "camera_keyframe_positions.hdf5")
+        metadata_cameras_csv_file = os.path.join(detail_dir, "metadata_cameras.csv")
+        with archive_utils.open_file(metadata_cameras_csv_file, archive_reader) as f: df_cameras = pd.read_csv(f)
+        cameras = df_cameras.to_records()
+
+        # check if scene has been flagged for exclusion
+        scene_included_in_dataset = False
+        for c in cameras:
+            camera_trajectory_name = scene_name + "_" + c["camera_name"]
+            scene_type = df_camera_trajectories.loc[camera_trajectory_name]["Scene type"]
+            if scene_type != "OUTSIDE VIEWING AREA (BAD INITIALIZATION)" and scene_type != "OUTSIDE VIEWING AREA (BAD TRAJECTORY)":
+                scene_included_in_dataset = True
+                break
+        if not scene_included_in_dataset:
+            print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] No good camera trajectories for scene " + scene_name + ", skipping...")
+            continue
 
-        with h5py.File(camera_keyframe_frame_indices_hdf5_file, "r") as f: camera_keyframe_frame_indices = f["dataset"][:]
-        with h5py.File(camera_keyframe_positions_hdf5_file,     "r") as f: camera_keyframe_positions     = f["dataset"][:]
+        all_camera_names_per_scene[scene_name] = []
+        camera_names_per_scene[scene_name]     = []
 
-        assert all(camera_keyframe_frame_indices == arange(camera_keyframe_frame_indices.shape[0]))
+        for c in cameras:
 
-        num_camera_positions = camera_keyframe_frame_indices.shape[0]
+            camera_name     = c["camera_name"]
+            camera_selected = args.camera_names is None or fnmatch.fnmatch(camera_name, args.camera_names)
+
+            # check if camera trajectory is flagged for exclusion
+            camera_trajectory_name = scene_name + "_" + camera_name
+            scene_type = df_camera_trajectories.loc[camera_trajectory_name]["Scene type"]
+            if scene_type == "OUTSIDE VIEWING AREA (BAD INITIALIZATION)" or scene_type == "OUTSIDE VIEWING AREA (BAD TRAJECTORY)":
+                if camera_selected:
+                    print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] Camera " + camera_name + " is outside the viewing area, skipping...")
+                continue
 
-        for i in range(num_camera_positions):
+            all_camera_names_per_scene[scene_name].append(camera_name)
+            if camera_selected:
+                camera_names_per_scene[scene_name].append(camera_name)
 
-            camera_position = camera_keyframe_positions[i]
+    if archive_reader is not None:
+        archive_reader.close()
 
-            in_file_root = "frame.%04d" % i
+    camera_trajectories = [ (scene_name, camera_name) for scene_name in camera_names_per_scene for camera_name in camera_names_per_scene[scene_name]
+                            if scene_name + "_" + camera_name not in checkpoint["completed_keys"] ]
 
-            in_depth_meters_hdf5_file      = os.path.join(in_geometry_hdf5_dir, in_file_root + ".depth_meters.hdf5")
-            in_normal_cam_hdf5_file        = os.path.join(in_geometry_hdf5_dir, in_file_root + ".normal_cam.hdf5")
-            in_normal_world_hdf5_file      = os.path.join(in_geometry_hdf5_dir, in_file_root + ".normal_world.hdf5")
-            in_position_hdf5_file          = os.path.join(in_geometry_hdf5_dir, in_file_root + ".position.hdf5")
-            in_render_entity_id_hdf5_file  = os.path.join(in_geometry_hdf5_dir, in_file_root + ".render_entity_id.hdf5")
-            in_semantic_hdf5_file          = os.path.join(in_geometry_hdf5_dir, in_file_root + ".semantic.hdf5")
-            in_semantic_instance_hdf5_file = os.path.join(in_geometry_hdf5_dir, in_file_root + ".semantic_instance.hdf5")
+    print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] Generating image statistics for " + str(len(camera_trajectories)) + " camera trajectories in " + str(len(camera_names_per_scene)) + " scenes (" + str(len(checkpoint["completed_keys"])) + " completed keys in checkpoint)...")
 
-            in_rgb_hdf5_file                  = os.path.join(in_final_hdf5_dir, in_file_root + ".color.hdf5")
-            in_diffuse_illumination_hdf5_file = os.path.join(in_final_hdf5_dir, in_file_root + ".diffuse_illumination.hdf5")
-            in_diffuse_reflectance_hdf5_file  = os.path.join(in_final_hdf5_dir, in_file_root + ".diffuse_reflectance.hdf5")
-            in_residual_hdf5_file             = os.path.join(in_final_hdf5_dir, in_file_root + ".residual.hdf5")
+    # add the partial histograms for a batch of camera trajectories to the checkpoint, then add the objects
+    # for each scene whose selected camera trajectories are all complete, and save the checkpoint
+    def update_checkpoint(camera_trajectories_batch, results_batch):
 
-            try:
-                with h5py.File(in_depth_meters_hdf5_file,      "r") as f: depth_meters      = f["dataset"][:].astype(float32)
-                with h5py.File(in_normal_cam_hdf5_file,        "r") as f: normal_cam        = f["dataset"][:].astype(float32)
-                with h5py.File(in_normal_world_hdf5_file,      "r") as f: normal_world      = f["dataset"][:].astype(float32)
-                with h5py.File(in_position_hdf5_file,          "r") as f: position          = f["dataset"][:].astype(float32)
-                with h5py.File(in_render_entity_id_hdf5_file,  "r") as f: render_entity_id  = f["dataset"][:].astype(int32)
-                with h5py.File(in_semantic_hdf5_file,          "r") as f: semantic          = f["dataset"][:].astype(int32)
-                with h5py.File(in_semantic_instance_hdf5_file, "r") as f: semantic_instance = f["dataset"][:].astype(int32)
+        for (scene_name, camera_name), (hists, unique_semantic_instance_ids) in zip(camera_trajectories_batch, results_batch):
+            merge_hists(checkpoint["hists"], hists)
+            checkpoint["completed_keys"].add(scene_name + "_" + camera_name)
+            if scene_name in checkpoint["unique_semantic_instance_ids"]:
+                unique_semantic_instance_ids = unique(r_[ checkpoint["unique_semantic_instance_ids"][scene_name], unique_semantic_instance_ids ])
+            checkpoint["unique_semantic_instance_ids"][scene_name] = unique_semantic_instance_ids
 
-                with h5py.File(in_rgb_hdf5_file,                  "r") as f: rgb_color            = f["dataset"][:].astype(float32)
-                with h5py.File(in_diffuse_illumination_hdf5_file, "r") as f: diffuse_illumination = f["dataset"][:].astype(float32)
-                with h5py.File(in_diffuse_reflectance_hdf5_file,  "r") as f: diffuse_reflectance  = f["dataset"][:].astype(float32)
-                with h5py.File(in_residual_hdf5_file,             "r") as f: residual             = f["dataset"][:].astype(float32)
-            except:
-                print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: COULD NOT LOAD IMAGE DATA: " + in_file_root + "...")
+        for scene_name in camera_names_per_scene:
+            if not all([ scene_name + "_" + camera_name in checkpoint["completed_keys"] for camera_name in camera_names_per_scene[scene_name] ]):
                 continue
 
-            assert all(semantic != 0)
-            assert all(semantic_instance != 0)
-
-            #
-            # Compute a valid mask, where valid means:
-            # 1. There was some valid geometry rendered at that pixel. AND
-            # 2. There are no inf values in any of the floating-point buffers at that pixel.
-            # We need to handle this case explicitly because we save our data as float16, so
-            # some data that might not have been rendered as inf originally will become inf when
-            # we save our HDF5 data. AND
-            # 3. Has a non-zero normal at that pixel.
-            # We need to handle this case explicitly because V-Ray might render geometry with
-            # zero normals.
-            #
-            
-            valid_mask = render_entity_id != -1
-            valid_mask_ = valid_mask.copy()
-
-            infinite_vals_mask = logical_not(isfinite(depth_meters)) 
-            if any(logical_and(valid_mask, infinite_vals_mask)):
-                warning_pixels_mask = logical_and(valid_mask, infinite_vals_mask)
-                warning_pixels_y, warning_pixels_x = where(warning_pixels_mask)
-                print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: NON-FINITE VALUE AT VALID PIXEL IN " + in_depth_meters_hdf5_file + " (num_pixels=" + str(warning_pixels_y.shape[0]) + "; see pixel y=" + str(warning_pixels_y[0]) + ", x=" + str(warning_pixels_x[0]) + ")")
-            valid_mask_[infinite_vals_mask] = False
-
-            infinite_vals_mask = logical_not(all(isfinite(normal_cam), axis=2))
-            if any(logical_and(valid_mask, infinite_vals_mask)):
-                warning_pixels_mask = logical_and(valid_mask, infinite_vals_mask)
-                warning_pixels_y, warning_pixels_x = where(warning_pixels_mask)
-                print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: NON-FINITE VALUE AT VALID PIXEL IN " + in_normal_cam_hdf5_file + " (num_pixels=" + str(warning_pixels_y.shape[0]) + "; see pixel y=" + str(warning_pixels_y[0]) + ", x=" + str(warning_pixels_x[0]) + ")")
-            valid_mask_[infinite_vals_mask] = False
-
-            infinite_vals_mask = logical_not(all(isfinite(normal_world), axis=2))
-            if any(logical_and(valid_mask, infinite_vals_mask)):
-                warning_pixels_mask = logical_and(valid_mask, infinite_vals_mask)
-                warning_pixels_y, warning_pixels_x = where(warning_pixels_mask)
-                print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: NON-FINITE VALUE AT VALID PIXEL IN " + in_normal_world_hdf5_file + " (num_pixels=" + str(warning_pixels_y.shape[0]) + "; see pixel y=" + str(warning_pixels_y[0]) + ", x=" + str(warning_pixels_x[0]) + ")")
-            valid_mask_[infinite_vals_mask] = False
-
-            infinite_vals_mask = logical_not(all(isfinite(position), axis=2))
-            if any(logical_and(valid_mask, infinite_vals_mask)):
-                warning_pixels_mask = logical_and(valid_mask, infinite_vals_mask)
-                warning_pixels_y, warning_pixels_x = where(warning_pixels_mask)
-                print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: NON-FINITE VALUE AT VALID PIXEL IN " + in_position_hdf5_file + " (num_pixels=" + str(warning_pixels_y.shape[0]) + "; see pixel y=" + str(warning_pixels_y[0]) + ", x=" + str(warning_pixels_x[0]) + ")")
-            valid_mask_[infinite_vals_mask] = False
-
-            infinite_vals_mask = logical_not(all(isfinite(rgb_color), axis=2))
-            if any(logical_and(valid_mask, infinite_vals_mask)):
-                warning_pixels_mask = logical_and(valid_mask, infinite_vals_mask)
-                warning_pixels_y, warning_pixels_x = where(warning_pixels_mask)
-                print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: NON-FINITE VALUE AT VALID PIXEL IN " + in_rgb_hdf5_file + " (num_pixels=" + str(warning_pixels_y.shape[0]) + "; see pixel y=" + str(warning_pixels_y[0]) + ", x=" + str(warning_pixels_x[0]) + ")")
-            valid_mask_[infinite_vals_mask] = False
-
-            infinite_vals_mask = logical_not(all(isfinite(diffuse_illumination), axis=2))
-            if any(logical_and(valid_mask, infinite_vals_mask)):
-                warning_pixels_mask = logical_and(valid_mask, infinite_vals_mask)
-                warning_pixels_y, warning_pixels_x = where(warning_pixels_mask)
-                print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: NON-FINITE VALUE AT VALID PIXEL IN " + in_diffuse_illumination_hdf5_file + " (num_pixels=" + str(warning_pixels_y.shape[0]) + "; see pixel y=" + str(warning_pixels_y[0]) + ", x=" + str(warning_pixels_x[0]) + ")")
-            valid_mask_[infinite_vals_mask] = False
-
-            infinite_vals_mask = logical_not(all(isfinite(diffuse_reflectance), axis=2))
-            if any(logical_and(valid_mask, infinite_vals_mask)):
-                warning_pixels_mask = logical_and(valid_mask, infinite_vals_mask)
-                warning_pixels_y, warning_pixels_x = where(warning_pixels_mask)
-                print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: NON-FINITE VALUE AT VALID PIXEL IN " + in_diffuse_reflectance_hdf5_file + " (num_pixels=" + str(warning_pixels_y.shape[0]) + "; see pixel y=" + str(warning_pixels_y[0]) + ", x=" + str(warning_pixels_x[0]) + ")")
-            valid_mask_[infinite_vals_mask] = False
-
-            infinite_vals_mask = logical_not(all(isfinite(residual), axis=2))
-            if any(logical_and(valid_mask, infinite_vals_mask)):
-                warning_pixels_mask = logical_and(valid_mask, infinite_vals_mask)
-                warning_pixels_y, warning_pixels_x = where(warning_pixels_mask)
-                print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: NON-FINITE VALUE AT VALID PIXEL IN " + in_residual_hdf5_file + " (num_pixels=" + str(warning_pixels_y.shape[0]) + "; see pixel y=" + str(warning_pixels_y[0]) + ", x=" + str(warning_pixels_x[0]) + ")")
-            valid_mask_[infinite_vals_mask] = False
-
-            zero_normals_mask = all(isclose(normal_cam, 0.0), axis=2)
-            if any(logical_and(valid_mask, zero_normals_mask)):
-                warning_pixels_mask = logical_and(valid_mask, zero_normals_mask)
-                warning_pixels_y, warning_pixels_x = where(warning_pixels_mask)
-                print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: ZERO NORMALS AT VALID PIXEL IN " + in_normal_cam_hdf5_file + " (num_pixels=" + str(warning_pixels_y.shape[0]) + "; see pixel y=" + str(warning_pixels_y[0]) + ", x=" + str(warning_pixels_x[0]) + ")")
-            valid_mask_[zero_normals_mask] = False
-
-            zero_normals_mask = all(isclose(normal_world, 0.0), axis=2)
-            if any(logical_and(valid_mask, zero_normals_mask)):
-                warning_pixels_mask = logical_and(valid_mask, zero_normals_mask)
-                warning_pixels_y, warning_pixels_x = where(warning_pixels_mask)
-                print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: ZERO NORMALS AT VALID PIXEL IN " + in_normal_world_hdf5_file + " (num_pixels=" + str(warning_pixels_y.shape[0]) + "; see pixel y=" + str(warning_pixels_y[0]) + ", x=" + str(warning_pixels_x[0]) + ")")
-            valid_mask_[zero_normals_mask] = False
-
-            valid_mask   = valid_mask_
-            invalid_mask = logical_not(valid_mask)
-
-            valid_mask_1d   = valid_mask.reshape(-1)
-            invalid_mask_1d = invalid_mask.reshape(-1)
-
-            if not any(valid_mask_1d):
-                print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: NO VALID PIXELS, SKIPPING...")
+            # the completed camera trajectories include the ones completed by previous runs with a different --camera_names
+            completed_camera_names = [ c for c in all_camera_names_per_scene[scene_name] if scene_name + "_" + c in checkpoint["completed_keys"] ]
+            scene_objects_key      = get_scene_objects_key(scene_name, completed_camera_names)
+            if scene_objects_key in checkpoint["completed_keys"]:
                 continue
 
-            # make sure normals are correctly normalized - should do this when generating the HDF5 data?
-            normal_cam_1d_ = normal_cam.reshape(-1,3)
-            normal_cam_1d_[invalid_mask_1d] = -987654321.0
-            normal_cam_1d_ = sklearn.preprocessing.normalize(normal_cam_1d_)
-            normal_cam     = normal_cam_1d_.reshape(normal_cam.shape)
-
-            normal_world_1d_ = normal_world.reshape(-1,3)
-            normal_world_1d_[invalid_mask_1d] = -987654321.0
-            normal_world_1d_ = sklearn.preprocessing.normalize(normal_world_1d_)
-            normal_world     = normal_world_1d_.reshape(normal_world.shape)
-
-            # compute flat lists of valid values
-            depth_meters_1d      = depth_meters.reshape(-1)[valid_mask_1d]
-            normal_cam_1d        = normal_cam.reshape(-1,3)[valid_mask_1d]
-            normal_world_1d      = normal_world.reshape(-1,3)[valid_mask_1d]
-            position_1d          = position.reshape(-1,3)[valid_mask_1d]
-            semantic_1d          = semantic.reshape(-1)[valid_mask_1d]
-            semantic_instance_1d = semantic_instance.reshape(-1)[valid_mask_1d]
-
-            rgb_color_1d            = rgb_color.reshape(-1,3)[valid_mask_1d]
-            diffuse_illumination_1d = diffuse_illumination.reshape(-1,3)[valid_mask_1d]
-            diffuse_reflectance_1d  = diffuse_reflectance.reshape(-1,3)[valid_mask_1d]
-            residual_1d             = residual.reshape(-1,3)[valid_mask_1d]
-
-            assert allclose(linalg.norm(normal_cam_1d,   axis=1), 1.0)
-            assert allclose(linalg.norm(normal_world_1d, axis=1), 1.0)
-
-            if (any(diffuse_reflectance_1d < 0.0)):
-                outliers = sort(diffuse_reflectance_1d[diffuse_reflectance_1d < 0.0])
-                print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: OUTLIER DIFFUSE REFLECTANCE DATA: " + str(outliers.shape[0]) + " outliers, min outlier = " + str(outliers[0]) + ", max outlier = " + str(outliers[-1]))
-            if (any(diffuse_reflectance_1d > 1.0)):
-                outliers = sort(diffuse_reflectance_1d[diffuse_reflectance_1d > 1.0])
-                print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: OUTLIER DIFFUSE REFLECTANCE DATA: " + str(outliers.shape[0]) + " outliers, min outlier = " + str(outliers[0]) + ", max outlier = " + str(outliers[-1]))
-
-            # orient normals towards the camera - should do this when generating the HDF5 data?
-            position_1d_     = position.reshape(-1,3)
-            normal_world_1d_ = normal_world.reshape(-1,3)
-
-            position_1d_[invalid_mask_1d]     = -987654321.0
-            normal_world_1d_[invalid_mask_1d] = -987654321.0
-
-            assert all(isfinite(position_1d_))
-
-            surface_to_cam_world_normalized_1d_ = sklearn.preprocessing.normalize(camera_position - position_1d_)
-            n_dot_v_1d_                         = sum(normal_world_1d_*surface_to_cam_world_normalized_1d_, axis=1)
-            normal_back_facing_mask_1d_         = logical_and(valid_mask_1d, n_dot_v_1d_ < 0)
-            normal_back_facing_mask             = normal_back_facing_mask_1d_.reshape(normal_world.shape[0], normal_world.shape[1])
-            normal_back_facing_mask_1d          = normal_back_facing_mask_1d_.reshape(-1)
-
-            normal_cam_ = normal_cam.copy()
-            normal_cam_[normal_back_facing_mask] = -normal_cam_[normal_back_facing_mask]
-            normal_cam_1d                        = normal_cam_.reshape(-1,3)[valid_mask_1d]
-
-            assert allclose(linalg.norm(normal_cam_1d, axis=1), 1.0)
-
-            # UNIQUE OBJECTS PER IMAGE: get number of unique objects in the current image (not including -1), increment histogram bin
-            semantic_instance_1d_non_null_only = semantic_instance_1d[semantic_instance_1d != -1]
-            num_unique_objects_current_image = unique(semantic_instance_1d_non_null_only).shape[0]
-
-            if num_unique_objects_current_image < unique_objects_per_image_hist_n_bins:
-                unique_objects_per_image_hist[num_unique_objects_current_image] += 1
-            else:
-                print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] WARNING: IMAGE " + in_file_root + " CONTAINS " + num_unique_objects_current_image + " UNIQUE OBJECTS, BUT HISTOGRAM ONLY HAS " + unique_objects_per_image_hist_n_bins + " BINS...")
+            unique_semantic_instance_ids  = checkpoint["unique_semantic_instance_ids"].get(scene_name, array([], dtype=int32))
+            counted_semantic_instance_ids = checkpoint["counted_semantic_instance_ids"].get(scene_name, array([], dtype=int32))
+            new_semantic_instance_ids     = setdiff1d(unique_semantic_instance_ids, counted_semantic_instance_ids)
 
-            # UNIQUE CLASSES PER IMAGE: get number of unique classes (not including -1) in the current image, increment histogram bin
-            semantic_1d_non_null_only = semantic_1d[semantic_1d != -1]
-            num_unique_classes_current_image = unique(semantic_1d_non_null_only).shape[0]
-            assert num_unique_classes_current_image < unique_classes_per_image_hist_n_bins
-            unique_classes_per_image_hist[num_unique_classes_current_image] += 1
+            if new_semantic_instance_ids.shape[0] > 0:
+                merge_hists(checkpoint["hists"], process_scene_objects(scene_name, new_semantic_instance_ids, args))
 
-            # UNIQUE OBJECTS PER CLASS: update list of unique semantic instance ids (including -1) visible in the current scene
-            if unique_semantic_instance_ids_current_scene.shape[0] == 0:
-                unique_semantic_instance_ids_current_scene = unique(semantic_instance_1d)
-            else:
-                unique_semantic_instance_ids_current_scene = unique(r_[ unique_semantic_instance_ids_current_scene, semantic_instance_1d ])
-
-            # PIXELS PER CLASS: compute histogram (including -1) for current image
-            H, H_edges = histogram(semantic_1d, bins=per_class_hist_n_bins, range=(per_class_hist_min_bin_center - 0.5, per_class_hist_max_bin_center + 0.5))
-            pixels_per_class_hist += H
-
-            # DEPTH (LINEAR)
-            H, H_edges = histogram(depth_meters_1d, bins=depth_hist_linear_bin_edges)
-            depth_hist_linear += H
-
-            # DEPTH (LOG)
-            H, H_edges = histogram(depth_meters_1d, bins=depth_hist_log_bin_edges)
-            depth_hist_log += H
-
-            # NORMAL
-            H, H_edges = histogramdd(normal_cam_1d[:,[1,0]], bins=normal_hist_n_bins, range=[(normal_hist_min, normal_hist_max), (normal_hist_min, normal_hist_max)])
-            normal_hist += H.astype(int64)
-
-            #
-            # compute brightness according to "CCIR601 YIQ" method, use CGIntrinsics strategy for tonemapping but exclude gamma, see [1,2]
-            # [1] https://github.com/snavely/pbrs_tonemapper/blob/master/tonemap_rgbe.py
-            # [2] https://landofinterruptions.co.uk/manyshades
-            #
-
-            def rgb_to_brightness(vals_1d_rgb):
-                return 0.3*vals_1d_rgb[:,0] + 0.59*vals_1d_rgb[:,1] + 0.11*vals_1d_rgb[:,2]
-
-            def rgb_to_hsv_xyz(vals_1d_rgb):
-                vals_1d_hsv     = matplotlib.colors.rgb_to_hsv(vals_1d_rgb)
-                vals_1d_h       = vals_1d_hsv[:,0]
-                vals_1d_s       = vals_1d_hsv[:,1]
-                vals_1d_v       = vals_1d_hsv[:,2]
-                vals_1d_theta   = vals_1d_h*2*pi
-                vals_1d_hsv_x   = vals_1d_s*cos(vals_1d_theta)
-                vals_1d_hsv_y   = vals_1d_s*sin(vals_1d_theta)
-                vals_1d_hsv_z   = vals_1d_v
-                vals_1d_hsv_xyz = c_[vals_1d_hsv_x, vals_1d_hsv_y, vals_1d_hsv_z]
-                return vals_1d_hsv_xyz
-
-            # compute linearly tonemapped values
-            percentile                        = 90
-            brightness_nth_percentile_desired = 0.8
-
-            if count_nonzero(valid_mask) == 0:
-                scale = 1.0
-            else:
-                brightness_1d = rgb_to_brightness(rgb_color_1d)
-
-                eps                               = 0.0001
-                brightness_nth_percentile_current = np.percentile(brightness_1d, percentile)
-
-                if brightness_nth_percentile_current < eps:
-                    scale = 0.0
-                else:
-                    scale = brightness_nth_percentile_desired / brightness_nth_percentile_current
-
-            rgb_color_1d_tm            = scale*rgb_color_1d
-            diffuse_illumination_1d_tm = scale*diffuse_illumination_1d
-            residual_1d_tm             = scale*residual_1d
-
-            # compute normalized hue saturation values
-            rgb_color_1d_norm            = sklearn.preprocessing.normalize(rgb_color_1d)
-            diffuse_illumination_1d_norm = sklearn.preprocessing.normalize(diffuse_illumination_1d)
-            diffuse_reflectance_1d_norm  = sklearn.preprocessing.normalize(diffuse_reflectance_1d)
-            residual_1d_norm             = sklearn.preprocessing.normalize(residual_1d)
-
-            rgb_color_1d_norm_hsv_xyz            = rgb_to_hsv_xyz(rgb_color_1d_norm)
-            diffuse_illumination_1d_norm_hsv_xyz = rgb_to_hsv_xyz(diffuse_illumination_1d_norm)
-            diffuse_reflectance_1d_norm_hsv_xyz  = rgb_to_hsv_xyz(diffuse_reflectance_1d_norm)
-            residual_1d_norm_hsv_xyz             = rgb_to_hsv_xyz(residual_1d_norm)
-
-            # commpute brightness values
-            rgb_color_1d_brightness            = rgb_to_brightness(rgb_color_1d)
-            diffuse_illumination_1d_brightness = rgb_to_brightness(diffuse_illumination_1d)
-            diffuse_reflectance_1d_brightness  = rgb_to_brightness(diffuse_reflectance_1d)
-            residual_1d_brightness             = rgb_to_brightness(residual_1d)
-
-            # RGB COLOR
-            H, H_edges = histogramdd(rgb_color_1d_tm[:,[2,1,0]], bins=color_hist_denorm_n_bins, range=[(color_hist_denorm_min, color_hist_denorm_max), (color_hist_denorm_min, color_hist_denorm_max), (color_hist_denorm_min, color_hist_denorm_max)])
-            rgb_color_hist += H.astype(int64)
-            H, H_edges = histogramdd(rgb_color_1d_norm_hsv_xyz[:,[1,0]], bins=hue_saturation_hist_n_bins, range=[(hue_saturation_hist_min, hue_saturation_hist_max), (hue_saturation_hist_min, hue_saturation_hist_max)])
-            rgb_color_hue_saturation_hist += H.astype(int64)
-            H, H_edges = histogram(rgb_color_1d_brightness, bins=brightness_hist_linear_bin_edges)
-            rgb_color_brightness_hist_linear += H
-            H, H_edges = histogram(rgb_color_1d_brightness, bins=brightness_hist_log_bin_edges)
-            rgb_color_brightness_hist_log += H
-
-            # DIFFUSE ILLUMINATION
-            H, H_edges = histogramdd(diffuse_illumination_1d_tm[:,[2,1,0]], bins=color_hist_denorm_n_bins, range=[(color_hist_denorm_min, color_hist_denorm_max), (color_hist_denorm_min, color_hist_denorm_max), (color_hist_denorm_min, color_hist_denorm_max)])
-            diffuse_illumination_hist += H.astype(int64)
-            H, H_edges = histogramdd(diffuse_illumination_1d_norm_hsv_xyz[:,[1,0]], bins=hue_saturation_hist_n_bins, range=[(hue_saturation_hist_min, hue_saturation_hist_max), (hue_saturation_hist_min, hue_saturation_hist_max)])
-            diffuse_illumination_hue_saturation_hist += H.astype(int64)
-            H, H_edges = histogram(diffuse_illumination_1d_brightness, bins=brightness_hist_linear_bin_edges)
-            diffuse_illumination_brightness_hist_linear += H
-            H, H_edges = histogram(diffuse_illumination_1d_brightness, bins=brightness_hist_log_bin_edges)
-            diffuse_illumination_brightness_hist_log += H
-
-            # DIFFUSE REFLECTANCE
-            H, H_edges = histogramdd(diffuse_reflectance_1d[:,[2,1,0]], bins=color_hist_norm_n_bins, range=[(color_hist_norm_min, color_hist_norm_max), (color_hist_norm_min, color_hist_norm_max), (color_hist_norm_min, color_hist_norm_max)])
-            diffuse_reflectance_hist += H.astype(int64)
-            H, H_edges = histogramdd(diffuse_reflectance_1d_norm_hsv_xyz[:,[1,0]], bins=hue_saturation_hist_n_bins, range=[(hue_saturation_hist_min, hue_saturation_hist_max), (hue_saturation_hist_min, hue_saturation_hist_max)])
-            diffuse_reflectance_hue_saturation_hist += H.astype(int64)
-            H, H_edges = histogram(diffuse_reflectance_1d_brightness, bins=brightness_hist_linear_bin_edges)
-            diffuse_reflectance_brightness_hist_linear += H
-            H, H_edges = histogram(diffuse_reflectance_1d_brightness, bins=brightness_hist_log_bin_edges)
-            diffuse_reflectance_brightness_hist_log += H
-
-            # NON-DIFFUSE RESIDUAL
-            H, H_edges = histogramdd(residual_1d_tm[:,[2,1,0]], bins=color_hist_denorm_n_bins, range=[(color_hist_denorm_min, color_hist_denorm_max), (color_hist_denorm_min, color_hist_denorm_max), (color_hist_denorm_min, color_hist_denorm_max)])
-            residual_hist += H.astype(int64)
-            H, H_edges = histogramdd(residual_1d_norm_hsv_xyz[:,[1,0]], bins=hue_saturation_hist_n_bins, range=[(hue_saturation_hist_min, hue_saturation_hist_max), (hue_saturation_hist_min, hue_saturation_hist_max)])
-            residual_hue_saturation_hist += H.astype(int64)
-            H, H_edges = histogram(residual_1d_brightness, bins=brightness_hist_linear_bin_edges)
-            residual_brightness_hist_linear += H
-            H, H_edges = histogram(residual_1d_brightness, bins=brightness_hist_log_bin_edges)
-            residual_brightness_hist_log += H
-
-            print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] Processing frame " + str(i) + " (scale=" + str(scale) + ")...")
-
-            # import mayavi.mlab
-            # path_utils.add_path_to_sys_path("../lib", mode="relative_to_cwd", frame=inspect.currentframe())
-            # import mayavi_utils
-
-            # color_hist_bin_centers_x_1d = color_hist_bin_edges[:-1] + diff(color_hist_bin_edges)/2.0
-            # color_hist_bin_centers_y_1d = color_hist_bin_edges[:-1] + diff(color_hist_bin_edges)/2.0
-            # color_hist_bin_centers_z_1d = color_hist_bin_edges[:-1] + diff(color_hist_bin_edges)/2.0
-
-            # color_hist_bin_centers_z, color_hist_bin_centers_y, color_hist_bin_centers_x = meshgrid(color_hist_bin_centers_x_1d, color_hist_bin_centers_y_1d, color_hist_bin_centers_z_1d, indexing="ij")
-            # color_hist_bin_centers_1d = c_[ color_hist_bin_centers_x.ravel(), color_hist_bin_centers_y.ravel(), color_hist_bin_centers_z.ravel() ]
-
-            # in_geometry_preview_dir = os.path.join(images_dir, in_scene_fileroot + "_" + camera_name + "_geometry_preview")
-
-            # # SEMANTIC
-            # semantic_img_file = os.path.join(in_geometry_preview_dir, in_file_root + ".semantic.png")
-            # semantic_img      = imread(semantic_img_file)
-            # semantic_img_1d   = semantic_img.reshape(-1,4)[:,0:3]
-
-            # H, H_edges = histogramdd(semantic_img_1d[:,[2,1,0]], bins=color_hist_n_bins, range=[(0,1), (0,1), (0,1)])
-            # H_norm    = H / H.sum()
-            # H_norm_1d = H_norm.ravel()
-            # mayavi.mlab.figure(bgcolor=(1,1,1), fgcolor=(0,0,0), engine=None, size=(512, 512))
-            # mayavi_utils.points3d_color_by_rgb_value(color_hist_bin_centers_1d, colors=color_hist_bin_centers_1d, sizes=H_norm_1d, scale_factor=0.5)
-            # mayavi.mlab.outline(color=(0,0,0), extent=[0,1,0,1,0,1])
-            # mayavi.mlab.axes()
-            # mayavi.mlab.xlabel("R")
-            # mayavi.mlab.ylabel("G")
-            # mayavi.mlab.zlabel("B")
-            # mayavi.mlab.show()
-
-            # # SEMANTIC INSTANCE
-            # semantic_instance_img_file = os.path.join(in_geometry_preview_dir, in_file_root + ".semantic_instance.png")
-            # semantic_instance_img      = imread(semantic_instance_img_file)
-            # semantic_instance_img_1d   = semantic_instance_img.reshape(-1,4)[:,0:3]
-
-            # H, H_edges = histogramdd(semantic_instance_img_1d[:,[2,1,0]], bins=color_hist_n_bins, range=[(0,1), (0,1), (0,1)])
-            # H_norm    = H / H.sum()
-            # H_norm_1d = H_norm.ravel()
-            # mayavi.mlab.figure(bgcolor=(1,1,1), fgcolor=(0,0,0), engine=None, size=(512, 512))
-            # mayavi_utils.points3d_color_by_rgb_value(color_hist_bin_centers_1d, colors=color_hist_bin_centers_1d, sizes=H_norm_1d, scale_factor=0.5)
-            # mayavi.mlab.outline(color=(0,0,0), extent=[0,1,0,1,0,1])
-            # mayavi.mlab.axes()
-            # mayavi.mlab.xlabel("R")
-            # mayavi.mlab.ylabel("G")
-            # mayavi.mlab.zlabel("B")
-            # mayavi.mlab.show()
+            checkpoint["counted_semantic_instance_ids"][scene_name] = unique_semantic_instance_ids
+            checkpoint["completed_keys"] = set([ k for k in checkpoint["completed_keys"] if not k.startswith(scene_name + ":") ]) | set([scene_objects_key])
 
-    # OBJECT VOLUME (LINEAR)
-    # OBJECT VOLUME (LOG)
-    # UNIQUE OBJECTS PER CLASS
-    unique_semantic_instance_ids_current_scene_non_null_only = unique_semantic_instance_ids_current_scene[unique_semantic_instance_ids_current_scene != -1]
+        save_checkpoint(checkpoint_file, checkpoint)
 
-    if unique_semantic_instance_ids_current_scene_non_null_only.shape[0] > 0:
+    if args.use_single_threaded_reference_implementation:
+        checkpoint_interval = 1
+    else:
+        from joblib import Parallel, delayed, effective_n_jobs
+        checkpoint_interval = 4*effective_n_jobs(n_jobs) # each batch waits for its slowest camera trajectory, so we want batches to be much larger than the number of processes
 
-        # OBJECT VOLUME (LINEAR)
-        # OBJECT VOLUME (LOG)
-        bounding_box_extents_meters       = meters_per_asset_unit*bounding_box_extents
-        bounding_box_volumes_meters_cubed = prod(bounding_box_extents_meters[unique_semantic_instance_ids_current_scene_non_null_only], axis=1)
+    if args.checkpoint_interval is not None:
+        checkpoint_interval = args.checkpoint_interval
 
-        # OBJECT VOLUME (LINEAR)
-        H, H_edges = histogram(bounding_box_volumes_meters_cubed, bins=object_volume_hist_linear_bin_edges)
-        object_volume_hist_linear += H
+    camera_trajectories_batches = [ camera_trajectories[i:i+checkpoint_interval] for i in range(0, len(camera_trajectories), checkpoint_interval) ]
 
-        # OBJECT VOLUME (LOG)
-        H, H_edges = histogram(bounding_box_volumes_meters_cubed, bins=object_volume_hist_log_bin_edges)
-        object_volume_hist_log += H
+    # scenes without any camera trajectories left to process (e.g., when resuming) can be completed immediately
+    update_checkpoint([], [])
 
-        # UNIQUE OBJECTS PER CLASS: compute histogram (including -1) for current scene
-        semantic_ids_current_scene = [ mesh_objects_sii_to_si_map[sii] for sii in unique_semantic_instance_ids_current_scene_non_null_only ]
+    if args.use_single_threaded_reference_implementation:
+        for b in camera_trajectories_batches:
+            update_checkpoint(b, [ process_camera_trajectory(scene_name, camera_name, args) for scene_name, camera_name in b ])
+
+    if not args.use_single_threaded_reference_implementation:
+        with Parallel(n_jobs=n_jobs, verbose=10) as parallel:
+            for b in camera_trajectories_batches:
+                update_checkpoint(b, parallel(delayed(process_camera_trajectory)(scene_name, camera_name, args) for scene_name, camera_name in b))
 
-        H, H_edges = histogram(semantic_ids_current_scene, bins=per_class_hist_n_bins, range=(per_class_hist_min_bin_center - 0.5, per_class_hist_max_bin_center + 0.5))
-        unique_objects_per_class_hist += H
-
-
-
-    print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] Saving snapshot...")
-
-    if not os.path.exists(batch_dir): os.makedirs(batch_dir)
-
-    with h5py.File(unique_objects_per_image_hist_hdf5_file,               "w") as f: f.create_dataset("dataset", data=unique_objects_per_image_hist)
-    with h5py.File(unique_classes_per_image_hist_hdf5_file,               "w") as f: f.create_dataset("dataset", data=unique_classes_per_image_hist)
-    with h5py.File(unique_objects_per_class_hist_hdf5_file,               "w") as f: f.create_dataset("dataset", data=unique_objects_per_class_hist)
-    with h5py.File(pixels_per_class_hist_hdf5_file,                       "w") as f: f.create_dataset("dataset", data=pixels_per_class_hist)
-    with h5py.File(depth_hist_linear_hdf5_file,                           "w") as f: f.create_dataset("dataset", data=depth_hist_linear)
-    with h5py.File(depth_hist_log_hdf5_file,                              "w") as f: f.create_dataset("dataset", data=depth_hist_log)
-    with h5py.File(normal_hist_hdf5_file,                                 "w") as f: f.create_dataset("dataset", data=normal_hist)
-    with h5py.File(rgb_color_hist_hdf5_file,                              "w") as f: f.create_dataset("dataset", data=rgb_color_hist)
-    with h5py.File(rgb_color_hue_saturation_hist_hdf5_file,               "w") as f: f.create_dataset("dataset", data=rgb_color_hue_saturation_hist)
-    with h5py.File(rgb_color_brightness_hist_linear_hdf5_file,            "w") as f: f.create_dataset("dataset", data=rgb_color_brightness_hist_linear)
-    with h5py.File(rgb_color_brightness_hist_log_hdf5_file,               "w") as f: f.create_dataset("dataset", data=rgb_color_brightness_hist_log)
-    with h5py.File(diffuse_illumination_hist_hdf5_file,                   "w") as f: f.create_dataset("dataset", data=diffuse_illumination_hist)
-    with h5py.File(diffuse_illumination_hue_saturation_hist_hdf5_file,    "w") as f: f.create_dataset("dataset", data=diffuse_illumination_hue_saturation_hist)
-    with h5py.File(diffuse_illumination_brightness_hist_linear_hdf5_file, "w") as f: f.create_dataset("dataset", data=diffuse_illumination_brightness_hist_linear)
-    with h5py.File(diffuse_illumination_brightness_hist_log_hdf5_file,    "w") as f: f.create_dataset("dataset", data=diffuse_illumination_brightness_hist_log)
-    with h5py.File(diffuse_reflectance_hist_hdf5_file,                    "w") as f: f.create_dataset("dataset", data=diffuse_reflectance_hist)
-    with h5py.File(diffuse_reflectance_hue_saturation_hist_hdf5_file,     "w") as f: f.create_dataset("dataset", data=diffuse_reflectance_hue_saturation_hist)
-    with h5py.File(diffuse_reflectance_brightness_hist_linear_hdf5_file,  "w") as f: f.create_dataset("dataset", data=diffuse_reflectance_brightness_hist_linear)
-    with h5py.File(diffuse_reflectance_brightness_hist_log_hdf5_file,     "w") as f: f.create_dataset("dataset", data=diffuse_reflectance_brightness_hist_log)
-    with h5py.File(residual_hist_hdf5_file,                               "w") as f: f.create_dataset("dataset", data=residual_hist)
-    with h5py.File(residual_hue_saturation_hist_hdf5_file,                "w") as f: f.create_dataset("dataset", data=residual_hue_saturation_hist)
-    with h5py.File(residual_brightness_hist_linear_hdf5_file,             "w") as f: f.create_dataset("dataset", data=residual_brightness_hist_linear)
-    with h5py.File(residual_brightness_hist_log_hdf5_file,                "w") as f: f.create_dataset("dataset", data=residual_brightness_hist_log)
-    with h5py.File(object_volume_hist_linear_hdf5_file,                   "w") as f: f.create_dataset("dataset", data=object_volume_hist_linear)
-    with h5py.File(object_volume_hist_log_hdf5_file,                      "w") as f: f.create_dataset("dataset", data=object_volume_hist_log)
-
-
-
-for s in scenes:
-    process_scene(s, args)
+checkpoint["finished"] = True
+
+if args.num_shards is not None:
+    print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] Saving checkpoint for shard " + str(args.shard_index) + " of " + str(args.num_shards) + " to " + checkpoint_file + "...")
+    save_checkpoint(checkpoint_file, checkpoint)
+else:
+    print("[HYPERSIM: DATASET_GENERATE_IMAGE_STATISTICS] Saving histograms...")
+    save_checkpoint(checkpoint_file, checkpoint)
+    save_hists(batch_dir, checkpoint["hists"])
 
 
 
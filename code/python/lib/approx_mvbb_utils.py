@@ -5,11 +5,10 @@
 
 from pylab import *
 
-import h5py
-import inspect
 import os
+import scipy.spatial
 
-import path_utils
+import cpp_tool_utils
 
 
 
@@ -17,37 +16,25 @@ def generate_oriented_bounding_box_2d(points, tmp_dir):
 
     if not os.path.exists(tmp_dir): os.makedirs(tmp_dir)
 
-    tmp_points_hdf5_file                          = os.path.join(tmp_dir, "_tmp_points.hdf5")
-    tmp_output_bounding_box_center_hdf5_file      = os.path.join(tmp_dir, "_tmp_output_bounding_box_center.hdf5")
-    tmp_output_bounding_box_extent_hdf5_file      = os.path.join(tmp_dir, "_tmp_output_bounding_box_extent.hdf5")
-    tmp_output_bounding_box_orientation_hdf5_file = os.path.join(tmp_dir, "_tmp_output_bounding_box_orientation.hdf5")
-
-    with h5py.File(tmp_points_hdf5_file, "w") as f: f.create_dataset("dataset", data=points)
-
-    current_source_path = path_utils.get_current_source_file_path(frame=inspect.currentframe())
-    cpp_bin             = os.path.abspath(os.path.join(current_source_path, "..", "..", "cpp", "bin", "generate_oriented_bounding_box"))
-
-    cmd = \
-        cpp_bin + \
-        " --points_file="                          + tmp_points_hdf5_file                          + \
-        " --n_epsilon="                            + str(0.0)                                      + \
-        " --n_point_samples="                      + str(0)                                        + \
-        " --n_grid_size="                          + str(0)                                        + \
-        " --n_diam_opt_loops="                     + str(0)                                        + \
-        " --n_grid_search_opt_loops="              + str(0)                                        + \
-        " --output_bounding_box_center_file="      + tmp_output_bounding_box_center_hdf5_file      + \
-        " --output_bounding_box_extent_file="      + tmp_output_bounding_box_extent_hdf5_file      + \
-        " --output_bounding_box_orientation_file=" + tmp_output_bounding_box_orientation_hdf5_file + \
-        " --silent"
-    # print("")
-    # print(cmd)
-    # print("")
-    retval = os.system(cmd)
-    assert retval == 0
-
-    with h5py.File(tmp_output_bounding_box_center_hdf5_file,      "r") as f: bounding_box_center      = matrix(f["dataset"][:]).A1
-    with h5py.File(tmp_output_bounding_box_extent_hdf5_file,      "r") as f: bounding_box_extent      = matrix(f["dataset"][:]).A1
-    with h5py.File(tmp_output_bounding_box_orientation_hdf5_file, "r") as f: bounding_box_orientation = matrix(f["dataset"][:]).A
+    retval, outputs = cpp_tool_utils.run_cpp_tool(
+        "generate_oriented_bounding_box",
+        tmp_dir=tmp_dir,
+        input_arrays=[("points_file", points)],
+        output_arrays=[
+            "output_bounding_box_center_file",
+            "output_bounding_box_extent_file",
+            "output_bounding_box_orientation_file"],
+        params=[
+            ("n_epsilon",               0.0),
+            ("n_point_samples",         0),
+            ("n_grid_size",             0),
+            ("n_diam_opt_loops",        0),
+            ("n_grid_search_opt_loops", 0),
+            ("silent",                  None)])
+
+    bounding_box_center      = matrix(outputs["output_bounding_box_center_file"]).A1
+    bounding_box_extent      = matrix(outputs["output_bounding_box_extent_file"]).A1
+    bounding_box_orientation = matrix(outputs["output_bounding_box_orientation_file"]).A
 
     assert bounding_box_extent[0] >= bounding_box_extent[1]
     assert isclose(linalg.det(bounding_box_orientation), 1)
@@ -60,40 +47,176 @@ def generate_oriented_bounding_box_3d(points, n_epsilon, n_point_samples, n_grid
 
     if not os.path.exists(tmp_dir): os.makedirs(tmp_dir)
 
-    tmp_points_hdf5_file                          = os.path.join(tmp_dir, "_tmp_points.hdf5")
-    tmp_output_bounding_box_center_hdf5_file      = os.path.join(tmp_dir, "_tmp_output_bounding_box_center.hdf5")
-    tmp_output_bounding_box_extent_hdf5_file      = os.path.join(tmp_dir, "_tmp_output_bounding_box_extent.hdf5")
-    tmp_output_bounding_box_orientation_hdf5_file = os.path.join(tmp_dir, "_tmp_output_bounding_box_orientation.hdf5")
-
-    with h5py.File(tmp_points_hdf5_file, "w") as f: f.create_dataset("dataset", data=points)
-
-    current_source_path = path_utils.get_current_source_file_path(frame=inspect.currentframe())
-    cpp_bin             = os.path.abspath(os.path.join(current_source_path, "..", "..", "cpp", "bin", "generate_oriented_bounding_box"))
-
-    cmd = \
-        cpp_bin + \
-        " --points_file="                          + tmp_points_hdf5_file                     + \
-        " --n_epsilon="                            + str(n_epsilon)                           + \
-        " --n_point_samples="                      + str(n_point_samples)                     + \
-        " --n_grid_size="                          + str(n_grid_size)                         + \
-        " --n_diam_opt_loops="                     + str(n_diam_opt_loops)                    + \
-        " --n_grid_search_opt_loops="              + str(n_grid_search_opt_loops)             + \
-        " --output_bounding_box_center_file="      + tmp_output_bounding_box_center_hdf5_file + \
-        " --output_bounding_box_extent_file="      + tmp_output_bounding_box_extent_hdf5_file + \
-        " --output_bounding_box_orientation_file=" + tmp_output_bounding_box_orientation_hdf5_file
-        # " --silent"
-    print("")
-    print(cmd)
-    print("")
-    retval = os.system(cmd)
-    assert retval == 0
-
-    with h5py.File(tmp_output_bounding_box_center_hdf5_file,      "r") as f: bounding_box_center      = matrix(f["dataset"][:]).A1
-    with h5py.File(tmp_output_bounding_box_extent_hdf5_file,      "r") as f: bounding_box_extent      = matrix(f["dataset"][:]).A1
-    with h5py.File(tmp_output_bounding_box_orientation_hdf5_file, "r") as f: bounding_box_orientation = matrix(f["dataset"][:]).A
+    retval, outputs = cpp_tool_utils.run_cpp_tool(
+        "generate_oriented_bounding_box",
+        tmp_dir=tmp_dir,
+        input_arrays=[("points_file", points)],
+        output_arrays=[
+            "output_bounding_box_center_file",
+            "output_bounding_box_extent_file",
+            "output_bounding_box_orientation_file"],
+        params=[
+            ("n_epsilon",               n_epsilon),
+            ("n_point_samples",         n_point_samples),
+            ("n_grid_size",             n_grid_size),
+            ("n_diam_opt_loops",        n_diam_opt_loops),
+            ("n_grid_search_opt_loops", n_grid_search_opt_loops)],
+            # ("silent",                None)
+        print_cmd=True)
+
+    bounding_box_center      = matrix(outputs["output_bounding_box_center_file"]).A1
+    bounding_box_extent      = matrix(outputs["output_bounding_box_extent_file"]).A1
+    bounding_box_orientation = matrix(outputs["output_bounding_box_orientation_file"]).A
 
     assert bounding_box_extent[0] >= bounding_box_extent[1]
     assert bounding_box_extent[1] >= bounding_box_extent[2]
     assert isclose(linalg.det(bounding_box_orientation), 1)
 
     return bounding_box_center, bounding_box_extent, bounding_box_orientation
+
+
+
+#
+# Batched versions of the functions above. Rather than calling our C++ tool once per point set in a
+# serial loop, callers pass all of their point sets at once, stacked into a single array, where the
+# point set for instance i is given by points[offsets[i]:offsets[i+1]]. We fan out the point sets over
+# a pool of n_jobs workers. We use threads rather than processes, because our workers spend nearly all
+# of their time waiting for our C++ tool to finish, and our C++ tool wrappers are thread-safe.
+#
+# The results are returned as stacked arrays of centers, extents, and orientations, with one entry per
+# instance. Instances with no points are assigned a bounding box filled with inf, which matches the
+# convention used in scene_generate_bounding_boxes.py for instances that don't appear in a scene.
+#
+# For the 2D case, if backend == "numpy" (or backend == "auto" and our C++ tool hasn't been built), we
+# compute each bounding box in pure NumPy by finding the minimum-area rectangle that is aligned with one
+# of the edges of the convex hull of each point set (i.e., using rotating calipers), and we use the
+# principal axes of each point set if its convex hull is degenerate. In both cases, we follow the same
+# axis conventions as our C++ tool, so the two backends can be used interchangeably.
+#
+
+def generate_oriented_bounding_boxes_2d(points, offsets, tmp_dir, n_jobs=1, backend="auto"):
+
+    assert backend in ["auto", "cpp", "numpy"]
+
+    if backend == "auto":
+        if os.path.exists(cpp_tool_utils.get_cpp_bin("generate_oriented_bounding_box")):
+            backend = "cpp"
+        else:
+            backend = "numpy"
+
+    if backend == "cpp":
+        generate_func = lambda points_i: generate_oriented_bounding_box_2d(points_i, tmp_dir=tmp_dir)
+    else:
+        generate_func = _generate_oriented_bounding_box_2d_numpy
+
+    return _generate_oriented_bounding_boxes(points, offsets, 2, generate_func, n_jobs)
+
+
+
+def generate_oriented_bounding_boxes_3d(points, offsets, n_epsilon, n_point_samples, n_grid_size, n_diam_opt_loops, n_grid_search_opt_loops, tmp_dir, n_jobs=1):
+
+    generate_func = lambda points_i: generate_oriented_bounding_box_3d(points_i,
+                                                                       n_epsilon=n_epsilon,
+                                                                       n_point_samples=n_point_samples,
+                                                                       n_grid_size=n_grid_size,
+                                                                       n_diam_opt_loops=n_diam_opt_loops,
+                                                                       n_grid_search_opt_loops=n_grid_search_opt_loops,
+                                                                       tmp_dir=tmp_dir)
+
+    return _generate_oriented_bounding_boxes(points, offsets, 3, generate_func, n_jobs)
+
+
+
+def _generate_oriented_bounding_boxes(points, offsets, num_dims, generate_func, n_jobs):
+
+    points  = asarray(points)
+    offsets = asarray(offsets)
+
+    assert points.ndim == 2 and points.shape[1] == num_dims
+    assert offsets.ndim == 1 and offsets.shape[0] >= 1
+    assert offsets[0] == 0 and offsets[-1] == points.shape[0]
+    assert all(diff(offsets) >= 0)
+
+    num_instances = offsets.shape[0] - 1
+
+    bounding_box_centers      = np.inf*ones((num_instances,num_dims))
+    bounding_box_extents      = np.inf*ones((num_instances,num_dims))
+    bounding_box_orientations = np.inf*ones((num_instances,num_dims,num_dims))
+
+    instances = [ i for i in range(num_instances) if offsets[i+1] > offsets[i] ]
+
+    if n_jobs == 1:
+        results = [ generate_func(points[offsets[i]:offsets[i+1]]) for i in instances ]
+    else:
+        from joblib import Parallel, delayed
+        results = Parallel(n_jobs=n_jobs, prefer="threads")(delayed(generate_func)(points[offsets[i]:offsets[i+1]]) for i in instances)
+
+    for i, (bounding_box_center, bounding_box_extent, bounding_box_orientation) in zip(instances, results):
+        bounding_box_centers[i]      = bounding_box_center
+        bounding_box_extents[i]      = bounding_box_extent
+        bounding_box_orientations[i] = bounding_box_orientation
+
+    return bounding_box_centers, bounding_box_extents, bounding_box_orientations
+
+
+
+def _generate_oriented_bounding_box_2d_numpy(points):
+
+    points = asarray(points, dtype=float64)
+
+    # candidate x-axes are the edge directions of the convex hull, or the principal axes of the point set if its convex hull is degenerate
+    points_centered = points - mean(points, axis=0)
+    if points.shape[0] >= 3 and linalg.matrix_rank(points_centered) == 2:
+        hull_points = points[scipy.spatial.ConvexHull(points).vertices]
+        hull_edges  = roll(hull_points, -1, axis=0) - hull_points
+        axes_0      = hull_edges[linalg.norm(hull_edges, axis=1) > 0]
+    else:
+        hull_points      = points
+        eigvals, eigvecs = linalg.eigh(points_centered.T.dot(points_centered))
+        axes_0           = eigvecs.T[::-1]
+
+    axes_0 = axes_0 / linalg.norm(axes_0, axis=1)[:,newaxis]
+    axes_1 = c_[-axes_0[:,1], axes_0[:,0]]
+
+    # project the hull onto each candidate pair of axes in chunks to bound memory usage, and keep the pair with minimum area
+    best_area  = np.inf
+    chunk_size = 256
+    for ci in range(0, axes_0.shape[0], chunk_size):
+        axes_0_ = axes_0[ci:ci+chunk_size]
+        axes_1_ = axes_1[ci:ci+chunk_size]
+        proj_0  = axes_0_.dot(hull_points.T)
+        proj_1  = axes_1_.dot(hull_points.T)
+        min_0, max_0 = np.min(proj_0, axis=1), np.max(proj_0, axis=1)
+        min_1, max_1 = np.min(proj_1, axis=1), np.max(proj_1, axis=1)
+        area    = (max_0 - min_0)*(max_1 - min_1)
+        ai      = argmin(area)
+        if area[ai] < best_area:
+            best_area = area[ai]
+            best_axes = array([axes_0_[ai], axes_1_[ai]])
+            best_min  = array([min_0[ai], min_1[ai]])
+            best_max  = array([max_0[ai], max_1[ai]])
+
+    bounding_box_center = best_axes.T.dot((best_min + best_max)/2.0)
+    bounding_box_extent = best_max - best_min
+
+    # Our convention is as follows: We set the x-axis to be the longest axis. We set the positive direction
+    # of the x-axis to be the direction that points roughly towards the center of mass of the points. We set
+    # the y-axis to be the positive x-axis rotated by positive 90 degrees. This matches our C++ tool.
+
+    points_bbcenter_to_mean = mean(points, axis=0) - bounding_box_center
+
+    sorted_axes   = argsort(-bounding_box_extent, kind="stable")
+    axis_0        = best_axes[sorted_axes[0]]
+    axis_0_length = bounding_box_extent[sorted_axes[0]]
+    if dot(axis_0, points_bbcenter_to_mean) < 0:
+        axis_0 = -axis_0
+    axis_1        = array([-axis_0[1], axis_0[0]])
+    axis_1_length = bounding_box_extent[sorted_axes[1]]
+
+    bounding_box_extent      = array([axis_0_length, axis_1_length])
+    bounding_box_orientation = c_[axis_0, axis_1]
+
+    assert bounding_box_extent[0] >= bounding_box_extent[1]
+    assert isclose(linalg.det(bounding_box_orientation), 1)
+
+    return bounding_box_center, bounding_box_extent, bounding_box_orientation
@@ -0,0 +1,268 @@
+#
+# For licensing see accompanying LICENSE.txt file.
+# Copyright (C) 2020 Apple Inc. All Rights Reserved.
+#
+
+from pylab import *
+
+import collections
+import fnmatch
+import glob
+import io
+import os
+import struct
+import threading
+import zipfile
+
+
+
+#
+# An ArchiveReader serves files from our scene ZIP files (e.g., as downloaded by
+# dataset_download_images.py without --decompress_dir) as if they had been extracted, so we can use the
+# dataset in place. Each ZIP file is named after its scene, e.g., ai_001_001.zip, and contains a top-level
+# directory with the same name, so we map a path on disk to a file in a ZIP file by looking for a path
+# component that matches the name of one of our ZIP files. For example, if archive_dirs contains
+# ai_001_001.zip, then .../scenes/ai_001_001/images/scene_cam_00_final_hdf5/frame.0000.color.hdf5 maps
+# to the file ai_001_001/images/scene_cam_00_final_hdf5/frame.0000.color.hdf5 in ai_001_001.zip.
+#
+# Most of our HDF5 files are compressed internally, so they are usually stored in our ZIP files without
+# further compression. We serve a stored file as a seekable window into the ZIP file, so h5py can read
+# individual datasets or chunks without reading the entire file. Compressed (deflated) files can't be
+# read at arbitrary offsets, so we decompress them into memory, which also checks their CRC-32
+# checksums.
+#
+# Opening a ZIP file requires reading its central directory, which is expensive for our largest ZIP
+# files, so we keep the max_open_archives most recently used ZIP files open.
+#
+
+class ArchiveReader:
+
+    def __init__(self, archive_dirs, max_open_archives=16):
+
+        if isinstance(archive_dirs, str):
+            archive_dirs = [archive_dirs]
+
+        assert max_open_archives >= 1
+
+        self._archive_files = {}
+        for archive_dir in archive_dirs:
+            assert os.path.isdir(archive_dir)
+            for archive_file in sorted(glob.glob(os.path.join(archive_dir, "*.zip"))):
+                archive_name = os.path.splitext(os.path.basename(archive_file))[0]
+                if archive_name not in self._archive_files:
+                    self._archive_files[archive_name] = archive_file
+
+        self._max_open_archives = max_open_archives
+        self._archives          = collections.OrderedDict()
+        self._lock              = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+
+        with self._lock:
+            for archive in self._archives.values():
+                archive.close()
+            self._archives = collections.OrderedDict()
+
+    # Return True if path is a file or a directory in one of our ZIP files.
+    def exists(self, path):
+
+        archive, member_name = self._get_archive_and_member_name(path)
+        if archive is None:
+            return False
+
+        return member_name in archive.infos or member_name + "/" in archive.dirs
+
+    # Return a seekable binary file object for a file in one of our ZIP files.
+    def open(self, path):
+
+        archive, member_name = self._get_archive_and_member_name(path)
+        assert archive is not None and member_name in archive.infos
+
+        return archive.open(archive.infos[member_name])
+
+    # Return the paths that match a glob pattern, where only the file name can contain wildcards, e.g.,
+    # .../scene_cam_00_final_hdf5/frame.*.color.hdf5.
+    def glob(self, path_pattern):
+
+        path_dir, pattern = os.path.split(path_pattern)
+
+        archive, member_dir = self._get_archive_and_member_name(path_dir)
+        if archive is None:
+            return []
+
+        member_names = archive.dirs.get(member_dir + "/", [])
+
+        return [ os.path.join(path_dir, m) for m in fnmatch.filter(member_names, pattern) ]
+
+    def _get_archive_and_member_name(self, path):
+
+        tokens = os.path.normpath(os.path.abspath(path)).split(os.sep)
+
+        for i in range(len(tokens) - 1, -1, -1):
+            if tokens[i] in self._archive_files:
+                return self._get_archive(tokens[i]), "/".join(tokens[i:])
+
+        return None, None
+
+    def _get_archive(self, archive_name):
+
+        with self._lock:
+
+            if archive_name in self._archives:
+                self._archives.move_to_end(archive_name)
+                return self._archives[archive_name]
+
+            archive = _Archive(self._archive_files[archive_name])
+            self._archives[archive_name] = archive
+
+            if len(self._archives) > self._max_open_archives:
+                _, archive_evicted = self._archives.popitem(last=False)
+                archive_evicted.close()
+
+            return archive
+
+
+
+#
+# Open a file for reading, either on disk, or from one of the ZIP files in archive_reader if the file
+# doesn't exist on disk.
+#
+
+def open_file(path, archive_reader=None):
+
+    if archive_reader is None or os.path.exists(path):
+        return open(path, "rb")
+
+    return archive_reader.open(path)
+
+
+
+# Return True if path exists on disk, or in one of the ZIP files in archive_reader.
+def path_exists(path, archive_reader=None):
+
+    if os.path.exists(path):
+        return True
+
+    return archive_reader is not None and archive_reader.exists(path)
+
+
+
+# Return the paths that match a glob pattern on disk, and in one of the ZIP files in archive_reader.
+def glob_files(path_pattern, archive_reader=None):
+
+    paths = glob.glob(path_pattern)
+
+    if archive_reader is not None:
+        paths = sorted(set(paths + archive_reader.glob(path_pattern)))
+
+    return paths
+
+
+
+class _Archive:
+
+    def __init__(self, archive_file):
+
+        self.archive_file = archive_file
+        self.zip_file     = zipfile.ZipFile(archive_file)
+
+        # our own file object for reading stored files, so we don't interfere with zip_file
+        self._file      = open(archive_file, "rb")
+        self._file_lock = threading.Lock()
+
+        # ZIP files don't necessarily contain entries for directories, so we add all parent directories of
+        # each file, where each directory maps to the names of the files it contains
+        self.infos = {}
+        self.dirs  = {}
+        for info in self.zip_file.infolist():
+            tokens = info.filename.rstrip("/").split("/")
+            for i in range(1, len(tokens)):
+                self.dirs.setdefault("/".join(tokens[:i]) + "/", [])
+            if info.is_dir():
+                self.dirs.setdefault(info.filename, [])
+            else:
+                self.infos[info.filename] = info
+                self.dirs.setdefault("/".join(tokens[:-1]) + "/", []).append(tokens[-1])
+
+    def close(self):
+
+        # files that are still open keep a reference to self._file, so we let it close when it is no longer referenced
+        self.zip_file.close()
+
+    def open(self, info):
+
+        if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1:
+            return io.BytesIO(self.zip_file.read(info))
+
+        with self._file_lock:
+            self._file.seek(info.header_offset)
+            header = self._file.read(zipfile.sizeFileHeader)
+
+        header = struct.unpack(zipfile.structFileHeader, header)
+        assert header[0] == zipfile.stringFileHeader
+
+        # the local header's file name and extra field lengths can differ from the central directory
+        data_offset = info.header_offset + zipfile.sizeFileHeader + header[10] + header[11]
+
+        return _ArchiveMemberFile(self._file, self._file_lock, data_offset, info.file_size)
+
+
+
+#
+# A read-only, seekable window into a file, which shares the underlying file object with all other
+# windows into the same file.
+#
+
+class _ArchiveMemberFile(io.RawIOBase):
+
+    def __init__(self, file, file_lock, offset, size):
+
+        self._file      = file
+        self._file_lock = file_lock
+        self._offset    = offset
+        self._size      = size
+        self._pos       = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+
+        if whence == io.SEEK_SET:
+            self._pos = pos
+        elif whence == io.SEEK_CUR:
+            self._pos = self._pos + pos
+        elif whence == io.SEEK_END:
+            self._pos = self._size + pos
+        else:
+            assert False
+
+        assert self._pos >= 0
+
+        return self._pos
+
+    def readinto(self, buffer):
+
+        n = min(len(buffer), self._size - self._pos)
+        if n <= 0:
+            return 0
+
+        with self._file_lock:
+            self._file.seek(self._offset + self._pos)
+            n = self._file.readinto(memoryview(buffer)[:n])
+
+        self._pos += n
+
+        return n
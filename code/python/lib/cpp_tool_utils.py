@@ -0,0 +1,261 @@
+#
+# For licensing see accompanying LICENSE.txt file.
+# Copyright (C) 2020 Apple Inc. All Rights Reserved.
+#
+
+from pylab import *
+
+import h5py
+import inspect
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+import path_utils
+
+
+
+#
+# Our Python wrappers pass arrays to our C++ tools, and receive arrays back from them, via HDF5 files.
+# This module provides a common transport layer for these files. We support the following transports:
+#
+#   "shm"  writes the HDF5 files to /dev/shm, i.e., to POSIX shared memory, so passing arrays to and
+#          from our C++ tools never touches the disk.
+#   "hdf5" writes the HDF5 files to tmp_dir, which is the behavior of our original wrappers.
+#
+# If transport == "auto", we use "shm" if /dev/shm exists and has enough free space for the arrays we
+# are about to write, and we fall back to "hdf5" otherwise. For each C++ tool and transport, we keep
+# running totals of the number of calls, the number of bytes moved, and the time spent in
+# cpp_tool_call_stats, which can be summarized by calling print_cpp_tool_call_stats(). We only keep
+# totals, so long-running processes that call our C++ tools many times don't accumulate memory.
+#
+# Each CppToolTransport writes its files to its own uniquely named scratch directory, so our wrappers
+# can safely be called concurrently from multiple threads or processes, even if they share the same
+# tmp_dir. Scratch directories are removed when the transport is closed, unless keep == True (or
+# keep_scratch_dirs == True), which can be useful for debugging.
+#
+
+transport_default   = "auto"
+keep_scratch_dirs   = False
+cpp_tool_call_stats = {} # (cpp_tool_name, transport) -> running totals
+
+_shm_root_dir             = "/dev/shm"
+_cpp_tool_call_stats_lock = threading.Lock()
+
+
+
+class CppToolTransport:
+
+    def __init__(self, tmp_dir, transport=None, num_bytes_hint=0, keep=None):
+
+        if transport is None:
+            transport = transport_default
+        if keep is None:
+            keep = keep_scratch_dirs
+
+        assert transport in ["auto", "shm", "hdf5"]
+
+        if transport == "auto":
+            if _shm_available(num_bytes_hint):
+                transport = "shm"
+            else:
+                transport = "hdf5"
+
+        if transport == "shm":
+            assert _shm_available(0)
+            self.scratch_dir = tempfile.mkdtemp(prefix="hypersim_", dir=_shm_root_dir)
+        else:
+            if not os.path.exists(tmp_dir): os.makedirs(tmp_dir, exist_ok=True)
+            self.scratch_dir = tempfile.mkdtemp(prefix="_tmp_", dir=tmp_dir)
+
+        self.transport = transport
+        self.keep      = keep
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+
+        if self.scratch_dir is None:
+            return
+
+        if self.keep:
+            print("[HYPERSIM: CPP_TOOL_UTILS] Keeping scratch directory: " + self.scratch_dir)
+        else:
+            shutil.rmtree(self.scratch_dir, ignore_errors=True)
+
+        self.scratch_dir = None
+
+    def get_file(self, name):
+        return os.path.join(self.scratch_dir, "_tmp_" + name + ".hdf5")
+
+    def write_arrays(self, arrays):
+
+        files = {}
+        for name, data in arrays:
+            files[name] = self.get_file(name)
+            with h5py.File(files[name], "w") as f: f.create_dataset("dataset", data=data)
+
+        return files
+
+    def read_arrays(self, files):
+
+        arrays = {}
+        for name, file in files.items():
+            with h5py.File(file, "r") as f: arrays[name] = f["dataset"][:]
+
+        return arrays
+
+
+
+def get_cpp_bin(cpp_tool_name):
+
+    current_source_path = path_utils.get_current_source_file_path(frame=inspect.currentframe())
+    return os.path.abspath(os.path.join(current_source_path, "..", "..", "cpp", "bin", cpp_tool_name))
+
+
+
+#
+# Run one of our C++ tools. The "_file" suffix is removed from each name in input_arrays and
+# output_arrays to obtain the name of the corresponding file, and the name itself is used as the
+# command-line argument, e.g., ("vertices_file", vertices) is passed to the tool as
+# --vertices_file=.../_tmp_vertices.hdf5. Entries in input_files are passed to the tool as-is, and
+# can be used to pass arrays that have already been written by a longer-lived CppToolTransport. All
+# other files are written to a new scratch directory for this call, which is removed before we return.
+# Entries in params are passed to the tool as --name=value, or as --name if value is None. Returns the
+# tool's exit status and a dictionary of output arrays (which is empty if the tool didn't execute
+# successfully).
+#
+
+def run_cpp_tool(cpp_tool_name, tmp_dir, input_arrays=None, input_files=None, output_arrays=None, params=None, transport=None, keep=None, print_cmd=False, allowed_retvals=None):
+
+    if input_arrays is None:    input_arrays    = []
+    if input_files is None:     input_files     = {}
+    if output_arrays is None:   output_arrays   = []
+    if params is None:          params          = []
+    if allowed_retvals is None: allowed_retvals = [0]
+
+    num_bytes_hint = sum([ asarray(data).nbytes for name, data in input_arrays ])
+
+    with CppToolTransport(tmp_dir, transport, num_bytes_hint=num_bytes_hint, keep=keep) as transport_:
+        retval, outputs = _run_cpp_tool(cpp_tool_name, input_arrays, input_files, output_arrays, params, transport_, print_cmd, allowed_retvals)
+
+    return retval, outputs
+
+
+
+def _run_cpp_tool(cpp_tool_name, input_arrays, input_files, output_arrays, params, transport, print_cmd, allowed_retvals):
+
+    time_begin = time.time()
+
+    input_arrays_files = transport.write_arrays([ (name[:-len("_file")], data) for name, data in input_arrays ])
+    output_files       = dict([ (name, transport.get_file(name[:-len("_file")])) for name in output_arrays ])
+    num_bytes_written  = sum([ os.path.getsize(file) for file in input_arrays_files.values() ])
+
+    time_write_end = time.time()
+
+    cmd = get_cpp_bin(cpp_tool_name)
+    for name, data in input_arrays:
+        cmd = cmd + " --" + name + "=" + input_arrays_files[name[:-len("_file")]]
+    for name, file in input_files.items():
+        cmd = cmd + " --" + name + "=" + file
+    for name, value in params:
+        if value is None:
+            cmd = cmd + " --" + name
+        else:
+            cmd = cmd + " --" + name + "=" + str(value)
+    for name in output_arrays:
+        cmd = cmd + " --" + name + "=" + output_files[name]
+
+    if print_cmd:
+        print("")
+        print(cmd)
+        print("")
+    retval = run_cmd(cmd)
+    assert retval in allowed_retvals
+
+    time_run_end = time.time()
+
+    outputs        = {}
+    num_bytes_read = 0
+    if retval == 0:
+        num_bytes_read = sum([ os.path.getsize(file) for file in output_files.values() ])
+        outputs        = transport.read_arrays(output_files)
+
+    time_read_end = time.time()
+
+    record_cpp_tool_call_stats(cpp_tool_name, transport.transport, num_bytes_written, num_bytes_read, time_write_end - time_begin, time_run_end - time_write_end, time_read_end - time_run_end)
+
+    return retval, outputs
+
+
+
+#
+# We launch our C++ tools via subprocess rather than os.system, because subprocess closes all inherited
+# file descriptors in the child process. Otherwise, when our wrappers are called from multiple threads,
+# a C++ tool can inherit (and hold a lock on) an HDF5 file that another thread is still writing.
+# Returns the tool's exit code.
+#
+
+def run_cmd(cmd):
+    return subprocess.call(cmd, shell=True, close_fds=True)
+
+
+
+def record_cpp_tool_call_stats(cpp_tool_name, transport, num_bytes_written, num_bytes_read, time_write_seconds, time_run_seconds, time_read_seconds):
+
+    # our wrappers can be called concurrently from multiple threads
+    with _cpp_tool_call_stats_lock:
+
+        key = (cpp_tool_name, transport)
+        if key not in cpp_tool_call_stats:
+            cpp_tool_call_stats[key] = {"num_calls": 0, "num_bytes_written": 0, "num_bytes_read": 0, "time_write_seconds": 0.0, "time_run_seconds": 0.0, "time_read_seconds": 0.0}
+
+        stats                       = cpp_tool_call_stats[key]
+        stats["num_calls"]          = stats["num_calls"]          + 1
+        stats["num_bytes_written"]  = stats["num_bytes_written"]  + num_bytes_written
+        stats["num_bytes_read"]     = stats["num_bytes_read"]     + num_bytes_read
+        stats["time_write_seconds"] = stats["time_write_seconds"] + time_write_seconds
+        stats["time_run_seconds"]   = stats["time_run_seconds"]   + time_run_seconds
+        stats["time_read_seconds"]  = stats["time_read_seconds"]  + time_read_seconds
+
+
+
+def print_cpp_tool_call_stats():
+
+    with _cpp_tool_call_stats_lock:
+        cpp_tool_call_stats_copy = { k: dict(v) for k, v in cpp_tool_call_stats.items() }
+
+    cpp_tool_names = []
+    for cpp_tool_name, transport in cpp_tool_call_stats_copy.keys():
+        if cpp_tool_name not in cpp_tool_names:
+            cpp_tool_names.append(cpp_tool_name)
+
+    for cpp_tool_name in cpp_tool_names:
+        stats      = [ s for (n, t), s in cpp_tool_call_stats_copy.items() if n == cpp_tool_name ]
+        transports = sorted([ t for (n, t) in cpp_tool_call_stats_copy.keys() if n == cpp_tool_name ])
+        print("[HYPERSIM: CPP_TOOL_UTILS] " + cpp_tool_name + ": " + \
+              str(sum([ s["num_calls"] for s in stats ])) + " calls, " + \
+              "transport = " + ",".join(transports) + ", " + \
+              "MB written = %0.1f, "  % (sum([ s["num_bytes_written"]  for s in stats ]) / 1e6) + \
+              "MB read = %0.1f, "     % (sum([ s["num_bytes_read"]     for s in stats ]) / 1e6) + \
+              "write time = %0.2fs, " % (sum([ s["time_write_seconds"] for s in stats ]))       + \
+              "run time = %0.2fs, "   % (sum([ s["time_run_seconds"]   for s in stats ]))       + \
+              "read time = %0.2fs"    % (sum([ s["time_read_seconds"]  for s in stats ])))
+
+
+
+def _shm_available(num_bytes_hint):
+
+    if not os.path.isdir(_shm_root_dir) or not os.access(_shm_root_dir, os.W_OK):
+        return False
+
+    # leave plenty of headroom, because our C++ tools also write their outputs to shared memory
+    statvfs = os.statvfs(_shm_root_dir)
+    return statvfs.f_bavail*statvfs.f_frsize > 4*num_bytes_hint
@@ -0,0 +1,288 @@
+#
+# For licensing see accompanying LICENSE.txt file.
+# Copyright (C) 2020 Apple Inc. All Rights Reserved.
+#
+
+from pylab import *
+
+import concurrent.futures
+import hashlib
+import http.client
+import os
+import pandas as pd
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.request
+import zipfile
+import zlib
+
+
+
+#
+# A Downloader downloads a list of archives into downloads_dir on a fixed number of download workers, and
+# optionally extracts each archive into decompress_dir on a separate pool of extract workers, so we can
+# extract an archive while other archives are still downloading. We only depend on the Python standard
+# library, so our downloader also works on platforms that don't have the curl and unzip command-line
+# utilities.
+#
+# We download each archive to a temporary <archive_name>.part file, and rename it when it is complete.
+# If a transfer fails, we retry it after an exponentially increasing delay, and we resume from the end
+# of the partial file with an HTTP range request, i.e., we don't download the same bytes twice. If the
+# server doesn't support range requests, we restart the transfer from the beginning. A download is
+# complete if the size of the downloaded file matches the size reported by the server, and, if we know
+# the SHA-256 checksum of the archive, if its checksum matches. If the checksum doesn't match, we delete
+# the downloaded file and retry from scratch. If the server doesn't report the size of an archive, we
+# can't tell whether a partial file is complete, so we always download the entire archive. Extracting an
+# archive also verifies the CRC-32 checksum of each file in it. If we don't know the checksum of an
+# archive and we can't extract it, the archive might have been corrupted even though its size is
+# correct, so we delete it and download it again once before giving up.
+#
+# We record the state of each archive in a small CSV file after each download or extraction finishes,
+# so if a run is interrupted or some archives fail, running the same downloader again only fetches and
+# extracts the archives that are missing. If an archive fails after all retries, we continue with all
+# other archives.
+#
+
+download_states = ["downloaded", "extracted", "failed"]
+
+
+
+class Downloader:
+
+    def __init__(self, downloads_dir, decompress_dir=None, delete_archive_after_decompress=False, n_jobs_download=4, n_jobs_decompress=2,
+                 max_retries=5, retry_delay_seconds=2.0, timeout_seconds=60.0, checksums={}):
+
+        self.downloads_dir                   = downloads_dir
+        self.decompress_dir                  = decompress_dir
+        self.delete_archive_after_decompress = delete_archive_after_decompress
+        self.n_jobs_download                 = n_jobs_download
+        self.n_jobs_decompress               = n_jobs_decompress
+        self.max_retries                     = max_retries
+        self.retry_delay_seconds             = retry_delay_seconds
+        self.timeout_seconds                 = timeout_seconds
+        self.checksums                       = checksums # archive name -> SHA-256 checksum
+        self.state_file                      = os.path.join(downloads_dir, "_download_state.csv")
+
+        assert n_jobs_download >= 1
+        assert n_jobs_decompress >= 1
+        assert not (delete_archive_after_decompress and decompress_dir is None)
+
+        if os.path.exists(self.state_file):
+            self._df_state = pd.read_csv(self.state_file, index_col="archive_name", keep_default_na=False)
+        else:
+            self._df_state = pd.DataFrame(columns=["archive_name", "status", "url", "size"]).set_index("archive_name")
+
+        self._lock = threading.Lock()
+
+    def run(self, urls):
+
+        if not os.path.exists(self.downloads_dir): os.makedirs(self.downloads_dir)
+        if self.decompress_dir is not None and not os.path.exists(self.decompress_dir): os.makedirs(self.decompress_dir)
+
+        archive_names = [ os.path.basename(url) for url in urls ]
+        assert len(set(archive_names)) == len(archive_names)
+
+        status = {}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.n_jobs_download) as download_executor, \
+             concurrent.futures.ThreadPoolExecutor(max_workers=self.n_jobs_decompress) as extract_executor:
+
+            download_futures = {}
+            extract_futures  = {}
+
+            for url, archive_name in zip(urls, archive_names):
+                if self._is_done(archive_name):
+                    status[archive_name] = "skipped"
+                    print("[HYPERSIM: DOWNLOAD_UTILS] Already done, skipping: " + archive_name)
+                    continue
+                download_futures[download_executor.submit(self._download_with_retries, url)] = archive_name
+
+            # extract each archive as soon as it has been downloaded
+            for future in concurrent.futures.as_completed(download_futures):
+                archive_name = download_futures[future]
+                if future.result():
+                    status[archive_name] = "downloaded"
+                    if self.decompress_dir is not None:
+                        extract_futures[extract_executor.submit(self._extract, archive_name)] = archive_name
+                else:
+                    status[archive_name] = "failed"
+
+            for future in concurrent.futures.as_completed(extract_futures):
+                archive_name = extract_futures[future]
+                status[archive_name] = "extracted" if future.result() else "failed"
+
+        df_status = pd.DataFrame({"archive_name": archive_names, "status": [ status[a] for a in archive_names ]})
+
+        for s in ["skipped"] + download_states:
+            print("[HYPERSIM: DOWNLOAD_UTILS] " + s + ": " + str(count_nonzero(df_status["status"] == s)) + " archives")
+        for dfi in df_status[df_status["status"] == "failed"].itertuples():
+            print("[HYPERSIM: DOWNLOAD_UTILS] FAILED: " + dfi.archive_name)
+
+        return df_status
+
+    # An archive is done if it has been extracted, or if it has been downloaded and we don't want to extract
+    # it. We also check that a downloaded archive still exists, in case it has been deleted since.
+    def _is_done(self, archive_name):
+
+        if archive_name not in self._df_state.index:
+            return False
+
+        state = self._df_state.loc[archive_name]
+
+        if state["status"] == "extracted":
+            return True
+        if state["status"] == "downloaded" and self.decompress_dir is None:
+            archive_file = os.path.join(self.downloads_dir, archive_name)
+            return os.path.exists(archive_file) and os.path.getsize(archive_file) == int(state["size"])
+
+        return False
+
+    def _download_with_retries(self, url):
+
+        archive_name = os.path.basename(url)
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                size = self._download(url)
+                self._save_state(archive_name, "downloaded", url, size)
+                return True
+            except (OSError, http.client.HTTPException, ValueError) as e:
+                # client errors (e.g., 404 Not Found) won't go away if we retry
+                is_client_error = isinstance(e, urllib.error.HTTPError) and 400 <= e.code < 500 and e.code not in [408, 429]
+                if attempt == self.max_retries or is_client_error:
+                    print("[HYPERSIM: DOWNLOAD_UTILS] WARNING: COULD NOT DOWNLOAD " + url + " (" + str(e) + ")")
+                    self._save_state(archive_name, "failed", url, -1)
+                    return False
+                retry_delay_seconds = self.retry_delay_seconds*2**attempt
+                print("[HYPERSIM: DOWNLOAD_UTILS] WARNING: DOWNLOAD FAILED, RETRYING IN " + str(retry_delay_seconds) + " SECONDS: " + url + " (" + str(e) + ")")
+                time.sleep(retry_delay_seconds)
+
+    # Returns the size of the downloaded archive, or raises an exception if the download fails.
+    def _download(self, url):
+
+        archive_name = os.path.basename(url)
+        archive_file = os.path.join(self.downloads_dir, archive_name)
+        part_file    = archive_file + ".part"
+
+        request = urllib.request.Request(url, method="HEAD")
+        with urllib.request.urlopen(request, timeout=self.timeout_seconds) as response:
+            content_length = response.headers.get("Content-Length")
+
+        # None if the server doesn't report the size of the archive
+        size = int(content_length) if content_length is not None else None
+
+        # an archive from a previous run that wasn't recorded in the state file, e.g., downloaded with curl
+        if size is not None and os.path.exists(archive_file) and os.path.getsize(archive_file) == size:
+            print("[HYPERSIM: DOWNLOAD_UTILS] Archive already exists: " + archive_file)
+            self._verify_checksum(archive_name, archive_file)
+            return size
+
+        offset = 0
+        if size is not None and os.path.exists(part_file):
+            offset = os.path.getsize(part_file)
+            if offset > size:
+                offset = 0
+
+        if size is None or offset < size:
+
+            request = urllib.request.Request(url)
+            if offset > 0:
+                request.add_header("Range", "bytes=%d-" % offset)
+
+            with urllib.request.urlopen(request, timeout=self.timeout_seconds) as response:
+
+                # if the server ignores our range request, it sends the entire file
+                if offset > 0 and response.status != 206:
+                    offset = 0
+
+                if offset > 0:
+                    print("[HYPERSIM: DOWNLOAD_UTILS] Resuming download at byte " + str(offset) + " of " + str(size) + ": " + url)
+                else:
+                    print("[HYPERSIM: DOWNLOAD_UTILS] Downloading " + (str(size) if size is not None else "unknown number of") + " bytes: " + url)
+
+                with open(part_file, "ab" if offset > 0 else "wb") as f:
+                    shutil.copyfileobj(response, f, 1024*1024)
+
+        if size is None:
+            size = os.path.getsize(part_file)
+
+        if os.path.getsize(part_file) != size:
+            raise OSError("downloaded " + str(os.path.getsize(part_file)) + " bytes, but expected " + str(size) + " bytes")
+
+        try:
+            self._verify_checksum(archive_name, part_file)
+        except ValueError:
+            os.remove(part_file)
+            raise
+
+        os.replace(part_file, archive_file)
+
+        print("[HYPERSIM: DOWNLOAD_UTILS] Finished downloading: " + archive_file)
+
+        return size
+
+    def _verify_checksum(self, archive_name, file):
+
+        if archive_name not in self.checksums:
+            return
+
+        sha256 = hashlib.sha256()
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(1024*1024), b""):
+                sha256.update(block)
+
+        if sha256.hexdigest() != self.checksums[archive_name].lower():
+            raise ValueError("SHA-256 checksum of " + file + " is " + sha256.hexdigest() + ", but expected " + self.checksums[archive_name])
+
+    def _extract(self, archive_name):
+
+        archive_file = os.path.join(self.downloads_dir, archive_name)
+
+        # download workers modify self._df_state concurrently
+        with self._lock:
+            state = self._df_state.loc[archive_name].copy()
+
+        # if we know the checksum of the archive, downloading it again won't help
+        max_attempts = 1 if archive_name in self.checksums else 2
+
+        for attempt in range(max_attempts):
+
+            print("[HYPERSIM: DOWNLOAD_UTILS] Extracting " + archive_file + " to " + self.decompress_dir + "...")
+
+            try:
+                with zipfile.ZipFile(archive_file) as z:
+                    z.extractall(self.decompress_dir)
+                break
+            except (OSError, EOFError, zipfile.BadZipFile, zlib.error) as e:
+                if attempt == max_attempts - 1:
+                    print("[HYPERSIM: DOWNLOAD_UTILS] WARNING: COULD NOT EXTRACT " + archive_file + " (" + str(e) + ")")
+                    self._save_state(archive_name, "failed", state["url"], state["size"])
+                    return False
+                print("[HYPERSIM: DOWNLOAD_UTILS] WARNING: COULD NOT EXTRACT " + archive_file + ", DELETING IT AND DOWNLOADING IT AGAIN (" + str(e) + ")")
+                if os.path.exists(archive_file): os.remove(archive_file)
+                if not self._download_with_retries(state["url"]):
+                    return False
+                with self._lock:
+                    state = self._df_state.loc[archive_name].copy()
+
+        if self.delete_archive_after_decompress:
+            os.remove(archive_file)
+
+        self._save_state(archive_name, "extracted", state["url"], state["size"])
+
+        print("[HYPERSIM: DOWNLOAD_UTILS] Finished extracting: " + archive_file)
+
+        return True
+
+    def _save_state(self, archive_name, status, url, size):
+
+        with self._lock:
+
+            self._df_state.loc[archive_name] = pd.Series({"status": status, "url": url, "size": size})
+
+            # write to a temporary file and rename it, so an interrupted run never leaves a partially written state file
+            tmp_state_file = self.state_file + ".tmp"
+            self._df_state.to_csv(tmp_state_file, index_label="archive_name")
+            os.replace(tmp_state_file, self.state_file)
@@ -5,53 +5,366 @@
 
 from pylab import *
 
-import h5py
-import inspect
 import os
+import weakref
 
-import path_utils
+import cpp_tool_utils
 
 
 
-def generate_ray_intersections(vertices, faces, ray_positions, ray_directions, tmp_dir):
+#
+# RayCaster is built once per mesh and can be queried repeatedly. We support the following backends:
+#
+#   "pyembree" uses the pyembree Python bindings to trace rays in-process.
+#   "cpp"      uses our generate_ray_intersections binary, but only writes the mesh once.
+#   "numpy"    uses a pure-NumPy BVH, so it works on machines without Embree.
+#
+# If backend == "auto", we pick the first backend that is available on this machine, in the order
+# listed above. All backends return the same outputs as generate_ray_intersections(...), i.e., the
+# intersection distances along the normalized ray directions, the normalized geometric normals, and
+# the primitive IDs of the intersected triangles. Rays that don't hit anything have an intersection
+# distance and normal of inf, and a primitive ID of -1.
+#
+
+class RayCaster:
+
+    def __init__(self, vertices, faces, backend="auto", tmp_dir=None, leaf_size=8):
+
+        assert backend in ["auto", "pyembree", "cpp", "numpy"]
+
+        vertices = array(vertices, dtype=float64).reshape(-1,3)
+        faces    = array(faces, dtype=int64).reshape(-1,3)
+
+        if backend == "auto":
+            if _pyembree_available():
+                backend = "pyembree"
+            elif tmp_dir is not None and os.path.exists(cpp_tool_utils.get_cpp_bin("generate_ray_intersections")):
+                backend = "cpp"
+            else:
+                backend = "numpy"
+
+        self.backend = backend
+
+        if self.backend == "pyembree":
+            self._init_pyembree(vertices, faces)
+        if self.backend == "cpp":
+            self._init_cpp(vertices, faces, tmp_dir)
+        if self.backend == "numpy":
+            self._init_numpy(vertices, faces, leaf_size)
+
+    def intersect(self, ray_positions, ray_directions):
+
+        ray_positions  = array(ray_positions, dtype=float64).reshape(-1,3)
+        ray_directions = array(ray_directions, dtype=float64).reshape(-1,3)
+        assert ray_positions.shape[0] == ray_directions.shape[0]
+
+        ray_directions = ray_directions / linalg.norm(ray_directions, axis=1)[:,newaxis]
+
+        if self.backend == "pyembree":
+            return self._intersect_pyembree(ray_positions, ray_directions)
+        if self.backend == "cpp":
+            return self._intersect_cpp(ray_positions, ray_directions)
+        if self.backend == "numpy":
+            return self._intersect_numpy(ray_positions, ray_directions)
+
+    #
+    # pyembree backend
+    #
+
+    def _init_pyembree(self, vertices, faces):
+
+        from pyembree import rtcore_scene
+        from pyembree.mesh_construction import TriangleMesh
+
+        self._vertices = vertices
+        self._faces    = faces
+
+        self._pyembree_scene = rtcore_scene.EmbreeScene()
+        self._pyembree_mesh  = TriangleMesh(self._pyembree_scene, vertices[faces].astype(float32))
+
+    def _intersect_pyembree(self, ray_positions, ray_directions):
+
+        num_rays = ray_positions.shape[0]
+
+        ray_hit_data = self._pyembree_scene.run(ray_positions.astype(float32), ray_directions.astype(float32), output=1)
+
+        prim_ids = ray_hit_data["primID"].astype(int64)
+        hit      = prim_ids != -1
+
+        intersection_distances = ones(num_rays)*np.inf
+        intersection_normals   = ones((num_rays,3))*np.inf
+
+        intersection_distances[hit] = ray_hit_data["tfar"][hit]
+        intersection_normals[hit]   = _normalize_rows(ray_hit_data["Ng"][hit].astype(float64))
+
+        return intersection_distances, intersection_normals, prim_ids
+
+    #
+    # cpp backend
+    #
+
+    def _init_cpp(self, vertices, faces, tmp_dir):
+
+        assert tmp_dir is not None
+
+        # write the mesh once, and reuse it for all subsequent calls
+        self._tmp_dir    = tmp_dir
+        self._transport  = cpp_tool_utils.CppToolTransport(tmp_dir, num_bytes_hint=vertices.nbytes+faces.nbytes)
+        self._mesh_files = self._transport.write_arrays([("vertices", vertices), ("faces", faces)])
+
+        weakref.finalize(self, self._transport.close)
+
+    def _intersect_cpp(self, ray_positions, ray_directions):
+
+        retval, outputs = cpp_tool_utils.run_cpp_tool(
+            "generate_ray_intersections",
+            input_arrays=[("ray_positions_file", ray_positions), ("ray_directions_file", ray_directions)],
+            input_files={"vertices_file": self._mesh_files["vertices"], "faces_file": self._mesh_files["faces"]},
+            output_arrays=["output_ray_hit_data_float_file", "output_ray_hit_data_int_file"],
+            params=[("silent", None)],
+            tmp_dir=self._tmp_dir,
+            transport=self._transport.transport)
+
+        ray_hit_data_float = outputs["output_ray_hit_data_float_file"]
+        ray_hit_data_int   = outputs["output_ray_hit_data_int_file"]
+
+        intersection_distances = matrix(ray_hit_data_float[:,0]).A1
+        intersection_normals   = matrix(ray_hit_data_float[:,1:4]).A
+        prim_ids               = matrix(ray_hit_data_int[:,0]).A1
+
+        return intersection_distances, intersection_normals, prim_ids
+
+    #
+    # numpy backend
+    #
+    # We build a linear BVH: triangles are sorted along a Morton curve, grouped into leaves of
+    # leaf_size consecutive triangles, and the leaves are arranged in a complete binary tree that is
+    # stored in heap order (the children of node k are 2k and 2k+1, and the root is node 1). Building
+    # the tree is fully vectorized. We traverse the tree with an explicit per-ray stack, where each
+    # iteration pops one node for every active ray, so each ray visits its nodes front-to-back and
+    # can be pruned against its closest hit so far.
+    #
+
+    def _init_numpy(self, vertices, faces, leaf_size):
+
+        num_faces = faces.shape[0]
+
+        v0 = vertices[faces[:,0]]
+        v1 = vertices[faces[:,1]]
+        v2 = vertices[faces[:,2]]
+
+        # sort triangles along a Morton curve
+        centroids     = (v0 + v1 + v2) / 3.0
+        centroids_min = np.min(centroids, axis=0) if num_faces > 0 else zeros(3)
+        centroids_max = np.max(centroids, axis=0) if num_faces > 0 else ones(3)
+        centroids_ext = np.maximum(centroids_max - centroids_min, np.finfo(float64).tiny)
+        quantized     = np.clip(((centroids - centroids_min) / centroids_ext * 1023.0).astype(int64), 0, 1023).astype(uint64)
+        morton_codes  = (_spread_bits_10(quantized[:,0]) << uint64(2)) | (_spread_bits_10(quantized[:,1]) << uint64(1)) | _spread_bits_10(quantized[:,2])
+        order         = argsort(morton_codes, kind="stable")
+
+        self._face_ids = order
+        self._v0       = v0[order]
+        self._e1       = v1[order] - self._v0
+        self._e2       = v2[order] - self._v0
+
+        # leaves, padded to a power of two
+        num_leaves     = max(int(ceil(num_faces / float(leaf_size))), 1)
+        num_leaves_pow = 1 << int(ceil(log2(num_leaves)))
+
+        tri_min = np.minimum(np.minimum(v0, v1), v2)[order]
+        tri_max = np.maximum(np.maximum(v0, v1), v2)[order]
+
+        node_min = ones((2*num_leaves_pow,3))*np.inf
+        node_max = ones((2*num_leaves_pow,3))*-np.inf
+
+        if num_faces > 0:
+            leaf_starts = arange(0, num_faces, leaf_size)
+            node_min[num_leaves_pow:num_leaves_pow+leaf_starts.shape[0]] = np.minimum.reduceat(tri_min, leaf_starts, axis=0)
+            node_max[num_leaves_pow:num_leaves_pow+leaf_starts.shape[0]] = np.maximum.reduceat(tri_max, leaf_starts, axis=0)
+
+        # internal nodes, bottom-up one level at a time
+        level_size = num_leaves_pow // 2
+        while level_size >= 1:
+            k = arange(level_size, 2*level_size)
+            node_min[k] = np.minimum(node_min[2*k], node_min[2*k+1])
+            node_max[k] = np.maximum(node_max[2*k], node_max[2*k+1])
+            level_size = level_size // 2
+
+        self._num_faces      = num_faces
+        self._leaf_size      = leaf_size
+        self._num_leaves_pow = num_leaves_pow
+        self._tree_depth     = int(log2(num_leaves_pow))
+        self._node_min       = node_min
+        self._node_max       = node_max
+        self._node_empty     = node_min[:,0] > node_max[:,0]
+
+    def _intersect_numpy(self, ray_positions, ray_directions, num_rays_per_batch=65536):
+
+        num_rays = ray_positions.shape[0]
+
+        intersection_distances = ones(num_rays)*np.inf
+        intersection_normals   = ones((num_rays,3))*np.inf
+        prim_ids               = -ones(num_rays, dtype=int64)
+
+        for b in range(0, num_rays, num_rays_per_batch):
+            s = slice(b, min(b+num_rays_per_batch, num_rays))
+            intersection_distances[s], intersection_normals[s], prim_ids[s] = self._intersect_numpy_batch(ray_positions[s], ray_directions[s])
+
+        return intersection_distances, intersection_normals, prim_ids
+
+    def _intersect_numpy_batch(self, ray_positions, ray_directions):
+
+        num_rays = ray_positions.shape[0]
+
+        best_t = ones(num_rays)*np.inf
+        best_i = -ones(num_rays, dtype=int64)
+
+        if self._num_faces == 0:
+            return best_t, ones((num_rays,3))*np.inf, best_i
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ray_inv_directions = 1.0 / ray_directions
+
+        # per-ray stacks of (node, entry distance) pairs
+        stack_size  = self._tree_depth + 2
+        stack_nodes = zeros((num_rays,stack_size), dtype=int64)
+        stack_t     = zeros((num_rays,stack_size))
+        stack_ptr   = zeros(num_rays, dtype=int64)
+
+        t_near, t_far = self._intersect_nodes(ray_positions, ray_inv_directions, ones(num_rays, dtype=int64))
+        root_hit = t_far >= np.maximum(t_near, 0.0)
+
+        stack_nodes[root_hit,0] = 1
+        stack_t[root_hit,0]     = t_near[root_hit]
+        stack_ptr[root_hit]     = 1
+
+        active = where(stack_ptr > 0)[0]
+
+        while active.shape[0] > 0:
+
+            # pop one node per active ray, discard it if we already found a closer hit
+            stack_ptr[active] -= 1
+            nodes    = stack_nodes[active, stack_ptr[active]]
+            nodes_t  = stack_t[active, stack_ptr[active]]
+            keep     = nodes_t <= best_t[active]
+            rays     = active[keep]
+            nodes    = nodes[keep]
+            is_leaf  = nodes >= self._num_leaves_pow
+
+            # leaf nodes: intersect the ray with all triangles in the leaf
+            leaf_rays  = rays[is_leaf]
+            leaf_nodes = nodes[is_leaf]
+            if leaf_rays.shape[0] > 0:
+                tri_ids   = (leaf_nodes - self._num_leaves_pow)[:,newaxis]*self._leaf_size + arange(self._leaf_size)[newaxis,:]
+                tri_valid = tri_ids < self._num_faces
+                tri_ids   = np.minimum(tri_ids, self._num_faces-1)
+                tri_rays  = repeat(leaf_rays[:,newaxis], self._leaf_size, axis=1)
+                t         = self._intersect_triangles(ray_positions[tri_rays.ravel()], ray_directions[tri_rays.ravel()], tri_ids.ravel()).reshape(tri_ids.shape)
+                t[~tri_valid] = np.inf
+                j         = argmin(t, axis=1)
+                t_min     = t[arange(t.shape[0]),j]
+                closer    = t_min < best_t[leaf_rays]
+                best_t[leaf_rays[closer]] = t_min[closer]
+                best_i[leaf_rays[closer]] = tri_ids[arange(t.shape[0]),j][closer]
+
+            # internal nodes: push the children that the ray hits, far child first
+            inner_rays  = rays[~is_leaf]
+            inner_nodes = nodes[~is_leaf]
+            if inner_rays.shape[0] > 0:
+                children_0 = 2*inner_nodes
+                children_1 = 2*inner_nodes+1
+                t_near_0, t_far_0 = self._intersect_nodes(ray_positions[inner_rays], ray_inv_directions[inner_rays], children_0)
+                t_near_1, t_far_1 = self._intersect_nodes(ray_positions[inner_rays], ray_inv_directions[inner_rays], children_1)
+                hit_0 = logical_and(t_far_0 >= np.maximum(t_near_0, 0.0), t_near_0 <= best_t[inner_rays])
+                hit_1 = logical_and(t_far_1 >= np.maximum(t_near_1, 0.0), t_near_1 <= best_t[inner_rays])
+
+                swap    = t_near_1 > t_near_0
+                far_n   = where(swap, children_1, children_0)
+                far_t   = where(swap, t_near_1, t_near_0)
+                far_h   = where(swap, hit_1, hit_0)
+                near_n  = where(swap, children_0, children_1)
+                near_t  = where(swap, t_near_0, t_near_1)
+                near_h  = where(swap, hit_0, hit_1)
+
+                for push_n, push_t, push_h in [(far_n, far_t, far_h), (near_n, near_t, near_h)]:
+                    r = inner_rays[push_h]
+                    stack_nodes[r, stack_ptr[r]] = push_n[push_h]
+                    stack_t[r, stack_ptr[r]]     = push_t[push_h]
+                    stack_ptr[r] += 1
+
+            active = active[stack_ptr[active] > 0]
+
+        hit = best_i != -1
+
+        intersection_normals      = ones((num_rays,3))*np.inf
+        intersection_normals[hit] = _normalize_rows(cross(self._e1[best_i[hit]], self._e2[best_i[hit]]))
+        prim_ids                  = -ones(num_rays, dtype=int64)
+        prim_ids[hit]             = self._face_ids[best_i[hit]]
+
+        return best_t, intersection_normals, prim_ids
+
+    def _intersect_nodes(self, ray_positions, ray_inv_directions, nodes):
+
+        # slab test, see https://tavianator.com/fast-branchless-raybounding-box-intersections/
+        with np.errstate(invalid="ignore"):
+            t_0 = (self._node_min[nodes] - ray_positions) * ray_inv_directions
+            t_1 = (self._node_max[nodes] - ray_positions) * ray_inv_directions
+            t_near = np.nanmax(np.minimum(t_0, t_1), axis=1)
+            t_far  = np.nanmin(np.maximum(t_0, t_1), axis=1)
+
+        t_far[self._node_empty[nodes]] = -np.inf
+
+        return t_near, t_far
+
+    def _intersect_triangles(self, ray_positions, ray_directions, tri_ids):
+
+        # Moller-Trumbore ray-triangle intersection, without backface culling
+        e1 = self._e1[tri_ids]
+        e2 = self._e2[tri_ids]
+        p  = cross(ray_directions, e2)
+        d  = np.sum(e1*p, axis=1)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inv_d = 1.0 / d
+            s     = ray_positions - self._v0[tri_ids]
+            u     = np.sum(s*p, axis=1) * inv_d
+            q     = cross(s, e1)
+            v     = np.sum(ray_directions*q, axis=1) * inv_d
+            t     = np.sum(e2*q, axis=1) * inv_d
+
+        hit    = (d != 0) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0)
+        t[~hit] = np.inf
+
+        return t
+
 
-    if not os.path.exists(tmp_dir): os.makedirs(tmp_dir)
 
-    tmp_vertices_hdf5_file                  = os.path.join(tmp_dir, "_tmp_vertices.hdf5")
-    tmp_faces_hdf5_file                     = os.path.join(tmp_dir, "_tmp_faces.hdf5")
-    tmp_ray_positions_hdf5_file             = os.path.join(tmp_dir, "_tmp_ray_positions.hdf5")
-    tmp_ray_directions_hdf5_file            = os.path.join(tmp_dir, "_tmp_ray_directions.hdf5")
-    tmp_output_ray_hit_data_float_hdf5_file = os.path.join(tmp_dir, "_tmp_output_ray_hit_data_float.hdf5")
-    tmp_output_ray_hit_data_int_hdf5_file   = os.path.join(tmp_dir, "_tmp_output_ray_hit_data_int.hdf5")
+def generate_ray_intersections(vertices, faces, ray_positions, ray_directions, tmp_dir, backend="auto"):
 
-    with h5py.File(tmp_vertices_hdf5_file,       "w") as f: f.create_dataset("dataset", data=vertices)
-    with h5py.File(tmp_faces_hdf5_file,          "w") as f: f.create_dataset("dataset", data=faces)
-    with h5py.File(tmp_ray_positions_hdf5_file,  "w") as f: f.create_dataset("dataset", data=ray_positions)
-    with h5py.File(tmp_ray_directions_hdf5_file, "w") as f: f.create_dataset("dataset", data=ray_directions)
+    # If you are casting rays against the same mesh repeatedly, it is much faster to construct a
+    # RayCaster once and call RayCaster.intersect(...) instead of calling this function.
+    ray_caster = RayCaster(vertices, faces, backend=backend, tmp_dir=tmp_dir)
+    return ray_caster.intersect(ray_positions, ray_directions)
 
-    current_source_path            = path_utils.get_current_source_file_path(frame=inspect.currentframe())
-    generate_ray_intersections_bin = os.path.abspath(os.path.join(current_source_path, "..", "..", "cpp", "bin", "generate_ray_intersections"))
 
-    cmd = \
-        generate_ray_intersections_bin + \
-        " --vertices_file="                  + tmp_vertices_hdf5_file                  + \
-        " --faces_file="                     + tmp_faces_hdf5_file                     + \
-        " --ray_positions_file="             + tmp_ray_positions_hdf5_file             + \
-        " --ray_directions_file="            + tmp_ray_directions_hdf5_file            + \
-        " --output_ray_hit_data_float_file=" + tmp_output_ray_hit_data_float_hdf5_file + \
-        " --output_ray_hit_data_int_file="   + tmp_output_ray_hit_data_int_hdf5_file   + \
-        " --silent"
-    # print("")
-    # print(cmd)
-    # print("")
-    retval = os.system(cmd)
-    assert retval == 0
 
-    with h5py.File(tmp_output_ray_hit_data_float_hdf5_file, "r") as f: ray_hit_data_float = f["dataset"][:]
-    with h5py.File(tmp_output_ray_hit_data_int_hdf5_file,   "r") as f: ray_hit_data_int   = f["dataset"][:]
+def _pyembree_available():
+    try:
+        import pyembree.rtcore_scene
+        import pyembree.mesh_construction
+        return True
+    except ImportError:
+        return False
 
-    intersection_distances = matrix(ray_hit_data_float[:,0]).A1
-    intersection_normals   = matrix(ray_hit_data_float[:,1:4]).A
-    prim_ids               = matrix(ray_hit_data_int[:,0]).A1
+def _normalize_rows(x):
+    return x / linalg.norm(x, axis=1)[:,newaxis]
 
-    return intersection_distances, intersection_normals, prim_ids
+def _spread_bits_10(x):
+    # spread the lower 10 bits of x so there are 2 zero bits between each bit, i.e., so 3 spread
+    # values can be interleaved into a 30-bit Morton code
+    x = x & uint64(0x3ff)
+    x = (x | (x << uint64(16))) & uint64(0x30000ff)
+    x = (x | (x << uint64(8)))  & uint64(0x300f00f)
+    x = (x | (x << uint64(4)))  & uint64(0x30c30c3)
+    x = (x | (x << uint64(2)))  & uint64(0x9249249)
+    return x
@@ -6,49 +6,244 @@
 from pylab import *
 
 import h5py
-import inspect
 import os
 import pandas as pd
+import time
 
-import path_utils
+import cpp_tool_utils
 
 
 
-def load_exr_file(filename, tmp_dir):
+#
+# ExrFile decodes the channels of an EXR file directly into NumPy arrays. We support the following
+# backends:
+#
+#   "openexr" uses the OpenEXR Python bindings to decode channels in-process. Opening a file only reads
+#             its header, and each channel is decoded lazily the first time it is accessed, so channels
+#             that are never accessed are never decoded.
+#   "cpp"     uses our generate_hdf5_from_exr binary. All requested channels are decoded by a single call
+#             to the binary, and the resulting per-channel HDF5 files are read back into memory and
+#             removed immediately, so they never accumulate in tmp_dir.
+#
+# If backend == "auto", we use "openexr" if the OpenEXR Python bindings are available, and we fall back
+# to "cpp" otherwise. If channel_names is None, all channels in the file can be accessed. Otherwise, only
+# the channels in channel_names can be accessed, and the "cpp" backend only decodes those channels. Both
+# backends return HALF and FLOAT channels as float32 arrays, and UINT channels as uint32 arrays.
+#
+
+class ExrFile:
+
+    def __init__(self, filename, tmp_dir=None, channel_names=None, backend="auto"):
+
+        assert backend in ["auto", "openexr", "cpp"]
+        assert os.path.exists(filename)
+
+        if backend == "auto":
+            if _openexr_available():
+                backend = "openexr"
+            else:
+                backend = "cpp"
+
+        self.filename = filename
+        self.backend  = backend
+        self._cache   = {}
+
+        if self.backend == "openexr":
+            self._init_openexr(filename)
+        if self.backend == "cpp":
+            assert tmp_dir is not None
+            self._init_cpp(filename, tmp_dir, channel_names)
+
+        if channel_names is None:
+            self.channel_names = self.df_channels["channel_name"].tolist()
+        else:
+            assert all(isin(channel_names, self.df_channels["channel_name"]))
+            self.channel_names = list(channel_names)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+
+        if self.backend == "openexr" and self._openexr_file is not None:
+            self._openexr_file.close()
+            self._openexr_file = None
+
+        self._cache = {}
+
+    def get_channel(self, channel_name):
+
+        assert channel_name in self.channel_names
+
+        if channel_name not in self._cache:
+            if self.backend == "openexr":
+                self._cache[channel_name] = self._decode_channel_openexr(channel_name)
+
+        return self._cache[channel_name]
+
+    # Returns the channels that share a common prefix stacked into a single HxWxN array, e.g., the
+    # channels VRayNormal.R, VRayNormal.G, and VRayNormal.B are returned as a single HxWx3 array by
+    # get_stacked_channels("VRayNormal"). If prefix == "", the unprefixed channels R, G, and B are returned.
+    def get_stacked_channels(self, prefix, suffixes=["R", "G", "B"]):
+
+        if prefix == "":
+            channel_names = suffixes
+        else:
+            channel_names = [ prefix + "." + s for s in suffixes ]
+
+        return dstack([ self.get_channel(c) for c in channel_names ])
+
+    def get_channels(self):
+        return dict([ (c, self.get_channel(c)) for c in self.channel_names ])
+
+    #
+    # openexr backend
+    #
+
+    def _init_openexr(self, filename):
+
+        import Imath
+        import OpenEXR
+
+        self._openexr_file = OpenEXR.InputFile(filename)
+
+        header      = self._openexr_file.header()
+        data_window = header["dataWindow"]
+
+        self.width  = data_window.max.x - data_window.min.x + 1
+        self.height = data_window.max.y - data_window.min.y + 1
+
+        pixel_type_names = {
+            Imath.PixelType.UINT:  "Imf::UINT",
+            Imath.PixelType.HALF:  "Imf::HALF",
+            Imath.PixelType.FLOAT: "Imf::FLOAT" }
+
+        header_attribute_names  = sorted(header.keys())
+        header_attribute_types  = [ type(header[h]).__name__ for h in header_attribute_names ]
+        header_attribute_values = [ str(header[h])           for h in header_attribute_names ]
+
+        channel_names = sorted(header["channels"].keys())
+        channel_types = [ pixel_type_names[header["channels"][c].type.v] for c in channel_names ]
 
-    if not os.path.exists(tmp_dir): os.makedirs(tmp_dir)
+        self.df_header   = pd.DataFrame({"header_attribute_name": header_attribute_names, "header_attribute_type": header_attribute_types, "header_attribute_value": header_attribute_values})
+        self.df_channels = pd.DataFrame({"channel_name": channel_names, "channel_type": channel_types})
 
-    tmp_output_file_prefix       = os.path.join(tmp_dir, "_tmp_output")
-    tmp_output_header_csv_file   = os.path.join(tmp_dir, "_tmp_output.header.csv")
-    tmp_output_channels_csv_file = os.path.join(tmp_dir, "_tmp_output.channels.csv")
+    def _decode_channel_openexr(self, channel_name):
 
-    current_source_path        = path_utils.get_current_source_file_path(frame=inspect.currentframe())
-    generate_hdf5_from_exr_bin = os.path.abspath(os.path.join(current_source_path, "..", "..", "cpp", "bin", "generate_hdf5_from_exr"))
+        import Imath
+
+        channel_type = self.df_channels.set_index("channel_name").loc[channel_name]["channel_type"]
+
+        # the OpenEXR library converts HALF channels to FLOAT while decoding
+        if channel_type == "Imf::UINT":
+            pixel_type, dtype = Imath.PixelType(Imath.PixelType.UINT), uint32
+        else:
+            pixel_type, dtype = Imath.PixelType(Imath.PixelType.FLOAT), float32
+
+        channel_bytes = self._openexr_file.channel(channel_name, pixel_type)
+
+        return frombuffer(channel_bytes, dtype=dtype).reshape(self.height, self.width).copy()
+
+    #
+    # cpp backend
+    #
+
+    def _init_cpp(self, filename, tmp_dir, channel_names):
+
+        if not os.path.exists(tmp_dir): os.makedirs(tmp_dir)
+
+        with cpp_tool_utils.CppToolTransport(tmp_dir, num_bytes_hint=os.path.getsize(filename)) as transport:
+            self.df_header, self.df_channels, self._cache = _load_exr_file_cpp(filename, transport, channel_names)
+
+        if len(self._cache) > 0:
+            self.height, self.width = list(self._cache.values())[0].shape[:2]
+
+
+
+#
+# Load an EXR file, and return its header, its list of channels, and a dictionary of decoded channels.
+# If channel_names is not None, only the channels in channel_names are decoded and returned.
+#
+
+def load_exr_file(filename, tmp_dir, channel_names=None, backend="auto"):
+
+    with ExrFile(filename, tmp_dir=tmp_dir, channel_names=channel_names, backend=backend) as exr_file:
+        df_header, df_channels, channels = exr_file.df_header, exr_file.df_channels, exr_file.get_channels()
+
+    return df_header, df_channels, channels
+
+
+
+def _load_exr_file_cpp(filename, transport, channel_names):
+
+    tmp_output_file_prefix       = os.path.join(transport.scratch_dir, "_tmp_output")
+    tmp_output_header_csv_file   = os.path.join(transport.scratch_dir, "_tmp_output.header.csv")
+    tmp_output_channels_csv_file = os.path.join(transport.scratch_dir, "_tmp_output.channels.csv")
+
+    time_begin = time.time()
 
     cmd = \
-        generate_hdf5_from_exr_bin + \
+        cpp_tool_utils.get_cpp_bin("generate_hdf5_from_exr") + \
         " --input_file="  + filename               + \
         " --output_file=" + tmp_output_file_prefix + \
         " --silent"
+    if channel_names is not None:
+        cmd = cmd + "".join([ " --o " + c for c in channel_names ])
     # print("")
     # print(cmd)
     # print("")
-    retval = os.system(cmd)
+    retval = cpp_tool_utils.run_cmd(cmd)
     assert retval == 0
 
+    time_run_end = time.time()
+
     df_header   = pd.read_csv(tmp_output_header_csv_file)
     df_channels = pd.read_csv(tmp_output_channels_csv_file)
 
-    channels = {}
+    if channel_names is None:
+        channel_names = df_channels["channel_name"].tolist()
+
+    channels     = {}
+    output_files = [tmp_output_header_csv_file, tmp_output_channels_csv_file]
 
     for dfi in df_channels.itertuples():
 
         params       = df_channels.loc[dfi.Index].copy()
         channel_name = params["channel_name"]
+        channel_type = params["channel_type"]
+
+        if channel_name not in channel_names:
+            continue
 
         tmp_output_channel_hdf5_file = tmp_output_file_prefix + "." + channel_name + ".hdf5"
 
+        # our C++ tool stores channels as float64 and uint64, so we convert them to match the openexr backend
         with h5py.File(tmp_output_channel_hdf5_file, "r") as f: channel = f["dataset"][:]
+        if channel_type == "Imf::UINT":
+            channel = channel.astype(uint32)
+        else:
+            channel = channel.astype(float32)
+
         channels[channel_name] = channel
+        output_files.append(tmp_output_channel_hdf5_file)
+
+    num_bytes_read = sum([ os.path.getsize(file) for file in output_files ])
+
+    time_read_end = time.time()
+
+    cpp_tool_utils.record_cpp_tool_call_stats("generate_hdf5_from_exr", transport.transport, 0, num_bytes_read, 0.0, time_run_end - time_begin, time_read_end - time_run_end)
 
     return df_header, df_channels, channels
+
+
+
+def _openexr_available():
+    try:
+        import Imath
+        import OpenEXR
+        return True
+    except ImportError:
+        return False
@@ -0,0 +1,129 @@
+#
+# For licensing see accompanying LICENSE.txt file.
+# Copyright (C) 2020 Apple Inc. All Rights Reserved.
+#
+
+from pylab import *
+
+import hashlib
+import os
+import pandas as pd
+
+import hdf5_utils
+
+
+
+#
+# Our tools use fingerprints to skip work whose inputs haven't changed since it was last done, similar to
+# make. Each stage of our pipeline (e.g., generating semantic segmentation images) divides its work into
+# units identified by a key (e.g., a frame's file_root), and declares the input files that each unit reads
+# and the output files that it writes. A unit's fingerprint combines the stage's parameters with the
+# fingerprint of each input file. By default, a file's fingerprint is its size and modification time,
+# which is cheap to compute, but a content hash can be used instead (e.g., for a dataset that has been
+# copied without preserving modification times).
+#
+# Images that are stored in a shared per-frame or per-trajectory HDF5 file (see hdf5_utils.py) are
+# fingerprinted by hashing the image data, because the shared file is modified whenever any other image
+# in it is written, e.g., when we add segmentation images to the same per-frame file as the render entity
+# ID images they are generated from.
+#
+# A stage stores the fingerprint of each unit it has done in a small CSV file next to its outputs, i.e.,
+# <out_dir>/_fingerprints.<stage_name>.csv, with columns key and fingerprint. A unit is up to date if its
+# stored fingerprint matches its current fingerprint and all of its outputs exist. If force is True, no
+# unit is up to date, so all work is redone.
+#
+
+fingerprint_modes = ["stat", "hash"]
+
+
+
+def get_fingerprints_file(out_dir, stage_name):
+    return os.path.join(out_dir, "_fingerprints." + stage_name + ".csv")
+
+
+
+def get_file_fingerprint(file, mode="stat"):
+
+    assert mode in fingerprint_modes
+
+    if mode == "stat":
+        stat = os.stat(file)
+        return "%d:%d" % (stat.st_size, stat.st_mtime_ns)
+
+    if mode == "hash":
+        sha1 = hashlib.sha1()
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(1024*1024), b""):
+                sha1.update(block)
+        return sha1.hexdigest()
+
+
+
+def get_image_fingerprint(hdf5_file, mode="stat", image_reader=None):
+
+    if os.path.exists(hdf5_file):
+        return get_file_fingerprint(hdf5_file, mode)
+
+    if image_reader is not None:
+        data = image_reader.load_image(hdf5_file)
+    else:
+        data = hdf5_utils.load_image(hdf5_file)
+
+    sha1 = hashlib.sha1()
+    sha1.update((str(data.dtype) + str(data.shape)).encode("utf-8"))
+    sha1.update(ascontiguousarray(data).tobytes())
+    return sha1.hexdigest()
+
+
+
+class Fingerprints:
+
+    def __init__(self, out_dir, stage_name, params={}, mode="stat", force=False):
+
+        assert mode in fingerprint_modes
+
+        self.fingerprints_file = get_fingerprints_file(out_dir, stage_name)
+        self.params            = params
+        self.mode              = mode
+        self.force             = force
+
+        if os.path.exists(self.fingerprints_file):
+            df = pd.read_csv(self.fingerprints_file, dtype=str, keep_default_na=False)
+            self._fingerprints = dict(zip(df["key"], df["fingerprint"]))
+        else:
+            self._fingerprints = {}
+
+    # Compute the fingerprint for a unit of work that reads input_files, and the images at the per-channel
+    # paths in input_images. Changing the order of the inputs changes the fingerprint.
+    def compute(self, input_files=[], input_images=[], image_reader=None):
+
+        tokens = [ repr(sorted([ (k, str(v)) for k, v in self.params.items() ])) ]
+        tokens.extend([ get_file_fingerprint(f, self.mode) for f in input_files ])
+        tokens.extend([ get_image_fingerprint(f, self.mode, image_reader) for f in input_images ])
+
+        return hashlib.sha1("\n".join(tokens).encode("utf-8")).hexdigest()
+
+    def is_up_to_date(self, key, fingerprint, output_files=[], output_images=[]):
+
+        if self.force:
+            return False
+        if key not in self._fingerprints or self._fingerprints[key] != fingerprint:
+            return False
+
+        return all([ os.path.exists(f) for f in output_files ]) and all([ hdf5_utils.image_exists(f) for f in output_images ])
+
+    def update(self, key, fingerprint):
+        self._fingerprints[key] = fingerprint
+
+    def save(self):
+
+        if len(self._fingerprints) == 0:
+            return
+
+        df = pd.DataFrame({"key": list(self._fingerprints.keys()), "fingerprint": list(self._fingerprints.values())})
+
+        # write to a temporary file and rename it, so an interrupted run never leaves a partially written file
+        if not os.path.exists(os.path.dirname(self.fingerprints_file)): os.makedirs(os.path.dirname(self.fingerprints_file))
+        tmp_fingerprints_file = self.fingerprints_file + ".tmp"
+        df.sort_values("key").to_csv(tmp_fingerprints_file, index=False)
+        os.replace(tmp_fingerprints_file, self.fingerprints_file)
@@ -0,0 +1,460 @@
+#
+# For licensing see accompanying LICENSE.txt file.
+# Copyright (C) 2020 Apple Inc. All Rights Reserved.
+#
+
+from pylab import *
+
+import fnmatch
+import h5py
+import os
+
+import archive_utils
+
+
+
+#
+# All of our image writers store their outputs according to a storage spec, i.e., a string that
+# specifies a codec and a chunk layout for each output channel. A storage spec is a comma-separated
+# list of storage options, where each option has the form [channel_name=]codec[@chunk_shape]. The
+# first option without a channel name is the default for all channels, and options with a channel name
+# override the default for that channel. Codecs have the following form:
+#
+#   "none"             no compression, contiguous layout unless a chunk shape is specified
+#   "gzip:N"           gzip (deflate) at compression level N, where N is 0-9
+#   "lzf"              lzf, which is much faster than gzip but compresses less
+#   "shuffle+gzip:N"   byte shuffle followed by gzip at compression level N
+#   "shuffle+lzf"      byte shuffle followed by lzf
+#
+# Chunk shapes have the form HxW, e.g., "gzip:4@128x128", and apply to the first two dimensions of each
+# dataset, where all remaining dimensions are stored in full within each chunk. If no chunk shape is
+# specified for a compressed codec, h5py chooses one automatically. For example, the storage spec
+# "gzip:4,depth_meters=shuffle+gzip:4,render_entity_id=lzf@64x64" stores depth images with shuffle and
+# gzip, render entity ID images with lzf in 64x64 chunks, and all other images with gzip at level 4.
+#
+# storage_spec_default matches the behavior of our original image writers.
+#
+
+storage_spec_default = "gzip:9"
+
+
+
+def parse_storage_spec(storage_spec):
+
+    if storage_spec is None:
+        storage_spec = storage_spec_default
+
+    storage_options = {}
+
+    for token in storage_spec.split(","):
+
+        token = token.strip()
+        assert token != ""
+
+        if "=" in token:
+            channel_name, token = token.split("=", 1)
+        else:
+            channel_name = None
+
+        assert channel_name not in storage_options
+        storage_options[channel_name] = _parse_storage_option(token)
+
+    assert None in storage_options
+
+    return storage_options
+
+
+
+#
+# Return the h5py create_dataset keyword arguments for the given channel name. storage_options can
+# either be a storage spec string or the output of parse_storage_spec(...).
+#
+
+def get_storage_kwargs(storage_options, channel_name=None, shape=None):
+
+    if storage_options is None or isinstance(storage_options, str):
+        storage_options = parse_storage_spec(storage_options)
+
+    if channel_name in storage_options:
+        storage_option = storage_options[channel_name]
+    else:
+        storage_option = storage_options[None]
+
+    kwargs = dict([ (k, v) for k, v in storage_option.items() if k != "chunk_shape" ])
+
+    if storage_option["chunk_shape"] is not None:
+        assert shape is not None
+        # chunks can't be larger than the dataset, and empty datasets can't be chunked
+        if len(shape) >= 2 and all([ s > 0 for s in shape ]):
+            chunk_shape      = list(storage_option["chunk_shape"]) + list(shape[2:])
+            kwargs["chunks"] = tuple(minimum(chunk_shape, shape).tolist())
+
+    return kwargs
+
+
+
+def write_hdf5_dataset(hdf5_file, data, storage_options=None, channel_name=None):
+
+    kwargs = get_storage_kwargs(storage_options, channel_name, data.shape)
+    with h5py.File(hdf5_file, "w") as f: f.create_dataset("dataset", data=data, **kwargs)
+
+
+
+#
+# Our image files are named <frame_name>.<channel_name>.hdf5, e.g., frame.0000.depth_meters.hdf5.
+#
+
+def get_channel_name_from_file(hdf5_file):
+
+    tokens = os.path.basename(hdf5_file).split(".")
+    assert len(tokens) >= 3 and tokens[-1] == "hdf5"
+    return tokens[-2]
+
+
+
+def _parse_storage_option(token):
+
+    if "@" in token:
+        codec, chunk_shape_str = token.split("@", 1)
+        chunk_shape            = tuple([ int(c) for c in chunk_shape_str.split("x") ])
+        assert len(chunk_shape) == 2 and all([ c > 0 for c in chunk_shape ])
+    else:
+        codec, chunk_shape = token, None
+
+    storage_option = {"chunk_shape": chunk_shape}
+
+    if codec.startswith("shuffle+"):
+        storage_option["shuffle"] = True
+        codec = codec[len("shuffle+"):]
+
+    if codec == "none":
+        assert "shuffle" not in storage_option
+    elif codec == "lzf":
+        storage_option["compression"] = "lzf"
+    elif codec.startswith("gzip"):
+        if codec == "gzip":
+            level = 4
+        else:
+            assert codec.startswith("gzip:")
+            level = int(codec[len("gzip:"):])
+        assert level >= 0 and level <= 9
+        storage_option["compression"]      = "gzip"
+        storage_option["compression_opts"] = level
+    else:
+        assert False
+
+    return storage_option
+
+
+
+#
+# Our image writers support the following layouts for the images in each of our *_hdf5 directories:
+#
+#   "per_channel"    one file per channel per frame, e.g., frame.0000.depth_meters.hdf5, which contains a
+#                    single dataset named "dataset". This is the layout of our original image writers.
+#   "per_frame"      one file per frame, e.g., frame.0000.hdf5, which contains one dataset per channel,
+#                    named after the channel, e.g., "depth_meters".
+#   "per_trajectory" one file per directory (frames.hdf5), which contains one group per channel. Each group
+#                    contains an NxHxW[xC] dataset named "dataset", chunked so each frame can be read
+#                    independently, where frame i is stored at index i, and an N-element dataset named
+#                    "frame_valid" that indicates which frames have been written.
+#
+# Readers can access images via ImageReader (or load_image(...)) and get_image_files(...), which accept
+# the per-channel paths of our original layout, and serve them from whichever layout is on disk. So
+# readers don't need to know which layout was used to write a directory. Readers also accept an optional
+# archive_reader (see archive_utils.py), in which case files that don't exist on disk are served from our
+# scene ZIP files, so readers don't need to extract the ZIP files either.
+#
+
+image_layouts        = ["per_channel", "per_frame", "per_trajectory"]
+trajectory_file_name = "frames.hdf5"
+
+
+
+def get_image_layout(hdf5_dir):
+
+    if os.path.exists(os.path.join(hdf5_dir, trajectory_file_name)):
+        return "per_trajectory"
+    if len(_get_frame_files(hdf5_dir)) > 0:
+        return "per_frame"
+    return "per_channel"
+
+
+
+#
+# Write all the channels for a frame, where images is a list of (channel_name, data) tuples, and
+# file_root is the name of the frame, e.g., frame.0000. Writing to an existing per-frame or
+# per-trajectory file adds channels to it, and replaces channels that have already been written for
+# the frame. Only one process can write to a per-trajectory file at a time, so parallel writers should
+# write per-frame files, and merge them with merge_frame_files_into_trajectory_file(...) afterwards.
+#
+# Readers look for an image in the per-channel layout first, then in the per-frame layout, and then in
+# the per-trajectory layout. So when we write an image in the per-frame or per-trajectory layout, we
+# remove any copies of it that a previous run wrote in a layout that readers look at first, because
+# readers would return the old data otherwise.
+#
+
+def write_images(hdf5_dir, file_root, images, storage_options=None, layout="per_channel"):
+
+    assert layout in image_layouts
+
+    if layout == "per_channel":
+        for channel_name, data in images:
+            write_hdf5_dataset(os.path.join(hdf5_dir, file_root + "." + channel_name + ".hdf5"), data, storage_options, channel_name)
+
+    if layout != "per_channel":
+        _remove_stale_images(hdf5_dir, file_root, [ channel_name for channel_name, data in images ], layout)
+
+    if layout == "per_frame":
+        with h5py.File(os.path.join(hdf5_dir, file_root + ".hdf5"), "a") as f:
+            for channel_name, data in images:
+                if channel_name in f:
+                    del f[channel_name]
+                f.create_dataset(channel_name, data=data, **get_storage_kwargs(storage_options, channel_name, data.shape))
+
+    if layout == "per_trajectory":
+        with h5py.File(os.path.join(hdf5_dir, trajectory_file_name), "a") as f:
+            _write_trajectory_images(f, file_root, images, storage_options)
+
+
+
+def merge_frame_files_into_trajectory_file(hdf5_dir, file_roots, storage_options=None, remove_frame_files=True):
+
+    with h5py.File(os.path.join(hdf5_dir, trajectory_file_name), "a") as f:
+
+        for file_root in file_roots:
+
+            frame_file = os.path.join(hdf5_dir, file_root + ".hdf5")
+            with h5py.File(frame_file, "r") as f_frame: images = [ (c, f_frame[c][:]) for c in f_frame.keys() ]
+
+            _remove_stale_images(hdf5_dir, file_root, [ c for c, data in images ], "per_frame")
+            _write_trajectory_images(f, file_root, images, storage_options)
+
+            if remove_frame_files:
+                os.remove(frame_file)
+
+
+
+#
+# Return the per-channel paths that match a glob pattern, e.g., .../frame.*.color.hdf5, regardless of
+# which layout was used to write the images. The returned paths can be passed to ImageReader.load_image(...).
+#
+
+def get_image_files(hdf5_files, archive_reader=None):
+
+    hdf5_dir, pattern = os.path.split(hdf5_files)
+    if hdf5_dir == "":
+        hdf5_dir = "."
+
+    # per-frame and per-trajectory files can match broad patterns, e.g., *.hdf5, so we skip them here
+    image_files = set([ os.path.basename(f) for f in archive_utils.glob_files(hdf5_files, archive_reader) if len(os.path.basename(f).split(".")) >= 4 ])
+
+    for frame_file in _get_frame_files(hdf5_dir, archive_reader):
+        file_root = os.path.basename(frame_file)[:-len(".hdf5")]
+        with open_hdf5_file(frame_file, archive_reader) as f: image_files.update([ file_root + "." + c + ".hdf5" for c in f.keys() ])
+
+    trajectory_file = os.path.join(hdf5_dir, trajectory_file_name)
+    if archive_utils.path_exists(trajectory_file, archive_reader):
+        with open_hdf5_file(trajectory_file, archive_reader) as f:
+            file_root_format = f.attrs["file_root_format"]
+            for c in f.keys():
+                frame_ids = where(f[c]["frame_valid"][:] == 1)[0]
+                image_files.update([ (file_root_format % i) + "." + c + ".hdf5" for i in frame_ids ])
+
+    image_files = [ f for f in image_files if fnmatch.fnmatch(f, pattern) ]
+
+    return [ os.path.join(hdf5_dir, f) for f in sorted(image_files) ]
+
+
+
+#
+# ImageReader keeps the most recently used per-frame file, and all per-trajectory files, open between
+# calls, so reading all the channels for a frame only requires a single call to open(). If archive_reader
+# is specified, the ZIP files it has opened also stay open between calls.
+#
+
+class ImageReader:
+
+    def __init__(self, archive_reader=None):
+
+        self._archive_reader   = archive_reader
+        self._frame_file_name  = None
+        self._frame_file       = None
+        self._trajectory_files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+
+        if self._frame_file is not None:
+            self._frame_file.close()
+        for f in self._trajectory_files.values():
+            f.close()
+
+        self._frame_file_name  = None
+        self._frame_file       = None
+        self._trajectory_files = {}
+
+    def load_image(self, hdf5_file):
+
+        if archive_utils.path_exists(hdf5_file, self._archive_reader):
+            with open_hdf5_file(hdf5_file, self._archive_reader) as f: return f["dataset"][:]
+
+        hdf5_dir, file_root, channel_name = _split_image_file(hdf5_file)
+
+        frame_file = os.path.join(hdf5_dir, file_root + ".hdf5")
+        if archive_utils.path_exists(frame_file, self._archive_reader):
+            if self._frame_file_name != frame_file:
+                if self._frame_file is not None:
+                    self._frame_file.close()
+                self._frame_file_name = frame_file
+                self._frame_file      = open_hdf5_file(frame_file, self._archive_reader)
+            return self._frame_file[channel_name][:]
+
+        trajectory_file = os.path.join(hdf5_dir, trajectory_file_name)
+        assert archive_utils.path_exists(trajectory_file, self._archive_reader)
+
+        if trajectory_file not in self._trajectory_files:
+            self._trajectory_files[trajectory_file] = open_hdf5_file(trajectory_file, self._archive_reader)
+
+        group    = self._trajectory_files[trajectory_file][channel_name]
+        frame_id = _get_frame_id(file_root)
+        assert frame_id < group["frame_valid"].shape[0] and group["frame_valid"][frame_id] == 1
+
+        return group["dataset"][frame_id]
+
+
+
+def load_image(hdf5_file, archive_reader=None):
+
+    with ImageReader(archive_reader) as image_reader:
+        return image_reader.load_image(hdf5_file)
+
+
+
+# Return True if the image at a per-channel path exists, regardless of which layout was used to write it.
+def image_exists(hdf5_file, archive_reader=None):
+
+    if archive_utils.path_exists(hdf5_file, archive_reader):
+        return True
+
+    hdf5_dir, file_root, channel_name = _split_image_file(hdf5_file)
+
+    frame_file = os.path.join(hdf5_dir, file_root + ".hdf5")
+    if archive_utils.path_exists(frame_file, archive_reader):
+        with open_hdf5_file(frame_file, archive_reader) as f: return channel_name in f
+
+    trajectory_file = os.path.join(hdf5_dir, trajectory_file_name)
+    if not archive_utils.path_exists(trajectory_file, archive_reader):
+        return False
+
+    with open_hdf5_file(trajectory_file, archive_reader) as f:
+        if channel_name not in f:
+            return False
+        frame_id    = _get_frame_id(file_root)
+        frame_valid = f[channel_name]["frame_valid"]
+        return bool(frame_id < frame_valid.shape[0] and frame_valid[frame_id] == 1)
+
+
+
+# Remove the images for a frame from the layouts that readers look at before the given layout.
+def _remove_stale_images(hdf5_dir, file_root, channel_names, layout):
+
+    for channel_name in channel_names:
+        channel_file = os.path.join(hdf5_dir, file_root + "." + channel_name + ".hdf5")
+        if os.path.exists(channel_file):
+            os.remove(channel_file)
+
+    frame_file = os.path.join(hdf5_dir, file_root + ".hdf5")
+    if layout == "per_trajectory" and os.path.exists(frame_file):
+        with h5py.File(frame_file, "a") as f:
+            for channel_name in channel_names:
+                if channel_name in f:
+                    del f[channel_name]
+            is_empty = len(f.keys()) == 0
+        if is_empty:
+            os.remove(frame_file)
+
+
+
+def _write_trajectory_images(f, file_root, images, storage_options):
+
+    frame_id         = _get_frame_id(file_root)
+    file_root_format = _get_file_root_format(file_root)
+
+    if "file_root_format" in f.attrs:
+        assert f.attrs["file_root_format"] == file_root_format
+    else:
+        f.attrs["file_root_format"] = file_root_format
+
+    for channel_name, data in images:
+
+        if channel_name not in f:
+            kwargs = get_storage_kwargs(storage_options, channel_name, data.shape)
+            chunks = (1,) + kwargs.pop("chunks", data.shape)
+            group  = f.create_group(channel_name)
+            group.create_dataset("dataset", shape=(frame_id+1,) + data.shape, maxshape=(None,) + data.shape, dtype=data.dtype, chunks=chunks, **kwargs)
+            group.create_dataset("frame_valid", shape=(frame_id+1,), maxshape=(None,), dtype=uint8, chunks=(1024,))
+
+        group = f[channel_name]
+        assert group["dataset"].shape[1:] == data.shape
+
+        if group["dataset"].shape[0] <= frame_id:
+            group["dataset"].resize(frame_id+1, axis=0)
+            group["frame_valid"].resize(frame_id+1, axis=0)
+
+        group["dataset"][frame_id]     = data
+        group["frame_valid"][frame_id] = 1
+
+
+
+def _get_frame_files(hdf5_dir, archive_reader=None):
+
+    frame_files = []
+    for f in archive_utils.glob_files(os.path.join(hdf5_dir, "*.hdf5"), archive_reader):
+        tokens = os.path.basename(f).split(".")
+        if len(tokens) == 3 and tokens[1].isdigit():
+            frame_files.append(f)
+
+    return sorted(frame_files)
+
+
+
+# Open an HDF5 file for reading, from disk if it exists, or from one of our ZIP files otherwise. h5py reads
+# files on disk with its own I/O routines, which is faster than reading through a Python file object.
+def open_hdf5_file(hdf5_file, archive_reader=None):
+
+    if archive_reader is None or os.path.exists(hdf5_file):
+        return h5py.File(hdf5_file, "r")
+
+    return h5py.File(archive_reader.open(hdf5_file), "r")
+
+
+
+def _split_image_file(hdf5_file):
+
+    hdf5_dir, hdf5_file_name = os.path.split(hdf5_file)
+    tokens = hdf5_file_name.split(".")
+    assert len(tokens) >= 4 and tokens[-1] == "hdf5"
+
+    return hdf5_dir, ".".join(tokens[:-2]), tokens[-2]
+
+
+
+def _get_frame_id(file_root):
+
+    tokens = file_root.split(".")
+    assert tokens[-1].isdigit()
+    return int(tokens[-1])
+
+
+
+def _get_file_root_format(file_root):
+
+    tokens = file_root.split(".")
+    assert tokens[-1].isdigit()
+    return ".".join(tokens[:-1] + ["%0" + str(len(tokens[-1])) + "d"])
@@ -0,0 +1,185 @@
+#
+# For licensing see accompanying LICENSE.txt file.
+# Copyright (C) 2020 Apple Inc. All Rights Reserved.
+#
+
+from pylab import *
+
+
+
+#
+# Our statistics tools accumulate many fixed-bin histograms over the same pixels. Rather than calling
+# histogram(...) or histogramdd(...), which sort or search the data for every histogram, we compute
+# each value's bin index with a few arithmetic operations, and count the indices with bincount(...). For
+# log-spaced bins, we apply the arithmetic to the log of each value. The arithmetic is done in the
+# precision of the input data (i.e., float32 for our image data), so it can be off by one bin for values
+# very close to a bin edge, and we correct these indices by comparing values to the exact bin edges,
+# like numpy does internally. So our counts are identical to the counts computed by
+# histogram(vals, bins=bins.edges) and histogramdd(vals, bins=[ b.edges for b in bins ]), i.e., each bin
+# includes its left edge, the last bin also includes its right edge, and values outside the range of
+# the bins (or non-finite values) are not counted.
+#
+# We assign values outside the range of the bins (or non-finite values) to an extra outlier bin on each
+# end, like histogramdd(...) does internally, and discard the outlier bins after counting, which avoids
+# selecting the values inside the range, which is surprisingly expensive. Comparing a float32 value to a
+# float64 edge requires converting the value to float64, so for float32 values, we compare against the
+# smallest float32 value that is greater than or equal to each edge instead, which gives identical
+# results and is much faster.
+#
+
+class Bins:
+
+    def __init__(self, n_bins, min, max, log_base=None):
+
+        assert n_bins >= 1
+        assert min < max
+
+        self.n_bins   = n_bins
+        self.min      = min
+        self.max      = max
+        self.log_base = log_base
+
+        # for log-spaced bins, min and max are exponents, like for logspace(...)
+        if log_base is None:
+            self.edges = linspace(min, max, n_bins+1)
+        else:
+            self.edges = logspace(min, max, n_bins+1, base=log_base)
+
+        # index = (t - min)*scale + 1, where t is the value (or the log of the value), and the +1 is for the outlier bin
+        self._scale  = n_bins / (max - min)
+        self._offset = 1.0 - min*self._scale
+
+        if log_base is not None:
+            self._log_base_inv = 1.0 / log(log_base)
+
+        self._edges_with_outliers_per_dtype = {}
+
+    # Returns the bin index for each value, where index 0 is the outlier bin for values below the range of
+    # the bins (and non-finite values), indices 1 to n_bins are the bins, and index n_bins+1 is the outlier
+    # bin for values above the range of the bins.
+    def get_bin_indices(self, vals):
+
+        vals = asarray(vals)
+        if vals.dtype != float32:
+            vals = vals.astype(float64)
+
+        edges_with_outliers = self._get_edges_with_outliers(vals.dtype)
+
+        with errstate(divide="ignore", invalid="ignore"):
+            if self.log_base is None:
+                t = vals*self._scale
+            else:
+                t = log(vals)*self._log_base_inv
+                t *= self._scale
+            t += self._offset
+
+        # fmin and fmax map NaN values to index 0
+        fmax(t, 0, out=t)
+        fmin(t, self.n_bins + 1, out=t)
+        indices = t.astype(intp)
+
+        # correct indices that are off by one because of rounding errors, where the NaN edges at each end
+        # prevent us from moving out of the outlier bins
+        indices -= vals < edges_with_outliers.take(indices)
+        indices += vals >= edges_with_outliers[1:].take(indices)
+
+        return indices
+
+    # Returns the lower edge of each bin including the outlier bins, followed by the upper edge of the
+    # last outlier bin, i.e., [NaN, e_0, e_1, ..., e_n-1, e_n', NaN], where e_n' is the smallest value
+    # greater than e_n, because the last bin includes its upper edge.
+    def _get_edges_with_outliers(self, dtype):
+
+        if dtype not in self._edges_with_outliers_per_dtype:
+
+            edges                     = self.edges.astype(dtype)
+            round_up_mask             = edges < self.edges
+            edges[round_up_mask]      = nextafter(edges[round_up_mask], dtype.type(inf))
+
+            # the largest value <= e_n, then the smallest value greater than that
+            edge_last = self.edges[-1:].astype(dtype)
+            if edge_last[0] > self.edges[-1]:
+                edge_last = nextafter(edge_last, dtype.type(-inf))
+            edge_last = nextafter(edge_last, dtype.type(inf))
+
+            self._edges_with_outliers_per_dtype[dtype] = r_[ dtype.type(nan), edges[:-1], edge_last, dtype.type(nan) ].astype(dtype)
+
+        return self._edges_with_outliers_per_dtype[dtype]
+
+
+
+#
+# Add the counts for vals to hist, which must be an int64 array with one dimension per element of bins.
+# If bins is a single Bins object, vals is an N-element array. Otherwise, vals is an NxD array, where D
+# is the number of elements in bins, and each column of vals is binned according to the corresponding
+# element in bins.
+#
+
+def accumulate_histogram(hist, vals, bins):
+
+    if isinstance(bins, Bins):
+        assert hist.shape == (bins.n_bins,)
+        hist += bincount(bins.get_bin_indices(vals), minlength=bins.n_bins+2)[1:-1]
+        return
+
+    assert vals.shape[1] == len(bins)
+    assert hist.shape == tuple([ b.n_bins for b in bins ])
+
+    hist_shape_with_outliers = tuple([ b.n_bins+2 for b in bins ])
+    indices_1d               = ravel_multi_index(tuple([ bins[d].get_bin_indices(vals[:,d]) for d in range(len(bins)) ]), hist_shape_with_outliers)
+    hist_with_outliers       = bincount(indices_1d, minlength=prod(hist_shape_with_outliers)).reshape(hist_shape_with_outliers)
+
+    hist += hist_with_outliers[tuple([ slice(1, -1) for b in bins ])]
+
+
+
+#
+# Compute brightness and hue-saturation values for an Nx3 array of RGB values in a single pass. We compute
+# brightness according to the "CCIR601 YIQ" method, as in the CGIntrinsics tonemapping strategy (see
+# tonemap_utils.py). We compute hue and saturation from L2-normalized RGB values, and return them as
+# points on the unit disk, i.e., x = s*cos(2*pi*h) and y = s*sin(2*pi*h). The arithmetic matches
+# sklearn.preprocessing.normalize(...) followed by matplotlib.colors.rgb_to_hsv(...) exactly, so for
+# float32 inputs our outputs are bit-identical, but we operate on each color component as a contiguous
+# array, we select values with where(...) rather than with boolean indexing, and we don't allocate
+# intermediate HSV arrays. Unlike rgb_to_hsv(...), we also accept normalized RGB values with negative
+# components (e.g., from non-diffuse residual images).
+#
+
+def rgb_to_brightness_and_hue_saturation(vals_1d_rgb):
+
+    assert vals_1d_rgb.ndim == 2 and vals_1d_rgb.shape[1] == 3
+
+    vals_1d_rgb = asarray(vals_1d_rgb, dtype=promote_types(vals_1d_rgb.dtype, float32))
+
+    brightness_1d = 0.3*vals_1d_rgb[:,0] + 0.59*vals_1d_rgb[:,1] + 0.11*vals_1d_rgb[:,2]
+
+    # normalize, treating near-zero vectors as zero vectors
+    norms_1d = sqrt(einsum("ij,ij->i", vals_1d_rgb, vals_1d_rgb))
+    norms_1d[norms_1d < 10*finfo(norms_1d.dtype).eps] = 1.0
+
+    vals_1d_r = vals_1d_rgb[:,0] / norms_1d
+    vals_1d_g = vals_1d_rgb[:,1] / norms_1d
+    vals_1d_b = vals_1d_rgb[:,2] / norms_1d
+
+    # hue and saturation, where division by zero only occurs for values that we don't select
+    vals_1d_max   = maximum(maximum(vals_1d_r, vals_1d_g), vals_1d_b)
+    vals_1d_delta = vals_1d_max - minimum(minimum(vals_1d_r, vals_1d_g), vals_1d_b)
+    mask_delta    = vals_1d_delta > 0
+
+    with errstate(divide="ignore", invalid="ignore"):
+
+        vals_1d_s = where(vals_1d_max > 0, vals_1d_delta / vals_1d_max, 0)
+
+        # if several components are equal to the max, the last one takes precedence
+        vals_1d_h = zeros_like(vals_1d_delta)
+        vals_1d_h = where(logical_and(vals_1d_r == vals_1d_max, mask_delta),      (vals_1d_g - vals_1d_b) / vals_1d_delta, vals_1d_h)
+        vals_1d_h = where(logical_and(vals_1d_g == vals_1d_max, mask_delta), 2. + (vals_1d_b - vals_1d_r) / vals_1d_delta, vals_1d_h)
+        vals_1d_h = where(logical_and(vals_1d_b == vals_1d_max, mask_delta), 4. + (vals_1d_r - vals_1d_g) / vals_1d_delta, vals_1d_h)
+        vals_1d_h = (vals_1d_h / 6.0) % 1.0
+
+    vals_1d_theta = vals_1d_h*2*pi
+
+    hue_saturation_x_1d = vals_1d_s*cos(vals_1d_theta)
+    hue_saturation_y_1d = vals_1d_s*sin(vals_1d_theta)
+
+    return brightness_1d, hue_saturation_x_1d, hue_saturation_y_1d
@@ -0,0 +1,65 @@
+#
+# For licensing see accompanying LICENSE.txt file.
+# Copyright (C) 2020 Apple Inc. All Rights Reserved.
+#
+
+from pylab import *
+
+
+
+#
+# A dense lookup table that maps integer IDs (e.g., render entity IDs, mesh object IDs, semantic IDs) to
+# values (e.g., other IDs, or colors), built once per scene. Rather than scanning an entire image once per
+# ID, we apply the lookup table to an image with a single vectorized indexing operation. IDs that aren't
+# in the lookup table (including IDs outside the range of the lookup table, e.g., -1) are mapped to
+# invalid_value. Values can be scalars or arrays, e.g., values can be an Nx3 array of RGB colors, in which
+# case applying the lookup table to an HxW image returns an HxWx3 image.
+#
+# Lookup tables can be composed, e.g., if node_lut maps render entity IDs to mesh object IDs, and
+# object_lut maps mesh object IDs to semantic IDs, then node_lut.compose(object_lut) maps render entity
+# IDs directly to semantic IDs. If an ID is mapped to invalid_value by the first lookup table, or to an
+# ID that isn't in the second lookup table, it is mapped to the second lookup table's invalid_value.
+#
+
+class IdLut:
+
+    def __init__(self, ids, values, invalid_value):
+
+        ids    = asarray(ids).astype(int64)
+        values = asarray(values)
+
+        assert ids.ndim == 1
+        assert ids.shape[0] == values.shape[0]
+        assert unique(ids).shape[0] == ids.shape[0]
+
+        if ids.shape[0] > 0:
+            self.id_min = np.min(ids)
+            self.id_max = np.max(ids)
+        else:
+            self.id_min = 0
+            self.id_max = -1
+
+        self.ids           = ids
+        self.values        = values
+        self.invalid_value = invalid_value
+
+        # the last entry in our lookup table is always invalid_value, and all IDs that aren't in the lookup
+        # table are mapped to this entry
+        num_entries = self.id_max - self.id_min + 1
+
+        self.lut                    = empty((num_entries+1,) + values.shape[1:], dtype=values.dtype)
+        self.lut[:]                 = invalid_value
+        self.lut[ids - self.id_min] = values
+        self.num_entries            = num_entries
+
+    def apply(self, ids):
+
+        ids = asarray(ids)
+
+        lut_indices = ids.astype(int64) - self.id_min
+        lut_indices[logical_or(lut_indices < 0, lut_indices >= self.num_entries)] = self.num_entries
+
+        return self.lut[lut_indices]
+
+    def compose(self, other):
+        return IdLut(self.ids, other.apply(self.values), other.invalid_value)
@@ -0,0 +1,272 @@
+#
+# For licensing see accompanying LICENSE.txt file.
+# Copyright (C) 2020 Apple Inc. All Rights Reserved.
+#
+
+from pylab import *
+
+import h5py
+import io
+import os
+import pandas as pd
+
+
+
+#
+# Group the elements of keys by value in a single pass, in CSR style. Returns the sorted unique keys,
+# an array of offsets, and an array of element indices sorted by key, such that the elements with key
+# unique_keys[i] are given by order[offsets[i]:offsets[i+1]]. The elements within each group remain in
+# their original order. Elements whose key is equal to ignore_value are excluded from all groups.
+#
+
+def group_by(keys, ignore_value=None):
+
+    keys  = asarray(keys).ravel()
+    order = argsort(keys, kind="stable")
+
+    if ignore_value is not None:
+        order = order[keys[order] != ignore_value]
+
+    if order.shape[0] == 0:
+        return keys[order], zeros(1, dtype=int64), order
+
+    keys_sorted = keys[order]
+    boundaries  = where(keys_sorted[1:] != keys_sorted[:-1])[0] + 1
+    unique_keys = keys_sorted[r_[0, boundaries]]
+    offsets     = r_[0, boundaries, keys_sorted.shape[0]].astype(int64)
+
+    return unique_keys, offsets, order
+
+
+
+#
+# A face-to-semantic-instance index for a mesh, built once per scene. Rather than scanning all the faces
+# in the mesh once per semantic instance, we sort the faces by semantic instance ID once, after which
+# the faces for each semantic instance can be looked up in constant time. Faces that don't belong to a
+# semantic instance (i.e., whose semantic instance ID is -1) are excluded from the index.
+#
+
+class MeshInstanceIndex:
+
+    def __init__(self, mesh_faces_oi, mesh_objects_sii):
+
+        mesh_objects_sii = asarray(mesh_objects_sii).ravel()
+        mesh_faces_sii   = mesh_objects_sii[asarray(mesh_faces_oi).ravel()]
+
+        self.sii, self.face_offsets, self.face_order = group_by(mesh_faces_sii, ignore_value=-1)
+        self.num_instances = self.sii.shape[0]
+
+    def get_faces(self, i):
+        return self.face_order[self.face_offsets[i]:self.face_offsets[i+1]]
+
+    # Returns the vertices for the faces of all semantic instances stacked into a single array, along with
+    # an array of offsets, such that the vertices for semantic instance sii[i] are given by
+    # vertices[offsets[i]:offsets[i+1]]. As in our original per-instance code, vertices are duplicated
+    # once per face that references them.
+    def get_face_vertices(self, mesh_vertices, mesh_faces_vi):
+
+        mesh_faces_vi = asarray(mesh_faces_vi)
+        vertices      = asarray(mesh_vertices)[mesh_faces_vi[self.face_order].ravel()]
+        offsets       = self.face_offsets*mesh_faces_vi.shape[1]
+
+        return vertices, offsets
+
+
+
+#
+# Compute axis-aligned bounding boxes for groups of points stacked into a single array, where the points
+# for group i are given by points[offsets[i]:offsets[i+1]], in a single vectorized pass. Groups with no
+# points are assigned a bounding box filled with inf.
+#
+
+def compute_axis_aligned_bounding_boxes(points, offsets):
+
+    points  = asarray(points)
+    offsets = asarray(offsets)
+
+    num_groups     = offsets.shape[0] - 1
+    group_nonempty = offsets[1:] > offsets[:-1]
+
+    points_min = np.inf*ones((num_groups,points.shape[1]))
+    points_max = np.inf*ones((num_groups,points.shape[1]))
+
+    if any(group_nonempty):
+        points_min[group_nonempty] = minimum.reduceat(points, offsets[:-1][group_nonempty], axis=0)
+        points_max[group_nonempty] = maximum.reduceat(points, offsets[:-1][group_nonempty], axis=0)
+
+    extents = points_max - points_min
+    centers = points_min + extents/2.0
+
+    extents[~group_nonempty] = np.inf
+    centers[~group_nonempty] = np.inf
+
+    return centers, extents
+
+
+
+#
+# Compute the semantic ID for each semantic instance ID in a single vectorized pass. Returns the sorted
+# unique semantic instance IDs (excluding -1), the corresponding semantic IDs, and the number of distinct
+# semantic IDs (excluding -1) that appear within each semantic instance. If a semantic instance has no
+# semantic ID, or more than one semantic ID, its semantic ID is set to -1.
+#
+
+def compute_semantic_instance_to_semantic_id_map(mesh_objects_sii, mesh_objects_si):
+
+    mesh_objects_sii = asarray(mesh_objects_sii).ravel()
+    mesh_objects_si  = asarray(mesh_objects_si).ravel()
+
+    sii_unique, offsets, order = group_by(mesh_objects_sii, ignore_value=-1)
+    num_sii_unique             = sii_unique.shape[0]
+
+    group_ids = repeat(arange(num_sii_unique), diff(offsets))
+    si_sorted = mesh_objects_si[order]
+    si_valid  = si_sorted != -1
+
+    group_id_si_pairs = unique(c_[group_ids[si_valid], si_sorted[si_valid]].astype(int64), axis=0)
+    num_si            = bincount(group_id_si_pairs[:,0], minlength=num_sii_unique)
+
+    si = -ones(num_sii_unique, dtype=int64)
+    group_id_si_pairs_unambiguous = group_id_si_pairs[num_si[group_id_si_pairs[:,0]] == 1]
+    si[group_id_si_pairs_unambiguous[:,0]] = group_id_si_pairs_unambiguous[:,1]
+
+    return sii_unique, si, num_si
+
+
+
+#
+# Each scene's mesh can optionally be stored in a single container file (mesh.hdf5), in addition to the
+# separate per-array HDF5 files written by generate_mesh_from_obj.py. The container stores all arrays
+# uncompressed with a contiguous layout, using compact dtypes (float64 coordinates, int32 indices, and
+# int16 or int32 object, group, and material IDs), along with the object, group, and material tables
+# that are otherwise stored in separate CSV files. Since each array is contiguous and uncompressed, it
+# can be memory-mapped directly from the container file, so loading a mesh is nearly instant, and the
+# mesh data is shared across processes via the OS page cache.
+#
+
+mesh_container_file_name = "mesh.hdf5"
+
+mesh_container_array_names = ["vertices", "texcoords", "normals", "faces_vi", "faces_vti", "faces_vni", "faces_oi", "faces_gi", "faces_mi"]
+
+
+
+def save_mesh_container(mesh_container_file, arrays, object_names, group_names, df_materials):
+
+    with h5py.File(mesh_container_file, "w") as f:
+
+        for name in mesh_container_array_names:
+            data = asarray(arrays[name])
+            if name in ["faces_vi", "faces_vti", "faces_vni"]:
+                data = _to_compact_int_dtype(data, [int32])
+            if name in ["faces_oi", "faces_gi", "faces_mi"]:
+                data = _to_compact_int_dtype(data, [int16, int32])
+            f.create_dataset(name, data=data)
+
+        string_dtype = h5py.string_dtype(encoding="utf-8")
+        f.create_dataset("object_names",           data=array(object_names, dtype=object), dtype=string_dtype)
+        f.create_dataset("group_names",            data=array(group_names,  dtype=object), dtype=string_dtype)
+        f.create_dataset("metadata_materials_csv", data=df_materials.to_csv(index=False), dtype=string_dtype)
+
+
+
+#
+# Load one or more arrays for a scene's mesh. If the scene has a mesh container, arrays are memory-mapped
+# from the container lazily, i.e., no data is read until the returned arrays are accessed. Otherwise, we
+# fall back to reading our separate per-array HDF5 files. We also fall back to separate files for arrays
+# that aren't stored in the container (e.g., objects_sii and objects_si, which are generated later by
+# our Scene Annotation Tool), and for arrays whose separate file is newer than the container, i.e., the
+# container is stale. Returns a list of arrays in the same order as names.
+#
+
+def load_mesh_arrays(mesh_dir, names, mmap=True):
+
+    mesh_container_file = os.path.join(mesh_dir, mesh_container_file_name)
+
+    arrays = []
+    for name in names:
+        if _use_mesh_container(mesh_dir, name):
+            arrays.append(_load_mesh_container_array(mesh_container_file, name, mmap))
+        else:
+            with h5py.File(os.path.join(mesh_dir, _get_mesh_array_file_name(name)), "r") as f: arrays.append(f["dataset"][:])
+
+    return arrays
+
+
+
+# Return the files that load_mesh_arrays(mesh_dir, names) reads from, e.g., to check if they have changed.
+def get_mesh_array_files(mesh_dir, names):
+
+    mesh_container_file = os.path.join(mesh_dir, mesh_container_file_name)
+
+    files = []
+    for name in names:
+        if _use_mesh_container(mesh_dir, name):
+            file = mesh_container_file
+        else:
+            file = os.path.join(mesh_dir, _get_mesh_array_file_name(name))
+        if file not in files:
+            files.append(file)
+
+    return files
+
+
+
+def load_mesh_container_tables(mesh_dir):
+
+    with h5py.File(os.path.join(mesh_dir, mesh_container_file_name), "r") as f:
+        object_names           = [ s.decode("utf-8") for s in f["object_names"][:] ]
+        group_names            = [ s.decode("utf-8") for s in f["group_names"][:] ]
+        metadata_materials_csv = f["metadata_materials_csv"][()].decode("utf-8")
+
+    df_materials = pd.read_csv(io.StringIO(metadata_materials_csv))
+
+    return object_names, group_names, df_materials
+
+
+
+def _get_mesh_array_file_name(name):
+
+    # NOTE: generate_mesh_from_obj.py historically writes faces_vni to mesh_faces_vti.hdf5 and vice versa
+    return {"faces_vti": "mesh_faces_vni.hdf5", "faces_vni": "mesh_faces_vti.hdf5"}.get(name, "mesh_" + name + ".hdf5")
+
+
+
+def _use_mesh_container(mesh_dir, name):
+
+    mesh_container_file = os.path.join(mesh_dir, mesh_container_file_name)
+    mesh_array_file     = os.path.join(mesh_dir, _get_mesh_array_file_name(name))
+
+    if not os.path.exists(mesh_container_file) or name not in mesh_container_array_names:
+        return False
+
+    # generate_mesh_from_obj.py writes the container after the separate files
+    return not os.path.exists(mesh_array_file) or os.path.getmtime(mesh_container_file) >= os.path.getmtime(mesh_array_file)
+
+
+
+def _load_mesh_container_array(mesh_container_file, name, mmap):
+
+    with h5py.File(mesh_container_file, "r") as f:
+        dataset = f[name]
+        offset  = dataset.id.get_offset()
+        dtype   = dataset.dtype
+        shape   = dataset.shape
+
+        # empty arrays have no storage, and non-contiguous datasets can't be memory-mapped
+        if not mmap or offset is None or dataset.chunks is not None or dataset.compression is not None:
+            return dataset[()]
+
+    return memmap(mesh_container_file, dtype=dtype, mode="r", offset=offset, shape=shape)
+
+
+
+def _to_compact_int_dtype(data, dtypes):
+
+    if data.size == 0:
+        return data.astype(dtypes[0])
+
+    for dtype in dtypes:
+        if np.min(data) >= iinfo(dtype).min and np.max(data) <= iinfo(dtype).max:
+            return data.astype(dtype)
+
+    return data
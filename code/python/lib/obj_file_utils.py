@@ -5,8 +5,10 @@
 
 from pylab import *
 
+import itertools
 import os
 import pandas as pd
+import warnings
 
 
 
@@ -66,7 +68,101 @@ def load_mtl_file(filename):
 
 
 
-def load_obj_file(filename):
+#
+# Our fast OBJ loader produces identical outputs to our original line-by-line loader (which we keep
+# as a reference implementation in _load_obj_file_reference), but is much faster and uses much less
+# memory on large files. Rather than dispatching on each line in Python, we split the file into large
+# chunks at line boundaries, and parse each run of consecutive "v", "vt", "vn", or "f" lines in each
+# chunk with a handful of vectorized NumPy operations into compact typed arrays (i.e., float64 for
+# coordinates and int32 for indices). Object, group, and material names are interned to integer IDs as
+# they are encountered, so we never store any strings per face. Any line that doesn't have the expected
+# layout (e.g., faces that aren't triangles) falls back to line-by-line parsing with the same error
+# handling as our reference implementation.
+#
+# Since each chunk is parsed independently, chunks can be parsed in parallel with n_jobs workers.
+# Faces that appear in a chunk before any "o", "g", or "usemtl" statement inherit the current object,
+# group, or material from the end of the previous chunk, and per-chunk name IDs are remapped to global
+# IDs (in order of first appearance) when we merge the chunks.
+#
+
+def load_obj_file(filename, use_reference_implementation=False, n_jobs=1, chunk_size_bytes=32*1024*1024):
+
+    if use_reference_implementation:
+        return _load_obj_file_reference(filename)
+
+    class obj_file:
+
+        def __init__(self, filename):
+
+            print("[HYPERSIM: OBJ_FILE_UTILS] Begin load_obj_file...")
+            print("[HYPERSIM: OBJ_FILE_UTILS] Parsing " + filename + "...")
+
+            chunk_ranges = _get_obj_file_chunk_ranges(filename, chunk_size_bytes)
+
+            if n_jobs == 1:
+                chunks = [ _parse_obj_file_chunk(filename, begin, end) for begin, end in chunk_ranges ]
+            else:
+                from joblib import Parallel, delayed
+                chunks = Parallel(n_jobs=n_jobs)(delayed(_parse_obj_file_chunk)(filename, begin, end) for begin, end in chunk_ranges)
+
+            print("[HYPERSIM: OBJ_FILE_UTILS] Loading material files...")
+
+            self.material_file_data = {}
+            self.material_param_map = {}
+
+            for material_file in itertools.chain.from_iterable([ c.material_files for c in chunks ]):
+                material_file_data = load_mtl_file(os.path.dirname(os.path.abspath(filename)) + "/" + material_file)
+                self.material_file_data[material_file] = material_file_data
+                self.material_param_map.update(material_file_data.material_param_map)
+
+            print("[HYPERSIM: OBJ_FILE_UTILS] Merging object names, group names, and material names...")
+
+            object_name_id_map   = {}
+            group_name_id_map    = {}
+            material_name_id_map = {}
+
+            faces_oi = []
+            faces_gi = []
+            faces_mi = []
+
+            # the state at the beginning of the file is always null
+            oi_curr, gi_curr, mi_curr = -1, -1, -1
+
+            for c in chunks:
+                faces_oi_, oi_curr = _merge_obj_file_chunk_name_ids(c.object_names,   c.faces_oi_runs, c.faces_run_lengths, c.oi_end, object_name_id_map,   oi_curr)
+                faces_gi_, gi_curr = _merge_obj_file_chunk_name_ids(c.group_names,    c.faces_gi_runs, c.faces_run_lengths, c.gi_end, group_name_id_map,    gi_curr)
+                faces_mi_, mi_curr = _merge_obj_file_chunk_name_ids(c.material_names, c.faces_mi_runs, c.faces_run_lengths, c.mi_end, material_name_id_map, mi_curr)
+                faces_oi.append(faces_oi_)
+                faces_gi.append(faces_gi_)
+                faces_mi.append(faces_mi_)
+
+            self.object_names   = list(object_name_id_map.keys())
+            self.group_names    = list(group_name_id_map.keys())
+            self.material_names = list(material_name_id_map.keys())
+
+            print("[HYPERSIM: OBJ_FILE_UTILS] Constructing numpy arrays...")
+
+            # match the dtypes and shapes produced by our reference implementation, including for empty arrays
+            self.vertices  = _concatenate_obj_file_arrays([ c.vertices  for c in chunks ], float64)
+            self.texcoords = _concatenate_obj_file_arrays([ c.texcoords for c in chunks ], float64)
+            self.normals   = _concatenate_obj_file_arrays([ c.normals   for c in chunks ], float64)
+            self.faces_oi  = _concatenate_obj_file_arrays(faces_oi, int64)
+            self.faces_gi  = _concatenate_obj_file_arrays(faces_gi, int64)
+            self.faces_mi  = _concatenate_obj_file_arrays(faces_mi, int64)
+            self.faces_vi  = _concatenate_obj_file_arrays([ c.faces_vi  for c in chunks ], int64) - 1
+            self.faces_vti = _concatenate_obj_file_arrays([ c.faces_vti for c in chunks ], int64) - 1
+            self.faces_vni = _concatenate_obj_file_arrays([ c.faces_vni for c in chunks ], int64) - 1
+
+            print("[HYPERSIM: OBJ_FILE_UTILS] Finished.")
+
+        def __repr__(self):
+            return _obj_file_repr(self)
+
+    return obj_file(filename)
+
+
+
+def _load_obj_file_reference(filename):
     
     class obj_file:
 
@@ -308,23 +404,403 @@ def load_obj_file(filename):
             print("[HYPERSIM: OBJ_FILE_UTILS] Finished.")
 
         def __repr__(self):
-            
-            _str = ""
-            _str = _str + "material_file_data\n" + str(self.material_file_data) + "\n"
-            _str = _str + "object_names\n"       + str(self.object_names)       + "\n"
-            _str = _str + "group_names\n"        + str(self.group_names)        + "\n"
-            _str = _str + "material_names\n"     + str(self.material_names)     + "\n"
-            _str = _str + "material_param_map\n" + str(self.material_param_map) + "\n"
-            _str = _str + "vertices\n"           + str(self.vertices.dtype)     + "\n" + str(self.vertices.shape)  + "\n" + str(self.vertices)  + "\n"
-            _str = _str + "texcoords\n"          + str(self.texcoords.dtype)    + "\n" + str(self.texcoords.shape) + "\n" + str(self.texcoords) + "\n"
-            _str = _str + "normals\n"            + str(self.normals.dtype)      + "\n" + str(self.normals.shape)   + "\n" + str(self.normals)   + "\n"
-            _str = _str + "faces_oi\n"           + str(self.faces_oi.dtype)     + "\n" + str(self.faces_oi.shape)  + "\n" + str(self.faces_oi)  + "\n"
-            _str = _str + "faces_gi\n"           + str(self.faces_gi.dtype)     + "\n" + str(self.faces_gi.shape)  + "\n" + str(self.faces_gi)  + "\n"
-            _str = _str + "faces_mi\n"           + str(self.faces_mi.dtype)     + "\n" + str(self.faces_mi.shape)  + "\n" + str(self.faces_mi)  + "\n"
-            _str = _str + "faces_vi\n"           + str(self.faces_vi.dtype)     + "\n" + str(self.faces_vi.shape)  + "\n" + str(self.faces_vi)  + "\n"
-            _str = _str + "faces_vti\n"          + str(self.faces_vti.dtype)    + "\n" + str(self.faces_vti.shape) + "\n" + str(self.faces_vti) + "\n"
-            _str = _str + "faces_vni\n"          + str(self.faces_vni.dtype)    + "\n" + str(self.faces_vni.shape) + "\n" + str(self.faces_vni) + "\n"
-
-            return _str
+            return _obj_file_repr(self)
 
     return obj_file(filename)
+
+
+
+def _obj_file_repr(obj_file):
+
+    _str = ""
+    _str = _str + "material_file_data\n" + str(obj_file.material_file_data) + "\n"
+    _str = _str + "object_names\n"       + str(obj_file.object_names)       + "\n"
+    _str = _str + "group_names\n"        + str(obj_file.group_names)        + "\n"
+    _str = _str + "material_names\n"     + str(obj_file.material_names)     + "\n"
+    _str = _str + "material_param_map\n" + str(obj_file.material_param_map) + "\n"
+    _str = _str + "vertices\n"           + str(obj_file.vertices.dtype)     + "\n" + str(obj_file.vertices.shape)  + "\n" + str(obj_file.vertices)  + "\n"
+    _str = _str + "texcoords\n"          + str(obj_file.texcoords.dtype)    + "\n" + str(obj_file.texcoords.shape) + "\n" + str(obj_file.texcoords) + "\n"
+    _str = _str + "normals\n"            + str(obj_file.normals.dtype)      + "\n" + str(obj_file.normals.shape)   + "\n" + str(obj_file.normals)   + "\n"
+    _str = _str + "faces_oi\n"           + str(obj_file.faces_oi.dtype)     + "\n" + str(obj_file.faces_oi.shape)  + "\n" + str(obj_file.faces_oi)  + "\n"
+    _str = _str + "faces_gi\n"           + str(obj_file.faces_gi.dtype)     + "\n" + str(obj_file.faces_gi.shape)  + "\n" + str(obj_file.faces_gi)  + "\n"
+    _str = _str + "faces_mi\n"           + str(obj_file.faces_mi.dtype)     + "\n" + str(obj_file.faces_mi.shape)  + "\n" + str(obj_file.faces_mi)  + "\n"
+    _str = _str + "faces_vi\n"           + str(obj_file.faces_vi.dtype)     + "\n" + str(obj_file.faces_vi.shape)  + "\n" + str(obj_file.faces_vi)  + "\n"
+    _str = _str + "faces_vti\n"          + str(obj_file.faces_vti.dtype)    + "\n" + str(obj_file.faces_vti.shape) + "\n" + str(obj_file.faces_vti) + "\n"
+    _str = _str + "faces_vni\n"          + str(obj_file.faces_vni.dtype)    + "\n" + str(obj_file.faces_vni.shape) + "\n" + str(obj_file.faces_vni) + "\n"
+
+    return _str
+
+
+
+def _get_obj_file_chunk_ranges(filename, chunk_size_bytes):
+
+    file_size_bytes = os.path.getsize(filename)
+
+    # move each chunk boundary forward to the beginning of the next line
+    boundaries = [0]
+    with open(filename, "rb") as f:
+        for offset in range(chunk_size_bytes, file_size_bytes, chunk_size_bytes):
+            if offset <= boundaries[-1]:
+                continue
+            f.seek(offset - 1)
+            f.readline()
+            boundaries.append(min(f.tell(), file_size_bytes))
+    if boundaries[-1] < file_size_bytes:
+        boundaries.append(file_size_bytes)
+
+    return [ (boundaries[i], boundaries[i+1]) for i in range(len(boundaries) - 1) ]
+
+
+
+def _concatenate_obj_file_arrays(arrays, dtype):
+
+    arrays = [ a for a in arrays if a.shape[0] > 0 ]
+    if len(arrays) == 0:
+        return array([])
+    return concatenate(arrays, axis=0).astype(dtype)
+
+
+
+def _merge_obj_file_chunk_name_ids(chunk_names, chunk_faces_ids_runs, chunk_faces_run_lengths, chunk_id_end, name_id_map, id_curr):
+
+    # null names are assigned an ID (so they appear in the list of names), but faces that refer to them are assigned -1
+    for name in chunk_names:
+        if name not in name_id_map:
+            name_id_map[name] = len(name_id_map)
+
+    # per-chunk ID -1 means null and -2 means inherited from the previous chunk, so we append these values to our map
+    chunk_id_map = array([ name_id_map[name] for name in chunk_names ] + [id_curr, -1], dtype=int64)
+    faces_ids    = repeat(chunk_id_map[chunk_faces_ids_runs], chunk_faces_run_lengths)
+
+    return faces_ids, chunk_id_map[chunk_id_end]
+
+
+
+class _ObjFileChunk:
+
+    def __init__(self):
+
+        self.vertices  = []
+        self.texcoords = []
+        self.normals   = []
+        self.faces_vi  = []
+        self.faces_vti = []
+        self.faces_vni = []
+
+        self.material_files = []
+
+        # per-chunk name IDs index into these lists, with -1 meaning null and -2 meaning inherited from the previous chunk
+        self.object_names   = []
+        self.group_names    = []
+        self.material_names = []
+
+        self._object_name_id_map   = {}
+        self._group_name_id_map    = {}
+        self._material_name_id_map = {}
+
+        self._oi_curr, self._gi_curr, self._mi_curr = -2, -2, -2
+
+        # run-length encoded per-face object, group, and material IDs
+        self.faces_oi_runs     = []
+        self.faces_gi_runs     = []
+        self.faces_mi_runs     = []
+        self.faces_run_lengths = []
+
+    # Our parser operates directly on the raw bytes in each chunk. We find the line boundaries and token
+    # boundaries in the chunk with vectorized NumPy operations, classify each line according to its
+    # keyword and layout, and then parse each run of consecutive lines with the same classification in
+    # a single call to NumPy's C text parser. Lines that we can't classify (e.g., "o", "g", and "usemtl"
+    # statements, comments, malformed lines, and lines with non-ASCII characters) are parsed one at a
+    # time by _parse_line.
+    def parse(self, data):
+
+        b_padded = frombuffer(data + b"\n\0\0", dtype=uint8)
+        b        = b_padded[:-2]
+
+        # str.split() treats all of these characters as whitespace
+        whitespace_lut = zeros(256, dtype=bool)
+        whitespace_lut[[9, 11, 12, 13, 28, 29, 30, 31, 32]] = True
+
+        is_newline   = b == ord("\n")
+        is_separator = whitespace_lut[b] | is_newline
+
+        newline_pos = flatnonzero(is_newline)
+        num_lines   = newline_pos.shape[0]
+        line_begin  = r_[0, newline_pos[:-1] + 1]
+        line_end    = newline_pos
+
+        token_begin_pos = flatnonzero(~is_separator & r_[True, is_separator[:-1]])
+        num_tokens      = token_begin_pos.shape[0]
+        tokens_per_line = bincount(searchsorted(newline_pos, token_begin_pos), minlength=num_lines)
+        line_token      = r_[0, cumsum(tokens_per_line)[:-1]]
+
+        slash_pos               = flatnonzero(b == ord("/"))
+        slashes_per_token       = bincount(searchsorted(token_begin_pos, slash_pos, side="right") - 1, minlength=num_tokens)
+        double_slash_pos        = slash_pos[b[slash_pos + 1] == ord("/")]
+        double_slashes_per_line = bincount(searchsorted(newline_pos, double_slash_pos), minlength=num_lines)
+
+        non_ascii_per_line = bincount(searchsorted(newline_pos, flatnonzero(b >= 128)), minlength=num_lines)
+
+        # keywords must begin at the start of the line and be followed by whitespace
+        c0 = b_padded[line_begin]
+        c1 = b_padded[line_begin + 1]
+        c2 = b_padded[line_begin + 2]
+
+        is_v  = (c0 == ord("v")) & whitespace_lut[c1]
+        is_vt = (c0 == ord("v")) & (c1 == ord("t")) & whitespace_lut[c2]
+        is_vn = (c0 == ord("v")) & (c1 == ord("n")) & whitespace_lut[c2]
+        is_f  = (c0 == ord("f")) & whitespace_lut[c1]
+
+        # all vertices in a face must have the same layout, i.e., v1 or v1/vt1 or v1//vn1 or v1/vt1/vn1
+        is_f_                = is_f & (tokens_per_line == 4)
+        face_line_token      = line_token[is_f_]
+        face_slashes         = c_[slashes_per_token[face_line_token + 1], slashes_per_token[face_line_token + 2], slashes_per_token[face_line_token + 3]]
+        face_slashes_uniform = all(face_slashes == face_slashes[:,0:1], axis=1)
+        face_slashes_        = -ones(num_lines, dtype=int64)
+        face_slashes_[is_f_] = where(face_slashes_uniform, face_slashes[:,0], -1)
+
+        line_kind = zeros(num_lines, dtype=int64)
+        line_kind[is_v  & (tokens_per_line == 4)]                        = 1
+        line_kind[is_vn & (tokens_per_line == 4)]                        = 2
+        line_kind[is_vt & (tokens_per_line == 3)]                        = 3
+        line_kind[is_vt & (tokens_per_line == 4)]                        = 4
+        line_kind[(face_slashes_ == 0)]                                  = 5 # v1
+        line_kind[(face_slashes_ == 1)]                                  = 6 # v1/vt1
+        line_kind[(face_slashes_ == 2) & (double_slashes_per_line == 3)] = 7 # v1//vn1
+        line_kind[(face_slashes_ == 2) & (double_slashes_per_line == 0)] = 8 # v1/vt1/vn1
+        line_kind[non_ascii_per_line > 0]                                = 0
+
+        run_boundaries = r_[0, flatnonzero(diff(line_kind)) + 1, num_lines]
+
+        for ri in range(run_boundaries.shape[0] - 1):
+
+            run_line_begin, run_line_end = run_boundaries[ri], run_boundaries[ri+1]
+            run_kind  = line_kind[run_line_begin]
+            run_bytes = b[line_begin[run_line_begin]:line_end[run_line_end-1]+1]
+            parsed    = False
+
+            if run_kind > 0:
+                keyword_pos = line_begin[run_line_begin:run_line_end] - line_begin[run_line_begin]
+                parsed      = self._parse_run(run_bytes, keyword_pos, run_kind, run_line_end - run_line_begin)
+
+            if not parsed:
+                for line in run_bytes.tobytes().decode("utf-8").split("\n")[:-1]:
+                    self._parse_line(line)
+
+        self._finalize()
+
+        return self
+
+    def _parse_run(self, run_bytes, keyword_pos, run_kind, num_lines):
+
+        keyword_length = {1: 1, 2: 2, 3: 2, 4: 2, 5: 1, 6: 1, 7: 1, 8: 1}[run_kind]
+
+        run_bytes = run_bytes.copy()
+        for i in range(keyword_length):
+            run_bytes[keyword_pos + i] = ord(" ")
+        if run_kind >= 5:
+            run_bytes[run_bytes == ord("/")] = ord(" ")
+
+        # NumPy's text parser silently stops at the first value it can't parse, so we treat any warning as a
+        # parse error and check that we got the expected number of values
+        num_values = {1: 3, 2: 3, 3: 2, 4: 3, 5: 3, 6: 6, 7: 6, 8: 9}[run_kind]
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("error")
+                values = fromstring(run_bytes.tobytes(), dtype=float64 if run_kind < 5 else int64, sep=" ")
+        except (ValueError, DeprecationWarning):
+            return False
+        if values.shape[0] != num_lines*num_values:
+            return False
+        if run_kind >= 5:
+            if any(values < iinfo(int32).min) or any(values > iinfo(int32).max):
+                return False
+            values = values.astype(int32)
+        values = values.reshape(num_lines, num_values)
+
+        if run_kind == 1:
+            self.vertices.append(values)
+        if run_kind == 2:
+            self.normals.append(values)
+        if run_kind in [3, 4]:
+            # HACK: if 3 texture coordinates are exported in the obj file, only the first 2 are stored
+            self.texcoords.append(values[:,0:2])
+
+        if run_kind >= 5:
+            # OBJ files are 1-indexed, so 0 is equivalent to assigning null
+            layout           = {5: [0], 6: [0, 1], 7: [0, 2], 8: [0, 1, 2]}[run_kind]
+            faces_vi_vti_vni = zeros((num_lines, 3, 3), dtype=int32)
+            faces_vi_vti_vni[:,:,layout] = values.reshape(num_lines, 3, len(layout))
+            self._append_faces(faces_vi_vti_vni[:,:,0], faces_vi_vti_vni[:,:,1], faces_vi_vti_vni[:,:,2])
+
+        return True
+
+    def _append_faces(self, faces_vi, faces_vti, faces_vni):
+
+        # store indices compactly, unless they don't fit in 32 bits
+        faces_vi_vti_vni = [faces_vi, faces_vti, faces_vni]
+        if all([ np.min(f) >= iinfo(int32).min and np.max(f) <= iinfo(int32).max for f in faces_vi_vti_vni ]):
+            faces_vi, faces_vti, faces_vni = [ f.astype(int32) for f in faces_vi_vti_vni ]
+
+        self.faces_vi.append(faces_vi)
+        self.faces_vti.append(faces_vti)
+        self.faces_vni.append(faces_vni)
+
+        state = (self._oi_curr, self._gi_curr, self._mi_curr)
+        if len(self.faces_run_lengths) > 0 and self._faces_run_state == state:
+            self.faces_run_lengths[-1] += faces_vi.shape[0]
+        else:
+            self.faces_oi_runs.append(self._oi_curr)
+            self.faces_gi_runs.append(self._gi_curr)
+            self.faces_mi_runs.append(self._mi_curr)
+            self.faces_run_lengths.append(faces_vi.shape[0])
+            self._faces_run_state = state
+
+    def _finalize(self):
+
+        self.vertices  = concatenate(self.vertices,  axis=0) if len(self.vertices)  > 0 else zeros((0,3))
+        self.texcoords = concatenate(self.texcoords, axis=0) if len(self.texcoords) > 0 else zeros((0,2))
+        self.normals   = concatenate(self.normals,   axis=0) if len(self.normals)   > 0 else zeros((0,3))
+        self.faces_vi  = concatenate(self.faces_vi,  axis=0) if len(self.faces_vi)  > 0 else zeros((0,3), dtype=int32)
+        self.faces_vti = concatenate(self.faces_vti, axis=0) if len(self.faces_vti) > 0 else zeros((0,3), dtype=int32)
+        self.faces_vni = concatenate(self.faces_vni, axis=0) if len(self.faces_vni) > 0 else zeros((0,3), dtype=int32)
+
+        self.faces_oi_runs     = array(self.faces_oi_runs,     dtype=int64)
+        self.faces_gi_runs     = array(self.faces_gi_runs,     dtype=int64)
+        self.faces_mi_runs     = array(self.faces_mi_runs,     dtype=int64)
+        self.faces_run_lengths = array(self.faces_run_lengths, dtype=int64)
+
+        self.oi_end, self.gi_end, self.mi_end = self._oi_curr, self._gi_curr, self._mi_curr
+
+    def _intern_name(self, name, names, name_id_map, null_name):
+
+        if name not in name_id_map:
+            name_id_map[name] = len(names)
+            names.append(name)
+
+        if name == null_name:
+            return -1
+        return name_id_map[name]
+
+    # parse a single line with the same error handling as our reference implementation
+    def _parse_line(self, line):
+
+        line = line.strip()
+
+        # hack for OBJ files exported from Unreal
+        if line.startswith("#") or line.startswith("\xef\xbb\xbf#"):
+            return
+
+        values = line.split()
+
+        if not values or len(values) == 0:
+            return
+
+        if values[0] in ["mtllib", "matlib"]:
+            self.material_files.append(values[1])
+
+        elif values[0] in ["v", "vn"]:
+            if len(values) == 4:
+                try:
+                    vertex = [float(values[1]), float(values[2]), float(values[3])]
+                except ValueError:
+                    print("[HYPERSIM: OBJ_FILE_UTILS] ERROR: Couldn't parse: " + " ".join(values))
+                    vertex = [0.0,0.0,0.0]
+            else:
+                print("[HYPERSIM: OBJ_FILE_UTILS] ERROR: Couldn't parse: " + " ".join(values))
+                vertex = [0.0,0.0,0.0]
+            (self.vertices if values[0] == "v" else self.normals).append(array([vertex], dtype=float64))
+
+        elif values[0] == "vt":
+            if len(values) == 3 or len(values) == 4:
+                try:
+                    vertex_texcoords = [float(values[1]), float(values[2])]
+                except ValueError:
+                    print("[HYPERSIM: OBJ_FILE_UTILS] ERROR: Couldn't parse: " + " ".join(values))
+                    vertex_texcoords = [0.0,0.0]
+            else:
+                print("[HYPERSIM: OBJ_FILE_UTILS] ERROR: Couldn't parse: " + " ".join(values))
+                vertex_texcoords = [0.0,0.0]
+            self.texcoords.append(array([vertex_texcoords], dtype=float64))
+
+        elif values[0] == "o":
+            self._oi_curr = self._intern_name(values[1], self.object_names, self._object_name_id_map, "_NULL_OBJECT")
+
+        elif values[0] == "g":
+            self._gi_curr = self._intern_name(values[1], self.group_names, self._group_name_id_map, "_NULL_GROUP")
+
+        elif values[0] in ("usemtl", "usemat"):
+            self._mi_curr = self._intern_name(values[1], self.material_names, self._material_name_id_map, "_NULL_MATERIAL")
+
+        elif values[0] == "f":
+
+            face_vi  = []
+            face_vti = []
+            face_vni = []
+
+            if len(values) == 4:
+                for v in values[1:4]:
+                    w = v.split("/")
+                    # v1
+                    if len(w) == 1:
+                        face_vi  += _parse_obj_file_ints(w[0:1], values)
+                    # v1/vt1
+                    elif len(w) == 2:
+                        face_vi  += _parse_obj_file_ints(w[0:1], values)
+                        face_vti += _parse_obj_file_ints(w[1:2], values)
+                    # v1//vn1
+                    elif len(w) == 3 and len(w[1]) == 0:
+                        face_vi  += _parse_obj_file_ints(w[0:1], values)
+                        face_vni += _parse_obj_file_ints(w[2:3], values)
+                    # v1/vt1/vn1
+                    elif len(w) == 3 and len(w[1]) > 0:
+                        face_vi  += _parse_obj_file_ints(w[0:1], values)
+                        face_vti += _parse_obj_file_ints(w[1:2], values)
+                        face_vni += _parse_obj_file_ints(w[2:3], values)
+                    else:
+                        print("[HYPERSIM: OBJ_FILE_UTILS] ERROR: Couldn't parse: " + " ".join(values))
+            else:
+                print("[HYPERSIM: OBJ_FILE_UTILS] ERROR: Couldn't parse: " + " ".join(values))
+
+            if len(face_vi) != 3:
+                print("[HYPERSIM: OBJ_FILE_UTILS] ERROR: Couldn't parse: " + " ".join(values))
+                face_vi = [0,0,0] # OBJ files are 1-indexed, so [0,0,0] is equivalent to assigning [null,null,null]
+
+            if len(face_vti) != 3:
+                if len(face_vti) != 0:
+                    print("[HYPERSIM: OBJ_FILE_UTILS] ERROR: Couldn't parse: " + " ".join(values))
+                face_vti = [0,0,0] # OBJ files are 1-indexed, so [0,0,0] is equivalent to assigning [null,null,null]
+
+            if len(face_vni) != 3:
+                if len(face_vni) != 0:
+                    print("[HYPERSIM: OBJ_FILE_UTILS] ERROR: Couldn't parse: " + " ".join(values))
+                face_vni = [0,0,0] # OBJ files are 1-indexed, so [0,0,0] is equivalent to assigning [null,null,null]
+
+            self._append_faces(array([face_vi], dtype=int64), array([face_vti], dtype=int64), array([face_vni], dtype=int64))
+
+        else:
+            print("[HYPERSIM: OBJ_FILE_UTILS] ERROR: Couldn't parse: " + line)
+
+
+
+def _parse_obj_file_ints(values_str, values):
+
+    parsed_values = []
+    for value_str in values_str:
+        try:
+            parsed_values.append(int(value_str))
+        except ValueError:
+            print("[HYPERSIM: OBJ_FILE_UTILS] ERROR: Couldn't parse: " + " ".join(values))
+            parsed_values.append(0)
+
+    return parsed_values
+
+
+
+def _parse_obj_file_chunk(filename, begin, end):
+
+    with open(filename, "rb") as f:
+        f.seek(begin)
+        data = f.read(end - begin)
+
+    return _ObjFileChunk().parse(data)
@@ -5,12 +5,10 @@
 
 from pylab import *
 
-import h5py
-import inspect
 import os
 import scipy.spatial
 
-import path_utils
+import cpp_tool_utils
 import sphere_sampling_utils
 
 
@@ -19,16 +17,6 @@ def generate_octomap(mesh_vertices, mesh_faces_vi, start_camera_positions, octom
 
     if not os.path.exists(tmp_dir): os.makedirs(tmp_dir)
 
-    tmp_mesh_vertices_hdf5_file          = os.path.join(tmp_dir, "_tmp_mesh_vertices.hdf5")
-    tmp_mesh_faces_vi_hdf5_file          = os.path.join(tmp_dir, "_tmp_mesh_faces_vi.hdf5")
-    tmp_start_camera_positions_hdf5_file = os.path.join(tmp_dir, "_tmp_start_camera_positions.hdf5")
-    tmp_ray_directions_hdf5_file         = os.path.join(tmp_dir, "_tmp_ray_directions.hdf5")
-    tmp_ray_neighbor_indices_hdf5_file   = os.path.join(tmp_dir, "_tmp_ray_neighbor_indices.hdf5")
-    tmp_octomap_min_hdf5_file            = os.path.join(tmp_dir, "_tmp_octomap_min.hdf5")
-    tmp_octomap_max_hdf5_file            = os.path.join(tmp_dir, "_tmp_octomap_max.hdf5")
-    tmp_free_space_min_hdf5_file         = os.path.join(tmp_dir, "_tmp_free_space_min.hdf5")
-    tmp_free_space_max_hdf5_file         = os.path.join(tmp_dir, "_tmp_free_space_max.hdf5")
-
     # compute ray directions
     ray_directions = sphere_sampling_utils.generate_evenly_distributed_samples_on_sphere(n_rays)
 
@@ -38,40 +26,29 @@ def generate_octomap(mesh_vertices, mesh_faces_vi, start_camera_positions, octom
     d,i                  = ckdtree.query(pset, k=n_ray_nearest_neighbors)
     ray_neighbor_indices = i
 
-    with h5py.File(tmp_mesh_vertices_hdf5_file,          "w") as f: f.create_dataset("dataset", data=mesh_vertices)
-    with h5py.File(tmp_mesh_faces_vi_hdf5_file,          "w") as f: f.create_dataset("dataset", data=mesh_faces_vi)
-    with h5py.File(tmp_start_camera_positions_hdf5_file, "w") as f: f.create_dataset("dataset", data=start_camera_positions)
-    with h5py.File(tmp_ray_directions_hdf5_file,         "w") as f: f.create_dataset("dataset", data=ray_directions)
-    with h5py.File(tmp_ray_neighbor_indices_hdf5_file,   "w") as f: f.create_dataset("dataset", data=ray_neighbor_indices)
-    with h5py.File(tmp_octomap_min_hdf5_file,            "w") as f: f.create_dataset("dataset", data=octomap_min)
-    with h5py.File(tmp_octomap_max_hdf5_file,            "w") as f: f.create_dataset("dataset", data=octomap_max)
-
-    current_source_path = path_utils.get_current_source_file_path(frame=inspect.currentframe())
-    cpp_bin             = os.path.abspath(os.path.join(current_source_path, "..", "..", "cpp", "bin", "generate_octomap"))
-
-    cmd = \
-        cpp_bin + \
-        " --mesh_vertices_file="          + tmp_mesh_vertices_hdf5_file          + \
-        " --mesh_faces_vi_file="          + tmp_mesh_faces_vi_hdf5_file          + \
-        " --start_camera_positions_file=" + tmp_start_camera_positions_hdf5_file + \
-        " --ray_directions_file="         + tmp_ray_directions_hdf5_file         + \
-        " --ray_neighbor_indices_file="   + tmp_ray_neighbor_indices_hdf5_file   + \
-        " --octomap_min_file="            + tmp_octomap_min_hdf5_file            + \
-        " --octomap_max_file="            + tmp_octomap_max_hdf5_file            + \
-        " --n_iters="                     + str(n_iters)                         + \
-        " --n_voxel_size="                + str(n_voxel_size)                    + \
-        " --octomap_file="                + octomap_file                         + \
-        " --free_space_min_file="         + tmp_free_space_min_hdf5_file         + \
-        " --free_space_max_file="         + tmp_free_space_max_hdf5_file
-        # " --silent"
-    print("")
-    print(cmd)
-    print("")
-    retval = os.system(cmd)
-    assert retval == 0
-
-    with h5py.File(tmp_free_space_min_hdf5_file, "r") as f: free_space_min = matrix(f["dataset"][:]).A1
-    with h5py.File(tmp_free_space_max_hdf5_file, "r") as f: free_space_max = matrix(f["dataset"][:]).A1
+    retval, outputs = cpp_tool_utils.run_cpp_tool(
+        "generate_octomap",
+        tmp_dir=tmp_dir,
+        input_arrays=[
+            ("mesh_vertices_file",          mesh_vertices),
+            ("mesh_faces_vi_file",          mesh_faces_vi),
+            ("start_camera_positions_file", start_camera_positions),
+            ("ray_directions_file",         ray_directions),
+            ("ray_neighbor_indices_file",   ray_neighbor_indices),
+            ("octomap_min_file",            octomap_min),
+            ("octomap_max_file",            octomap_max)],
+        output_arrays=[
+            "free_space_min_file",
+            "free_space_max_file"],
+        params=[
+            ("n_iters",      n_iters),
+            ("n_voxel_size", n_voxel_size),
+            ("octomap_file", octomap_file)],
+            # ("silent",     None)
+        print_cmd=True)
+
+    free_space_min = matrix(outputs["free_space_min_file"]).A1
+    free_space_max = matrix(outputs["free_space_max_file"]).A1
 
     return free_space_min, free_space_max
 
@@ -81,26 +58,211 @@ def generate_octomap_samples(octomap_file, query_positions, tmp_dir):
 
     if not os.path.exists(tmp_dir): os.makedirs(tmp_dir)
 
-    tmp_query_positions_hdf5_file = os.path.join(tmp_dir, "_tmp_query_positions.hdf5")
-    tmp_octomap_samples_hdf5_file = os.path.join(tmp_dir, "_tmp_octomap_samples.hdf5")
+    retval, outputs = cpp_tool_utils.run_cpp_tool(
+        "generate_octomap_samples",
+        tmp_dir=tmp_dir,
+        input_arrays=[("query_positions_file", query_positions)],
+        output_arrays=["output_file"],
+        params=[("octomap_file", octomap_file), ("silent", None)])
 
-    with h5py.File(tmp_query_positions_hdf5_file, "w") as f: f.create_dataset("dataset", data=query_positions)
+    octomap_samples = matrix(outputs["output_file"]).A1
 
-    current_source_path = path_utils.get_current_source_file_path(frame=inspect.currentframe())
-    cpp_bin             = os.path.abspath(os.path.join(current_source_path, "..", "..", "cpp", "bin", "generate_octomap_samples"))
+    return octomap_samples
 
-    cmd = \
-        cpp_bin + \
-        " --octomap_file="         + octomap_file                  + \
-        " --query_positions_file=" + tmp_query_positions_hdf5_file + \
-        " --output_file="          + tmp_octomap_samples_hdf5_file + \
-        " --silent"
-    # print("")
-    # print(cmd)
-    # print("")
-    retval = os.system(cmd)
-    assert retval == 0
 
-    with h5py.File(tmp_octomap_samples_hdf5_file, "r") as f: octomap_samples = matrix(f["dataset"][:]).A1
 
-    return octomap_samples
+#
+# OctomapIndex parses an octomap.bt file once, and answers batched occupancy queries in-process. The
+# query results are identical to generate_octomap_samples(...), i.e., 0 for free space, 1 for occupied
+# space, -1 for unknown space, and -2 for query positions that aren't finite.
+#
+# See https://github.com/OctoMap/octomap/blob/devel/octomap/include/octomap/OccupancyOcTreeBase.hxx for
+# the binary file format. The file contains the nodes of the tree in depth-first order, where each inner
+# node is stored as 2 bytes that encode the state of its 8 children using 2 bits per child: 0 means the
+# child doesn't exist (i.e., unknown space), 1 means the child is a free leaf, 2 means the child is an
+# occupied leaf, and 3 means the child is an inner node that is stored next in the file.
+#
+# We store the leaves of the tree in two array-backed structures. Within the free space bounding box
+# (padded by one voxel), we store a dense int8 grid at leaf resolution, so most queries are a single
+# array lookup. Outside this bounding box, we store the leaves at each depth of the tree in a sorted
+# array of keys, and perform queries using binary search.
+#
+
+class OctomapIndex:
+
+    _tree_depth   = 16
+    _tree_max_val = 32768
+
+    def __init__(self, octomap_file, free_space_min=None, free_space_max=None):
+
+        self.resolution = None
+
+        with open(octomap_file, "rb") as f:
+            while True:
+                line = f.readline()
+                assert line != b""
+                tokens = line.decode("ascii").split()
+                if len(tokens) == 0 or tokens[0].startswith("#"):
+                    continue
+                if tokens[0] == "id":
+                    assert tokens[1] == "OcTree"
+                if tokens[0] == "res":
+                    self.resolution = float(tokens[1])
+                if tokens[0] == "data":
+                    break
+            data = f.read()
+
+        assert self.resolution is not None
+
+        leaf_depths, leaf_keys, leaf_vals = self._parse_binary_data(data)
+
+        # tables of leaves at each depth, sorted by key
+        self._leaf_tables = {}
+        for depth in unique(leaf_depths):
+            mask  = leaf_depths == depth
+            codes = self._encode_keys(leaf_keys[mask], depth)
+            order = argsort(codes)
+            self._leaf_tables[depth] = (codes[order], leaf_vals[mask][order])
+
+        # dense grid within the free space bounding box
+        if free_space_min is None or free_space_max is None:
+            free_mask = leaf_vals == 0
+            if any(free_mask):
+                leaf_sizes     = (1 << (self._tree_depth - leaf_depths[free_mask].astype(int64)))[:,newaxis]
+                grid_key_min   = np.min(leaf_keys[free_mask], axis=0)
+                grid_key_max   = np.max(leaf_keys[free_mask] + leaf_sizes - 1, axis=0)
+            else:
+                grid_key_min   = zeros(3, dtype=int64)
+                grid_key_max   = -ones(3, dtype=int64)
+        else:
+            grid_key_min, _ = self._coords_to_keys(array([free_space_min], dtype=float64))
+            grid_key_max, _ = self._coords_to_keys(array([free_space_max], dtype=float64))
+            grid_key_min    = grid_key_min[0]
+            grid_key_max    = grid_key_max[0]
+
+        self._grid_key_min = np.maximum(grid_key_min - 1, 0)
+        self._grid_key_max = np.minimum(grid_key_max + 1, 2*self._tree_max_val - 1)
+        self._grid         = -ones(np.maximum(self._grid_key_max - self._grid_key_min + 1, 0), dtype=int8)
+
+        for depth in unique(leaf_depths):
+            mask = leaf_depths == depth
+            self._fill_grid(leaf_keys[mask], 1 << (self._tree_depth - int(depth)), leaf_vals[mask])
+
+    def query(self, query_positions):
+
+        query_positions = array(query_positions, dtype=float64).reshape(-1,3)
+        num_queries     = query_positions.shape[0]
+
+        octomap_samples = -ones(num_queries, dtype=int64)
+
+        finite = all(isfinite(query_positions), axis=1)
+        octomap_samples[~finite] = -2
+
+        keys, in_tree = self._coords_to_keys(where(finite[:,newaxis], query_positions, 0.0))
+        in_tree       = logical_and(in_tree, finite)
+        in_grid       = logical_and(in_tree, all(logical_and(keys >= self._grid_key_min, keys <= self._grid_key_max), axis=1))
+        in_tables     = logical_and(in_tree, ~in_grid)
+
+        grid_keys                = keys[in_grid] - self._grid_key_min
+        octomap_samples[in_grid] = self._grid[grid_keys[:,0], grid_keys[:,1], grid_keys[:,2]]
+
+        # each position is contained in at most one leaf, so we can check every depth independently
+        table_indices = where(in_tables)[0]
+        for depth, (codes, vals) in self._leaf_tables.items():
+            if table_indices.shape[0] == 0 or codes.shape[0] == 0:
+                break
+            query_codes = self._encode_keys(keys[table_indices], depth)
+            i           = np.minimum(searchsorted(codes, query_codes), codes.shape[0]-1)
+            found       = codes[i] == query_codes
+            octomap_samples[table_indices[found]] = vals[i[found]]
+            table_indices = table_indices[~found]
+
+        return octomap_samples
+
+    def _parse_binary_data(self, data):
+
+        data = frombuffer(data, dtype=uint8)
+
+        # for each possible 16-bit node value, precompute the list of existing children as (child index, child state) pairs
+        child_states = (arange(65536)[:,newaxis] >> (2*arange(8))[newaxis,:]) & 3
+        children_lut = [ [ (i,s) for i,s in enumerate(child_states[n]) if s != 0 ] for n in range(65536) ]
+
+        leaf_depths = []
+        leaf_keys   = []
+        leaf_vals   = []
+
+        if data.shape[0] == 0:
+            return zeros(0, dtype=uint8), zeros((0,3), dtype=int64), zeros(0, dtype=int8)
+
+        pos        = 0
+        node_stack = [(0,0,0,0)]
+
+        while len(node_stack) > 0:
+
+            depth, kx, ky, kz = node_stack.pop()
+
+            node_val = int(data[pos]) | (int(data[pos+1]) << 8)
+            pos      = pos + 2
+            half     = 1 << (self._tree_depth - 1 - depth)
+            inner    = []
+
+            for i, s in children_lut[node_val]:
+                child = (depth+1, kx + half*(i & 1), ky + half*((i >> 1) & 1), kz + half*((i >> 2) & 1))
+                if s == 3:
+                    inner.append(child)
+                else:
+                    leaf_depths.append(depth+1)
+                    leaf_keys.append(child[1:])
+                    leaf_vals.append(1 if s == 2 else 0)
+
+            # children are stored in order, so push them in reverse order
+            node_stack.extend(inner[::-1])
+
+        return array(leaf_depths, dtype=uint8), array(leaf_keys, dtype=int64).reshape(-1,3), array(leaf_vals, dtype=int8)
+
+    # octomap stores coordinates as float32 (i.e., point3d), and computes keys in float64 using
+    # resolution_factor = 1.0/resolution, so we do the same to get identical keys for coordinates
+    # close to a voxel boundary
+    def _coords_to_keys(self, coords):
+
+        with np.errstate(over="ignore"):
+            keys_float = floor(coords.astype(float32).astype(float64) * (1.0/self.resolution))
+
+        in_tree = all(logical_and(keys_float >= -self._tree_max_val, keys_float < self._tree_max_val), axis=1)
+        keys    = where(in_tree[:,newaxis], keys_float, 0.0).astype(int64) + self._tree_max_val
+
+        return keys, in_tree
+
+    def _encode_keys(self, keys, depth):
+
+        shift = self._tree_depth - int(depth)
+        keys  = keys >> shift
+
+        return keys[:,0] | (keys[:,1] << 16) | (keys[:,2] << 32)
+
+    def _fill_grid(self, leaf_keys, leaf_size, leaf_vals, max_num_voxels_per_batch=2**22):
+
+        # clip each leaf against the grid
+        key_min = np.maximum(leaf_keys, self._grid_key_min)
+        key_max = np.minimum(leaf_keys + leaf_size - 1, self._grid_key_max)
+        mask    = all(key_min <= key_max, axis=1)
+        key_min = key_min[mask] - self._grid_key_min
+        key_max = key_max[mask] - self._grid_key_min
+        vals    = leaf_vals[mask]
+
+        if leaf_size**3 > 512:
+            # large leaves are rare, so we fill them one at a time
+            for k_min, k_max, val in zip(key_min, key_max, vals):
+                self._grid[k_min[0]:k_max[0]+1, k_min[1]:k_max[1]+1, k_min[2]:k_max[2]+1] = val
+            return
+
+        # small leaves are common, so we fill them in batches, discarding offsets that fall outside each clipped leaf
+        offsets    = stack(meshgrid(arange(leaf_size), arange(leaf_size), arange(leaf_size), indexing="ij"), axis=-1).reshape(-1,3)
+        batch_size = max(max_num_voxels_per_batch // offsets.shape[0], 1)
+        for b in range(0, key_min.shape[0], batch_size):
+            k_min = key_min[b:b+batch_size]
+            k_max = key_max[b:b+batch_size]
+            k     = (k_min[:,newaxis,:] + offsets[newaxis,:,:]).reshape(-1,3)
+            valid = all(k <= repeat(k_max, offsets.shape[0], axis=0), axis=1)
+            v     = repeat(vals[b:b+batch_size], offsets.shape[0])
+            self._grid[k[valid,0], k[valid,1], k[valid,2]] = v[valid]
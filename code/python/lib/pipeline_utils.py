@@ -0,0 +1,171 @@
+#
+# For licensing see accompanying LICENSE.txt file.
+# Copyright (C) 2020 Apple Inc. All Rights Reserved.
+#
+
+from pylab import *
+
+import concurrent.futures
+import os
+import pandas as pd
+import subprocess
+import time
+
+
+
+#
+# A Pipeline is a DAG of tasks, where each task is a shell command that depends on zero or more other
+# tasks. We run tasks concurrently on a fixed number of workers (i.e., a global worker budget shared by
+# all stages and all scenes), and a task is launched as soon as all of its dependencies have succeeded.
+# If a task fails, we don't launch any task that depends on it, directly or indirectly, but we continue
+# running all other tasks.
+#
+# We record the state of each task in a small CSV file after each task finishes, so if a run is
+# interrupted or some tasks fail, running the same pipeline again resumes where the previous run
+# stopped, i.e., tasks that previously succeeded are skipped, unless their command has changed, or unless
+# one of their dependencies runs again, because their outputs would be stale otherwise. If force is True,
+# we run all tasks again. Each task writes its output to its own log file in log_dir, because the output
+# from concurrent tasks would otherwise be interleaved.
+#
+
+task_states = ["succeeded", "failed", "blocked", "pending", "skipped"]
+
+
+
+class Pipeline:
+
+    def __init__(self, state_file, log_dir, force=False):
+
+        self.state_file = state_file
+        self.log_dir    = log_dir
+        self.force      = force
+        self.tasks      = {}
+        self.task_ids   = []
+
+        if os.path.exists(self.state_file):
+            self._df_state = pd.read_csv(self.state_file, index_col="task_id", keep_default_na=False)
+        else:
+            self._df_state = pd.DataFrame(columns=["task_id", "status", "cmd", "duration_seconds"]).set_index("task_id")
+
+    def add_task(self, task_id, cmd, cwd, deps=[]):
+
+        assert task_id not in self.tasks
+        for d in deps:
+            assert d in self.tasks # tasks must be added after their dependencies, so the DAG can't have cycles
+
+        self.tasks[task_id] = {"task_id": task_id, "cmd": cmd, "cwd": cwd, "deps": list(deps)}
+        self.task_ids.append(task_id)
+
+    # Returns a DataFrame with one row per task in dependency order, where status is "skipped" for tasks
+    # that already succeeded in a previous run with the same command, and whose dependencies are all
+    # skipped, and "pending" otherwise.
+    def get_plan(self):
+
+        status = self._get_initial_status()
+
+        plan = []
+        for task_id in self.task_ids:
+            task = self.tasks[task_id]
+            plan.append({"task_id": task_id, "status": status[task_id], "deps": ",".join(task["deps"]), "cwd": task["cwd"], "cmd": task["cmd"]})
+
+        return pd.DataFrame(plan, columns=["task_id", "status", "deps", "cwd", "cmd"])
+
+    def run(self, n_jobs):
+
+        assert n_jobs >= 1
+
+        if not os.path.exists(self.log_dir): os.makedirs(self.log_dir)
+
+        status  = self._get_initial_status()
+        futures = {}
+
+        # forget that pending tasks succeeded previously, so they still run if this run is interrupted
+        for task_id in self.task_ids:
+            if status[task_id] == "pending" and task_id in self._df_state.index:
+                self._df_state.loc[task_id, "status"] = "pending"
+        self._save_state()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_jobs) as executor:
+
+            while True:
+
+                # mark pending tasks with a failed or blocked dependency as blocked, and launch pending tasks whose dependencies are all done
+                for task_id in self.task_ids:
+                    if status[task_id] != "pending":
+                        continue
+                    deps_status = [ status[d] for d in self.tasks[task_id]["deps"] ]
+                    if any([ s in ["failed", "blocked"] for s in deps_status ]):
+                        status[task_id] = "blocked"
+                        print("[HYPERSIM: PIPELINE_UTILS] Blocked: " + task_id)
+                    elif all([ s in ["succeeded", "skipped"] for s in deps_status ]) and len(futures) < n_jobs:
+                        status[task_id] = "running"
+                        futures[executor.submit(self._run_task, self.tasks[task_id])] = task_id
+                        print("[HYPERSIM: PIPELINE_UTILS] Launched: " + task_id)
+
+                if len(futures) == 0:
+                    break
+
+                done, not_done = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+
+                for future in done:
+                    task_id                  = futures.pop(future)
+                    retval, duration_seconds = future.result()
+                    status[task_id]          = "succeeded" if retval == 0 else "failed"
+                    self._save_task_state(self.tasks[task_id], status[task_id], duration_seconds)
+                    print("[HYPERSIM: PIPELINE_UTILS] " + status[task_id].capitalize() + ": " + task_id + " (%0.1fs)" % duration_seconds)
+
+        df_status = pd.DataFrame({"task_id": self.task_ids, "status": [ status[t] for t in self.task_ids ]})
+
+        for s in task_states:
+            print("[HYPERSIM: PIPELINE_UTILS] " + s + ": " + str(count_nonzero(df_status["status"] == s)) + " tasks")
+        for dfi in df_status[df_status["status"] == "failed"].itertuples():
+            print("[HYPERSIM: PIPELINE_UTILS] FAILED: " + dfi.task_id + ", see " + self._get_log_file(dfi.task_id))
+
+        return df_status
+
+    def _run_task(self, task):
+
+        time_begin = time.time()
+
+        with open(self._get_log_file(task["task_id"]), "w") as log_file:
+            log_file.write(task["cmd"] + "\n\n")
+            log_file.flush()
+            retval = subprocess.call(task["cmd"], shell=True, cwd=task["cwd"], stdout=log_file, stderr=subprocess.STDOUT, close_fds=True)
+
+        return retval, time.time() - time_begin
+
+    # tasks are added after their dependencies, so we can visit them in order
+    def _get_initial_status(self):
+
+        status = {}
+        for task_id in self.task_ids:
+            task = self.tasks[task_id]
+            if self._succeeded_previously(task) and all([ status[d] == "skipped" for d in task["deps"] ]):
+                status[task_id] = "skipped"
+            else:
+                status[task_id] = "pending"
+
+        return status
+
+    def _succeeded_previously(self, task):
+
+        if self.force or task["task_id"] not in self._df_state.index:
+            return False
+
+        state = self._df_state.loc[task["task_id"]]
+        return state["status"] == "succeeded" and state["cmd"] == task["cmd"]
+
+    def _save_task_state(self, task, status, duration_seconds):
+
+        self._df_state.loc[task["task_id"]] = pd.Series({"status": status, "cmd": task["cmd"], "duration_seconds": duration_seconds})
+        self._save_state()
+
+    def _save_state(self):
+
+        # write to a temporary file and rename it, so an interrupted run never leaves a partially written state file
+        tmp_state_file = self.state_file + ".tmp"
+        self._df_state.to_csv(tmp_state_file, index_label="task_id")
+        os.replace(tmp_state_file, self.state_file)
+
+    def _get_log_file(self, task_id):
+        return os.path.join(self.log_dir, task_id.replace("/", ".") + ".log")
@@ -0,0 +1,199 @@
+#
+# For licensing see accompanying LICENSE.txt file.
+# Copyright (C) 2020 Apple Inc. All Rights Reserved.
+#
+
+from pylab import *
+
+import matplotlib
+import os
+import PIL.Image
+
+
+
+#
+# We generate the following preview images for each frame. Preview images are written as JPG files,
+# except for geometry previews that would be corrupted by JPG compression artifacts, which are written
+# as PNG files. When previews == "minimal", we only generate a tonemapped (i.e., gamma-corrected) color
+# image for each frame, and when previews == "none", we don't generate any preview images.
+#
+
+preview_names = {
+    "geometry": ["color", "gamma", "render_entity_id", "depth_meters", "normal_world", "normal_cam", "normal_bump_world", "normal_bump_cam", "tex_coord"],
+    "final":    ["color", "gamma", "diffuse_reflectance", "diffuse_illumination", "residual", "lambertian", "non_lambertian", "diff"] }
+
+preview_names_minimal = {
+    "geometry": ["gamma"],
+    "final":    ["gamma"] }
+
+_jpg_preview_names = ["color", "gamma", "diffuse_reflectance", "diffuse_illumination", "residual", "lambertian", "non_lambertian", "diff"]
+
+_colormap_luts = {}
+
+
+
+def get_preview_names(render_pass, previews):
+
+    assert render_pass in ["geometry", "final"]
+    assert previews in ["none", "minimal", "all"]
+
+    if previews == "none":
+        return []
+    if previews == "minimal":
+        return preview_names_minimal[render_pass]
+    if previews == "all":
+        return preview_names[render_pass]
+
+
+
+def get_preview_file(preview_dir, file_root, preview_name):
+
+    if preview_name in _jpg_preview_names:
+        return os.path.join(preview_dir, file_root + "." + preview_name + ".jpg")
+    else:
+        return os.path.join(preview_dir, file_root + "." + preview_name + ".png")
+
+
+
+#
+# Generate preview images for a geometry frame, where images is a dictionary of full-precision images
+# that must contain all the images needed for the requested previews, i.e., color (for color and
+# gamma), render_entity_id, depth_meters, normal_world, normal_cam, normal_bump_world, normal_bump_cam,
+# and tex_coord. Invalid pixels in render_entity_id must be set to -1, and render_entity_id_lut must be
+# a lut_utils.IdLut that maps render entity IDs to color values, where invalid IDs are mapped to NaN.
+# Returns a list of (preview_name, data, kwargs) tuples, where kwargs should be passed to save_preview(...).
+#
+
+def generate_geometry_previews(images, preview_names, render_entity_id_lut=None):
+
+    previews = []
+
+    for preview_name in preview_names:
+
+        if preview_name == "color":
+            previews.append((preview_name, clip(images["color"],0,1), {}))
+
+        if preview_name == "gamma":
+            gamma = 1.0/2.2 # standard gamma correction exponent
+            previews.append((preview_name, clip(np.power(np.maximum(images["color"],0), gamma),0,1), {}))
+
+        if preview_name == "render_entity_id":
+            render_entity_id_ = render_entity_id_lut.apply(images["render_entity_id"])
+            previews.append((preview_name, render_entity_id_, {"vmin": np.min(render_entity_id_lut.values), "vmax": np.max(render_entity_id_lut.values), "nearest": True}))
+
+        # ideally we would normalize depth consistently for each scene, but we don't know a good depth range, so don't try to normalize
+        if preview_name == "depth_meters":
+            previews.append((preview_name, images["depth_meters"], {}))
+
+        # normals are already unit-length, but due to occasional numerical artifacts we need to clip anyway
+        if preview_name in ["normal_world", "normal_cam", "normal_bump_world", "normal_bump_cam"]:
+            previews.append((preview_name, clip((images[preview_name] + 1.0)/2.0,0,1), {}))
+
+        if preview_name == "tex_coord":
+            previews.append((preview_name, clip(images["tex_coord"],0,1), {}))
+
+    return previews
+
+
+
+#
+# Generate preview images for a final frame, where images is a dictionary that must contain color,
+# diffuse_reflectance, diffuse_illumination, and residual images.
+#
+
+def generate_final_previews(images, preview_names):
+
+    rgb_color            = images["color"]
+    diffuse_reflectance  = images["diffuse_reflectance"]
+    diffuse_illumination = images["diffuse_illumination"]
+    residual             = images["residual"]
+
+    lambertian     = diffuse_reflectance*diffuse_illumination
+    non_lambertian = lambertian + residual
+    diff           = abs(rgb_color - non_lambertian)
+
+    gamma           = 1.0/2.2 # standard gamma correction exponent
+    rgb_color_gamma = np.power(np.maximum(rgb_color,0), gamma)
+
+    preview_images = {
+        "color":                rgb_color,
+        "gamma":                rgb_color_gamma,
+        "diffuse_reflectance":  diffuse_reflectance,
+        "diffuse_illumination": diffuse_illumination,
+        "residual":             residual,
+        "lambertian":           lambertian,
+        "non_lambertian":       non_lambertian,
+        "diff":                 diff }
+
+    return [ (p, clip(preview_images[p],0,1), {}) for p in preview_names ]
+
+
+
+#
+# Save a preview image directly via PIL, which is much faster than matplotlib's imsave. As with imsave,
+# 2D images are colormapped, where vmin and vmax default to the minimum and maximum finite values in the
+# image, and NaN values are transparent in PNG files. We colormap images with a precomputed 256-entry
+# lookup table, which is equivalent to the quantization performed by matplotlib. 3D images are expected
+# to be in the range [0,1]. If scale != 1.0, the preview image is resized by scale (e.g., scale=0.25
+# generates a thumbnail), using nearest-neighbor resampling if nearest == True, and bilinear resampling
+# otherwise.
+#
+
+def save_preview(preview_file, data, vmin=None, vmax=None, nearest=False, scale=1.0, cmap="viridis"):
+
+    if data.ndim == 2:
+        data_uint8 = _apply_colormap(data, vmin, vmax, cmap)
+    else:
+        assert data.ndim == 3
+        data_uint8 = (nan_to_num(data, nan=0.0)*255.0).astype(uint8)
+
+    if preview_file.endswith(".jpg") and data_uint8.ndim == 3 and data_uint8.shape[2] == 4:
+        data_uint8 = data_uint8[:,:,0:3]
+
+    image = PIL.Image.fromarray(ascontiguousarray(data_uint8))
+
+    if scale != 1.0:
+        width  = int(np.maximum(1, np.round(image.size[0]*scale)))
+        height = int(np.maximum(1, np.round(image.size[1]*scale)))
+        if nearest:
+            image = image.resize((width, height), PIL.Image.NEAREST)
+        else:
+            image = image.resize((width, height), PIL.Image.BILINEAR)
+
+    image.save(preview_file)
+
+
+
+def _apply_colormap(data, vmin, vmax, cmap):
+
+    lut = _get_colormap_lut(cmap)
+
+    finite_mask = isfinite(data)
+    if vmin is None:
+        vmin = np.min(data[finite_mask]) if any(finite_mask) else 0.0
+    if vmax is None:
+        vmax = np.max(data[finite_mask]) if any(finite_mask) else 0.0
+
+    if vmax > vmin:
+        data_normalized = (data.astype(float64) - vmin) / (vmax - vmin)
+    else:
+        data_normalized = zeros_like(data, dtype=float64)
+
+    lut_indices              = clip(floor(nan_to_num(data_normalized, nan=0.0)*lut.shape[0]), 0, lut.shape[0]-1).astype(int32)
+    data_uint8               = lut[lut_indices]
+    data_uint8[~finite_mask] = 0
+
+    return data_uint8
+
+
+
+def _get_colormap_lut(cmap):
+
+    if cmap not in _colormap_luts:
+        try:
+            colormap = matplotlib.colormaps[cmap]
+        except AttributeError:
+            colormap = matplotlib.cm.get_cmap(cmap)
+        _colormap_luts[cmap] = colormap(linspace(0.0, 1.0, 256), bytes=True)
+
+    return _colormap_luts[cmap]
@@ -0,0 +1,287 @@
+#
+# For licensing see accompanying LICENSE.txt file.
+# Copyright (C) 2020 Apple Inc. All Rights Reserved.
+#
+
+from pylab import *
+
+import os
+import pandas as pd
+
+import fingerprint_utils
+import hdf5_utils
+
+
+
+#
+# We compute brightness according to the "CCIR601 YIQ" method, and we use the CGIntrinsics strategy for
+# tonemapping, see [1,2]. We scale each image so its nth percentile brightness value is equal to a desired
+# brightness value after gamma correction.
+# [1] https://github.com/snavely/pbrs_tonemapper/blob/master/tonemap_rgbe.py
+# [2] https://landofinterruptions.co.uk/manyshades
+#
+
+gamma                             = 1.0/2.2   # standard gamma correction exponent
+inv_gamma                         = 1.0/gamma
+percentile                        = 90        # we want this percentile brightness value in the unmodified image...
+brightness_nth_percentile_desired = 0.8       # ...to be this bright after scaling
+
+#
+# We store the scale computed for each frame in a small per-camera table, i.e.,
+# _detail/cam_XX/metadata_tonemap.csv, so other tools can reuse our scales instead of recomputing them.
+# The table has the following columns: file_root (e.g., frame.0000), brightness_nth_percentile (the nth
+# percentile brightness value in the unmodified image, or NaN if the image has no valid pixels), and scale.
+#
+
+tonemap_scales_file_name = "metadata_tonemap.csv"
+
+
+
+#
+# Compute the nth percentile of a 1D array without sorting it. We partition the array around the two
+# ranks that bracket the nth percentile, which takes linear time, and linearly interpolate between them
+# the same way as np.percentile does, so we return exactly the same value as np.percentile(values,
+# percentile).
+#
+
+def compute_percentile(values, percentile):
+
+    values = asarray(values).ravel()
+    assert values.shape[0] > 0
+
+    rank       = (values.shape[0] - 1)*(percentile/100.0)
+    rank_lower = int(floor(rank))
+    rank_upper = int(np.minimum(rank_lower + 1, values.shape[0] - 1))
+
+    values_partitioned = np.partition(values, [rank_lower, rank_upper])
+    value_lower        = values_partitioned[rank_lower]
+    value_upper        = values_partitioned[rank_upper]
+
+    # np.percentile interpolates from whichever end is closer, which is more accurate in floating point
+    t = rank - rank_lower
+    if t >= 0.5:
+        return value_upper - (value_upper - value_lower)*(1.0 - t)
+    else:
+        return value_lower + (value_upper - value_lower)*t
+
+
+
+#
+# Compute the tonemapping scale for an image, where pixels whose render_entity_id is -1 are ignored.
+# Returns the scale and the nth percentile brightness value in the unmodified image.
+#
+
+def compute_tonemap_scale(rgb_color, render_entity_id):
+
+    assert all(render_entity_id != 0)
+
+    valid_mask = render_entity_id != -1
+
+    if count_nonzero(valid_mask) == 0:
+        return 1.0, np.nan # if there are no valid pixels, then set scale to 1.0
+
+    rgb_color_valid  = rgb_color[valid_mask]
+    brightness_valid = 0.3*rgb_color_valid[:,0] + 0.59*rgb_color_valid[:,1] + 0.11*rgb_color_valid[:,2] # "CCIR601 YIQ" method for computing brightness
+
+    eps                               = 0.0001 # if the nth percentile brightness value in the unmodified image is less than this, set the scale to 0.0 to avoid divide-by-zero
+    brightness_nth_percentile_current = compute_percentile(brightness_valid, percentile)
+
+    if brightness_nth_percentile_current < eps:
+        return 0.0, brightness_nth_percentile_current
+
+    # Snavely uses the following expression in the code at https://github.com/snavely/pbrs_tonemapper/blob/master/tonemap_rgbe.py:
+    # scale = np.exp(np.log(brightness_nth_percentile_desired)*inv_gamma - np.log(brightness_nth_percentile_current))
+    #
+    # Our expression below is equivalent, but is more intuitive, because it follows more directly from the expression:
+    # (scale*brightness_nth_percentile_current)^gamma = brightness_nth_percentile_desired
+
+    scale = np.power(brightness_nth_percentile_desired, inv_gamma) / brightness_nth_percentile_current
+
+    return scale, brightness_nth_percentile_current
+
+
+
+def apply_tonemap(rgb_color, scale):
+    return clip(np.power(np.maximum(scale*rgb_color,0), gamma),0,1)
+
+
+
+#
+# A tonemapping work item is a (scene_dir, camera_name, file_root, fingerprint) tuple. Work items are
+# independent of each other, so they can be processed in any order, by any number of processes.
+# Processing a work item writes a tonemapped preview image, and returns a dictionary with the scene_dir,
+# camera_name, file_root, brightness_nth_percentile, scale, and fingerprint for the frame, or None if the
+# frame's images couldn't be loaded.
+#
+# We only return work items for frames whose tonemapped images are out of date, i.e., frames whose color
+# image, render entity ID image, or tonemapping parameters have changed since their tonemapped image was
+# generated, unless force is True. See fingerprint_utils.py for details.
+#
+
+def get_tonemap_work_items(scene_dir, camera_name, force=False):
+
+    images_dir        = os.path.join(scene_dir, "images")
+    in_scene_fileroot = "scene"
+    in_rgb_hdf5_files = os.path.join(images_dir, in_scene_fileroot + "_" + camera_name + "_final_hdf5", "frame.*.color.hdf5")
+    in_filenames      = [ os.path.basename(f) for f in hdf5_utils.get_image_files(in_rgb_hdf5_files) ]
+
+    fingerprints        = get_tonemap_fingerprints(scene_dir, camera_name, force)
+    tonemap_scales_file = get_tonemap_scales_file(scene_dir, camera_name)
+
+    work_items = []
+
+    with hdf5_utils.ImageReader() as image_reader:
+
+        for in_filename in in_filenames:
+
+            file_root = in_filename.replace(".color.hdf5", "")
+
+            in_rgb_hdf5_file, in_render_entity_id_hdf5_file, out_rgb_tm_jpg_file = _get_tonemap_work_item_files(scene_dir, camera_name, file_root)
+
+            # if we can't compute a fingerprint, e.g., because an image is missing, we process the frame anyway, so it is reported by process_tonemap_work_item(...)
+            try:
+                fingerprint = fingerprints.compute(input_images=[in_rgb_hdf5_file, in_render_entity_id_hdf5_file], image_reader=image_reader)
+            except:
+                fingerprint = None
+
+            if fingerprint is None or not fingerprints.is_up_to_date(file_root, fingerprint, output_files=[out_rgb_tm_jpg_file, tonemap_scales_file]):
+                work_items.append((scene_dir, camera_name, file_root, fingerprint))
+
+    print("[HYPERSIM: TONEMAP_UTILS] " + camera_name + ": " + str(len(in_filenames) - len(work_items)) + " of " + str(len(in_filenames)) + " frames are already up to date...")
+
+    return work_items
+
+
+
+def process_tonemap_work_item(work_item, image_reader=None):
+
+    scene_dir, camera_name, file_root, fingerprint = work_item
+
+    in_rgb_hdf5_file, in_render_entity_id_hdf5_file, out_rgb_tm_jpg_file = _get_tonemap_work_item_files(scene_dir, camera_name, file_root)
+    out_preview_dir = os.path.dirname(out_rgb_tm_jpg_file)
+
+    # if image_reader is not None, per-frame and per-trajectory files are kept open across work items
+    if image_reader is not None:
+        load_image = image_reader.load_image
+    else:
+        load_image = hdf5_utils.load_image
+
+    try:
+        rgb_color = load_image(in_rgb_hdf5_file).astype(float32)
+    except:
+        print("[HYPERSIM: TONEMAP_UTILS]")
+        print("[HYPERSIM: TONEMAP_UTILS]")
+        print("[HYPERSIM: TONEMAP_UTILS]")
+        print("[HYPERSIM: TONEMAP_UTILS] WARNING: COULD NOT LOAD COLOR IMAGE: " + in_rgb_hdf5_file + "...")
+        print("[HYPERSIM: TONEMAP_UTILS]")
+        print("[HYPERSIM: TONEMAP_UTILS]")
+        print("[HYPERSIM: TONEMAP_UTILS]")
+        return None
+
+    try:
+        render_entity_id = load_image(in_render_entity_id_hdf5_file).astype(int32)
+    except:
+        print("[HYPERSIM: TONEMAP_UTILS]")
+        print("[HYPERSIM: TONEMAP_UTILS]")
+        print("[HYPERSIM: TONEMAP_UTILS]")
+        print("[HYPERSIM: TONEMAP_UTILS] WARNING: COULD NOT LOAD RENDER ENTITY ID IMAGE: " + in_render_entity_id_hdf5_file + "...")
+        print("[HYPERSIM: TONEMAP_UTILS]")
+        print("[HYPERSIM: TONEMAP_UTILS]")
+        print("[HYPERSIM: TONEMAP_UTILS]")
+        return None
+
+    scale, brightness_nth_percentile = compute_tonemap_scale(rgb_color, render_entity_id)
+    rgb_color_tm                     = apply_tonemap(rgb_color, scale)
+
+    print("[HYPERSIM: TONEMAP_UTILS] Saving output file: " + out_rgb_tm_jpg_file + " (scale=" + str(scale) + ")")
+
+    if not os.path.exists(out_preview_dir): os.makedirs(out_preview_dir, exist_ok=True)
+    imsave(out_rgb_tm_jpg_file, clip(rgb_color_tm,0,1))
+
+    return {"scene_dir": scene_dir, "camera_name": camera_name, "file_root": file_root, "brightness_nth_percentile": brightness_nth_percentile, "scale": scale, "fingerprint": fingerprint}
+
+
+
+# process a batch of work items with a single ImageReader, so consecutive frames from the same camera can share open files
+def process_tonemap_work_items(work_items):
+
+    with hdf5_utils.ImageReader() as image_reader:
+        return [ process_tonemap_work_item(w, image_reader) for w in work_items ]
+
+
+
+#
+# Save the results returned by process_tonemap_work_item(...) to our per-camera tables, and record the
+# fingerprint of each frame in results. Results can come from any number of cameras. Rows for frames that
+# aren't in results are preserved, and rows for frames that are in results are replaced.
+#
+
+def save_tonemap_scales(results):
+
+    results = [ r for r in results if r is not None ]
+    if len(results) == 0:
+        return
+
+    df_results = pd.DataFrame(results)
+
+    for (scene_dir, camera_name), df_camera in df_results.groupby(["scene_dir", "camera_name"], sort=False):
+
+        tonemap_scales_file = get_tonemap_scales_file(scene_dir, camera_name)
+
+        df = df_camera[["file_root", "brightness_nth_percentile", "scale"]]
+        if os.path.exists(tonemap_scales_file):
+            df_existing = pd.read_csv(tonemap_scales_file)
+            df          = pd.concat([df_existing[~df_existing["file_root"].isin(df["file_root"])], df])
+
+        if not os.path.exists(os.path.dirname(tonemap_scales_file)): os.makedirs(os.path.dirname(tonemap_scales_file))
+
+        # write to a temporary file and rename it, so an interrupted run never leaves a partially written table
+        tmp_tonemap_scales_file = tonemap_scales_file + ".tmp"
+        df.sort_values("file_root").to_csv(tmp_tonemap_scales_file, index=False)
+        os.replace(tmp_tonemap_scales_file, tonemap_scales_file)
+
+        fingerprints = get_tonemap_fingerprints(scene_dir, camera_name)
+        for dfi in df_camera[df_camera["fingerprint"].notna()].itertuples():
+            fingerprints.update(dfi.file_root, dfi.fingerprint)
+        fingerprints.save()
+
+
+
+#
+# Load the per-camera table of tonemapping scales, indexed by file_root. Returns None if the table
+# doesn't exist, e.g., if the tonemapped images for the camera haven't been generated yet.
+#
+
+def load_tonemap_scales(scene_dir, camera_name):
+
+    tonemap_scales_file = get_tonemap_scales_file(scene_dir, camera_name)
+    if not os.path.exists(tonemap_scales_file):
+        return None
+
+    return pd.read_csv(tonemap_scales_file, index_col="file_root")
+
+
+
+def get_tonemap_scales_file(scene_dir, camera_name):
+    return os.path.join(scene_dir, "_detail", camera_name, tonemap_scales_file_name)
+
+
+
+def get_tonemap_fingerprints(scene_dir, camera_name, force=False):
+
+    out_preview_dir = os.path.join(scene_dir, "images", "scene_" + camera_name + "_final_preview")
+    params          = {"gamma": gamma, "percentile": percentile, "brightness_nth_percentile_desired": brightness_nth_percentile_desired}
+
+    return fingerprint_utils.Fingerprints(out_preview_dir, "generate_images_tonemap", params, force=force)
+
+
+
+def _get_tonemap_work_item_files(scene_dir, camera_name, file_root):
+
+    images_dir                    = os.path.join(scene_dir, "images")
+    in_scene_fileroot             = "scene"
+    in_rgb_hdf5_file              = os.path.join(images_dir, in_scene_fileroot + "_" + camera_name + "_final_hdf5", file_root + ".color.hdf5")
+    in_render_entity_id_hdf5_file = os.path.join(images_dir, in_scene_fileroot + "_" + camera_name + "_geometry_hdf5", file_root + ".render_entity_id.hdf5")
+    out_rgb_tm_jpg_file           = os.path.join(images_dir, in_scene_fileroot + "_" + camera_name + "_final_preview", file_root + ".tonemap.jpg")
+
+    return in_rgb_hdf5_file, in_render_entity_id_hdf5_file, out_rgb_tm_jpg_file
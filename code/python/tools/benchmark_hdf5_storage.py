@@ -0,0 +1,104 @@
+#
+# For licensing see accompanying LICENSE.txt file.
+# Copyright (C) 2020 Apple Inc. All Rights Reserved.
+#
+
+from pylab import *
+
+import argparse
+import glob
+import h5py
+import inspect
+import os
+import pandas as pd
+import shutil
+import tempfile
+import time
+
+import path_utils
+path_utils.add_path_to_sys_path("../lib", mode="relative_to_current_source_dir", frame=inspect.currentframe())
+import hdf5_utils
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--in_hdf5_files", required=True)
+parser.add_argument("--storage_options", default="none;gzip:1;gzip:4;gzip:6;gzip:9;lzf;shuffle+gzip:1;shuffle+gzip:4;shuffle+lzf")
+parser.add_argument("--tmp_dir", required=True)
+parser.add_argument("--out_csv_file")
+args = parser.parse_args()
+
+
+
+print("[HYPERSIM: BENCHMARK_HDF5_STORAGE] Begin...")
+
+
+
+#
+# For each input image and each storage option (see hdf5_utils.py), we re-encode the image, read it back,
+# and measure the encode time, the decode time, and the resulting file size. We report totals for each
+# channel (e.g., depth_meters, normal_cam, etc), so we can choose a storage option for each channel, and
+# combine the chosen options into a single storage spec for our image writers. Storage options are
+# separated by semicolons, e.g., --storage_options "gzip:1;lzf@64x64".
+#
+
+in_hdf5_files   = sort(glob.glob(args.in_hdf5_files))
+storage_options = [ s.strip() for s in args.storage_options.split(";") if s.strip() != "" ]
+
+assert len(in_hdf5_files) > 0
+for s in storage_options:
+    assert "=" not in s and "," not in s
+    hdf5_utils.parse_storage_spec(s)
+
+if not os.path.exists(args.tmp_dir): os.makedirs(args.tmp_dir)
+scratch_dir = tempfile.mkdtemp(prefix="_tmp_", dir=args.tmp_dir)
+tmp_file    = os.path.join(scratch_dir, "_tmp_benchmark.hdf5")
+
+results = []
+
+for in_hdf5_file in in_hdf5_files:
+
+    print("[HYPERSIM: BENCHMARK_HDF5_STORAGE] Benchmarking " + in_hdf5_file + "...")
+
+    channel_name = hdf5_utils.get_channel_name_from_file(in_hdf5_file)
+    with h5py.File(in_hdf5_file, "r") as f: data = f["dataset"][:]
+
+    for s in storage_options:
+
+        time_begin = time.time()
+        hdf5_utils.write_hdf5_dataset(tmp_file, data, s)
+        time_encode_end = time.time()
+        with h5py.File(tmp_file, "r") as f: data_ = f["dataset"][:]
+        time_decode_end = time.time()
+
+        assert array_equal(data, data_, equal_nan=issubdtype(data.dtype, floating))
+
+        results.append({
+            "channel_name":     channel_name,
+            "storage_option":   s,
+            "num_files":        1,
+            "num_bytes_raw":    data.nbytes,
+            "num_bytes":        os.path.getsize(tmp_file),
+            "encode_time":      time_encode_end - time_begin,
+            "decode_time":      time_decode_end - time_encode_end })
+
+shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+
+df = pd.DataFrame(results).groupby(["channel_name", "storage_option"], sort=False).sum().reset_index()
+df["compression_ratio"] = df["num_bytes_raw"] / df["num_bytes"]
+df["encode_mb_per_sec"] = df["num_bytes_raw"] / df["encode_time"] / 1e6
+df["decode_mb_per_sec"] = df["num_bytes_raw"] / df["decode_time"] / 1e6
+
+for channel_name in df["channel_name"].unique():
+    print("[HYPERSIM: BENCHMARK_HDF5_STORAGE]")
+    print("[HYPERSIM: BENCHMARK_HDF5_STORAGE] " + channel_name + " (" + str(df[df["channel_name"] == channel_name]["num_files"].iloc[0]) + " files):")
+    for dfi in df[df["channel_name"] == channel_name].itertuples():
+        print("[HYPERSIM: BENCHMARK_HDF5_STORAGE]     %-20s MB = %8.2f, ratio = %5.2f, encode time = %7.3fs (%7.1f MB/s), decode time = %7.3fs (%7.1f MB/s)" % \
+            (dfi.storage_option, dfi.num_bytes/1e6, dfi.compression_ratio, dfi.encode_time, dfi.encode_mb_per_sec, dfi.decode_time, dfi.decode_mb_per_sec))
+
+if args.out_csv_file is not None:
+    df.to_csv(args.out_csv_file, index=False)
+
+
+
+print("[HYPERSIM: BENCHMARK_HDF5_STORAGE] Finished.")
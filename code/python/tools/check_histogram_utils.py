@@ -0,0 +1,161 @@
+#
+# For licensing see accompanying LICENSE.txt file.
+# Copyright (C) 2020 Apple Inc. All Rights Reserved.
+#
+
+from pylab import *
+
+import argparse
+import inspect
+import matplotlib.colors
+import sklearn.preprocessing
+
+import path_utils
+path_utils.add_path_to_sys_path("../lib", mode="relative_to_current_source_dir", frame=inspect.currentframe())
+import histogram_utils
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--n_trials", type=int, default=20)
+parser.add_argument("--n_vals", type=int, default=100000)
+parser.add_argument("--seed", type=int, default=0)
+args = parser.parse_args()
+
+
+
+print("[HYPERSIM: CHECK_HISTOGRAM_UTILS] Begin...")
+
+
+
+#
+# Check that histogram_utils.py computes exactly the same counts as the histogram(...) and histogramdd(...)
+# calls that our statistics tools used previously, for the bins used by
+# dataset_generate_image_statistics.py. We check random float32 and float64 values, including NaN,
+# infinite, and out-of-range values, and values exactly on, or adjacent to, each bin edge. We also check
+# that rgb_to_brightness_and_hue_saturation(...) matches sklearn.preprocessing.normalize(...) followed by
+# matplotlib.colors.rgb_to_hsv(...), which only accepts non-negative values.
+#
+
+# n_bins, min, max, log_base
+bins_1d_params = [
+    (42,   -1.5, 40.5, None), # per class
+    (1000,  0.0, 20.0, None), # depth (linear)
+    (1000, -2.0,  3.0, 10.0), # depth (log)
+    (1000,  0.0, 10.0, None), # brightness (linear)
+    (1000, -3.0,  1.0, 10.0), # brightness (log)
+    (1000,  0.0, 10.0, None), # object volume (linear)
+    (1000, -6.0,  3.0, 10.0)  # object volume (log)
+]
+
+# n_bins, min, max, dimensions
+bins_nd_params = [
+    (100, -1.0, 1.0, 2), # normal, hue saturation
+    (20,   0.0, 2.0, 3), # rgb color, diffuse illumination, residual
+    (10,   0.0, 1.0, 3)  # diffuse reflectance
+]
+
+rng = np.random.default_rng(args.seed)
+
+num_failed = 0
+
+def check(name, hist, hist_expected):
+    global num_failed
+    if not array_equal(hist, hist_expected):
+        print("[HYPERSIM: CHECK_HISTOGRAM_UTILS] FAILED: " + name + " (" + str(sum(abs(hist - hist_expected))) + " counts differ)")
+        num_failed = num_failed + 1
+
+def add_special_vals(vals, val_min, val_max):
+    vals          = vals.copy()
+    n             = vals.shape[0] // 100
+    vals[0*n:1*n] = nan
+    vals[1*n:2*n] = inf
+    vals[2*n:3*n] = -inf
+    vals[3*n:4*n] = val_min
+    vals[4*n:5*n] = val_max
+    vals[5*n:6*n] = val_min - 1.0
+    vals[6*n:7*n] = val_max + 1.0
+    return vals
+
+for trial in range(args.n_trials):
+
+    print("[HYPERSIM: CHECK_HISTOGRAM_UTILS] Trial " + str(trial) + "...")
+
+    for n_bins, bin_min, bin_max, log_base in bins_1d_params:
+
+        bins = histogram_utils.Bins(n_bins, bin_min, bin_max, log_base=log_base)
+        name = "Bins(" + str(n_bins) + ", " + str(bin_min) + ", " + str(bin_max) + ", log_base=" + str(log_base) + ")"
+
+        val_min = bins.edges[0]
+        val_max = bins.edges[-1]
+        vals    = val_min + (val_max - val_min)*(rng.random(args.n_vals)*1.2 - 0.1)
+        vals    = add_special_vals(vals, val_min, val_max)
+
+        # values exactly on, and adjacent to, each bin edge in both precisions
+        vals_edges_float32 = bins.edges.astype(float32)
+        vals_edges_float64 = bins.edges
+
+        vals_per_dtype = [
+            vals.astype(float32),
+            vals.astype(float64),
+            r_[ vals_edges_float32, nextafter(vals_edges_float32, float32(inf)), nextafter(vals_edges_float32, float32(-inf)) ],
+            r_[ vals_edges_float64, nextafter(vals_edges_float64, inf),          nextafter(vals_edges_float64, -inf) ] ]
+
+        for v in vals_per_dtype:
+            hist = zeros(n_bins, dtype=int64)
+            histogram_utils.accumulate_histogram(hist, v, bins)
+            hist_expected, _ = histogram(v, bins=bins.edges)
+            check(name + " " + str(v.dtype), hist, hist_expected)
+
+        # integer values, like our semantic IDs
+        if log_base is None:
+            v                = rng.integers(int(floor(bin_min)) - 2, int(ceil(bin_max)) + 2, args.n_vals).astype(int32)
+            hist             = zeros(n_bins, dtype=int64)
+            histogram_utils.accumulate_histogram(hist, v, bins)
+            hist_expected, _ = histogram(v, bins=n_bins, range=(bin_min, bin_max))
+            check(name + " " + str(v.dtype), hist, hist_expected)
+
+    for n_bins, bin_min, bin_max, n_dims in bins_nd_params:
+
+        bins = [ histogram_utils.Bins(n_bins, bin_min, bin_max) ]*n_dims
+        name = str(n_dims) + " x Bins(" + str(n_bins) + ", " + str(bin_min) + ", " + str(bin_max) + ")"
+
+        vals = bin_min + (bin_max - bin_min)*(rng.random((args.n_vals, n_dims))*1.2 - 0.1)
+        for d in range(n_dims):
+            vals[:,d] = add_special_vals(rng.permutation(vals[:,d]), bin_min, bin_max)
+
+        for v in [ vals.astype(float32), vals.astype(float64) ]:
+            hist             = zeros(tuple([ n_bins ]*n_dims), dtype=int64)
+            histogram_utils.accumulate_histogram(hist, v, bins)
+            hist_expected, _ = histogramdd(v, bins=n_bins, range=[ (bin_min, bin_max) ]*n_dims)
+            check(name + " " + str(v.dtype), hist, hist_expected.astype(int64))
+
+    # brightness and hue saturation, including zero vectors and ties between components
+    vals_rgb            = (rng.random((args.n_vals, 3))*2.2).astype(float32)
+    vals_rgb[0:100]     = 0.0
+    vals_rgb[100:200,1] = vals_rgb[100:200,0]
+    vals_rgb[200:300,2] = vals_rgb[200:300,1]
+
+    brightness_1d, hue_saturation_x_1d, hue_saturation_y_1d = histogram_utils.rgb_to_brightness_and_hue_saturation(vals_rgb)
+
+    brightness_1d_expected       = 0.3*vals_rgb[:,0] + 0.59*vals_rgb[:,1] + 0.11*vals_rgb[:,2]
+    vals_hsv_expected            = matplotlib.colors.rgb_to_hsv(sklearn.preprocessing.normalize(vals_rgb))
+    vals_theta_expected          = vals_hsv_expected[:,0]*2*pi
+    hue_saturation_x_1d_expected = vals_hsv_expected[:,1]*cos(vals_theta_expected)
+    hue_saturation_y_1d_expected = vals_hsv_expected[:,1]*sin(vals_theta_expected)
+
+    check("brightness",       brightness_1d,       brightness_1d_expected)
+    check("hue saturation x", hue_saturation_x_1d, hue_saturation_x_1d_expected)
+    check("hue saturation y", hue_saturation_y_1d, hue_saturation_y_1d_expected)
+
+    bins             = [ histogram_utils.Bins(100, -1.0, 1.0) ]*2
+    hist             = zeros((100, 100), dtype=int64)
+    histogram_utils.accumulate_histogram(hist, c_[hue_saturation_y_1d, hue_saturation_x_1d], bins)
+    hist_expected, _ = histogramdd(c_[hue_saturation_x_1d_expected, hue_saturation_y_1d_expected][:,[1,0]], bins=100, range=[(-1.0, 1.0), (-1.0, 1.0)])
+    check("hue saturation histogram", hist, hist_expected.astype(int64))
+
+if num_failed > 0:
+    print("[HYPERSIM: CHECK_HISTOGRAM_UTILS] " + str(num_failed) + " CHECKS FAILED.")
+    exit(-1)
+
+
+
+print("[HYPERSIM: CHECK_HISTOGRAM_UTILS] Finished.")
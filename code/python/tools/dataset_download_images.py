@@ -3,13 +3,28 @@
 # Copyright (C) 2020 Apple Inc. All Rights Reserved.
 #
 
+from pylab import *
+
 import argparse
+import fnmatch
+import inspect
 import os
+import pandas as pd
+
+import path_utils
+path_utils.add_path_to_sys_path("../lib", mode="relative_to_current_source_dir", frame=inspect.currentframe())
+import download_utils
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--downloads_dir", required=True)
 parser.add_argument("--decompress_dir")
 parser.add_argument("--delete_archive_after_decompress", action="store_true")
+parser.add_argument("--scene_names")
+parser.add_argument("--base_url")
+parser.add_argument("--checksums_file")
+parser.add_argument("--n_jobs_download", type=int, default=4)
+parser.add_argument("--n_jobs_decompress", type=int, default=2)
+parser.add_argument("--max_retries", type=int, default=5)
 args = parser.parse_args()
 
 
@@ -18,41 +33,6 @@ print("[HYPERSIM: DATASET_DOWNLOAD_IMAGES] Begin...")
 
 
 
-if not os.path.exists(args.downloads_dir): os.makedirs(args.downloads_dir)
-
-if args.decompress_dir is not None:
-    if not os.path.exists(args.decompress_dir): os.makedirs(args.decompress_dir)
-
-
-
-def download(url):
-    download_name = os.path.basename(url)
-    download_file = os.path.join(args.downloads_dir, download_name)
-
-    cmd = "curl " + url + " --output " + download_file
-    print("")
-    print(cmd)
-    print("")
-    retval = os.system(cmd)
-    assert retval == 0
-
-    if args.decompress_dir is not None:
-        cmd = "unzip " + download_file + " -d " + args.decompress_dir
-        print("")
-        print(cmd)
-        print("")
-        retval = os.system(cmd)
-        assert retval == 0
-        if args.delete_archive_after_decompress:
-            cmd = "rm " + download_file
-            print("")
-            print(cmd)
-            print("")
-            retval = os.system(cmd)
-            assert retval == 0
-
-
-
 urls_to_download = [
     "https://docs-assets.developer.apple.com/ml-research/datasets/hypersim/v1/scenes/ai_001_001.zip",
     "https://docs-assets.developer.apple.com/ml-research/datasets/hypersim/v1/scenes/ai_001_002.zip",
@@ -513,7 +493,33 @@ urls_to_download = [
     "https://docs-assets.developer.apple.com/ml-research/datasets/hypersim/v1/scenes/ai_055_010.zip",
 ]
 
-for url in urls_to_download:
-    download(url)
+
+
+if args.scene_names is not None:
+    urls_to_download = [ url for url in urls_to_download if fnmatch.fnmatch(os.path.splitext(os.path.basename(url))[0], args.scene_names) ]
+
+# download from a different server (or a local mirror) with the same directory structure
+if args.base_url is not None:
+    urls_to_download = [ args.base_url.rstrip("/") + "/" + os.path.basename(url) for url in urls_to_download ]
+
+# the checksums file is a CSV file with archive_name and sha256 columns
+checksums = {}
+if args.checksums_file is not None:
+    df_checksums = pd.read_csv(args.checksums_file)
+    checksums    = dict(zip(df_checksums["archive_name"], df_checksums["sha256"]))
+
+downloader = download_utils.Downloader(
+    downloads_dir=args.downloads_dir,
+    decompress_dir=args.decompress_dir,
+    delete_archive_after_decompress=args.delete_archive_after_decompress,
+    n_jobs_download=args.n_jobs_download,
+    n_jobs_decompress=args.n_jobs_decompress,
+    max_retries=args.max_retries,
+    checksums=checksums)
+
+df_status = downloader.run(urls_to_download)
+
+# if some archives failed, running this script again will only download and extract the missing archives
+assert all(df_status["status"] != "failed")
 
 print("[HYPERSIM: DATASET_DOWNLOAD_IMAGES] Finished.")
@@ -19,6 +19,7 @@ parser.add_argument("--dataset_dir", required=True)
 parser.add_argument("--scene_names")
 parser.add_argument("--bounding_box_type")
 parser.add_argument("--n_jobs", type=int)
+parser.add_argument("--force", action="store_true")
 parser.add_argument("--use_single_threaded_reference_implementation", action="store_true")
 args = parser.parse_args()
 
@@ -61,7 +62,8 @@ def process_scene(s, args):
     cmd = \
         _system_config.python_bin + " scene_generate_bounding_boxes.py" + \
         " --scene_dir "         + scene_dir + \
-        " --bounding_box_type " + args.bounding_box_type
+        " --bounding_box_type " + args.bounding_box_type + \
+        (" --force" if args.force else "")
     print("")
     print(cmd)
     print("")
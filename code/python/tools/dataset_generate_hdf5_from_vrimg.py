@@ -22,7 +22,12 @@ parser.add_argument("--camera_names")
 parser.add_argument("--frames")
 parser.add_argument("--render_pass")
 parser.add_argument("--n_jobs", type=int)
+parser.add_argument("--hdf5_storage")
+parser.add_argument("--hdf5_layout")
+parser.add_argument("--previews")
+parser.add_argument("--preview_scale")
 parser.add_argument("--denoise", action="store_true")
+parser.add_argument("--force", action="store_true")
 parser.add_argument("--use_single_threaded_reference_implementation", action="store_true")
 args = parser.parse_args()
 
@@ -69,6 +74,31 @@ def process_scene(s, args):
     metadata_cameras_csv_file = os.path.join(detail_dir, "metadata_cameras.csv")
     df = pd.read_csv(metadata_cameras_csv_file)
 
+    if args.hdf5_storage is not None:
+        hdf5_storage_arg = " --hdf5_storage " + args.hdf5_storage
+    else:
+        hdf5_storage_arg = ""
+
+    if args.hdf5_layout is not None:
+        hdf5_layout_arg = " --hdf5_layout " + args.hdf5_layout
+    else:
+        hdf5_layout_arg = ""
+
+    if args.previews is not None:
+        previews_arg = " --previews " + args.previews
+    else:
+        previews_arg = ""
+
+    if args.preview_scale is not None:
+        preview_scale_arg = " --preview_scale " + args.preview_scale
+    else:
+        preview_scale_arg = ""
+
+    if args.force:
+        force_arg = " --force"
+    else:
+        force_arg = ""
+
     if args.camera_names is not None:
         cameras = [ c for c in df.to_records() if fnmatch.fnmatch(c["camera_name"], args.camera_names) ]
     else:
@@ -111,7 +141,12 @@ def process_scene(s, args):
                 " --out_hdf5_dir "             + out_hdf5_dir             + \
                 " --out_preview_dir "          + out_preview_dir          + \
                 " --tmp_dir "                  + tmp_dir_                 + \
-                " --render_pass geometry"
+                " --render_pass geometry" + \
+                hdf5_storage_arg          + \
+                hdf5_layout_arg           + \
+                previews_arg              + \
+                preview_scale_arg         + \
+                force_arg
             print("")
             print(cmd)
             print("")
@@ -151,7 +186,12 @@ def process_scene(s, args):
                 " --out_preview_dir "  + out_preview_dir + \
                 " --tmp_dir "          + tmp_dir_        + \
                 " --render_pass final" + \
-                denoise_arg
+                denoise_arg            + \
+                hdf5_storage_arg       + \
+                hdf5_layout_arg        + \
+                previews_arg           + \
+                preview_scale_arg      + \
+                force_arg
             print("")
             print(cmd)
             print("")
@@ -20,6 +20,8 @@ parser.add_argument("--dataset_dir", required=True)
 parser.add_argument("--scene_names")
 parser.add_argument("--camera_names")
 parser.add_argument("--n_jobs", type=int)
+parser.add_argument("--hdf5_storage")
+parser.add_argument("--force", action="store_true")
 parser.add_argument("--use_single_threaded_reference_implementation", action="store_true")
 args = parser.parse_args()
 
@@ -57,6 +59,16 @@ def process_scene(s, args):
     metadata_cameras_csv_file = os.path.join(detail_dir, "metadata_cameras.csv")
     df = pd.read_csv(metadata_cameras_csv_file)
 
+    if args.hdf5_storage is not None:
+        hdf5_storage_arg = " --hdf5_storage " + args.hdf5_storage
+    else:
+        hdf5_storage_arg = ""
+
+    if args.force:
+        force_arg = " --force"
+    else:
+        force_arg = ""
+
     if args.camera_names is not None:
         cameras = [ c for c in df.to_records() if fnmatch.fnmatch(c["camera_name"], args.camera_names) ]
     else:
@@ -79,7 +91,9 @@ def process_scene(s, args):
             _system_config.python_bin + " scene_generate_images_semantic_segmentation.py" + \
             " --scene_dir "         + scene_dir  + \
             " --camera_name "       + camera_name + \
-            " --segmentation_type " + segmentation_type
+            " --segmentation_type " + segmentation_type + \
+            hdf5_storage_arg + \
+            force_arg
         print("")
         print(cmd)
         print("")
@@ -101,7 +115,9 @@ def process_scene(s, args):
             _system_config.python_bin + " scene_generate_images_semantic_segmentation.py" + \
             " --scene_dir "         + scene_dir  + \
             " --camera_name "       + camera_name + \
-            " --segmentation_type " + segmentation_type
+            " --segmentation_type " + segmentation_type + \
+            hdf5_storage_arg + \
+            force_arg
         print("")
         print(cmd)
         print("")
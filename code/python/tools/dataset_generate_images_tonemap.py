@@ -12,18 +12,21 @@ import os
 import pandas as pd
 
 import path_utils
-path_utils.add_path_to_sys_path("..", mode="relative_to_current_source_dir", frame=inspect.currentframe())
-import _system_config
+path_utils.add_path_to_sys_path("../lib", mode="relative_to_current_source_dir", frame=inspect.currentframe())
+import tonemap_utils
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--dataset_dir", required=True)
 parser.add_argument("--scene_names")
 parser.add_argument("--camera_names")
 parser.add_argument("--n_jobs", type=int)
+parser.add_argument("--batch_size", type=int, default=16)
+parser.add_argument("--force", action="store_true")
 parser.add_argument("--use_single_threaded_reference_implementation", action="store_true")
 args = parser.parse_args()
 
 assert os.path.exists(args.dataset_dir)
+assert args.batch_size >= 1
 
 path_utils.add_path_to_sys_path(args.dataset_dir, mode="relative_to_cwd", frame=inspect.currentframe())
 import _dataset_config
@@ -38,8 +41,8 @@ if not args.use_single_threaded_reference_implementation:
     if args.n_jobs is not None:
         n_jobs = args.n_jobs
     else:
-        n_jobs = 4 # 4 parallel jobs by default; more processes don't seem to offer much speed-up
-        
+        n_jobs = -1 # use all available cores by default, since frames are processed independently
+
 dataset_scenes_dir = os.path.join(args.dataset_dir, "scenes")
 
 if args.scene_names is not None:
@@ -49,10 +52,22 @@ else:
 
 
 
-def process_scene(s, args):
+#
+# We tonemap all frames in-process, rather than launching a separate Python process for each camera. We
+# build a flat list of (scene, camera, frame) work items for all scenes and cameras, split it into
+# batches of consecutive frames, and process the batches on a process pool, so the work is evenly
+# distributed across processes regardless of how many frames each camera has. We only build work items
+# for frames whose tonemapped images are out of date, unless --force is specified. See tonemap_utils.py
+# for details.
+#
+
+work_items = []
+
+for s in scenes:
 
     scene_name = s["name"]
-    detail_dir = os.path.join(dataset_scenes_dir, scene_name, "_detail")
+    scene_dir  = os.path.abspath(os.path.join(dataset_scenes_dir, scene_name))
+    detail_dir = os.path.join(scene_dir, "_detail")
 
     metadata_cameras_csv_file = os.path.join(detail_dir, "metadata_cameras.csv")
     df = pd.read_csv(metadata_cameras_csv_file)
@@ -63,38 +78,22 @@ def process_scene(s, args):
         cameras = df.to_records()
 
     for c in cameras:
+        work_items.extend(tonemap_utils.get_tonemap_work_items(scene_dir, c["camera_name"], args.force))
 
-        camera_name = c["camera_name"]
-
-        print("[HYPERSIM: DATASET_GENERATE_IMAGES_TONEMAP] For scene " + scene_name + ", generating tonemapped images for camera " + camera_name + "...")
-
-        scene_dir = os.path.abspath(os.path.join(dataset_scenes_dir, scene_name))
-
-        current_source_file_path = path_utils.get_current_source_file_path(frame=inspect.currentframe())
-        cwd = os.getcwd()
-        os.chdir(current_source_file_path)
-
-        cmd = \
-            _system_config.python_bin + " scene_generate_images_tonemap.py" + \
-            " --scene_dir "   + scene_dir + \
-            " --camera_name " + camera_name
-        print("")
-        print(cmd)
-        print("")
-        retval = os.system(cmd)
-        assert retval == 0
-
-        os.chdir(cwd)
-
+print("[HYPERSIM: DATASET_GENERATE_IMAGES_TONEMAP] Generating tonemapped images for " + str(len(work_items)) + " frames...")
 
+work_item_batches = [ work_items[i:i+args.batch_size] for i in range(0, len(work_items), args.batch_size) ]
 
 if args.use_single_threaded_reference_implementation:
-    for s in scenes:
-        process_scene(s, args)
+    results_per_batch = [ tonemap_utils.process_tonemap_work_items(b) for b in work_item_batches ]
 
 if not args.use_single_threaded_reference_implementation:
     from joblib import Parallel, delayed
-    Parallel(n_jobs=n_jobs, verbose=10)(delayed(process_scene)(s, args) for s in scenes)
+    results_per_batch = Parallel(n_jobs=n_jobs, verbose=10)(delayed(tonemap_utils.process_tonemap_work_items)(b) for b in work_item_batches)
+
+results = [ r for results_batch in results_per_batch for r in results_batch ]
+
+tonemap_utils.save_tonemap_scales(results)
 
 
 
@@ -19,6 +19,8 @@ parser.add_argument("--dataset_dir", required=True)
 parser.add_argument("--scene_names")
 parser.add_argument("--n_jobs", type=int)
 parser.add_argument("--use_single_threaded_reference_implementation", action="store_true")
+parser.add_argument("--write_mesh_containers", action="store_true")
+parser.add_argument("--force", action="store_true")
 args = parser.parse_args()
 
 assert os.path.exists(args.dataset_dir)
@@ -65,7 +67,9 @@ def process_scene(s, args):
     cmd = \
         _system_config.python_bin + " generate_mesh_from_obj.py" + \
         " --in_file " + in_file + \
-        " --out_dir " + out_dir
+        " --out_dir " + out_dir + \
+        (" --write_mesh_container" if args.write_mesh_containers else "") + \
+        (" --force" if args.force else "")
     print("")
     print(cmd)
     print("")
@@ -0,0 +1,270 @@
+#
+# For licensing see accompanying LICENSE.txt file.
+# Copyright (C) 2020 Apple Inc. All Rights Reserved.
+#
+
+from pylab import *
+
+import argparse
+import fnmatch
+import inspect
+import os
+import pandas as pd
+
+import path_utils
+path_utils.add_path_to_sys_path("..", mode="relative_to_current_source_dir", frame=inspect.currentframe())
+import _system_config
+
+path_utils.add_path_to_sys_path("../lib", mode="relative_to_current_source_dir", frame=inspect.currentframe())
+import pipeline_utils
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--dataset_dir", required=True)
+parser.add_argument("--scene_names")
+parser.add_argument("--camera_names")
+parser.add_argument("--stages")
+parser.add_argument("--n_jobs", type=int, default=4)
+parser.add_argument("--dry_run", action="store_true")
+parser.add_argument("--force", action="store_true")
+parser.add_argument("--downloads_dir")
+parser.add_argument("--dataset_dir_to_copy")
+parser.add_argument("--platform_when_rendering")
+parser.add_argument("--dataset_dir_when_rendering")
+parser.add_argument("--bounding_box_type")
+parser.add_argument("--analysis_dir")
+parser.add_argument("--batch_name")
+args = parser.parse_args()
+
+assert args.n_jobs >= 1
+
+
+
+print("[HYPERSIM: DATASET_RUN_PIPELINE] Begin...")
+
+
+
+#
+# Each stage of our pipeline is run by one of our dataset-level tools, and is either global (i.e., one
+# task for the whole dataset), per-scene (one task per scene), or per-camera (one task per camera). We
+# run each task by invoking the stage's tool with --scene_names and --camera_names set to the task's
+# scene and camera, so each task runs the same code as running the tool by hand. We launch tasks via
+# pipeline_utils.Pipeline, which runs independent tasks concurrently across scenes and stages, using at
+# most n_jobs tasks at a time. We pass --n_jobs 1 to each tool that accepts it, so n_jobs is a global
+# worker budget.
+#
+# Rendering happens outside of our pipeline, so the stages after modify_vrscenes_for_hypersim_rendering
+# expect the rendered images to already be available. The tasks for per-camera stages are determined by
+# _detail/metadata_cameras.csv, which is generated by generate_camera_trajectories. If this file doesn't
+# exist yet for a scene (e.g., when planning a run that also generates camera trajectories), we schedule
+# a single per-scene task for the stage instead.
+#
+# The state of each task is stored in _pipeline/pipeline_state.csv in the dataset directory, and the
+# output of each task is stored in _pipeline/logs, so running this tool again resumes where the previous
+# run stopped. A task that succeeded previously is run again if any of its dependencies is run again.
+# Use --dry_run to print the tasks that would be run without running them.
+#
+# generate_images_tonemap depends on generate_images_semantic_segmentation, even though it doesn't use
+# its output, because both tools access the same geometry HDF5 files (with the per_frame and
+# per_trajectory layouts, see hdf5_utils.py), and generate_images_semantic_segmentation writes to them.
+#
+# Several of our tools also skip work whose inputs haven't changed since it was last done, see
+# fingerprint_utils.py. If --force is specified, we pass --force to these tools, so all work is redone,
+# and we run all tasks again, including the tasks for stages whose tools don't accept --force.
+#
+
+stages = [
+    # stage name,                               granularity, tool,                                                  accepts --n_jobs, dependencies
+    ("initialize_scenes",                       "global",    "dataset_initialize_scenes.py",                        False, []),
+    ("modify_vrscenes_normalize",               "scene",     "dataset_modify_vrscenes_normalize.py",                False, ["initialize_scenes"]),
+    ("generate_meshes",                         "scene",     "dataset_generate_meshes.py",                          True,  ["modify_vrscenes_normalize"]),
+    ("generate_octomaps",                       "scene",     "dataset_generate_octomaps.py",                        True,  ["generate_meshes"]),
+    ("generate_camera_trajectories",            "scene",     "dataset_generate_camera_trajectories.py",             True,  ["generate_meshes", "generate_octomaps"]),
+    ("modify_vrscenes_for_hypersim_rendering",  "scene",     "dataset_modify_vrscenes_for_hypersim_rendering.py",   False, ["generate_camera_trajectories"]),
+    ("generate_hdf5_geometry",                  "camera",    "dataset_generate_hdf5_from_vrimg.py",                 True,  ["modify_vrscenes_for_hypersim_rendering"]),
+    ("generate_hdf5_final",                     "camera",    "dataset_generate_hdf5_from_vrimg.py",                 True,  ["modify_vrscenes_for_hypersim_rendering"]),
+    ("generate_images_semantic_segmentation",   "camera",    "dataset_generate_images_semantic_segmentation.py",    True,  ["generate_meshes", "generate_hdf5_geometry"]),
+    ("generate_images_tonemap",                 "camera",    "dataset_generate_images_tonemap.py",                  True,  ["generate_hdf5_geometry", "generate_hdf5_final", "generate_images_semantic_segmentation"]),
+    ("generate_bounding_boxes",                 "scene",     "dataset_generate_bounding_boxes.py",                  True,  ["generate_meshes"]),
+    ("generate_image_statistics",               "global",    "../analysis/dataset_generate_image_statistics.py",    False, ["generate_hdf5_final", "generate_images_semantic_segmentation", "generate_bounding_boxes"]) ]
+
+stage_names        = [ s[0] for s in stages ]
+stage_granularity  = dict([ (s[0], s[1]) for s in stages ])
+stage_tools        = dict([ (s[0], s[2]) for s in stages ])
+stage_accepts_jobs = dict([ (s[0], s[3]) for s in stages ])
+stage_deps         = dict([ (s[0], s[4]) for s in stages ])
+
+# stages whose tools accept --force
+stages_with_fingerprints = ["generate_meshes", "generate_hdf5_geometry", "generate_hdf5_final", "generate_images_semantic_segmentation", "generate_images_tonemap", "generate_bounding_boxes"]
+
+if args.stages is not None:
+    selected_stage_names = [ s for s in stage_names if any([ fnmatch.fnmatch(s, p) for p in args.stages.split(",") ]) ]
+else:
+    selected_stage_names = [ s for s in stage_names if s != "initialize_scenes" and s != "generate_image_statistics" ]
+
+assert len(selected_stage_names) > 0
+
+if "initialize_scenes" in selected_stage_names:
+    assert args.downloads_dir is not None
+if "modify_vrscenes_normalize" in selected_stage_names or "modify_vrscenes_for_hypersim_rendering" in selected_stage_names:
+    assert args.platform_when_rendering is not None
+    assert args.dataset_dir_when_rendering is not None
+if "generate_bounding_boxes" in selected_stage_names or "generate_image_statistics" in selected_stage_names:
+    assert args.bounding_box_type is not None
+if "generate_image_statistics" in selected_stage_names:
+    assert args.analysis_dir is not None
+    assert args.batch_name is not None
+
+# if we're initializing scenes, our dataset config might not have been copied into the dataset dir yet
+dataset_dir = os.path.abspath(args.dataset_dir)
+if os.path.exists(os.path.join(dataset_dir, "_dataset_config.py")) or args.dataset_dir_to_copy is None:
+    dataset_config_dir = dataset_dir
+else:
+    dataset_config_dir = os.path.abspath(args.dataset_dir_to_copy)
+
+path_utils.add_path_to_sys_path(dataset_config_dir, mode="relative_to_cwd", frame=inspect.currentframe())
+import _dataset_config
+
+if args.scene_names is not None:
+    scenes = [ s for s in _dataset_config.scenes if fnmatch.fnmatch(s["name"], args.scene_names) ]
+else:
+    scenes = _dataset_config.scenes
+
+dataset_scenes_dir = os.path.join(dataset_dir, "scenes")
+pipeline_dir       = os.path.join(dataset_dir, "_pipeline")
+tools_dir          = path_utils.get_current_source_file_path(frame=inspect.currentframe())
+
+
+
+def get_camera_names(scene_name):
+
+    metadata_cameras_csv_file = os.path.join(dataset_scenes_dir, scene_name, "_detail", "metadata_cameras.csv")
+    if not os.path.exists(metadata_cameras_csv_file):
+        return None
+
+    camera_names = pd.read_csv(metadata_cameras_csv_file)["camera_name"].tolist()
+    if args.camera_names is not None:
+        camera_names = [ c for c in camera_names if fnmatch.fnmatch(c, args.camera_names) ]
+
+    return camera_names
+
+
+
+# get the selected stages that a stage depends on, skipping over stages that aren't selected
+def get_selected_stage_deps(stage_name):
+
+    selected_deps = []
+    for d in stage_deps[stage_name]:
+        if d in selected_stage_names:
+            selected_deps.append(d)
+        else:
+            selected_deps.extend(get_selected_stage_deps(d))
+
+    return [ d for i, d in enumerate(selected_deps) if d not in selected_deps[:i] ]
+
+
+
+def get_task_id(stage_name, scene_name=None, camera_name=None):
+    return "/".join([ t for t in [stage_name, scene_name, camera_name] if t is not None ])
+
+
+
+def get_cmd(stage_name, scene_name, camera_name):
+
+    cmd = _system_config.python_bin + " " + stage_tools[stage_name] + " --dataset_dir " + dataset_dir
+
+    if scene_name is not None:
+        cmd = cmd + ' --scene_names "' + scene_name + '"'
+    elif args.scene_names is not None:
+        cmd = cmd + ' --scene_names "' + args.scene_names + '"'
+
+    if camera_name is not None:
+        cmd = cmd + ' --camera_names "' + camera_name + '"'
+    elif args.camera_names is not None and stage_name in ["generate_hdf5_geometry", "generate_hdf5_final", "generate_images_semantic_segmentation", "generate_images_tonemap", "generate_image_statistics"]:
+        cmd = cmd + ' --camera_names "' + args.camera_names + '"'
+
+    if stage_accepts_jobs[stage_name]:
+        cmd = cmd + " --n_jobs 1"
+
+    if args.force and stage_name in stages_with_fingerprints:
+        cmd = cmd + " --force"
+
+    if stage_name == "initialize_scenes":
+        cmd = cmd + " --downloads_dir " + os.path.abspath(args.downloads_dir)
+        if args.dataset_dir_to_copy is not None:
+            cmd = cmd + " --dataset_dir_to_copy " + os.path.abspath(args.dataset_dir_to_copy)
+    if stage_name in ["modify_vrscenes_normalize", "modify_vrscenes_for_hypersim_rendering"]:
+        cmd = cmd + " --platform_when_rendering " + args.platform_when_rendering + ' --dataset_dir_when_rendering "' + args.dataset_dir_when_rendering + '"'
+    if stage_name == "generate_hdf5_geometry":
+        cmd = cmd + " --render_pass geometry"
+    if stage_name == "generate_hdf5_final":
+        cmd = cmd + " --render_pass final"
+    if stage_name in ["generate_bounding_boxes", "generate_image_statistics"]:
+        cmd = cmd + " --bounding_box_type " + args.bounding_box_type
+    if stage_name == "generate_image_statistics":
+        cmd = cmd + " --analysis_dir " + os.path.abspath(args.analysis_dir) + " --batch_name " + args.batch_name
+
+    return cmd
+
+
+
+#
+# build the task graph
+#
+
+pipeline = pipeline_utils.Pipeline(os.path.join(pipeline_dir, "pipeline_state.csv"), os.path.join(pipeline_dir, "logs"), force=args.force)
+
+# for each stage, a list of (task_id, scene_name, camera_name) tuples
+stage_tasks = {}
+
+for stage_name in selected_stage_names:
+
+    granularity   = stage_granularity[stage_name]
+    selected_deps = get_selected_stage_deps(stage_name)
+
+    if granularity == "global":
+        tasks = [ (get_task_id(stage_name), None, None) ]
+
+    if granularity == "scene":
+        tasks = [ (get_task_id(stage_name, s["name"]), s["name"], None) for s in scenes ]
+
+    if granularity == "camera":
+        tasks = []
+        for s in scenes:
+            camera_names = get_camera_names(s["name"])
+            if camera_names is None:
+                tasks.append((get_task_id(stage_name, s["name"]), s["name"], None))
+            else:
+                tasks.extend([ (get_task_id(stage_name, s["name"], c), s["name"], c) for c in camera_names ])
+
+    for task_id, scene_name, camera_name in tasks:
+
+        # a task depends on all tasks in its dependency stages that cover the same scene (or camera), where
+        # global tasks cover all scenes and cameras, and per-scene tasks cover all cameras in the scene
+        deps = []
+        for d in selected_deps:
+            for task_id_, scene_name_, camera_name_ in stage_tasks[d]:
+                if scene_name is not None and scene_name_ is not None and scene_name != scene_name_:
+                    continue
+                if camera_name is not None and camera_name_ is not None and camera_name != camera_name_:
+                    continue
+                deps.append(task_id_)
+
+        pipeline.add_task(task_id, get_cmd(stage_name, scene_name, camera_name), tools_dir, deps)
+
+    stage_tasks[stage_name] = tasks
+
+
+
+if args.dry_run:
+    df_plan = pipeline.get_plan()
+    for dfi in df_plan.itertuples():
+        print("[HYPERSIM: DATASET_RUN_PIPELINE] " + dfi.status.upper() + " " + dfi.task_id + ((" (after " + dfi.deps + ")") if dfi.deps != "" else ""))
+        print("[HYPERSIM: DATASET_RUN_PIPELINE]     " + dfi.cmd)
+    print("[HYPERSIM: DATASET_RUN_PIPELINE] " + str(df_plan.shape[0]) + " tasks, " + str(count_nonzero(df_plan["status"] == "pending")) + " pending, " + str(count_nonzero(df_plan["status"] == "skipped")) + " already succeeded")
+else:
+    df_status = pipeline.run(args.n_jobs)
+    assert all(isin(df_status["status"], ["succeeded", "skipped"]))
+
+
+
+print("[HYPERSIM: DATASET_RUN_PIPELINE] Finished.")
@@ -6,12 +6,15 @@
 from pylab import *
 
 import argparse
+import concurrent.futures
 import h5py
 import inspect
 import glob
 import os
 import pandas as pd
 import shutil
+import tempfile
+import time
 
 import path_utils
 
@@ -25,10 +28,20 @@ parser.add_argument("--out_preview_dir", required=True)
 parser.add_argument("--tmp_dir", required=True)
 parser.add_argument("--render_pass", required=True)
 parser.add_argument("--denoise", action="store_true")
+parser.add_argument("--n_jobs", type=int, default=1)
+parser.add_argument("--hdf5_storage")
+parser.add_argument("--hdf5_layout", default="per_channel")
+parser.add_argument("--previews", default="all")
+parser.add_argument("--preview_scale", type=float, default=1.0)
+parser.add_argument("--force", action="store_true")
 args = parser.parse_args()
 
 assert args.render_pass == "geometry" or args.render_pass == "final"
 assert not (args.render_pass == "geometry" and args.denoise)
+assert args.n_jobs >= 1
+assert args.hdf5_layout in ["per_channel", "per_frame", "per_trajectory"]
+assert args.previews in ["none", "minimal", "all"]
+assert args.preview_scale > 0.0
 
 if args.render_pass == "geometry":
     assert args.in_camera_trajectory_dir is not None
@@ -39,6 +52,14 @@ if args.render_pass == "geometry":
 path_utils.add_path_to_sys_path("..", mode="relative_to_current_source_dir", frame=inspect.currentframe())
 import _system_config
 
+path_utils.add_path_to_sys_path("../lib", mode="relative_to_current_source_dir", frame=inspect.currentframe())
+import cpp_tool_utils
+import exr_utils
+import fingerprint_utils
+import hdf5_utils
+import lut_utils
+import preview_utils
+
 
 
 print("[HYPERSIM: GENERATE_HDF5_FROM_VRIMG] Begin...")
@@ -77,26 +98,143 @@ if args.render_pass == "geometry":
     color_vals_unique = arange(node_ids_unique.shape[0])
     np.random.shuffle(color_vals_unique)
 
+    render_entity_id_lut = lut_utils.IdLut(node_ids_unique, color_vals_unique.astype(float32), np.nan)
+
     df_scene = pd.read_csv(args.in_metadata_scene_file, index_col="parameter_name")
     meters_per_asset_unit = df_scene.loc["meters_per_asset_unit"][0]
 
+    # in addition to each frame's vrimg file, the outputs for each frame depend on these files
+    in_files_per_scene = [
+        camera_keyframe_frame_indices_hdf5_file,
+        camera_keyframe_positions_hdf5_file,
+        camera_keyframe_orientations_hdf5_file,
+        args.in_metadata_nodes_file,
+        args.in_metadata_scene_file ]
+
+    hdf5_channel_names = ["render_entity_id", "position", "depth_meters", "normal_world", "normal_cam", "normal_bump_world", "normal_bump_cam", "tex_coord"]
+
+    output_channels_allow_list = [
+        "R",
+        "G",
+        "B",
+        "VRayRenderEntityID",
+        "VRayPosition.R",
+        "VRayPosition.G",
+        "VRayPosition.B",
+        "VRayNormal.R",
+        "VRayNormal.G",
+        "VRayNormal.B",
+        "VRayNormalBump.R",
+        "VRayNormalBump.G",
+        "VRayNormalBump.B",
+        "VRayTexCoord.R",
+        "VRayTexCoord.G",
+        "VRayTexCoord.B" ]
+
+if args.render_pass == "final":
+
+    in_files_per_scene = []
+    hdf5_channel_names = ["color", "diffuse_reflectance", "diffuse_illumination", "residual"]
+
+    output_channels_allow_list = [
+        "R",
+        "G",
+        "B",
+        "VRayDiffuseFilter.R",
+        "VRayDiffuseFilter.G",
+        "VRayDiffuseFilter.B",
+        "VRayRawTotalLighting.R",
+        "VRayRawTotalLighting.G",
+        "VRayRawTotalLighting.B",
+        "VRayReflection.R",
+        "VRayReflection.G",
+        "VRayReflection.B",
+        "VRayRefraction.R",
+        "VRayRefraction.G",
+        "VRayRefraction.B",
+        "VRaySpecular.R",
+        "VRaySpecular.G",
+        "VRaySpecular.B",
+        "VRaySSS2.R",
+        "VRaySSS2.G",
+        "VRaySSS2.B",
+        "VRaySelfIllumination.R",
+        "VRaySelfIllumination.G",
+        "VRaySelfIllumination.B",
+        "VRayCaustics.R",
+        "VRayCaustics.G",
+        "VRayCaustics.B",
+        "VRayAtmosphere.R",
+        "VRayAtmosphere.G",
+        "VRayAtmosphere.B",
+        "VRayBackground.R",
+        "VRayBackground.G",
+        "VRayBackground.B" ]
+
+hdf5_storage_options = hdf5_utils.parse_storage_spec(args.hdf5_storage)
+preview_names        = preview_utils.get_preview_names(args.render_pass, args.previews)
+
+stage_names = ["copy", "denoise", "convert_to_exr", "decode_exr", "generate_derived_images", "write_hdf5", "write_previews"]
+
+
+
+#
+# Each frame passes through the following stages: copy -> denoise -> convert to exr -> decode exr ->
+# generate derived images -> write hdf5 -> write previews. We process frames in parallel across n_jobs
+# worker processes, where each worker processes every n_jobs-th frame in its own scratch directory, so
+# workers never share temporary files. Within each worker, we write the outputs for each frame on a
+# background thread, so we can convert and decode the next frame (which is mostly spent in external
+# processes) while the current frame is being compressed and written. At most one frame is waiting to
+# be written at any time, so each worker holds at most two frames in memory.
+#
+
+def process_frames(in_filenames):
+
+    scratch_dir = tempfile.mkdtemp(prefix="_tmp_", dir=args.tmp_dir)
+    stage_times = []
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+
+        write_future = None
+
+        for in_filename in in_filenames:
+
+            stage_times_frame = dict([ (s, 0.0) for s in stage_names ])
+            hdf5_outputs, preview_outputs = convert_frame(in_filename, scratch_dir, stage_times_frame)
+
+            if write_future is not None:
+                write_future.result()
+            write_future = executor.submit(write_frame_outputs, in_filename.replace(".vrimg", ""), hdf5_outputs, preview_outputs, stage_times_frame)
+
+            stage_times.append(stage_times_frame)
+
+        if write_future is not None:
+            write_future.result()
+
+    shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    return stage_times
 
 
-in_filenames = [ os.path.basename(f) for f in sort(glob.glob(args.in_vrimg_files)) ]
 
-for in_filename in in_filenames:
+def convert_frame(in_filename, scratch_dir, stage_times):
+
+    time_begin = time.time()
 
     in_file  = os.path.join(input_dir, in_filename)
-    out_file = os.path.join(args.tmp_dir, "_tmp_frame.vrimg")
+    out_file = os.path.join(scratch_dir, "_tmp_frame.vrimg")
     shutil.copy(in_file, out_file)
 
+    time_copy_end = time.time()
+    stage_times["copy"] = time_copy_end - time_begin
+
     if args.denoise:
 
         #
         # denoise
         #
 
-        in_file  = os.path.join(args.tmp_dir, "_tmp_frame.vrimg")
+        in_file  = os.path.join(scratch_dir, "_tmp_frame.vrimg")
 
         cmd = _system_config.vdenoise_bin + \
             " -inputFile=" + in_file + \
@@ -104,373 +242,266 @@ for in_filename in in_filenames:
         print("")
         print(cmd)
         print("")
-        retval = os.system(cmd)
+        retval = cpp_tool_utils.run_cmd(cmd)
         assert retval == 0
 
-        in_file  = os.path.join(args.tmp_dir, "_tmp_frame_denoised.vrimg")
-        out_file = os.path.join(args.tmp_dir, "_tmp_frame.vrimg")
+        in_file  = os.path.join(scratch_dir, "_tmp_frame_denoised.vrimg")
+        out_file = os.path.join(scratch_dir, "_tmp_frame.vrimg")
         shutil.move(in_file, out_file)
 
+    time_denoise_end = time.time()
+    stage_times["denoise"] = time_denoise_end - time_copy_end
+
     #
     # convert to exr
     #
 
-    input_file = os.path.join(args.tmp_dir, "_tmp_frame.vrimg")
+    input_file = os.path.join(scratch_dir, "_tmp_frame.vrimg")
 
     cmd = _system_config.vrimg2exr_bin + \
         " " + input_file
     print("")
     print(cmd)
     print("")
-    retval = os.system(cmd)
+    retval = cpp_tool_utils.run_cmd(cmd)
     assert retval == 0
 
+    time_convert_end = time.time()
+    stage_times["convert_to_exr"] = time_convert_end - time_denoise_end
+
     #
-    # convert to hdf5
+    # decode exr channels
     #
 
-    if args.render_pass == "geometry":
-
-        output_channels_allow_list = [
-            "R",
-            "G",
-            "B",
-            "VRayRenderEntityID",
-            "VRayPosition.R",
-            "VRayPosition.G",
-            "VRayPosition.B",
-            "VRayNormal.R",
-            "VRayNormal.G",
-            "VRayNormal.B",
-            "VRayNormalBump.R",
-            "VRayNormalBump.G",
-            "VRayNormalBump.B",
-            "VRayTexCoord.R",
-            "VRayTexCoord.G",
-            "VRayTexCoord.B" ]
-
-    if args.render_pass == "final":
-
-        output_channels_allow_list = [
-            "R",
-            "G",
-            "B",
-            "VRayDiffuseFilter.R",
-            "VRayDiffuseFilter.G",
-            "VRayDiffuseFilter.B",
-            "VRayRawTotalLighting.R",
-            "VRayRawTotalLighting.G",
-            "VRayRawTotalLighting.B",
-            "VRayReflection.R",
-            "VRayReflection.G",
-            "VRayReflection.B",
-            "VRayRefraction.R",
-            "VRayRefraction.G",
-            "VRayRefraction.B",
-            "VRaySpecular.R",
-            "VRaySpecular.G",
-            "VRaySpecular.B",
-            "VRaySSS2.R",
-            "VRaySSS2.G",
-            "VRaySSS2.B",
-            "VRaySelfIllumination.R",
-            "VRaySelfIllumination.G",
-            "VRaySelfIllumination.B",
-            "VRayCaustics.R",
-            "VRayCaustics.G",
-            "VRayCaustics.B",
-            "VRayAtmosphere.R",
-            "VRayAtmosphere.G",
-            "VRayAtmosphere.B",
-            "VRayBackground.R",
-            "VRayBackground.G",
-            "VRayBackground.B" ]
-
-    current_source_path             = path_utils.get_current_source_file_path(frame=inspect.currentframe())
-    generate_hdf5_from_exr_bin      = os.path.abspath(os.path.join(current_source_path, "..", "..", "cpp", "bin", "generate_hdf5_from_exr"))
-    input_file                      = os.path.join(args.tmp_dir, "_tmp_frame.exr")
-    output_file                     = os.path.join(args.tmp_dir, "_tmp_frame")
-    output_channels_allow_list_args = " --o " + " --o ".join(output_channels_allow_list)
-
-    cmd = generate_hdf5_from_exr_bin + \
-        " --input_file "  + input_file  + \
-        " --output_file " + output_file + \
-        output_channels_allow_list_args
-    print("")
-    print(cmd)
-    print("")
-    retval = os.system(cmd)
-    assert retval == 0
+    input_file = os.path.join(scratch_dir, "_tmp_frame.exr")
 
-    #
-    # generate hdf5 output
-    #
+    with exr_utils.ExrFile(input_file, tmp_dir=scratch_dir, channel_names=output_channels_allow_list) as exr_file:
+
+        # decode all channels here, so decoding time isn't attributed to generating derived images
+        exr_file.get_channels()
 
-    in_file_root = in_filename.replace(".vrimg", "")
-
-    if args.render_pass == "geometry":
-
-        in_vray_rgb_color_r_hdf5_file      = os.path.join(args.tmp_dir, "_tmp_frame.R.hdf5")
-        in_vray_rgb_color_g_hdf5_file      = os.path.join(args.tmp_dir, "_tmp_frame.G.hdf5")
-        in_vray_rgb_color_b_hdf5_file      = os.path.join(args.tmp_dir, "_tmp_frame.B.hdf5")
-        in_vray_render_entity_id_hdf5_file = os.path.join(args.tmp_dir, "_tmp_frame.VRayRenderEntityID.hdf5")
-        in_vray_position_r_hdf5_file       = os.path.join(args.tmp_dir, "_tmp_frame.VRayPosition.R.hdf5")
-        in_vray_position_g_hdf5_file       = os.path.join(args.tmp_dir, "_tmp_frame.VRayPosition.G.hdf5")
-        in_vray_position_b_hdf5_file       = os.path.join(args.tmp_dir, "_tmp_frame.VRayPosition.B.hdf5")
-        in_vray_normal_r_hdf5_file         = os.path.join(args.tmp_dir, "_tmp_frame.VRayNormal.R.hdf5")
-        in_vray_normal_g_hdf5_file         = os.path.join(args.tmp_dir, "_tmp_frame.VRayNormal.G.hdf5")
-        in_vray_normal_b_hdf5_file         = os.path.join(args.tmp_dir, "_tmp_frame.VRayNormal.B.hdf5")
-        in_vray_normal_bump_r_hdf5_file    = os.path.join(args.tmp_dir, "_tmp_frame.VRayNormalBump.R.hdf5")
-        in_vray_normal_bump_g_hdf5_file    = os.path.join(args.tmp_dir, "_tmp_frame.VRayNormalBump.G.hdf5")
-        in_vray_normal_bump_b_hdf5_file    = os.path.join(args.tmp_dir, "_tmp_frame.VRayNormalBump.B.hdf5")
-        in_vray_tex_coord_r_hdf5_file      = os.path.join(args.tmp_dir, "_tmp_frame.VRayTexCoord.R.hdf5")
-        in_vray_tex_coord_g_hdf5_file      = os.path.join(args.tmp_dir, "_tmp_frame.VRayTexCoord.G.hdf5")
-        in_vray_tex_coord_b_hdf5_file      = os.path.join(args.tmp_dir, "_tmp_frame.VRayTexCoord.B.hdf5")
-
-        out_render_entity_id_hdf5_file  = os.path.join(args.out_hdf5_dir, in_file_root + ".render_entity_id.hdf5")
-        out_position_hdf5_file          = os.path.join(args.out_hdf5_dir, in_file_root + ".position.hdf5")
-        out_depth_meters_hdf5_file      = os.path.join(args.out_hdf5_dir, in_file_root + ".depth_meters.hdf5")
-        out_normal_world_hdf5_file      = os.path.join(args.out_hdf5_dir, in_file_root + ".normal_world.hdf5")
-        out_normal_cam_hdf5_file        = os.path.join(args.out_hdf5_dir, in_file_root + ".normal_cam.hdf5")
-        out_normal_bump_world_hdf5_file = os.path.join(args.out_hdf5_dir, in_file_root + ".normal_bump_world.hdf5")
-        out_normal_bump_cam_hdf5_file   = os.path.join(args.out_hdf5_dir, in_file_root + ".normal_bump_cam.hdf5")
-        out_tex_coord_hdf5_file         = os.path.join(args.out_hdf5_dir, in_file_root + ".tex_coord.hdf5")
-
-        out_color_jpg_file             = os.path.join(args.out_preview_dir, in_file_root + ".color.jpg")
-        out_gamma_jpg_file             = os.path.join(args.out_preview_dir, in_file_root + ".gamma.jpg")
-        out_render_entity_id_png_file  = os.path.join(args.out_preview_dir, in_file_root + ".render_entity_id.png")
-        out_depth_meters_png_file      = os.path.join(args.out_preview_dir, in_file_root + ".depth_meters.png")
-        out_normal_world_png_file      = os.path.join(args.out_preview_dir, in_file_root + ".normal_world.png")
-        out_normal_cam_png_file        = os.path.join(args.out_preview_dir, in_file_root + ".normal_cam.png")
-        out_normal_bump_world_png_file = os.path.join(args.out_preview_dir, in_file_root + ".normal_bump_world.png")
-        out_normal_bump_cam_png_file   = os.path.join(args.out_preview_dir, in_file_root + ".normal_bump_cam.png")
-        out_tex_coord_png_file         = os.path.join(args.out_preview_dir, in_file_root + ".tex_coord.png")
-
-        with h5py.File(in_vray_rgb_color_r_hdf5_file,      "r") as f: vray_rgb_color_r      = f["dataset"][:]
-        with h5py.File(in_vray_rgb_color_g_hdf5_file,      "r") as f: vray_rgb_color_g      = f["dataset"][:]
-        with h5py.File(in_vray_rgb_color_b_hdf5_file,      "r") as f: vray_rgb_color_b      = f["dataset"][:]
-        with h5py.File(in_vray_render_entity_id_hdf5_file, "r") as f: vray_render_entity_id = f["dataset"][:]
-        with h5py.File(in_vray_position_r_hdf5_file,       "r") as f: vray_position_r       = f["dataset"][:]
-        with h5py.File(in_vray_position_g_hdf5_file,       "r") as f: vray_position_g       = f["dataset"][:]
-        with h5py.File(in_vray_position_b_hdf5_file,       "r") as f: vray_position_b       = f["dataset"][:]
-        with h5py.File(in_vray_normal_r_hdf5_file,         "r") as f: vray_normal_r         = f["dataset"][:]
-        with h5py.File(in_vray_normal_g_hdf5_file,         "r") as f: vray_normal_g         = f["dataset"][:]
-        with h5py.File(in_vray_normal_b_hdf5_file,         "r") as f: vray_normal_b         = f["dataset"][:]
-        with h5py.File(in_vray_normal_bump_r_hdf5_file,    "r") as f: vray_normal_bump_r    = f["dataset"][:]
-        with h5py.File(in_vray_normal_bump_g_hdf5_file,    "r") as f: vray_normal_bump_g    = f["dataset"][:]
-        with h5py.File(in_vray_normal_bump_b_hdf5_file,    "r") as f: vray_normal_bump_b    = f["dataset"][:]
-        with h5py.File(in_vray_tex_coord_r_hdf5_file,      "r") as f: vray_tex_coord_r      = f["dataset"][:]
-        with h5py.File(in_vray_tex_coord_g_hdf5_file,      "r") as f: vray_tex_coord_g      = f["dataset"][:]
-        with h5py.File(in_vray_tex_coord_b_hdf5_file,      "r") as f: vray_tex_coord_b      = f["dataset"][:]
-
-        rgb_color         = dstack([vray_rgb_color_r, vray_rgb_color_g, vray_rgb_color_b])
-        render_entity_id  = vray_render_entity_id.astype(int32)
-        position          = dstack([vray_position_r,    vray_position_g,    vray_position_b])
-        normal_world      = dstack([vray_normal_r,      vray_normal_g,      vray_normal_b])
-        normal_bump_world = dstack([vray_normal_bump_r, vray_normal_bump_g, vray_normal_bump_b])
-        tex_coord         = dstack([vray_tex_coord_r,   vray_tex_coord_g,   vray_tex_coord_b])
-
-        # get image parameters
-        height_pixels = rgb_color.shape[0] 
-        width_pixels  = rgb_color.shape[1]
-
-        # get camera parameters
-        in_filename_ids = [int(t) for t in in_filename.split(".") if t.isdigit()]
-        assert len(in_filename_ids) == 1
-        frame_id     = in_filename_ids[0]
-        keyframe_ids = where(camera_keyframe_frame_indices == frame_id)[0]
-        assert len(keyframe_ids) == 1
-
-        keyframe_id        = keyframe_ids[0]
-        camera_position    = camera_keyframe_positions[keyframe_id]
-        camera_orientation = camera_keyframe_orientations[keyframe_id]
-        R_world_from_cam   = matrix(camera_orientation)
-        R_cam_from_world   = R_world_from_cam.T
+        time_decode_end = time.time()
+        stage_times["decode_exr"] = time_decode_end - time_convert_end
 
+        #
         # generate derived images
-        invalid_mask                    = logical_or(render_entity_id == -1, render_entity_id == 0)
-        render_entity_id[invalid_mask]  = -1
-        position[invalid_mask]          = np.nan
-        normal_world[invalid_mask]      = np.nan
-        normal_bump_world[invalid_mask] = np.nan
-
-        render_entity_id_ = ones_like(render_entity_id)*np.nan
-        for node_id,color_val in zip(node_ids_unique,color_vals_unique):
-            render_entity_id_[node_id == render_entity_id] = color_val
-        render_entity_id_[invalid_mask] = np.nan
-
-        depth        = linalg.norm(position - camera_position[newaxis,newaxis,:], axis=2)
-        depth_meters = meters_per_asset_unit*depth
-
-        N_world       = matrix(normal_world.reshape(-1,3)).T
-        N_cam         = R_cam_from_world*N_world
-        normal_cam    = N_cam.T.A.reshape(height_pixels, width_pixels, -1)
-        normal_world_ = (normal_world + 1.0)/2.0
-        normal_cam_   = (normal_cam + 1.0)/2.0
-
-        N_bump_world       = matrix(normal_bump_world.reshape(-1,3)).T
-        N_bump_cam         = R_cam_from_world*N_bump_world
-        normal_bump_cam    = N_bump_cam.T.A.reshape(height_pixels, width_pixels, -1)
-        normal_bump_world_ = (normal_bump_world + 1.0)/2.0
-        normal_bump_cam_   = (normal_bump_cam + 1.0)/2.0
-
-        gamma           = 1.0/2.2 # standard gamma correction exponent
-        rgb_color_gamma = np.power(np.maximum(rgb_color,0), gamma)
-
-        print("[HYPERSIM: GENERATE_HDF5_FROM_VRIMG] Saving output files for the input file: " + in_file_root + "...")
-
-        with h5py.File(out_render_entity_id_hdf5_file,  "w") as f: f.create_dataset("dataset", data=render_entity_id.astype(int16),    compression="gzip", compression_opts=9)
-        with h5py.File(out_position_hdf5_file,          "w") as f: f.create_dataset("dataset", data=position.astype(float16),          compression="gzip", compression_opts=9)
-        with h5py.File(out_depth_meters_hdf5_file,      "w") as f: f.create_dataset("dataset", data=depth_meters.astype(float16),      compression="gzip", compression_opts=9)
-        with h5py.File(out_normal_world_hdf5_file,      "w") as f: f.create_dataset("dataset", data=normal_world.astype(float16),      compression="gzip", compression_opts=9)
-        with h5py.File(out_normal_cam_hdf5_file,        "w") as f: f.create_dataset("dataset", data=normal_cam.astype(float16),        compression="gzip", compression_opts=9)
-        with h5py.File(out_normal_bump_world_hdf5_file, "w") as f: f.create_dataset("dataset", data=normal_bump_world.astype(float16), compression="gzip", compression_opts=9)
-        with h5py.File(out_normal_bump_cam_hdf5_file,   "w") as f: f.create_dataset("dataset", data=normal_bump_cam.astype(float16),   compression="gzip", compression_opts=9)
-        with h5py.File(out_tex_coord_hdf5_file,         "w") as f: f.create_dataset("dataset", data=tex_coord.astype(float16),         compression="gzip", compression_opts=9)
-
-        eps = 0.000001 # amount of numerical slack when checking if normal images are in the range [0,1]
-        assert all(np.min(normal_world_.reshape(-1,3),      axis=0)) > 0.0 - eps
-        assert all(np.min(normal_cam_.reshape(-1,3),        axis=0)) > 0.0 - eps
-        assert all(np.min(normal_bump_world_.reshape(-1,3), axis=0)) > 0.0 - eps
-        assert all(np.min(normal_bump_cam_.reshape(-1,3),   axis=0)) > 0.0 - eps
-        assert all(np.max(normal_world_.reshape(-1,3),      axis=0)) < 1.0 + eps
-        assert all(np.max(normal_cam_.reshape(-1,3),        axis=0)) < 1.0 + eps
-        assert all(np.max(normal_bump_world_.reshape(-1,3), axis=0)) < 1.0 + eps
-        assert all(np.max(normal_bump_cam_.reshape(-1,3),   axis=0)) < 1.0 + eps
-
-        # ideally we would normalize depth consistently for each scene, but we don't know a good depth range, so don't try to normalize
-        # normals are already unit-length, but due to occasional numerical artifacts we need to clip anyway
-        imsave(out_color_jpg_file,             clip(rgb_color,0,1))
-        imsave(out_gamma_jpg_file,             clip(rgb_color_gamma,0,1))
-        imsave(out_render_entity_id_png_file,  render_entity_id_, vmin=np.min(color_vals_unique), vmax=np.max(color_vals_unique))
-        imsave(out_depth_meters_png_file,      depth_meters)
-        imsave(out_normal_world_png_file,      clip(normal_world_,0,1))
-        imsave(out_normal_cam_png_file,        clip(normal_cam_,0,1))
-        imsave(out_normal_bump_world_png_file, clip(normal_bump_world_,0,1))
-        imsave(out_normal_bump_cam_png_file,   clip(normal_bump_cam_,0,1))
-        imsave(out_tex_coord_png_file,         clip(tex_coord,0,1))
-
-    if args.render_pass == "final":
-
-        in_vray_rgb_color_r_hdf5_file          = os.path.join(args.tmp_dir, "_tmp_frame.R.hdf5")
-        in_vray_rgb_color_g_hdf5_file          = os.path.join(args.tmp_dir, "_tmp_frame.G.hdf5")
-        in_vray_rgb_color_b_hdf5_file          = os.path.join(args.tmp_dir, "_tmp_frame.B.hdf5")
-        in_vray_diffuse_filter_r_hdf5_file     = os.path.join(args.tmp_dir, "_tmp_frame.VRayDiffuseFilter.R.hdf5")
-        in_vray_diffuse_filter_g_hdf5_file     = os.path.join(args.tmp_dir, "_tmp_frame.VRayDiffuseFilter.G.hdf5")
-        in_vray_diffuse_filter_b_hdf5_file     = os.path.join(args.tmp_dir, "_tmp_frame.VRayDiffuseFilter.B.hdf5")
-        in_vray_raw_total_lighting_r_hdf5_file = os.path.join(args.tmp_dir, "_tmp_frame.VRayRawTotalLighting.R.hdf5")
-        in_vray_raw_total_lighting_g_hdf5_file = os.path.join(args.tmp_dir, "_tmp_frame.VRayRawTotalLighting.G.hdf5")
-        in_vray_raw_total_lighting_b_hdf5_file = os.path.join(args.tmp_dir, "_tmp_frame.VRayRawTotalLighting.B.hdf5")
-        in_vray_reflection_r_hdf5_file         = os.path.join(args.tmp_dir, "_tmp_frame.VRayReflection.R.hdf5")
-        in_vray_reflection_g_hdf5_file         = os.path.join(args.tmp_dir, "_tmp_frame.VRayReflection.G.hdf5")
-        in_vray_reflection_b_hdf5_file         = os.path.join(args.tmp_dir, "_tmp_frame.VRayReflection.B.hdf5")
-        in_vray_refraction_r_hdf5_file         = os.path.join(args.tmp_dir, "_tmp_frame.VRayRefraction.R.hdf5")
-        in_vray_refraction_g_hdf5_file         = os.path.join(args.tmp_dir, "_tmp_frame.VRayRefraction.G.hdf5")
-        in_vray_refraction_b_hdf5_file         = os.path.join(args.tmp_dir, "_tmp_frame.VRayRefraction.B.hdf5")
-        in_vray_specular_r_hdf5_file           = os.path.join(args.tmp_dir, "_tmp_frame.VRaySpecular.R.hdf5")
-        in_vray_specular_g_hdf5_file           = os.path.join(args.tmp_dir, "_tmp_frame.VRaySpecular.G.hdf5")
-        in_vray_specular_b_hdf5_file           = os.path.join(args.tmp_dir, "_tmp_frame.VRaySpecular.B.hdf5")
-        in_vray_sss2_r_hdf5_file               = os.path.join(args.tmp_dir, "_tmp_frame.VRaySSS2.R.hdf5")
-        in_vray_sss2_g_hdf5_file               = os.path.join(args.tmp_dir, "_tmp_frame.VRaySSS2.G.hdf5")
-        in_vray_sss2_b_hdf5_file               = os.path.join(args.tmp_dir, "_tmp_frame.VRaySSS2.B.hdf5")
-        in_vray_self_illumination_r_hdf5_file  = os.path.join(args.tmp_dir, "_tmp_frame.VRaySelfIllumination.R.hdf5")
-        in_vray_self_illumination_g_hdf5_file  = os.path.join(args.tmp_dir, "_tmp_frame.VRaySelfIllumination.G.hdf5")
-        in_vray_self_illumination_b_hdf5_file  = os.path.join(args.tmp_dir, "_tmp_frame.VRaySelfIllumination.B.hdf5")
-        in_vray_caustics_r_hdf5_file           = os.path.join(args.tmp_dir, "_tmp_frame.VRayCaustics.R.hdf5")
-        in_vray_caustics_g_hdf5_file           = os.path.join(args.tmp_dir, "_tmp_frame.VRayCaustics.G.hdf5")
-        in_vray_caustics_b_hdf5_file           = os.path.join(args.tmp_dir, "_tmp_frame.VRayCaustics.B.hdf5")
-        in_vray_atmosphere_r_hdf5_file         = os.path.join(args.tmp_dir, "_tmp_frame.VRayAtmosphere.R.hdf5")
-        in_vray_atmosphere_g_hdf5_file         = os.path.join(args.tmp_dir, "_tmp_frame.VRayAtmosphere.G.hdf5")
-        in_vray_atmosphere_b_hdf5_file         = os.path.join(args.tmp_dir, "_tmp_frame.VRayAtmosphere.B.hdf5")
-        in_vray_background_r_hdf5_file         = os.path.join(args.tmp_dir, "_tmp_frame.VRayBackground.R.hdf5")
-        in_vray_background_g_hdf5_file         = os.path.join(args.tmp_dir, "_tmp_frame.VRayBackground.G.hdf5")
-        in_vray_background_b_hdf5_file         = os.path.join(args.tmp_dir, "_tmp_frame.VRayBackground.B.hdf5")
-
-        out_color_hdf5_file                = os.path.join(args.out_hdf5_dir, in_file_root + ".color.hdf5")
-        out_diffuse_reflectance_hdf5_file  = os.path.join(args.out_hdf5_dir, in_file_root + ".diffuse_reflectance.hdf5")
-        out_diffuse_illumination_hdf5_file = os.path.join(args.out_hdf5_dir, in_file_root + ".diffuse_illumination.hdf5")
-        out_residual_hdf5_file             = os.path.join(args.out_hdf5_dir, in_file_root + ".residual.hdf5")
-
-        out_color_jpg_file                = os.path.join(args.out_preview_dir, in_file_root + ".color.jpg")
-        out_gamma_jpg_file                = os.path.join(args.out_preview_dir, in_file_root + ".gamma.jpg")
-        out_diffuse_reflectance_jpg_file  = os.path.join(args.out_preview_dir, in_file_root + ".diffuse_reflectance.jpg")
-        out_diffuse_illumination_jpg_file = os.path.join(args.out_preview_dir, in_file_root + ".diffuse_illumination.jpg")
-        out_residual_jpg_file             = os.path.join(args.out_preview_dir, in_file_root + ".residual.jpg")
-        out_lambertian_jpg_file           = os.path.join(args.out_preview_dir, in_file_root + ".lambertian.jpg")
-        out_non_lambertian_jpg_file       = os.path.join(args.out_preview_dir, in_file_root + ".non_lambertian.jpg")
-        out_diff_jpg_file                 = os.path.join(args.out_preview_dir, in_file_root + ".diff.jpg")
-
-        with h5py.File(in_vray_rgb_color_r_hdf5_file,          "r") as f: vray_rgb_color_r          = f["dataset"][:]
-        with h5py.File(in_vray_rgb_color_g_hdf5_file,          "r") as f: vray_rgb_color_g          = f["dataset"][:]
-        with h5py.File(in_vray_rgb_color_b_hdf5_file,          "r") as f: vray_rgb_color_b          = f["dataset"][:]
-        with h5py.File(in_vray_diffuse_filter_r_hdf5_file,     "r") as f: vray_diffuse_filter_r     = f["dataset"][:]
-        with h5py.File(in_vray_diffuse_filter_g_hdf5_file,     "r") as f: vray_diffuse_filter_g     = f["dataset"][:]
-        with h5py.File(in_vray_diffuse_filter_b_hdf5_file,     "r") as f: vray_diffuse_filter_b     = f["dataset"][:]
-        with h5py.File(in_vray_raw_total_lighting_r_hdf5_file, "r") as f: vray_raw_total_lighting_r = f["dataset"][:]
-        with h5py.File(in_vray_raw_total_lighting_g_hdf5_file, "r") as f: vray_raw_total_lighting_g = f["dataset"][:]
-        with h5py.File(in_vray_raw_total_lighting_b_hdf5_file, "r") as f: vray_raw_total_lighting_b = f["dataset"][:]
-        with h5py.File(in_vray_reflection_r_hdf5_file,         "r") as f: vray_reflection_r         = f["dataset"][:]
-        with h5py.File(in_vray_reflection_g_hdf5_file,         "r") as f: vray_reflection_g         = f["dataset"][:]
-        with h5py.File(in_vray_reflection_b_hdf5_file,         "r") as f: vray_reflection_b         = f["dataset"][:]
-        with h5py.File(in_vray_refraction_r_hdf5_file,         "r") as f: vray_refraction_r         = f["dataset"][:]
-        with h5py.File(in_vray_refraction_g_hdf5_file,         "r") as f: vray_refraction_g         = f["dataset"][:]
-        with h5py.File(in_vray_refraction_b_hdf5_file,         "r") as f: vray_refraction_b         = f["dataset"][:]
-        with h5py.File(in_vray_specular_r_hdf5_file,           "r") as f: vray_specular_r           = f["dataset"][:]
-        with h5py.File(in_vray_specular_g_hdf5_file,           "r") as f: vray_specular_g           = f["dataset"][:]
-        with h5py.File(in_vray_specular_b_hdf5_file,           "r") as f: vray_specular_b           = f["dataset"][:]
-        with h5py.File(in_vray_sss2_r_hdf5_file,               "r") as f: vray_sss2_r               = f["dataset"][:]
-        with h5py.File(in_vray_sss2_g_hdf5_file,               "r") as f: vray_sss2_g               = f["dataset"][:]
-        with h5py.File(in_vray_sss2_b_hdf5_file,               "r") as f: vray_sss2_b               = f["dataset"][:]
-        with h5py.File(in_vray_self_illumination_r_hdf5_file,  "r") as f: vray_self_illumination_r  = f["dataset"][:]
-        with h5py.File(in_vray_self_illumination_g_hdf5_file,  "r") as f: vray_self_illumination_g  = f["dataset"][:]
-        with h5py.File(in_vray_self_illumination_b_hdf5_file,  "r") as f: vray_self_illumination_b  = f["dataset"][:]
-        with h5py.File(in_vray_caustics_r_hdf5_file,           "r") as f: vray_caustics_r           = f["dataset"][:]
-        with h5py.File(in_vray_caustics_g_hdf5_file,           "r") as f: vray_caustics_g           = f["dataset"][:]
-        with h5py.File(in_vray_caustics_b_hdf5_file,           "r") as f: vray_caustics_b           = f["dataset"][:]
-        with h5py.File(in_vray_atmosphere_r_hdf5_file,         "r") as f: vray_atmosphere_r         = f["dataset"][:]
-        with h5py.File(in_vray_atmosphere_g_hdf5_file,         "r") as f: vray_atmosphere_g         = f["dataset"][:]
-        with h5py.File(in_vray_atmosphere_b_hdf5_file,         "r") as f: vray_atmosphere_b         = f["dataset"][:]
-        with h5py.File(in_vray_background_r_hdf5_file,         "r") as f: vray_background_r         = f["dataset"][:]
-        with h5py.File(in_vray_background_g_hdf5_file,         "r") as f: vray_background_g         = f["dataset"][:]
-        with h5py.File(in_vray_background_b_hdf5_file,         "r") as f: vray_background_b         = f["dataset"][:]
-
-        rgb_color          = dstack([vray_rgb_color_r,          vray_rgb_color_g,          vray_rgb_color_b])
-        diffuse_filter     = dstack([vray_diffuse_filter_r,     vray_diffuse_filter_g,     vray_diffuse_filter_b])
-        raw_total_lighting = dstack([vray_raw_total_lighting_r, vray_raw_total_lighting_g, vray_raw_total_lighting_b])
-        reflection         = dstack([vray_reflection_r,         vray_reflection_g,         vray_reflection_b])
-        refraction         = dstack([vray_refraction_r,         vray_refraction_g,         vray_refraction_b])
-        specular           = dstack([vray_specular_r,           vray_specular_g,           vray_specular_b])
-        sss2               = dstack([vray_sss2_r,               vray_sss2_g,               vray_sss2_b])
-        self_illumination  = dstack([vray_self_illumination_r,  vray_self_illumination_g,  vray_self_illumination_b])
-        caustics           = dstack([vray_caustics_r,           vray_caustics_g,           vray_caustics_b])
-        atmosphere         = dstack([vray_atmosphere_r,         vray_atmosphere_g,         vray_atmosphere_b])
-        background         = dstack([vray_background_r,         vray_background_g,         vray_background_b])
-
-        residual = reflection + refraction + specular + sss2 + self_illumination + caustics + atmosphere + background
-
-        total_lighting_ = diffuse_filter*raw_total_lighting
-        rgb_color_      = total_lighting_ + residual
-
-        diff = abs(rgb_color - rgb_color_)
-
-        gamma           = 1.0/2.2 # standard gamma correction exponent
-        rgb_color_gamma = np.power(np.maximum(rgb_color,0), gamma)
-
-        print("[HYPERSIM: GENERATE_HDF5_FROM_VRIMG] Saving output files for the input file: " + in_file_root + "...")
-
-        with h5py.File(out_color_hdf5_file,                "w") as f: f.create_dataset("dataset", data=rgb_color.astype(float16),          compression="gzip", compression_opts=9)
-        with h5py.File(out_diffuse_reflectance_hdf5_file,  "w") as f: f.create_dataset("dataset", data=diffuse_filter.astype(float16),     compression="gzip", compression_opts=9)
-        with h5py.File(out_diffuse_illumination_hdf5_file, "w") as f: f.create_dataset("dataset", data=raw_total_lighting.astype(float16), compression="gzip", compression_opts=9)
-        with h5py.File(out_residual_hdf5_file,             "w") as f: f.create_dataset("dataset", data=residual.astype(float16),           compression="gzip", compression_opts=9)
-
-        imsave(out_color_jpg_file,                clip(rgb_color,0,1))
-        imsave(out_gamma_jpg_file,                clip(rgb_color_gamma,0,1))
-        imsave(out_diffuse_reflectance_jpg_file,  clip(diffuse_filter,0,1))
-        imsave(out_diffuse_illumination_jpg_file, clip(raw_total_lighting,0,1))
-        imsave(out_residual_jpg_file,             clip(residual,0,1))
-        imsave(out_lambertian_jpg_file,           clip(total_lighting_,0,1))
-        imsave(out_non_lambertian_jpg_file,       clip(rgb_color_,0,1))
-        imsave(out_diff_jpg_file,                 clip(diff,0,1))
+        #
+
+        if args.render_pass == "geometry":
+            hdf5_outputs, preview_outputs = generate_geometry_outputs(exr_file, in_filename)
+        if args.render_pass == "final":
+            hdf5_outputs, preview_outputs = generate_final_outputs(exr_file)
+
+    time_derive_end = time.time()
+    stage_times["generate_derived_images"] = time_derive_end - time_decode_end
+
+    return hdf5_outputs, preview_outputs
+
+
+
+def generate_geometry_outputs(exr_file, in_filename):
+
+    rgb_color         = exr_file.get_stacked_channels("")
+    render_entity_id  = exr_file.get_channel("VRayRenderEntityID").astype(int32)
+    position          = exr_file.get_stacked_channels("VRayPosition").astype(float64)
+    normal_world      = exr_file.get_stacked_channels("VRayNormal").astype(float64)
+    normal_bump_world = exr_file.get_stacked_channels("VRayNormalBump").astype(float64)
+    tex_coord         = exr_file.get_stacked_channels("VRayTexCoord")
+
+    # get image parameters
+    height_pixels = rgb_color.shape[0]
+    width_pixels  = rgb_color.shape[1]
+
+    # get camera parameters
+    in_filename_ids = [int(t) for t in in_filename.split(".") if t.isdigit()]
+    assert len(in_filename_ids) == 1
+    frame_id     = in_filename_ids[0]
+    keyframe_ids = where(camera_keyframe_frame_indices == frame_id)[0]
+    assert len(keyframe_ids) == 1
+
+    keyframe_id        = keyframe_ids[0]
+    camera_position    = camera_keyframe_positions[keyframe_id]
+    camera_orientation = camera_keyframe_orientations[keyframe_id]
+    R_world_from_cam   = matrix(camera_orientation)
+    R_cam_from_world   = R_world_from_cam.T
+
+    # generate derived images
+    invalid_mask                    = logical_or(render_entity_id == -1, render_entity_id == 0)
+    render_entity_id[invalid_mask]  = -1
+    position[invalid_mask]          = np.nan
+    normal_world[invalid_mask]      = np.nan
+    normal_bump_world[invalid_mask] = np.nan
+
+    depth        = linalg.norm(position - camera_position[newaxis,newaxis,:], axis=2)
+    depth_meters = meters_per_asset_unit*depth
+
+    N_world       = matrix(normal_world.reshape(-1,3)).T
+    N_cam         = R_cam_from_world*N_world
+    normal_cam    = N_cam.T.A.reshape(height_pixels, width_pixels, -1)
+    normal_world_ = (normal_world + 1.0)/2.0
+    normal_cam_   = (normal_cam + 1.0)/2.0
+
+    N_bump_world       = matrix(normal_bump_world.reshape(-1,3)).T
+    N_bump_cam         = R_cam_from_world*N_bump_world
+    normal_bump_cam    = N_bump_cam.T.A.reshape(height_pixels, width_pixels, -1)
+    normal_bump_world_ = (normal_bump_world + 1.0)/2.0
+    normal_bump_cam_   = (normal_bump_cam + 1.0)/2.0
+
+    eps = 0.000001 # amount of numerical slack when checking if normal images are in the range [0,1]
+    assert all(np.min(normal_world_.reshape(-1,3),      axis=0)) > 0.0 - eps
+    assert all(np.min(normal_cam_.reshape(-1,3),        axis=0)) > 0.0 - eps
+    assert all(np.min(normal_bump_world_.reshape(-1,3), axis=0)) > 0.0 - eps
+    assert all(np.min(normal_bump_cam_.reshape(-1,3),   axis=0)) > 0.0 - eps
+    assert all(np.max(normal_world_.reshape(-1,3),      axis=0)) < 1.0 + eps
+    assert all(np.max(normal_cam_.reshape(-1,3),        axis=0)) < 1.0 + eps
+    assert all(np.max(normal_bump_world_.reshape(-1,3), axis=0)) < 1.0 + eps
+    assert all(np.max(normal_bump_cam_.reshape(-1,3),   axis=0)) < 1.0 + eps
+
+    hdf5_outputs = [
+        ("render_entity_id",  render_entity_id.astype(int16)),
+        ("position",          position.astype(float16)),
+        ("depth_meters",      depth_meters.astype(float16)),
+        ("normal_world",      normal_world.astype(float16)),
+        ("normal_cam",        normal_cam.astype(float16)),
+        ("normal_bump_world", normal_bump_world.astype(float16)),
+        ("normal_bump_cam",   normal_bump_cam.astype(float16)),
+        ("tex_coord",         tex_coord.astype(float16)) ]
+
+    preview_images = {
+        "color":             rgb_color,
+        "render_entity_id":  render_entity_id,
+        "depth_meters":      depth_meters,
+        "normal_world":      normal_world,
+        "normal_cam":        normal_cam,
+        "normal_bump_world": normal_bump_world,
+        "normal_bump_cam":   normal_bump_cam,
+        "tex_coord":         tex_coord }
+
+    preview_outputs = preview_utils.generate_geometry_previews(preview_images, preview_names, render_entity_id_lut)
+
+    return hdf5_outputs, preview_outputs
+
+
+
+def generate_final_outputs(exr_file):
+
+    rgb_color          = exr_file.get_stacked_channels("")
+    diffuse_filter     = exr_file.get_stacked_channels("VRayDiffuseFilter")
+    raw_total_lighting = exr_file.get_stacked_channels("VRayRawTotalLighting")
+    reflection         = exr_file.get_stacked_channels("VRayReflection")
+    refraction         = exr_file.get_stacked_channels("VRayRefraction")
+    specular           = exr_file.get_stacked_channels("VRaySpecular")
+    sss2               = exr_file.get_stacked_channels("VRaySSS2")
+    self_illumination  = exr_file.get_stacked_channels("VRaySelfIllumination")
+    caustics           = exr_file.get_stacked_channels("VRayCaustics")
+    atmosphere         = exr_file.get_stacked_channels("VRayAtmosphere")
+    background         = exr_file.get_stacked_channels("VRayBackground")
+
+    # our EXR channels are float32, but we sum in float64 like we did when our channels were stored in
+    # intermediate float64 HDF5 files, so rounding doesn't change the residual after converting to float16
+    residual = reflection.astype(float64) + refraction.astype(float64) + specular.astype(float64) + sss2.astype(float64) + \
+        self_illumination.astype(float64) + caustics.astype(float64) + atmosphere.astype(float64) + background.astype(float64)
+
+    hdf5_outputs = [
+        ("color",                rgb_color.astype(float16)),
+        ("diffuse_reflectance",  diffuse_filter.astype(float16)),
+        ("diffuse_illumination", raw_total_lighting.astype(float16)),
+        ("residual",             residual.astype(float16)) ]
+
+    preview_images = {
+        "color":                rgb_color,
+        "diffuse_reflectance":  diffuse_filter,
+        "diffuse_illumination": raw_total_lighting,
+        "residual":             residual }
+
+    preview_outputs = preview_utils.generate_final_previews(preview_images, preview_names)
+
+    return hdf5_outputs, preview_outputs
+
+
+
+def write_frame_outputs(in_file_root, hdf5_outputs, preview_outputs, stage_times):
+
+    time_begin = time.time()
+
+    print("[HYPERSIM: GENERATE_HDF5_FROM_VRIMG] Saving output files for the input file: " + in_file_root + "...")
+
+    # only one process can write to a per-trajectory file at a time, so we write per-frame files here, and
+    # merge them into a per-trajectory file after all frames have been processed
+    if args.hdf5_layout == "per_trajectory":
+        hdf5_layout = "per_frame"
+    else:
+        hdf5_layout = args.hdf5_layout
+
+    hdf5_utils.write_images(args.out_hdf5_dir, in_file_root, hdf5_outputs, hdf5_storage_options, hdf5_layout)
+
+    time_write_hdf5_end = time.time()
+    stage_times["write_hdf5"] = time_write_hdf5_end - time_begin
+
+    for preview_name, data, kwargs in preview_outputs:
+        preview_file = preview_utils.get_preview_file(args.out_preview_dir, in_file_root, preview_name)
+        preview_utils.save_preview(preview_file, data, scale=args.preview_scale, **kwargs)
+
+    time_write_previews_end = time.time()
+    stage_times["write_previews"] = time_write_previews_end - time_write_hdf5_end
+
+
+
+time_begin = time.time()
+
+#
+# We skip frames whose outputs are up to date, i.e., frames whose vrimg file, per-scene input files, and
+# parameters haven't changed since their outputs were generated, unless --force is specified. See
+# fingerprint_utils.py for details.
+#
+
+fingerprints_params = {"render_pass": args.render_pass, "denoise": args.denoise, "hdf5_storage": args.hdf5_storage, "hdf5_layout": args.hdf5_layout, "previews": args.previews, "preview_scale": args.preview_scale}
+fingerprints        = fingerprint_utils.Fingerprints(args.out_hdf5_dir, "generate_hdf5_from_vrimg", fingerprints_params, force=args.force)
+frame_fingerprints  = {}
+
+in_filenames_all = [ os.path.basename(f) for f in sort(glob.glob(args.in_vrimg_files)) ]
+in_filenames     = []
+
+for in_filename in in_filenames_all:
+
+    in_file_root  = in_filename.replace(".vrimg", "")
+    fingerprint   = fingerprints.compute(input_files=[os.path.join(input_dir, in_filename)] + in_files_per_scene)
+    output_images = [ os.path.join(args.out_hdf5_dir, in_file_root + "." + c + ".hdf5") for c in hdf5_channel_names ]
+    output_files  = [ preview_utils.get_preview_file(args.out_preview_dir, in_file_root, p) for p in preview_names ]
+
+    if fingerprints.is_up_to_date(in_file_root, fingerprint, output_files, output_images):
+        continue
+
+    in_filenames.append(in_filename)
+    frame_fingerprints[in_file_root] = fingerprint
+
+print("[HYPERSIM: GENERATE_HDF5_FROM_VRIMG] Skipping " + str(len(in_filenames_all) - len(in_filenames)) + " of " + str(len(in_filenames_all)) + " frames that are already up to date...")
+
+if args.n_jobs == 1:
+    stage_times = process_frames(in_filenames)
+else:
+    from joblib import Parallel, delayed
+    in_filenames_per_job = [ in_filenames[i::args.n_jobs] for i in range(args.n_jobs) ]
+    in_filenames_per_job = [ f for f in in_filenames_per_job if len(f) > 0 ]
+    stage_times_per_job  = Parallel(n_jobs=args.n_jobs)(delayed(process_frames)(f) for f in in_filenames_per_job)
+    stage_times          = [ t for stage_times_job in stage_times_per_job for t in stage_times_job ]
+
+if args.hdf5_layout == "per_trajectory":
+    print("[HYPERSIM: GENERATE_HDF5_FROM_VRIMG] Merging per-frame files into a per-trajectory file...")
+    hdf5_utils.merge_frame_files_into_trajectory_file(args.out_hdf5_dir, [ f.replace(".vrimg", "") for f in in_filenames ], hdf5_storage_options)
+
+for in_file_root, fingerprint in frame_fingerprints.items():
+    fingerprints.update(in_file_root, fingerprint)
+fingerprints.save()
+
+time_end = time.time()
+
+num_frames = len(stage_times)
+print("[HYPERSIM: GENERATE_HDF5_FROM_VRIMG] Processed " + str(num_frames) + " frames with " + str(args.n_jobs) + " jobs in %0.2fs." % (time_end - time_begin))
+for s in stage_names:
+    stage_time_total = sum([ t[s] for t in stage_times ])
+    stage_time_mean  = stage_time_total / num_frames if num_frames > 0 else 0.0
+    print("[HYPERSIM: GENERATE_HDF5_FROM_VRIMG]     " + s + ": total time = %0.2fs, mean time per frame = %0.3fs" % (stage_time_total, stage_time_mean))
 
 
 
@@ -6,6 +6,7 @@
 from pylab import *
 
 import argparse
+import glob
 import h5py
 import inspect
 import os
@@ -13,11 +14,16 @@ import pandas as pd
 
 import path_utils
 path_utils.add_path_to_sys_path("../lib", mode="relative_to_current_source_dir", frame=inspect.currentframe())
+import fingerprint_utils
+import mesh_utils
 import obj_file_utils
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--in_file", required=True)
 parser.add_argument("--out_dir", required=True)
+parser.add_argument("--n_jobs", type=int, default=1)
+parser.add_argument("--write_mesh_container", action="store_true")
+parser.add_argument("--force", action="store_true")
 args = parser.parse_args()
 
 assert os.path.exists(args.in_file)
@@ -40,13 +46,47 @@ mesh_faces_vti_hdf5_file         = os.path.join(args.out_dir, "mesh_faces_vni.hd
 mesh_metadata_materials_csv_file = os.path.join(args.out_dir, "metadata_materials.csv")
 mesh_metadata_objects_csv_file   = os.path.join(args.out_dir, "metadata_objects.csv")
 mesh_metadata_groups_csv_file    = os.path.join(args.out_dir, "metadata_groups.csv")
+mesh_container_file              = os.path.join(args.out_dir, mesh_utils.mesh_container_file_name)
 
 if not os.path.exists(args.out_dir): os.makedirs(args.out_dir)
 
 
 
+# skip generating our mesh if the obj file (and the mtl files next to it) haven't changed since we last
+# generated it, unless --force is specified, see fingerprint_utils.py
+fingerprints = fingerprint_utils.Fingerprints(args.out_dir, "generate_mesh_from_obj", {"write_mesh_container": args.write_mesh_container}, force=args.force)
+in_files     = [args.in_file] + sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(args.in_file)), "*.mtl")))
+out_files    = [
+    mesh_vertices_hdf5_file,
+    mesh_texcoords_hdf5_file,
+    mesh_normals_hdf5_file,
+    mesh_faces_oi_hdf5_file,
+    mesh_faces_gi_hdf5_file,
+    mesh_faces_mi_hdf5_file,
+    mesh_faces_vi_hdf5_file,
+    mesh_faces_vni_hdf5_file,
+    mesh_faces_vti_hdf5_file,
+    mesh_metadata_materials_csv_file,
+    mesh_metadata_objects_csv_file,
+    mesh_metadata_groups_csv_file ] + ([mesh_container_file] if args.write_mesh_container else [])
+fingerprint  = fingerprints.compute(input_files=in_files)
+
+if fingerprints.is_up_to_date("mesh", fingerprint, output_files=out_files):
+    print("[HYPERSIM: GENERATE_MESH_FROM_OBJ] Mesh is already up to date, skipping...")
+    print("[HYPERSIM: GENERATE_MESH_FROM_OBJ] Finished.")
+    exit(0)
+
+
+
 # load vertices and faces
-obj_data = obj_file_utils.load_obj_file(args.in_file)
+obj_data = obj_file_utils.load_obj_file(args.in_file, n_jobs=args.n_jobs)
+
+
+
+# remove a container from a previous run before we overwrite our per-array files, otherwise mesh_utils
+# would keep reading the stale container instead of our new files
+if os.path.exists(mesh_container_file):
+    os.remove(mesh_container_file)
 
 
 
@@ -73,6 +113,14 @@ df_materials = pd.DataFrame.from_dict(obj_data.material_param_map, orient="index
 df_materials_ = df_materials.loc[obj_data.material_names].rename_axis("material_name").reset_index()
 df_materials_.to_csv(mesh_metadata_materials_csv_file, index=False)
 
+# optionally save all of the above in a single memory-mappable container file
+if args.write_mesh_container:
+    mesh_container_arrays = dict([ (name, getattr(obj_data, name)) for name in mesh_utils.mesh_container_array_names ])
+    mesh_utils.save_mesh_container(mesh_container_file, mesh_container_arrays, obj_data.object_names, obj_data.group_names, df_materials_)
+
+fingerprints.update("mesh", fingerprint)
+fingerprints.save()
+
 
 
 print("[HYPERSIM: GENERATE_MESH_FROM_OBJ] Finished.")
@@ -14,10 +14,15 @@ import pandas as pd
 import path_utils
 path_utils.add_path_to_sys_path("../lib", mode="relative_to_current_source_dir", frame=inspect.currentframe())
 import approx_mvbb_utils
+import cpp_tool_utils
+import fingerprint_utils
+import mesh_utils
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--scene_dir", required=True)
 parser.add_argument("--bounding_box_type", required=True)
+parser.add_argument("--n_jobs", type=int, default=1)
+parser.add_argument("--force", action="store_true")
 args = parser.parse_args()
 
 assert os.path.exists(args.scene_dir)
@@ -29,9 +34,6 @@ print("[HYPERSIM: SCENE_GENERATE_BOUNDING_BOXES] Begin...")
 
 
 
-mesh_vertices_hdf5_file                     = os.path.join(args.scene_dir, "_detail", "mesh", "mesh_vertices.hdf5")
-mesh_faces_vi_hdf5_file                     = os.path.join(args.scene_dir, "_detail", "mesh", "mesh_faces_vi.hdf5")
-mesh_faces_oi_hdf5_file                     = os.path.join(args.scene_dir, "_detail", "mesh", "mesh_faces_oi.hdf5")
 mesh_objects_sii_hdf5_file                  = os.path.join(args.scene_dir, "_detail", "mesh", "mesh_objects_sii.hdf5")
 mesh_objects_si_hdf5_file                   = os.path.join(args.scene_dir, "_detail", "mesh", "mesh_objects_si.hdf5")
 metadata_semantic_instance_colors_hdf5_file = os.path.join(args.scene_dir, "_detail", "mesh", "metadata_semantic_instance_colors.hdf5")
@@ -52,9 +54,23 @@ if args.bounding_box_type == "object_aligned_3d":
 
 
 
-with h5py.File(mesh_vertices_hdf5_file,                     "r") as f: mesh_vertices                     = f["dataset"][:]
-with h5py.File(mesh_faces_vi_hdf5_file,                     "r") as f: mesh_faces_vi                     = f["dataset"][:]
-with h5py.File(mesh_faces_oi_hdf5_file,                     "r") as f: mesh_faces_oi                     = f["dataset"][:]
+# skip this scene if our mesh and segmentation files haven't changed since we last generated bounding
+# boxes of this type, unless --force is specified, see fingerprint_utils.py
+fingerprints = fingerprint_utils.Fingerprints(os.path.join(args.scene_dir, "_detail", "mesh"), "generate_bounding_boxes", force=args.force)
+in_files     = \
+    mesh_utils.get_mesh_array_files(os.path.join(args.scene_dir, "_detail", "mesh"), ["vertices", "faces_vi", "faces_oi"]) + \
+    [mesh_objects_sii_hdf5_file, mesh_objects_si_hdf5_file, metadata_semantic_instance_colors_hdf5_file, metadata_semantic_colors_hdf5_file]
+out_files    = [metadata_semantic_instance_bounding_box_positions_hdf5_file, metadata_semantic_instance_bounding_box_orientations_hdf5_file, metadata_semantic_instance_bounding_box_extents_hdf5_file]
+fingerprint  = fingerprints.compute(input_files=in_files)
+
+if fingerprints.is_up_to_date(args.bounding_box_type, fingerprint, output_files=out_files):
+    print("[HYPERSIM: SCENE_GENERATE_BOUNDING_BOXES] Bounding boxes are already up to date, skipping...")
+    print("[HYPERSIM: SCENE_GENERATE_BOUNDING_BOXES] Finished.")
+    exit(0)
+
+
+
+mesh_vertices, mesh_faces_vi, mesh_faces_oi = mesh_utils.load_mesh_arrays(os.path.join(args.scene_dir, "_detail", "mesh"), ["vertices", "faces_vi", "faces_oi"])
 with h5py.File(mesh_objects_sii_hdf5_file,                  "r") as f: mesh_objects_sii                  = matrix(f["dataset"][:]).A1
 with h5py.File(mesh_objects_si_hdf5_file,                   "r") as f: mesh_objects_si                   = matrix(f["dataset"][:]).A1
 with h5py.File(metadata_semantic_instance_colors_hdf5_file, "r") as f: metadata_semantic_instance_colors = f["dataset"][:]
@@ -68,79 +84,72 @@ bounding_box_positions    = np.inf*ones((num_instances,3))
 bounding_box_orientations = np.inf*ones((num_instances,3,3))
 bounding_box_extents      = np.inf*ones((num_instances,3))
 
-for sii in unique(mesh_objects_sii):
-    if sii == -1:
-        continue
+tmp_dir = os.path.join(args.scene_dir, "_tmp")
 
-    color_sii = metadata_semantic_instance_colors[sii]
-    fi_sii    = where(in1d(mesh_faces_oi, where(mesh_objects_sii == sii)[0]))[0]
+# build a face-to-semantic-instance index once, and gather the vertices for all semantic instances into
+# a single array, so we can compute all bounding boxes in a single vectorized pass or batched call
+mesh_instance_index = mesh_utils.MeshInstanceIndex(mesh_faces_oi, mesh_objects_sii)
+sii_unique          = mesh_instance_index.sii
 
-    assert fi_sii.shape[0] > 0
+assert array_equal(sii_unique, [ sii for sii in unique(mesh_objects_sii) if sii != -1 ])
 
-    mesh_faces_vi_sii  = mesh_faces_vi[fi_sii]
-    mesh_vertices_sii_ = mesh_vertices[mesh_faces_vi_sii.ravel()]
+mesh_vertices_sii_all, mesh_vertices_offsets = mesh_instance_index.get_face_vertices(mesh_vertices, mesh_faces_vi)
 
-    if args.bounding_box_type == "axis_aligned":    
+# compute axis-aligned bounding boxes, which are also the starting point for object-and-gravity-aligned bounding boxes
+bounding_box_positions[sii_unique], bounding_box_extents[sii_unique] = \
+    mesh_utils.compute_axis_aligned_bounding_boxes(mesh_vertices_sii_all, mesh_vertices_offsets)
+bounding_box_orientations[sii_unique] = identity(3)
 
-        print("[HYPERSIM: SCENE_GENERATE_BOUNDING_BOXES] Generating axis-aligned bounding box for semantic instance ID " + str(sii) + "...")
-
-        mesh_vertices_sii_min    = np.min(mesh_vertices_sii_, axis=0)
-        mesh_vertices_sii_max    = np.max(mesh_vertices_sii_, axis=0)
-        mesh_vertices_sii_extent = mesh_vertices_sii_max - mesh_vertices_sii_min
-        mesh_vertices_sii_center = mesh_vertices_sii_min + mesh_vertices_sii_extent/2.0
+if args.bounding_box_type == "axis_aligned":
 
-        bounding_box_center_world = matrix(mesh_vertices_sii_center).A
-        bounding_box_extent_world = matrix(mesh_vertices_sii_extent).A
-        R_world_from_obj          = matrix(identity(3))
+    print("[HYPERSIM: SCENE_GENERATE_BOUNDING_BOXES] Generated axis-aligned bounding boxes for " + str(len(sii_unique)) + " semantic instances...")
 
-    if args.bounding_box_type == "object_aligned_2d":
+if args.bounding_box_type == "object_aligned_2d":
 
-        print("[HYPERSIM: SCENE_GENERATE_BOUNDING_BOXES] Generating object-and-gravity-aligned bounding box for semantic instance ID " + str(sii) + "...")
+    print("[HYPERSIM: SCENE_GENERATE_BOUNDING_BOXES] Generating object-and-gravity-aligned bounding boxes for " + str(len(sii_unique)) + " semantic instances...")
 
-        mesh_vertices_sii_min    = np.min(mesh_vertices_sii_, axis=0)
-        mesh_vertices_sii_max    = np.max(mesh_vertices_sii_, axis=0)
-        mesh_vertices_sii_extent = mesh_vertices_sii_max - mesh_vertices_sii_min
-        mesh_vertices_sii_center = mesh_vertices_sii_min + mesh_vertices_sii_extent/2.0
+    bounding_box_centers_world_2d, bounding_box_extents_world_2d, bounding_box_orientations_2d = \
+        approx_mvbb_utils.generate_oriented_bounding_boxes_2d(mesh_vertices_sii_all[:,0:2],
+                                                              mesh_vertices_offsets,
+                                                              tmp_dir=tmp_dir,
+                                                              n_jobs=args.n_jobs)
 
-        bounding_box_center_world = matrix(mesh_vertices_sii_center).A
-        bounding_box_extent_world = matrix(mesh_vertices_sii_extent).A
-        R_world_from_obj          = matrix(identity(3))
+    bounding_box_positions[sii_unique,0:2]        = bounding_box_centers_world_2d
+    bounding_box_extents[sii_unique,0:2]          = bounding_box_extents_world_2d
+    bounding_box_orientations[sii_unique,0:2,0:2] = bounding_box_orientations_2d
 
-        tmp_dir = os.path.join(args.scene_dir, "_tmp")
+if args.bounding_box_type == "object_aligned_3d":
 
-        bounding_box_center_world_2d, bounding_box_extent_world_2d, bounding_box_orientation_2d = \
-            approx_mvbb_utils.generate_oriented_bounding_box_2d(mesh_vertices_sii_[:,0:2],
-                                                                tmp_dir=tmp_dir)
+    print("[HYPERSIM: SCENE_GENERATE_BOUNDING_BOXES] Generating object-aligned bounding boxes for " + str(len(sii_unique)) + " semantic instances...")
 
-        bounding_box_center_world[0,0:2] = bounding_box_center_world_2d
-        bounding_box_extent_world[0,0:2] = bounding_box_extent_world_2d
-        R_world_from_obj[0:2,0:2]        = bounding_box_orientation_2d
+    # use default parameters, see https://github.com/gabyx/ApproxMVBB
+    bounding_box_centers_world, bounding_box_extents_world, R_world_from_obj = \
+        approx_mvbb_utils.generate_oriented_bounding_boxes_3d(mesh_vertices_sii_all,
+                                                              mesh_vertices_offsets,
+                                                              n_epsilon=0.001,
+                                                              n_point_samples=500,
+                                                              n_grid_size=5,
+                                                              n_diam_opt_loops=0,
+                                                              n_grid_search_opt_loops=5,
+                                                              tmp_dir=tmp_dir,
+                                                              n_jobs=args.n_jobs)
 
-    if args.bounding_box_type == "object_aligned_3d":
+    bounding_box_positions[sii_unique]    = bounding_box_centers_world
+    bounding_box_orientations[sii_unique] = R_world_from_obj
+    bounding_box_extents[sii_unique]      = bounding_box_extents_world
 
-        print("[HYPERSIM: SCENE_GENERATE_BOUNDING_BOXES] Generating object-aligned bounding box for semantic instance ID " + str(sii) + "...")
 
-        tmp_dir = os.path.join(args.scene_dir, "_tmp")
 
-        # use default parameters, see https://github.com/gabyx/ApproxMVBB
-        bounding_box_center_world, bounding_box_extent_world, R_world_from_obj = \
-            approx_mvbb_utils.generate_oriented_bounding_box_3d(mesh_vertices_sii_,
-                                                                n_epsilon=0.001,
-                                                                n_point_samples=500,
-                                                                n_grid_size=5,
-                                                                n_diam_opt_loops=0,
-                                                                n_grid_search_opt_loops=5,
-                                                                tmp_dir=tmp_dir)
+with h5py.File(metadata_semantic_instance_bounding_box_positions_hdf5_file,    "w") as f: f.create_dataset("dataset", data=bounding_box_positions)
+with h5py.File(metadata_semantic_instance_bounding_box_orientations_hdf5_file, "w") as f: f.create_dataset("dataset", data=bounding_box_orientations)
+with h5py.File(metadata_semantic_instance_bounding_box_extents_hdf5_file,      "w") as f: f.create_dataset("dataset", data=bounding_box_extents)
 
-    bounding_box_positions[sii]    = bounding_box_center_world
-    bounding_box_orientations[sii] = R_world_from_obj
-    bounding_box_extents[sii]      = bounding_box_extent_world
+fingerprints.update(args.bounding_box_type, fingerprint)
+fingerprints.save()
 
 
 
-with h5py.File(metadata_semantic_instance_bounding_box_positions_hdf5_file,    "w") as f: f.create_dataset("dataset", data=bounding_box_positions)
-with h5py.File(metadata_semantic_instance_bounding_box_orientations_hdf5_file, "w") as f: f.create_dataset("dataset", data=bounding_box_orientations)
-with h5py.File(metadata_semantic_instance_bounding_box_extents_hdf5_file,      "w") as f: f.create_dataset("dataset", data=bounding_box_extents)
+cpp_tool_utils.print_cpp_tool_call_stats()
 
 
 
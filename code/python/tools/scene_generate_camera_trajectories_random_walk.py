@@ -16,7 +16,10 @@ import sklearn.metrics
 
 import path_utils
 path_utils.add_path_to_sys_path("../lib", mode="relative_to_current_source_dir", frame=inspect.currentframe())
+import cpp_tool_utils
 import embree_utils
+import lut_utils
+import mesh_utils
 import octomap_utils
 import random_walk_utils
 
@@ -46,17 +49,12 @@ tmp_dir          = os.path.join(args.scene_dir, "_tmp")
 metadata_cameras_asset_export_csv_file = os.path.join(asset_export_dir, "metadata_cameras_asset_export.csv")
 metadata_cameras_csv_file              = os.path.join(detail_dir, "metadata_cameras.csv")
 metadata_scene_csv_file                = os.path.join(detail_dir, "metadata_scene.csv")
-mesh_vertices_hdf5_file                = os.path.join(mesh_dir, "mesh_vertices.hdf5")
-mesh_faces_vi_hdf5_file                = os.path.join(mesh_dir, "mesh_faces_vi.hdf5")
-mesh_faces_oi_hdf5_file                = os.path.join(mesh_dir, "mesh_faces_oi.hdf5")
 octomap_bt_file                        = os.path.join(octomap_dir, "octomap.bt")
 octomap_free_space_min_hdf5_file       = os.path.join(octomap_dir, "octomap_free_space_min.hdf5")
 octomap_free_space_max_hdf5_file       = os.path.join(octomap_dir, "octomap_free_space_max.hdf5")
 
 scene = [ s for s in _dataset_config.scenes if s["name"] == scene_name ][0]
-with h5py.File(mesh_vertices_hdf5_file,          "r") as f: mesh_vertices          = f["dataset"][:]
-with h5py.File(mesh_faces_vi_hdf5_file,          "r") as f: mesh_faces_vi          = f["dataset"][:]
-with h5py.File(mesh_faces_oi_hdf5_file,          "r") as f: mesh_faces_oi          = f["dataset"][:]
+mesh_vertices, mesh_faces_vi, mesh_faces_oi = mesh_utils.load_mesh_arrays(mesh_dir, ["vertices", "faces_vi", "faces_oi"])
 with h5py.File(octomap_free_space_min_hdf5_file, "r") as f: octomap_free_space_min = f["dataset"][:]
 with h5py.File(octomap_free_space_max_hdf5_file, "r") as f: octomap_free_space_max = f["dataset"][:]
 
@@ -65,6 +63,10 @@ color_vals_unique = arange(obj_ids_unique.shape[0])
 np.random.seed(0)
 np.random.shuffle(color_vals_unique)
 
+# map primitive IDs directly to color values for our preview images, where invalid primitive IDs are mapped to NaN
+obj_id_lut  = lut_utils.IdLut(obj_ids_unique, color_vals_unique.astype(float32), np.nan)
+prim_id_lut = lut_utils.IdLut(arange(mesh_faces_oi.shape[0]), mesh_faces_oi, -1).compose(obj_id_lut)
+
 df_scene              = pd.read_csv(metadata_scene_csv_file, index_col="parameter_name")
 meters_per_asset_unit = df_scene.loc["meters_per_asset_unit"][0]
 asset_units_per_meter = 1.0 / meters_per_asset_unit
@@ -132,6 +134,10 @@ if args.use_python_reference_implementation:
 
     np.random.seed(0)
 
+    # build acceleration structures for ray casting and occupancy queries once, and reuse them for all camera trajectories
+    ray_caster    = embree_utils.RayCaster(mesh_vertices, mesh_faces_vi, tmp_dir=tmp_dir)
+    octomap_index = octomap_utils.OctomapIndex(octomap_bt_file, octomap_free_space_min, octomap_free_space_max)
+
 
 
 # get cameras from the original asset file
@@ -203,12 +209,7 @@ for c in df_cameras_asset_export.to_records():
         for j in range(n_samples_random_walk):
 
             prim_ids_curr = prim_ids[j]
-            obj_ids_curr  = mesh_faces_oi[prim_ids_curr]
-
-            color_vals = ones_like(obj_ids_curr)*np.nan
-            for obj_id,color_val in zip(obj_ids_unique,color_vals_unique):
-                color_vals[obj_id == obj_ids_curr] = color_val
-            color_vals[prim_ids_curr == -1] = np.nan
+            color_vals    = prim_id_lut.apply(prim_ids_curr)
 
             out_camera_preview_jpg_file = os.path.join(out_camera_preview_dir, "frame.%04d.jpg" % j)
             imsave(out_camera_preview_jpg_file, color_vals, vmin=np.min(color_vals_unique), vmax=np.max(color_vals_unique))
@@ -248,10 +249,10 @@ for c in df_cameras_asset_export.to_records():
         start_camera_look_at_dir      = -start_camera_R_world_from_cam[:,2]
 
         # compute intersection distance for center ray
-        intersection_distances, intersection_normals, prim_ids = embree_utils.generate_ray_intersections(mesh_vertices, mesh_faces_vi, matrix(start_camera_look_from_position).A, matrix(start_camera_look_at_dir).A, tmp_dir=tmp_dir)
+        intersection_distances, intersection_normals, prim_ids = ray_caster.intersect(matrix(start_camera_look_from_position).A, matrix(start_camera_look_at_dir).A)
         intersection_distance = max(intersection_distances[0] - 1.75*n_voxel_size, delta)
         query_position        = start_camera_look_from_position + intersection_distance*start_camera_look_at_dir
-        octomap_sample        = octomap_utils.generate_octomap_samples(octomap_bt_file, array([query_position]), tmp_dir)[0]
+        octomap_sample        = octomap_index.query(array([query_position]))[0]
 
         if isfinite(intersection_distance) and octomap_sample == 0:
             start_camera_look_at_position = start_camera_look_from_position + intersection_distance*start_camera_look_at_dir
@@ -276,7 +277,7 @@ for c in df_cameras_asset_export.to_records():
                 ray_directions_world = V_world.T.A
                 ray_positions_world  = ones_like(ray_directions_world) * (start_camera_look_from_position + p*camera_perturb_length*camera_z_axis)
 
-                intersection_distances, intersection_normals, prim_ids = embree_utils.generate_ray_intersections(mesh_vertices, mesh_faces_vi, ray_positions_world, ray_directions_world, tmp_dir=tmp_dir)
+                intersection_distances, intersection_normals, prim_ids = ray_caster.intersect(ray_positions_world, ray_directions_world)
 
                 if not any(isfinite(intersection_distances)):
                     all_intersection_distances_at_infinity = True
@@ -321,7 +322,7 @@ for c in df_cameras_asset_export.to_records():
                 intersection_distances = np.maximum(np.minimum(intersection_distances, t_max) - 1.75*n_voxel_size,  delta)
 
                 query_positions = (start_camera_look_from_position + p*camera_perturb_length*camera_z_axis) + intersection_distances[:,newaxis]*ray_directions_world
-                octomap_samples = octomap_utils.generate_octomap_samples(octomap_bt_file, query_positions, tmp_dir)
+                octomap_samples = octomap_index.query(query_positions)
 
                 # import mayavi_utils
                 # import mayavi.mlab
@@ -383,16 +384,11 @@ for c in df_cameras_asset_export.to_records():
             ray_directions_world = V_world.T.A
             ray_positions_world  = ones_like(ray_directions_world) * start_camera_look_from_position
             intersection_distances, intersection_normals, prim_ids = \
-                embree_utils.generate_ray_intersections(mesh_vertices, mesh_faces_vi, ray_positions_world, ray_directions_world, tmp_dir=tmp_dir)
+                ray_caster.intersect(ray_positions_world, ray_directions_world)
 
         prim_ids      = prim_ids.reshape(height_pixels, width_pixels)
         prim_ids_curr = prim_ids
-        obj_ids_curr  = mesh_faces_oi[prim_ids_curr]
-
-        color_vals = ones_like(obj_ids_curr)*np.nan
-        for obj_id,color_val in zip(obj_ids_unique,color_vals_unique):
-            color_vals[obj_id == obj_ids_curr] = color_val
-        color_vals[prim_ids_curr == -1] = np.nan
+        color_vals    = prim_id_lut.apply(prim_ids_curr)
 
         out_camera_preview_jpg_file = os.path.join(out_camera_preview_dir, "frame.%04d.jpg" % 0)
         imsave(out_camera_preview_jpg_file, color_vals, vmin=np.min(color_vals_unique), vmax=np.max(color_vals_unique))
@@ -437,7 +433,7 @@ for c in df_cameras_asset_export.to_records():
             assert query_positions.shape[0] > 0
 
             # filter according to occupancy
-            octomap_samples = octomap_utils.generate_octomap_samples(octomap_bt_file, query_positions, tmp_dir)
+            octomap_samples = octomap_index.query(query_positions)
             query_positions = query_positions[octomap_samples == 0]
             assert query_positions.shape[0] > 0
 
@@ -446,7 +442,7 @@ for c in df_cameras_asset_export.to_records():
             current_to_query_distances = linalg.norm(current_to_query, axis=1)
             query_ray_directions       = current_to_query / current_to_query_distances[:,newaxis]
             query_ray_positions        = ones_like(query_ray_directions)*current_position
-            intersection_distances, intersection_normals, prim_ids = embree_utils.generate_ray_intersections(mesh_vertices, mesh_faces_vi, query_ray_positions, query_ray_directions, tmp_dir=tmp_dir)
+            intersection_distances, intersection_normals, prim_ids = ray_caster.intersect(query_ray_positions, query_ray_directions)
             query_positions = query_positions[(1-eps)*intersection_distances >= current_to_query_distances]
             assert query_positions.shape[0] > 0
 
@@ -469,7 +465,7 @@ for c in df_cameras_asset_export.to_records():
             assert query_positions.shape[0] > 0
 
             # filter according to occupancy
-            octomap_samples = octomap_utils.generate_octomap_samples(octomap_bt_file, query_positions, tmp_dir)
+            octomap_samples = octomap_index.query(query_positions)
             query_positions = query_positions[octomap_samples == 0]
             assert query_positions.shape[0] > 0
 
@@ -478,7 +474,7 @@ for c in df_cameras_asset_export.to_records():
             current_to_query_distances = linalg.norm(current_to_query, axis=1)
             query_ray_directions       = current_to_query
             query_ray_positions        = ones_like(query_ray_directions)*current_position
-            intersection_distances, intersection_normals, prim_ids = embree_utils.generate_ray_intersections(mesh_vertices, mesh_faces_vi, query_ray_positions, query_ray_directions, tmp_dir=tmp_dir)
+            intersection_distances, intersection_normals, prim_ids = ray_caster.intersect(query_ray_positions, query_ray_directions)
             query_positions = query_positions[(1-eps)*intersection_distances >= current_to_query_distances]
             assert query_positions.shape[0] > 0
 
@@ -529,7 +525,7 @@ for c in df_cameras_asset_export.to_records():
                     ray_positions_world  = r_[ray_positions_world,  ones_like(V_world.T.A) * camera_look_from_position]
 
             intersection_distances, intersection_normals, prim_ids = \
-                embree_utils.generate_ray_intersections(mesh_vertices, mesh_faces_vi, ray_positions_world, ray_directions_world, tmp_dir=tmp_dir)
+                ray_caster.intersect(ray_positions_world, ray_directions_world)
 
             #
             # select a camera pose candidate with probability proportional to the view score
@@ -552,12 +548,7 @@ for c in df_cameras_asset_export.to_records():
             #
 
             prim_ids_curr = prim_ids[selected_index]
-            obj_ids_curr  = mesh_faces_oi[prim_ids_curr]
-
-            color_vals = ones_like(obj_ids_curr)*np.nan
-            for obj_id,color_val in zip(obj_ids_unique,color_vals_unique):
-                color_vals[obj_id == obj_ids_curr] = color_val
-            color_vals[prim_ids_curr == -1] = np.nan
+            color_vals    = prim_id_lut.apply(prim_ids_curr)
 
             out_camera_preview_jpg_file = os.path.join(out_camera_preview_dir, "frame.%04d.jpg" % j)
             imsave(out_camera_preview_jpg_file, color_vals, vmin=np.min(color_vals_unique), vmax=np.max(color_vals_unique))
@@ -603,4 +594,8 @@ df_cameras.to_csv(metadata_cameras_csv_file, index=False)
 
 
 
+cpp_tool_utils.print_cpp_tool_call_stats()
+
+
+
 print("[HYPERSIM: SCENE_GENERATE_CAMERA_TRAJECTORIES_RANDOM_WALK] Finished.")
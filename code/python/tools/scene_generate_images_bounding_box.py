@@ -8,9 +8,14 @@ from pylab import *
 import argparse
 import h5py
 import glob
+import inspect
 import os
 import PIL.ImageDraw
 
+import path_utils
+path_utils.add_path_to_sys_path("../lib", mode="relative_to_current_source_dir", frame=inspect.currentframe())
+import hdf5_utils
+
 parser = argparse.ArgumentParser()
 parser.add_argument("--scene_dir", required=True)
 parser.add_argument("--camera_name", required=True)
@@ -110,7 +115,7 @@ for in_filename in in_filenames:
         continue
 
     try:
-        with h5py.File(in_position_hdf5_file, "r") as f: position = f["dataset"][:].astype(float32)
+        position = hdf5_utils.load_image(in_position_hdf5_file).astype(float32)
     except:
         print("[HYPERSIM: SCENE_GENERATE_IMAGES_BOUNDING_BOX]") 
         print("[HYPERSIM: SCENE_GENERATE_IMAGES_BOUNDING_BOX]")
@@ -0,0 +1,131 @@
+#
+# For licensing see accompanying LICENSE.txt file.
+# Copyright (C) 2020 Apple Inc. All Rights Reserved.
+#
+
+from pylab import *
+
+import argparse
+import inspect
+import os
+import pandas as pd
+
+import path_utils
+path_utils.add_path_to_sys_path("../lib", mode="relative_to_current_source_dir", frame=inspect.currentframe())
+import hdf5_utils
+import lut_utils
+import preview_utils
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--scene_dir", required=True)
+parser.add_argument("--camera_name", required=True)
+parser.add_argument("--render_pass", required=True)
+parser.add_argument("--frames")
+parser.add_argument("--previews", default="all")
+parser.add_argument("--preview_scale", type=float, default=1.0)
+parser.add_argument("--force", action="store_true")
+args = parser.parse_args()
+
+assert args.render_pass == "geometry" or args.render_pass == "final"
+assert args.previews in ["minimal", "all"]
+assert args.preview_scale > 0.0
+
+
+
+print("[HYPERSIM: SCENE_GENERATE_IMAGES_PREVIEW] Begin...")
+
+
+
+#
+# Generate preview images on demand from the HDF5 files written by generate_hdf5_from_vrimg.py, e.g.,
+# after running generate_hdf5_from_vrimg.py with --previews none or --previews minimal. As with our
+# dataset-level tools, --frames is a glob pattern for frame ids (e.g., --frames "000[0-4]"). We skip
+# previews that already exist, unless --force is specified. We don't store the color image for the
+# geometry pass in our HDF5 files, so we can't generate the color and gamma previews for the geometry
+# pass here.
+#
+
+images_dir = os.path.join(args.scene_dir, "images")
+detail_dir = os.path.join(args.scene_dir, "_detail")
+
+in_scene_fileroot = "scene"
+in_hdf5_dir       = os.path.join(images_dir, in_scene_fileroot + "_" + args.camera_name + "_" + args.render_pass + "_hdf5")
+out_preview_dir   = os.path.join(images_dir, in_scene_fileroot + "_" + args.camera_name + "_" + args.render_pass + "_preview")
+
+if args.frames is not None:
+    frames = args.frames
+else:
+    frames = "*"
+
+if not os.path.exists(out_preview_dir): os.makedirs(out_preview_dir)
+
+preview_names = preview_utils.get_preview_names(args.render_pass, args.previews)
+
+if args.render_pass == "geometry":
+
+    preview_names = [ p for p in preview_names if p not in ["color", "gamma"] ]
+
+    # see generate_hdf5_from_vrimg.py, we need to generate the same color values for each node
+    in_metadata_nodes_file = os.path.join(detail_dir, "metadata_nodes.csv")
+    df_nodes = pd.read_csv(in_metadata_nodes_file)
+    np.random.seed(0)
+    node_ids_unique   = df_nodes["node_id"].to_numpy()
+    color_vals_unique = arange(node_ids_unique.shape[0])
+    np.random.shuffle(color_vals_unique)
+
+    render_entity_id_lut = lut_utils.IdLut(node_ids_unique, color_vals_unique.astype(float32), np.nan)
+
+    in_channel_names = ["render_entity_id", "depth_meters", "normal_world", "normal_cam", "normal_bump_world", "normal_bump_cam", "tex_coord"]
+    in_channel_name  = "render_entity_id"
+
+if args.render_pass == "final":
+
+    in_channel_names = ["color", "diffuse_reflectance", "diffuse_illumination", "residual"]
+    in_channel_name  = "color"
+
+if len(preview_names) == 0:
+    print("[HYPERSIM: SCENE_GENERATE_IMAGES_PREVIEW] No previews to generate for the " + args.render_pass + " pass.")
+
+in_hdf5_files = os.path.join(in_hdf5_dir, "frame." + frames + "." + in_channel_name + ".hdf5")
+in_filenames  = [ os.path.basename(f) for f in hdf5_utils.get_image_files(in_hdf5_files) ]
+
+image_reader = hdf5_utils.ImageReader()
+
+for in_filename in in_filenames:
+
+    in_file_root = in_filename.replace("." + in_channel_name + ".hdf5", "")
+
+    if args.force:
+        preview_names_frame = preview_names
+    else:
+        preview_names_frame = [ p for p in preview_names if not os.path.exists(preview_utils.get_preview_file(out_preview_dir, in_file_root, p)) ]
+
+    if len(preview_names_frame) == 0:
+        continue
+
+    print("[HYPERSIM: SCENE_GENERATE_IMAGES_PREVIEW] Generating previews for " + in_file_root + "...")
+
+    images = {}
+    for c in in_channel_names:
+        if args.render_pass == "geometry" and c not in preview_names_frame:
+            continue
+        image = image_reader.load_image(os.path.join(in_hdf5_dir, in_file_root + "." + c + ".hdf5"))
+        if c == "render_entity_id":
+            images[c] = image.astype(int32)
+        else:
+            images[c] = image.astype(float32)
+
+    if args.render_pass == "geometry":
+        previews = preview_utils.generate_geometry_previews(images, preview_names_frame, render_entity_id_lut)
+    if args.render_pass == "final":
+        previews = preview_utils.generate_final_previews(images, preview_names_frame)
+
+    for preview_name, data, kwargs in previews:
+        preview_file = preview_utils.get_preview_file(out_preview_dir, in_file_root, preview_name)
+        preview_utils.save_preview(preview_file, data, scale=args.preview_scale, **kwargs)
+
+image_reader.close()
+
+
+
+print("[HYPERSIM: SCENE_GENERATE_IMAGES_PREVIEW] Finished.")
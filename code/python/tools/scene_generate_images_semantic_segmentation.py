@@ -8,13 +8,22 @@ from pylab import *
 import argparse
 import h5py
 import glob
+import inspect
 import os
 import pandas as pd
 
+import path_utils
+path_utils.add_path_to_sys_path("../lib", mode="relative_to_current_source_dir", frame=inspect.currentframe())
+import fingerprint_utils
+import hdf5_utils
+import lut_utils
+
 parser = argparse.ArgumentParser()
 parser.add_argument("--scene_dir", required=True)
 parser.add_argument("--camera_name", required=True)
 parser.add_argument("--segmentation_type", required=True)
+parser.add_argument("--hdf5_storage")
+parser.add_argument("--force", action="store_true")
 args = parser.parse_args()
 
 assert os.path.exists(args.scene_dir)
@@ -63,11 +72,30 @@ node_id_max = node_ids_.shape[0]
 assert all(node_ids_ == arange(1,node_id_max+1)) 
 
 node_ids_to_mesh_object_ids_ = df_nodes["object_id"].to_numpy()
-node_ids_to_mesh_object_ids  = r_[-1,node_ids_to_mesh_object_ids_]
 
+assert all(logical_or(node_ids_to_mesh_object_ids_ == -1, logical_and(node_ids_to_mesh_object_ids_ >= 0, node_ids_to_mesh_object_ids_ <= mesh_object_id_max)))
+
+# build lookup tables that map render entity IDs directly to segmentation IDs and segmentation colors,
+# so we can generate each segmentation image with a single vectorized lookup, see lut_utils.py
+node_id_lut                       = lut_utils.IdLut(node_ids_, node_ids_to_mesh_object_ids_, -1)
+mesh_object_id_lut                = lut_utils.IdLut(arange(mesh_object_id_max+1), mesh_object_ids_to_segmentation_indices, -1)
+segmentation_id_lut               = lut_utils.IdLut(arange(segmentation_id_max+1), segmentation_ids_to_segmentation_colors, 0)
+node_id_to_segmentation_id_lut    = node_id_lut.compose(mesh_object_id_lut)
+node_id_to_segmentation_color_lut = node_id_to_segmentation_id_lut.compose(segmentation_id_lut)
+
+
+
+hdf5_storage_options = hdf5_utils.parse_storage_spec(args.hdf5_storage)
 
+# write our segmentation images using the same layout as the render entity ID images they are generated from
+hdf5_layout = hdf5_utils.get_image_layout(in_render_entity_id_hdf5_dir)
 
-in_filenames = [ os.path.basename(f) for f in sort(glob.glob(in_render_entity_id_hdf5_files)) ]
+# we skip frames whose render entity ID image, per-scene input files, and parameters haven't changed since
+# their segmentation images were generated, unless --force is specified, see fingerprint_utils.py
+fingerprints = fingerprint_utils.Fingerprints(out_hdf5_dir, "generate_images_" + out_segmentation_name, {"hdf5_storage": args.hdf5_storage}, force=args.force)
+in_files     = [in_mesh_objects_segmentation_file, in_metadata_segmentation_colors_file, in_metadata_nodes_file]
+
+in_filenames = [ os.path.basename(f) for f in hdf5_utils.get_image_files(in_render_entity_id_hdf5_files) ]
 
 for in_filename in in_filenames:
 
@@ -78,7 +106,11 @@ for in_filename in in_filenames:
     out_png_file                  = os.path.join(out_preview_dir, in_file_root + "." + out_segmentation_name + ".png")
 
     try:
-        with h5py.File(in_render_entity_id_hdf5_file, "r") as f: render_entity_id_img = f["dataset"][:].astype(int32)
+        fingerprint = fingerprints.compute(input_files=in_files, input_images=[in_render_entity_id_hdf5_file])
+        if fingerprints.is_up_to_date(in_file_root, fingerprint, output_files=[out_png_file], output_images=[out_hdf5_file]):
+            print("[HYPERSIM: SCENE_GENERATE_IMAGES_SEMANTIC_SEGMENTATION] Skipping up-to-date input file: " + in_render_entity_id_hdf5_file + "...")
+            continue
+        render_entity_id_img = hdf5_utils.load_image(in_render_entity_id_hdf5_file).astype(int32)
     except:
         print("[HYPERSIM: SCENE_GENERATE_IMAGES_SEMANTIC_SEGMENTATION]")
         print("[HYPERSIM: SCENE_GENERATE_IMAGES_SEMANTIC_SEGMENTATION]")
@@ -89,26 +121,24 @@ for in_filename in in_filenames:
         print("[HYPERSIM: SCENE_GENERATE_IMAGES_SEMANTIC_SEGMENTATION]")
         continue
 
-    mesh_object_id_img     = ones_like(render_entity_id_img)*-1
-    segmentation_id_img    = ones_like(render_entity_id_img)*-1
-    segmentation_color_img = zeros((render_entity_id_img.shape[0], render_entity_id_img.shape[1], 3), dtype=uint8)
-
     # nodes are assigned render_entity_ids 1 to N, and all lights are set to invisible, so we should never encounter a render_entity_id greater than node_id_max
     assert all(logical_or(render_entity_id_img == -1, logical_and(render_entity_id_img >= 1, render_entity_id_img <= node_id_max)))
-    mesh_object_id_img[render_entity_id_img != -1] = node_ids_to_mesh_object_ids[render_entity_id_img[render_entity_id_img != -1]]
 
-    assert all(logical_or(mesh_object_id_img == -1, logical_and(mesh_object_id_img >= 0, mesh_object_id_img <= mesh_object_id_max)))
-    segmentation_id_img[mesh_object_id_img != -1] = mesh_object_ids_to_segmentation_indices[mesh_object_id_img[mesh_object_id_img != -1]]
+    segmentation_id_img    = node_id_to_segmentation_id_lut.apply(render_entity_id_img)
+    segmentation_color_img = node_id_to_segmentation_color_lut.apply(render_entity_id_img)
 
     assert all(logical_or(segmentation_id_img == -1, logical_and(segmentation_id_img >= 1, segmentation_id_img <= segmentation_id_max)))
-    segmentation_color_img[segmentation_id_img != -1] = segmentation_ids_to_segmentation_colors[segmentation_id_img[segmentation_id_img != -1]]
 
     print("[HYPERSIM: SCENE_GENERATE_IMAGES_SEMANTIC_SEGMENTATION] Saving output files for the input file: " + in_render_entity_id_hdf5_file + "...")
 
-    with h5py.File(out_hdf5_file, "w") as f: f.create_dataset("dataset", data=segmentation_id_img.astype(int16), compression="gzip", compression_opts=9)
+    hdf5_utils.write_images(out_hdf5_dir, in_file_root, [(out_segmentation_name, segmentation_id_img.astype(int16))], hdf5_storage_options, hdf5_layout)
 
     imsave(out_png_file, segmentation_color_img)
 
+    fingerprints.update(in_file_root, fingerprint)
+
+fingerprints.save()
+
 
 
 print("[HYPERSIM: SCENE_GENERATE_IMAGES_SEMANTIC_SEGMENTATION] Finished.")
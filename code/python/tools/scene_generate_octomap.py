@@ -13,6 +13,8 @@ import pandas as pd
 
 import path_utils
 path_utils.add_path_to_sys_path("../lib", mode="relative_to_current_source_dir", frame=inspect.currentframe())
+import cpp_tool_utils
+import mesh_utils
 import octomap_utils
 
 parser = argparse.ArgumentParser()
@@ -36,8 +38,6 @@ detail_dir       = os.path.join(args.scene_dir, "_detail")
 tmp_dir          = os.path.join(args.scene_dir, "_tmp")
 mesh_dir         = os.path.join(detail_dir, "mesh")
 
-mesh_vertices_hdf5_file                = os.path.join(mesh_dir, "mesh_vertices.hdf5")
-mesh_faces_vi_hdf5_file                = os.path.join(mesh_dir, "mesh_faces_vi.hdf5")
 metadata_cameras_asset_export_csv_file = os.path.join(asset_export_dir, "metadata_cameras_asset_export.csv")
 metadata_scene_csv_file                = os.path.join(detail_dir, "metadata_scene.csv")
 
@@ -51,8 +51,7 @@ if not os.path.exists(out_dir): os.makedirs(out_dir)
 
 
 
-with h5py.File(mesh_vertices_hdf5_file, "r") as f: mesh_vertices = f["dataset"][:]
-with h5py.File(mesh_faces_vi_hdf5_file, "r") as f: mesh_faces_vi = f["dataset"][:]
+mesh_vertices, mesh_faces_vi = mesh_utils.load_mesh_arrays(mesh_dir, ["vertices", "faces_vi"])
 
 
 
@@ -142,4 +141,8 @@ with h5py.File(octomap_free_space_max_hdf5_file, "w") as f: f.create_dataset("da
 
 
 
+cpp_tool_utils.print_cpp_tool_call_stats()
+
+
+
 print("[HYPERSIM: SCENE_GENERATE_OCTOMAP] Finished.")
@@ -14,6 +14,7 @@ import os
 import path_utils
 path_utils.add_path_to_sys_path("../lib", mode="relative_to_current_source_dir", frame=inspect.currentframe())
 import mayavi_utils
+import mesh_utils
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--mesh_dir", required=True)
@@ -47,16 +48,12 @@ if args.cameras_scale_factor is not None:
 else:
     cameras_scale_factor = 50.0
 
-mesh_vertices_hdf5_file = os.path.join(args.mesh_dir, "mesh_vertices.hdf5")
-mesh_faces_vi_hdf5_file = os.path.join(args.mesh_dir, "mesh_faces_vi.hdf5")
-
 camera_keyframe_frame_indices_hdf5_file     = os.path.join(args.camera_trajectory_dir, "camera_keyframe_frame_indices.hdf5")
 camera_keyframe_positions_hdf5_file         = os.path.join(args.camera_trajectory_dir, "camera_keyframe_positions.hdf5")
 camera_keyframe_look_at_positions_hdf5_file = os.path.join(args.camera_trajectory_dir, "camera_keyframe_look_at_positions.hdf5")
 camera_keyframe_orientations_hdf5_file      = os.path.join(args.camera_trajectory_dir, "camera_keyframe_orientations.hdf5")
 
-with h5py.File(mesh_vertices_hdf5_file, "r") as f: mesh_vertices = f["dataset"][:]
-with h5py.File(mesh_faces_vi_hdf5_file, "r") as f: mesh_faces_vi = f["dataset"][:]
+mesh_vertices, mesh_faces_vi = mesh_utils.load_mesh_arrays(args.mesh_dir, ["vertices", "faces_vi"])
 
 with h5py.File(camera_keyframe_frame_indices_hdf5_file, "r") as f: camera_keyframe_frame_indices = f["dataset"][:]
 with h5py.File(camera_keyframe_positions_hdf5_file,     "r") as f: camera_keyframe_positions     = f["dataset"][:]
@@ -14,6 +14,7 @@ import os
 import path_utils
 path_utils.add_path_to_sys_path("../lib", mode="relative_to_current_source_dir", frame=inspect.currentframe())
 import mayavi_utils
+import mesh_utils
 import octomap_utils
 
 parser = argparse.ArgumentParser()
@@ -49,15 +50,11 @@ if args.octomap_scale is not None:
 else:
     octomap_scale = 3.25
 
-mesh_vertices_hdf5_file = os.path.join(args.mesh_dir, "mesh_vertices.hdf5")
-mesh_faces_vi_hdf5_file = os.path.join(args.mesh_dir, "mesh_faces_vi.hdf5")
-
 octomap_bt_file                  = os.path.join(args.octomap_dir, "octomap.bt")
 octomap_free_space_min_hdf5_file = os.path.join(args.octomap_dir, "octomap_free_space_min.hdf5")
 octomap_free_space_max_hdf5_file = os.path.join(args.octomap_dir, "octomap_free_space_max.hdf5")
 
-with h5py.File(mesh_vertices_hdf5_file, "r") as f: mesh_vertices = f["dataset"][:]
-with h5py.File(mesh_faces_vi_hdf5_file, "r") as f: mesh_faces_vi = f["dataset"][:]
+mesh_vertices, mesh_faces_vi = mesh_utils.load_mesh_arrays(args.mesh_dir, ["vertices", "faces_vi"])
 
 with h5py.File(octomap_free_space_min_hdf5_file, "r") as f: free_space_min = f["dataset"][:]
 with h5py.File(octomap_free_space_max_hdf5_file, "r") as f: free_space_max = f["dataset"][:]
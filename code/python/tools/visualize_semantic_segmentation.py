@@ -7,9 +7,14 @@ from pylab import *
 
 import argparse
 import h5py
+import inspect
 import mayavi.mlab
 import os
 
+import path_utils
+path_utils.add_path_to_sys_path("../lib", mode="relative_to_current_source_dir", frame=inspect.currentframe())
+import mesh_utils
+
 
 
 parser = argparse.ArgumentParser()
@@ -44,17 +49,12 @@ if args.segmentation_type is not None:
 else:
     segmentation_type = "semantic_instance"
 
-mesh_vertices_hdf5_file                     = os.path.join(args.mesh_dir, "mesh_vertices.hdf5")
-mesh_faces_vi_hdf5_file                     = os.path.join(args.mesh_dir, "mesh_faces_vi.hdf5")
-mesh_faces_oi_hdf5_file                     = os.path.join(args.mesh_dir, "mesh_faces_oi.hdf5")
 mesh_objects_sii_hdf5_file                  = os.path.join(args.mesh_dir, "mesh_objects_sii.hdf5")
 mesh_objects_si_hdf5_file                   = os.path.join(args.mesh_dir, "mesh_objects_si.hdf5")
 metadata_semantic_instance_colors_hdf5_file = os.path.join(args.mesh_dir, "metadata_semantic_instance_colors.hdf5")
 metadata_semantic_colors_hdf5_file          = os.path.join(args.mesh_dir, "metadata_semantic_colors.hdf5")
 
-with h5py.File(mesh_vertices_hdf5_file,                     "r") as f: mesh_vertices                     = f["dataset"][:]
-with h5py.File(mesh_faces_vi_hdf5_file,                     "r") as f: mesh_faces_vi                     = f["dataset"][:]
-with h5py.File(mesh_faces_oi_hdf5_file,                     "r") as f: mesh_faces_oi                     = f["dataset"][:]
+mesh_vertices, mesh_faces_vi, mesh_faces_oi = mesh_utils.load_mesh_arrays(args.mesh_dir, ["vertices", "faces_vi", "faces_oi"])
 with h5py.File(mesh_objects_sii_hdf5_file,                  "r") as f: mesh_objects_sii                  = matrix(f["dataset"][:]).A1
 with h5py.File(mesh_objects_si_hdf5_file,                   "r") as f: mesh_objects_si                   = matrix(f["dataset"][:]).A1
 with h5py.File(metadata_semantic_instance_colors_hdf5_file, "r") as f: metadata_semantic_instance_colors = f["dataset"][:]
@@ -25,8 +25,17 @@
 
 import os
 import argparse
+import collections
+import concurrent.futures
+import csv
+import gzip
+import json
+import re
 import requests
+import struct
+import threading
 import zipfile
+import zlib
 
 # Increase download speed
 zipfile.ZipExtFile.MIN_READ_SIZE = 2 ** 20
@@ -492,15 +501,44 @@ URLS = [
 ]
 
 
+# Seekable read-only file object for a remote file, which fetches the file in
+# fixed-size blocks with HTTP range requests and keeps recently used blocks in
+# memory. A read that misses the cache fetches all missing blocks with a single
+# request, plus read_ahead additional bytes, so the many small reads that zipfile
+# makes (e.g., for local file headers) rarely cost a round trip. The block cache
+# is shared between threads, and prefetch() can be called from several threads
+# to fetch independent byte ranges concurrently.
 class WebFile:
-    def __init__(self, url, session):
-        with session.head(url) as response:
-            size = int(response.headers["content-length"])
-
+    def __init__(
+        self,
+        url,
+        block_size=2 ** 16,
+        read_ahead=2 ** 18,
+        max_request_size=2 ** 24,
+        max_cached_bytes=2 ** 28,
+    ):
         self.url = url
-        self.session = session
+        self.block_size = block_size
+        self.read_ahead = read_ahead
+        self.max_request_size = max(max_request_size, block_size)
+        self.max_cached_blocks = max(1, max_cached_bytes // block_size)
+        self.blocks = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+        with self.session().head(url) as response:
+            response.raise_for_status()
+            self.size = int(response.headers["content-length"])
+            self.etag = response.headers.get("etag")
+
         self.offset = 0
-        self.size = size
+
+    def session(self):
+        # requests sessions are not guaranteed to be thread-safe, so we use one
+        # session (i.e., one pool of keep-alive connections) per thread
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.session()
+        return self.local.session
 
     def seekable(self):
         return True
@@ -522,62 +560,491 @@ class WebFile:
     def read(self, n=None):
         if n is None:
             n = self.available()
-        else:
-            n = min(n, self.available())
 
-        end_inclusive = self.offset + n - 1
+        data = self.read_at(self.offset, n)
+
+        self.offset += len(data)
+
+        return data
+
+    # read n bytes starting at offset without moving the file position, so
+    # several threads can read from the same file concurrently
+    def read_at(self, offset, n):
+        n = min(n, self.size - offset)
+
+        if n <= 0:
+            return b""
+
+        start = offset
+        end = start + n
+
+        blocks = self.get_blocks(start, end, read_ahead=self.read_ahead)
+
+        first = start // self.block_size
+        data = b"".join(blocks[i] for i in range(first, (end - 1) // self.block_size + 1))
+        data = data[start - first * self.block_size:][:n]
+
+        return data
+
+    # fetch the blocks for the byte range [start, end) into the cache
+    def prefetch(self, start, end):
+        self.get_blocks(max(0, start), min(end, self.size), read_ahead=0)
+
+    def get_blocks(self, start, end, read_ahead):
+        first = start // self.block_size
+        last = (end - 1) // self.block_size
+
+        with self.lock:
+            blocks = {i: self.blocks[i] for i in range(first, last + 1) if i in self.blocks}
+            for i in blocks:
+                self.blocks.move_to_end(i)
+
+        missing = [i for i in range(first, last + 1) if i not in blocks]
+
+        if missing:
+            num_blocks_total = (self.size + self.block_size - 1) // self.block_size
+            num_blocks_read_ahead = (read_ahead + self.block_size - 1) // self.block_size
+            max_blocks_per_request = self.max_request_size // self.block_size
+
+            # fetch consecutive missing blocks with a single request, and extend
+            # the last request with read-ahead blocks that are not cached yet
+            runs = []
+            for i in missing:
+                if runs and runs[-1][1] == i and runs[-1][1] - runs[-1][0] < max_blocks_per_request:
+                    runs[-1][1] = i + 1
+                else:
+                    runs.append([i, i + 1])
+
+            with self.lock:
+                stop = min(num_blocks_total, runs[-1][1] + num_blocks_read_ahead, runs[-1][0] + max_blocks_per_request)
+                while runs[-1][1] < stop and runs[-1][1] not in self.blocks:
+                    runs[-1][1] += 1
+
+            for run_first, run_end in runs:
+                fetched = self.fetch_blocks(run_first, run_end)
+                blocks.update((i, fetched[i]) for i in range(run_first, run_end) if i <= last)
+
+        return blocks
+
+    def fetch_blocks(self, first, end):
+        start = first * self.block_size
+        end_inclusive = min(end * self.block_size, self.size) - 1
 
         headers = {
-            "Range": f"bytes={self.offset}-{end_inclusive}",
+            "Range": f"bytes={start}-{end_inclusive}",
         }
 
-        with self.session.get(self.url, headers=headers) as response:
+        with self.session().get(self.url, headers=headers) as response:
+            response.raise_for_status()
             data = response.content
 
-        self.offset += len(data)
+        if response.status_code != 206 or len(data) != end_inclusive + 1 - start:
+            raise IOError(f"Server did not return the requested range {start}-{end_inclusive} of {self.url}")
 
-        return data
+        fetched = {
+            i: data[(i - first) * self.block_size:(i - first + 1) * self.block_size]
+            for i in range(first, end)
+        }
+
+        with self.lock:
+            for i, block in fetched.items():
+                self.blocks[i] = block
+                self.blocks.move_to_end(i)
+            while len(self.blocks) > self.max_cached_blocks:
+                self.blocks.popitem(last=False)
+
+        return fetched
+
+
+# An entry of a zip file, i.e., the information from the zip file's central
+# directory that we need to locate, extract and verify a file without reading
+# the central directory again.
+IndexEntry = collections.namedtuple(
+    "IndexEntry",
+    ["filename", "header_offset", "compress_size", "file_size", "crc", "compress_type"],
+)
+
+
+def get_index_file(index_dir, url):
+    name = os.path.splitext(os.path.basename(url))[0]
+    return os.path.join(index_dir, name + ".json.gz")
+
+
+def load_index(index_dir, url):
+    index_file = get_index_file(index_dir, url)
+
+    if not os.path.isfile(index_file):
+        return None
+
+    with gzip.open(index_file, "rt", encoding="utf-8") as f:
+        index = json.load(f)
+
+    index["entries"] = [IndexEntry(*entry) for entry in index["entries"]]
+
+    return index
+
+
+def save_index(index_dir, index):
+    index_file = get_index_file(index_dir, index["url"])
+
+    os.makedirs(index_dir, exist_ok=True)
+
+    # write to a temporary file and rename it, so an interrupted run never
+    # leaves a partially written index file
+    tmp_index_file = index_file + ".tmp"
+    with gzip.open(tmp_index_file, "wt", encoding="utf-8") as f:
+        json.dump(index, f, separators=(",", ":"))
+    os.replace(tmp_index_file, index_file)
+
+
+# Read the central directory of a remote zip file, and return an index of the
+# files it contains.
+def build_index(f):
+    with zipfile.ZipFile(f) as z:
+        entries = [
+            IndexEntry(entry.filename, entry.header_offset, entry.compress_size, entry.file_size, entry.CRC, entry.compress_type)
+            for entry in z.infolist()
+            # skip directories in zip file (will be created automatically)
+            if not entry.is_dir()
+        ]
+
+    return {"url": f.url, "size": f.size, "etag": f.etag, "entries": entries}
+
+
+# Return the index for a zip file. We only contact the server if the index
+# doesn't exist yet, or if check_remote is True, in which case we rebuild the
+# index if the size or ETag of the zip file has changed.
+def get_index(url, index_dir, check_remote=False):
+    index = load_index(index_dir, url)
+
+    if index is not None and not check_remote:
+        return index
+
+    f = WebFile(url)
+
+    if index is not None and index["size"] == f.size and index["etag"] == f.etag:
+        return index
+
+    print("Indexing:", url)
+
+    index = build_index(f)
+
+    save_index(index_dir, index)
+
+    return index
+
+
+def get_indices(urls, index_dir, check_remote, jobs):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(lambda url: get_index(url, index_dir, check_remote), urls))
+
+
+# Return a byte range that contains the local file header and the data of a zip
+# file entry. The central directory doesn't store the size of the local header's
+# extra field, so we add some slack for it and for the optional data descriptor.
+def get_entry_range(entry):
+    start = entry.header_offset
+    end = start + zipfile.sizeFileHeader + len(entry.filename.encode("utf-8")) + entry.compress_size + 1024
+    return start, end
+
+
+# Group zip file entries that are close to each other in the zip file, so each
+# group can be fetched with a single request. Entries are grouped if the gap
+# between them is at most max_gap bytes, and if the byte range of the group is
+# at most max_size bytes.
+def coalesce_entries(entries, max_gap, max_size):
+    groups = []
+    for entry in sorted(entries, key=lambda entry: entry.header_offset):
+        start, end = get_entry_range(entry)
+        if groups and start - groups[-1][1] <= max_gap and end - groups[-1][0] <= max_size:
+            groups[-1][1] = max(groups[-1][1], end)
+            groups[-1][2].append(entry)
+        else:
+            groups.append([start, end, [entry]])
+    return groups
+
+
+def get_extract_path(directory, filename):
+    # sanitize the file name like zipfile.ZipFile.extract does, i.e. remove
+    # drive letters, empty, "." and ".." components, so a malicious zip file
+    # can not write files outside of the output directory
+    filename = filename.replace("/", os.path.sep)
+    if os.path.altsep:
+        filename = filename.replace(os.path.altsep, os.path.sep)
+    filename = os.path.splitdrive(filename)[1]
+    parts = [part for part in filename.split(os.path.sep) if part not in ("", os.path.curdir, os.path.pardir)]
+
+    if not parts:
+        raise zipfile.BadZipFile(f"Invalid file name {filename!r}")
+
+    path = os.path.join(directory, *parts)
+
+    if os.path.commonpath([os.path.realpath(directory), os.path.realpath(path)]) != os.path.realpath(directory):
+        raise zipfile.BadZipFile(f"File name {filename!r} is outside of {directory}")
+
+    return path
+
+
+def extract_entry(f, entry, directory):
+    header = f.read_at(entry.header_offset, zipfile.sizeFileHeader)
+    header = struct.unpack(zipfile.structFileHeader, header)
+
+    if header[0] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"Bad local file header for {entry.filename} in {f.url}")
+
+    filename_length, extra_length = header[10], header[11]
+    offset = entry.header_offset + zipfile.sizeFileHeader + filename_length + extra_length
+
+    if entry.compress_type == zipfile.ZIP_STORED:
+        decompressor = None
+    elif entry.compress_type == zipfile.ZIP_DEFLATED:
+        decompressor = zlib.decompressobj(-15)
+    else:
+        raise zipfile.BadZipFile(f"Compression method {entry.compress_type} of {entry.filename} in {f.url} is not supported")
+
+    path = get_extract_path(directory, entry.filename)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # write to a temporary file and rename it after checking the CRC, so a
+    # failed download never leaves a file that looks like it is complete
+    tmp_path = path + ".tmp"
+    crc = 0
+    file_size = 0
+
+    with open(tmp_path, "wb") as out:
+        for chunk_offset in range(0, entry.compress_size, zipfile.ZipExtFile.MIN_READ_SIZE):
+            data = f.read_at(offset + chunk_offset, min(zipfile.ZipExtFile.MIN_READ_SIZE, entry.compress_size - chunk_offset))
+            if decompressor is not None:
+                data = decompressor.decompress(data)
+            crc = zlib.crc32(data, crc)
+            file_size += len(data)
+            out.write(data)
+        if decompressor is not None:
+            data = decompressor.flush()
+            crc = zlib.crc32(data, crc)
+            file_size += len(data)
+            out.write(data)
+
+    if crc != entry.crc or file_size != entry.file_size:
+        os.remove(tmp_path)
+        raise zipfile.BadZipFile(f"Bad CRC or size for {entry.filename} in {f.url}")
+
+    os.replace(tmp_path, path)
+
+
+def extract_entries(f, start, end, entries, directory):
+    # fetch the entries in as few requests as possible, then extract them from
+    # the cache
+    f.prefetch(start, min(end, start + f.max_request_size))
+
+    for entry in entries:
+        extract_entry(f, entry, directory)
+
+
+FRAME_REGEX = re.compile(r"^(ai_\d+_\d+)/images/scene_(cam_\d+)_\w+/frame\.(\d+)\.(.+)$")
+DETAIL_CAMERA_REGEX = re.compile(r"^(ai_\d+_\d+)/_detail/(cam_\d+)/")
+
+
+def parse_frames(frames):
+    frame_ids = set()
+    for frame_range in frames.split(","):
+        first, _, last = frame_range.partition("-")
+        frame_ids.update(range(int(first), int(last or first) + 1))
+    return frame_ids
+
+
+# Return the (scene, camera, frame) triples that match the query, according to
+# the image metadata file, e.g., metadata_images_split_scene_v1.csv or
+# metadata_images.csv in ml-hypersim/evermotion_dataset/analysis. Images that
+# are not included in our public release are not in the zip files, so we skip
+# them.
+def get_selected_images(args):
+    selected_images = set()
+
+    with open(args.metadata_file, newline="") as f:
+        for row in csv.DictReader(f):
+            if row["included_in_public_release"] != "True":
+                continue
+            if args.split and row.get("split_partition_name") not in args.split:
+                continue
+            if args.scene is not None and args.scene not in row["scene_name"]:
+                continue
+            selected_images.add((row["scene_name"], row["camera_name"], int(row["frame_id"])))
+
+    return selected_images
+
+
+# Return a function that decides whether to download a file from a zip file
+# based on the query options (or None if no query options were specified), and
+# the set of scenes that contain selected images (or None if all scenes can
+# contain selected images).
+def get_entry_filter(args):
+    if args.split and args.metadata_file is None:
+        raise ValueError("--split requires --metadata-file")
+
+    if args.metadata_file is None and not args.cameras and args.frames is None and not args.channels:
+        return None, None
+
+    selected_images = None
+    selected_scenes = None
+    selected_scene_cameras = None
+    if args.metadata_file is not None:
+        selected_images = get_selected_images(args)
+        selected_scenes = set(image[0] for image in selected_images)
+        selected_scene_cameras = set(image[:2] for image in selected_images)
+    selected_cameras = set(args.cameras) if args.cameras else None
+    selected_frames = parse_frames(args.frames) if args.frames is not None else None
+
+    # a channel without an extension refers to our lossless HDF5 images
+    selected_channels = None
+    if args.channels:
+        selected_channels = set(channel if "." in channel else channel + ".hdf5" for channel in args.channels)
+
+    def is_camera_selected(scene, camera):
+        if selected_cameras is not None and camera not in selected_cameras:
+            return False
+        if selected_scene_cameras is not None and (scene, camera) not in selected_scene_cameras:
+            return False
+        return True
+
+    def entry_filter(filename):
+        match = FRAME_REGEX.match(filename)
+
+        if match is None:
+            if not args.include_detail:
+                return False
+            match = DETAIL_CAMERA_REGEX.match(filename)
+            return match is None or is_camera_selected(*match.groups())
+
+        scene, camera, frame, channel = match.groups()
+        frame = int(frame)
+
+        if selected_images is not None and (scene, camera, frame) not in selected_images:
+            return False
+        if selected_cameras is not None and camera not in selected_cameras:
+            return False
+        if selected_frames is not None and frame not in selected_frames:
+            return False
+        if selected_channels is not None and channel not in selected_channels:
+            return False
+
+        return True
+
+    return entry_filter, selected_scenes
+
+
+# WebFile fetches whole blocks, so the number of bytes we download for a byte
+# range is the size of the blocks that contain it.
+def get_num_bytes_requested(start, end, size, block_size):
+    first = start // block_size
+    last = (min(end, size) - 1) // block_size
+    return min((last + 1) * block_size, size) - first * block_size
+
+
+def format_bytes(num_bytes):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if num_bytes < 1000:
+            break
+        num_bytes /= 1000
+    else:
+        unit = "TB"
+    return f"{num_bytes:.1f} {unit}"
 
 
 def download_files(args):
-    session = requests.session()
+    entry_filter, selected_scenes = get_entry_filter(args)
 
-    # For each zip file
-    for url in URLS:
+    urls = [url for url in URLS if args.scene is None or args.scene in url]
 
-        if args.scene is None or args.scene in url:
+    # don't index or download zip files that don't contain any selected images
+    if selected_scenes is not None:
+        urls = [url for url in urls if os.path.splitext(os.path.basename(url))[0] in selected_scenes]
 
-            f = WebFile(url, session)
+    # read the list of files in each zip file from the index, and only contact
+    # the server for zip files that haven't been indexed yet
+    indices = get_indices(urls, args.index_dir, check_remote=args.update_index, jobs=args.jobs)
 
-            z = zipfile.ZipFile(f)
+    downloads = []
 
-            # for each file in zip file
-            for entry in z.infolist():
+    # For each zip file
+    for url, index in zip(urls, indices):
 
-                # skip directories in zip file (will be created automatically)
-                if entry.is_dir():
-                    continue
+        entries_to_download = []
 
-                path = os.path.join(args.directory, entry.filename)
+        # for each file in zip file
+        for entry in index["entries"]:
 
-                contains_all_words = all(
-                    word in entry.filename for words in args.contains for word in words
-                )
+            path = os.path.join(args.directory, entry.filename)
 
-                if args.list:
-                    if contains_all_words:
-                        print(entry.filename)
-                else:
-                    if contains_all_words:
-                        if os.path.isfile(path) and not args.overwrite:
-                            print("File already exists:", path)
-                        else:
-                            print("Downloading:", path)
+            contains_all_words = all(
+                word in entry.filename for words in args.contains for word in words
+            )
 
-                            z.extract(entry.filename, args.directory)
+            if entry_filter is not None:
+                contains_all_words = contains_all_words and entry_filter(entry.filename)
+
+            if args.list:
+                if contains_all_words:
+                    print(entry.filename)
+            else:
+                if contains_all_words:
+                    if os.path.isfile(path) and not args.overwrite:
+                        print("File already exists:", path)
                     else:
-                        if not args.silent:
-                            print("Skipping:", path)
+                        print("Downloading:", path)
+
+                        entries_to_download.append(entry)
+                else:
+                    if not args.silent:
+                        print("Skipping:", path)
+
+        if entries_to_download:
+            groups = coalesce_entries(entries_to_download, max_gap=args.max_gap, max_size=args.max_request_size)
+            downloads.append((url, index, entries_to_download, groups))
+
+    if args.list:
+        return
+
+    # report how much we are going to download before downloading anything
+    num_files = sum(len(entries) for _, _, entries, _ in downloads)
+    num_bytes_files = sum(entry.file_size for _, _, entries, _ in downloads for entry in entries)
+    num_bytes_requested = sum(
+        get_num_bytes_requested(start, end, index["size"], args.block_size)
+        for _, index, _, groups in downloads
+        for start, end, _ in groups
+    )
+    num_bytes_archives = sum(index["size"] for index in indices)
+
+    print(
+        f"Plan: {num_files} files ({format_bytes(num_bytes_files)}) from {len(downloads)} zip files, "
+        f"downloading {format_bytes(num_bytes_requested)} of {format_bytes(num_bytes_archives)}"
+    )
+
+    if args.dry_run:
+        return
+
+    for url, index, entries_to_download, groups in downloads:
+
+        # the cache must be large enough to hold the groups that are being extracted concurrently
+        f = WebFile(
+            url,
+            block_size=args.block_size,
+            read_ahead=args.read_ahead,
+            max_request_size=args.max_request_size,
+            max_cached_bytes=(args.jobs + 1) * args.max_request_size,
+        )
+
+        if f.size != index["size"] or f.etag != index["etag"]:
+            raise IOError(f"{url} has changed since it was indexed, run again with --update-index")
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+            futures = [
+                executor.submit(extract_entries, f, start, end, entries, args.directory)
+                for start, end, entries in groups
+            ]
+            for future in futures:
+                future.result()
 
 
 def main():
@@ -591,6 +1058,11 @@ example: download the first preview of each scene:
 
     ./download.py --contains scene_cam_00_final_preview --contains frame.0000.color.jpg --silent
 
+example: download the color and depth images of the training split, and report the download size first:
+
+    ./download.py --metadata-file metadata_images_split_scene_v1.csv --split train --channels color depth_meters --dry-run
+    ./download.py --metadata-file metadata_images_split_scene_v1.csv --split train --channels color depth_meters --silent
+
 example: download all files to "all hypersim images" directory
 
     ./download.py --directory 'all hypersim images'
@@ -610,6 +1082,20 @@ example: print this help text
     parser.add_argument("-e", "--scene", type=str, help="only download files from this scene")
     parser.add_argument("-s", "--silent", action="store_true", help="only print downloaded files")
     parser.add_argument("-l", "--list", action="store_true", help="only list files, do not download")
+    parser.add_argument("-m", "--metadata-file", type=str, help="only download images listed in this metadata file, e.g., metadata_images_split_scene_v1.csv")
+    parser.add_argument("--split", nargs="*", choices=["train", "val", "test"], help="only download images from these split partitions (requires --metadata-file)")
+    parser.add_argument("--cameras", nargs="*", help="only download images from these cameras, e.g., cam_00")
+    parser.add_argument("--frames", type=str, help="only download these frames, e.g., 0-9,20")
+    parser.add_argument("--channels", nargs="*", help="only download these images, e.g., color depth_meters color.jpg")
+    parser.add_argument("--include-detail", action="store_true", help="also download scene and camera metadata from _detail directories when selecting images")
+    parser.add_argument("-n", "--dry-run", action="store_true", help="only report how much would be downloaded, do not download")
+    parser.add_argument("-i", "--index-dir", type=str, default="index", help="directory to store the list of files in each zip file")
+    parser.add_argument("-u", "--update-index", action="store_true", help="update the list of files for zip files that have changed")
+    parser.add_argument("-j", "--jobs", type=int, default=8, help="number of concurrent downloads")
+    parser.add_argument("--block-size", type=int, default=2 ** 16, help="size of cached blocks in bytes")
+    parser.add_argument("--read-ahead", type=int, default=2 ** 18, help="number of bytes to read ahead on a cache miss")
+    parser.add_argument("--max-gap", type=int, default=2 ** 16, help="download files together if they are at most this many bytes apart")
+    parser.add_argument("--max-request-size", type=int, default=2 ** 24, help="maximum number of bytes to download with a single request")
 
     args = parser.parse_args()
 